@@ -7,17 +7,23 @@ import math
 import time
 import threading
 import os
+import atexit
+import copy
 import itertools
 import json
+import hashlib
 import re
 import html
 from types import SimpleNamespace
+from functools import lru_cache
+from bisect import bisect_left
 from datetime import datetime, time as dt_time, timedelta, date
 import pytz
 from decimal import Decimal, ROUND_HALF_UP
 import io
 import twstock
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
 import calendar
 import gc
 import plotly.graph_objects as go
@@ -27,7 +33,6 @@ import streamlit.components.v1 as components
 import urllib3
 import pdfplumber
 import fitz  # PyMuPDF 用於將 PDF 轉為圖片
-from PIL import Image
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
@@ -42,6 +47,12 @@ try:
 except ImportError:
     si = None
 
+# Streamlit 本身依賴 pyarrow；缺少時表格快取退回 JSON 格式。
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 sj_import_error = None
 try:
     import shioaji as sj
@@ -2541,33 +2552,37 @@ def get_cached_market_temperature_data(code, lookback_days=180, max_age_seconds=
     return df, source
 
 
-def calculate_market_temperature(df):
-    """Return a transparent 0-100 trend / momentum temperature score."""
+MARKET_TEMPERATURE_MIN_BARS = 25
+
+
+def calculate_market_temperature_frame(df):
+    """一次算出每根 K 的溫度分數與組成指標（RSI、ATR、均線、60 日位置、5 日動能）。
+
+    每列只使用到該列為止的資料，因此前一日分數、溫度變化與歷史走勢都能直接讀取，
+    不必再截掉最後一根重算；資料不足的前段分數為 NaN。
+    """
     required = {'High', 'Low', 'Close'}
     if df.empty or not required.issubset(df.columns):
         return None
 
-    data = df.dropna(subset=['High', 'Low', 'Close']).copy()
-    if len(data) < 25:
+    data = df.dropna(subset=['High', 'Low', 'Close'])
+    if len(data) < MARKET_TEMPERATURE_MIN_BARS:
         return None
 
     close = data['Close'].astype(float)
     high = data['High'].astype(float)
     low = data['Low'].astype(float)
-    latest = float(close.iloc[-1])
 
-    window = min(60, len(data))
-    range_high = float(high.tail(window).max())
-    range_low = float(low.tail(window).min())
-    range_score = 50.0 if range_high == range_low else (latest - range_low) / (range_high - range_low) * 100
+    range_high = high.rolling(60, min_periods=1).max()
+    range_low = low.rolling(60, min_periods=1).min()
+    range_span = range_high - range_low
+    range_score = ((close - range_low) / range_span.where(range_span != 0) * 100).fillna(50.0)
 
     change = close.diff()
     gains = change.clip(lower=0).rolling(14, min_periods=10).mean()
     losses = (-change.clip(upper=0)).rolling(14, min_periods=10).mean()
     relative_strength = gains / losses.replace(0, np.nan)
-    rsi = float((100 - 100 / (1 + relative_strength)).iloc[-1])
-    if not np.isfinite(rsi):
-        rsi = 50.0
+    rsi = (100 - 100 / (1 + relative_strength)).where(lambda value: np.isfinite(value), 50.0)
 
     previous_close = close.shift(1)
     true_range = pd.concat([
@@ -2575,13 +2590,42 @@ def calculate_market_temperature(df):
         (high - previous_close).abs(),
         (low - previous_close).abs()
     ], axis=1).max(axis=1)
-    atr = float(true_range.rolling(14, min_periods=10).mean().iloc[-1])
-    ma20 = float(close.rolling(20, min_periods=15).mean().iloc[-1])
-    ma60 = float(close.rolling(60, min_periods=20).mean().iloc[-1])
-    trend_score = 50.0 if not np.isfinite(atr) or atr <= 0 else 50 + (latest - ma20) / atr * 10
+    atr = true_range.rolling(14, min_periods=10).mean()
+    ma20 = close.rolling(20, min_periods=15).mean()
+    ma60 = close.rolling(60, min_periods=20).mean()
+    trend_score = (50 + (close - ma20) / atr * 10).where(np.isfinite(atr) & (atr > 0), 50.0)
 
-    momentum = 0.0 if len(close) <= 5 else (latest / float(close.iloc[-6]) - 1) * 100
+    momentum = ((close / close.shift(5) - 1) * 100).fillna(0.0)
     momentum_score = 50 + momentum * 20
+    score = np.round(np.clip(0.40 * range_score + 0.25 * rsi + 0.25 * trend_score + 0.10 * momentum_score, 0, 100))
+    score.iloc[:MARKET_TEMPERATURE_MIN_BARS - 1] = np.nan
+
+    frame = pd.DataFrame({
+        'close': close, 'score': score, 'rsi': rsi, 'atr': atr, 'ma20': ma20, 'ma60': ma60,
+        'range_score': range_score, 'trend_score': trend_score, 'momentum': momentum,
+    })
+    frame['status'] = np.select([frame['score'] >= 60, frame['score'] <= 40], ["偏多", "偏空"], "區間盤整")
+    frame.loc[frame['score'].isna(), 'status'] = None
+    return frame
+
+
+def calculate_market_temperature(df):
+    """Return a transparent 0-100 trend / momentum temperature score."""
+    frame = calculate_market_temperature_frame(df)
+    if frame is None:
+        return None
+
+    close = frame['close']
+    latest = float(close.iloc[-1])
+    current = frame.iloc[-1]
+    rsi = float(current['rsi'])
+    atr = float(current['atr'])
+    ma20 = float(current['ma20'])
+    ma60 = float(current['ma60'])
+    range_score = float(current['range_score'])
+    momentum = float(current['momentum'])
+    previous_score = frame['score'].iloc[-2]
+    previous_score = int(previous_score) if np.isfinite(previous_score) else None
     # 期貨夜盤使用券商快照的官方參考價；未取得快照時才退回前一根日 K。
     reference_close = df.attrs.get('market_temperature_reference_close')
     try:
@@ -2608,8 +2652,7 @@ def calculate_market_temperature(df):
     else:
         price_color, price_arrow = "#dfe6e9", "◆"
 
-    clip = lambda value: float(np.clip(value, 0, 100))
-    score = round(clip(0.40 * range_score + 0.25 * rsi + 0.25 * trend_score + 0.10 * momentum_score))
+    score = int(current['score'])
 
     # 狀態以溫度區間為主；均線僅作入／出場規則輔助。否則溫度已落在
     # 0 度這類極端空方值時，仍可能因均線排序暫未翻轉而誤顯示盤整。
@@ -2632,13 +2675,566 @@ def calculate_market_temperature(df):
         'score': score, 'status': status, 'color': color,
         'entry': entry, 'exit_rule': exit_rule, 'close': latest,
         'rsi': rsi, 'range_score': range_score, 'ma20': ma20,
-        'ma60': ma60, 'momentum': momentum, 'updated_at': data.index[-1],
+        'ma60': ma60, 'momentum': momentum, 'updated_at': frame.index[-1], 'atr': atr,
+        'previous_score': previous_score,
+        'score_delta': float(score - previous_score) if previous_score is not None else 0.0,
+        'history': frame,
         'change': change_value, 'change_pct': change_pct,
         'reference_close': previous,
         'price_color': price_color, 'price_arrow': price_arrow
     }
 
 
+# 圖表資料管線：長序列先降採樣再送進瀏覽器，點數多時改用 WebGL；同一份資料的圖表物件跨重跑共用，
+# 只有資料版本（筆數、首末時間、最後一列數值）或顯示參數改變時才重建。
+CHART_MAX_POINTS = 1500
+CHART_WEBGL_MIN_POINTS = 1000
+CHART_MAX_CANDLES = 400
+CHART_FIGURE_CACHE_SIZE = 32
+
+
+def lttb_indices(x, y, threshold=CHART_MAX_POINTS):
+    """Largest-Triangle-Three-Buckets 降採樣：回傳保留點的位置，首尾必留，轉折處優先保留。"""
+    y = np.asarray(y, dtype=float)
+    count = len(y)
+    if threshold >= count or threshold < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=float)
+    edges = np.linspace(1, count - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, count - 1
+    anchor = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+        next_x, next_y = x[end:max(next_end, end + 1)], y[end:max(next_end, end + 1)]
+        average_x = next_x.mean()
+        average_y = np.nanmean(next_y) if np.isfinite(next_y).any() else y[anchor]
+        with np.errstate(invalid='ignore'):
+            area = np.abs(
+                (x[anchor] - average_x) * (y[start:end] - y[anchor])
+                - (x[anchor] - x[start:end]) * (average_y - y[anchor])
+            )
+        anchor = start + int(np.argmax(np.where(np.isfinite(area), area, -1.0)))
+        selected[bucket + 1] = anchor
+    return selected
+
+
+def chart_line_trace(x, y, **kwargs):
+    """點數超過 CHART_WEBGL_MIN_POINTS 時改用 Scattergl，由 GPU 繪製長序列。"""
+    trace_class = go.Scattergl if len(y) >= CHART_WEBGL_MIN_POINTS else go.Scatter
+    return trace_class(x=x, y=y, **kwargs)
+
+
+def chart_time_axis(index):
+    """時間軸改送 epoch 毫秒整數；Plotly 日期軸可直接解讀，JSON 比 ISO 字串小且不必逐根格式化。"""
+    return pd.DatetimeIndex(index).as_unit('ms').asi8
+
+
+@st.cache_resource(show_spinner=False)
+def get_chart_figure_cache():
+    """跨 session 共用的圖表物件快取（LRU）；key 需包含資料版本與所有顯示參數。"""
+    return {'figures': OrderedDict(), 'lock': threading.Lock()}
+
+
+def cached_chart_figure(key, builder, *args, **kwargs):
+    """資料與參數未變時直接回傳上次建好的圖表，不重跑 add_trace／add_shape 等建構流程。"""
+    cache = get_chart_figure_cache()
+    with cache['lock']:
+        figure = cache['figures'].get(key)
+        if figure is not None:
+            cache['figures'].move_to_end(key)
+            return figure
+    figure = builder(*args, **kwargs)
+    with cache['lock']:
+        cache['figures'][key] = figure
+        while len(cache['figures']) > CHART_FIGURE_CACHE_SIZE:
+            cache['figures'].popitem(last=False)
+    return figure
+
+
+def live_chart_figure(chart_id, static_key, build, build_args, patch, patch_args=()):
+    """即時圖表的狀態層：靜態部分依 static_key 建一次並保留在本 session，之後每次報價更新
+    只呼叫 patch 原地改寫會動的部分（最後一根 K 棒、即時價位線、標題），不重建整張圖。
+
+    圖表物件會被 patch 修改，因此存放在 session_state，不與其他 session 共用。
+    """
+    states = st.session_state.setdefault('_live_chart_states', {})
+    state = states.get(chart_id)
+    if state is None or state['static_key'] != static_key:
+        state = {'static_key': static_key, 'figure': build(*build_args)}
+        states[chart_id] = state
+    elif state['figure'] is not None:
+        patch(state['figure'], *patch_args)
+    return state['figure']
+
+
+# 溫度歷史：每條序列（加權日線、期貨日線、期貨 15 分 K）只把已收完的 K 棒分數附加到 CSV 尾端，
+# 重啟後可接續；進行中的最後一根只在記憶體中顯示，不寫檔。
+MARKET_TEMPERATURE_HISTORY_DIR = "market_temperature_history"
+MARKET_TEMPERATURE_HISTORY_COLUMNS = ['close', 'score', 'rsi', 'status']
+MARKET_TEMPERATURE_HISTORY_SERIES = {
+    '^TWII@1d': "加權指數（日線）",
+    'TWF=F@1d': "臺股期貨（日線）",
+    'TWF=F@15m': "臺股期貨（15 分 K）",
+}
+MARKET_TEMPERATURE_FORWARD_HORIZONS = (1, 5, 20)
+# 60 根區間位置與 MA60 需滿窗才寫入；gap 標記該列之前有未抓到的 K 棒（期間沒有 session 更新序列）。
+MARKET_TEMPERATURE_FULL_WINDOW_BARS = 60
+MARKET_TEMPERATURE_LEGACY_GAP = pd.Timedelta(days=4)
+
+
+@st.cache_resource(show_spinner=False)
+def get_market_temperature_history_store():
+    """跨 session 共用的溫度歷史；series 為各序列的分數表，events 為對應的多空狀態轉換索引。"""
+    return {'series': {}, 'events': {}, 'lock': threading.RLock()}
+
+
+def _market_temperature_history_path(series_key):
+    safe_key = re.sub(r'[^A-Za-z0-9_-]', '_', str(series_key))
+    return os.path.join(MARKET_TEMPERATURE_HISTORY_DIR, f"{safe_key}.csv")
+
+
+def market_temperature_regime_events(history, previous_status=None):
+    """找出狀態（偏多／偏空／區間盤整）改變的 K 棒；previous_status 為前一段序列的最後狀態。"""
+    if history is None or history.empty:
+        return pd.DataFrame(columns=['from', 'to', 'score', 'close'])
+    status = history['status']
+    prior = status.shift(1)
+    if len(prior):
+        prior.iloc[0] = previous_status
+    changed = prior.notna() & (status != prior)
+    return pd.DataFrame({
+        'from': prior[changed], 'to': status[changed],
+        'score': history['score'][changed], 'close': history['close'][changed],
+    })
+
+
+def _migrate_market_temperature_history(path, stored):
+    """舊版檔案沒有 gap 欄且從第 25 根起寫入：去掉前段未滿 60 根窗口的列，
+    並以相隔超過 MARKET_TEMPERATURE_LEGACY_GAP 推定斷點後整檔重寫。"""
+    stored = stored.iloc[MARKET_TEMPERATURE_FULL_WINDOW_BARS - MARKET_TEMPERATURE_MIN_BARS:]
+    gaps = pd.Series(stored.index, index=stored.index).diff() > MARKET_TEMPERATURE_LEGACY_GAP
+    stored = stored.reindex(columns=MARKET_TEMPERATURE_HISTORY_COLUMNS).assign(gap=gaps)
+    temp_path = f"{path}.tmp"
+    stored.rename_axis('ts').to_csv(temp_path)
+    os.replace(temp_path, path)
+    return stored
+
+
+def load_market_temperature_history(series_key):
+    """讀取一條溫度序列；每個程序只讀檔一次，之後由附加寫入維持記憶體與檔案同步。"""
+    store = get_market_temperature_history_store()
+    with store['lock']:
+        if series_key in store['series']:
+            return store['series'][series_key]
+        history = pd.DataFrame(columns=MARKET_TEMPERATURE_HISTORY_COLUMNS + ['gap'])
+        path = _market_temperature_history_path(series_key)
+        try:
+            if os.path.exists(path):
+                stored = pd.read_csv(path, parse_dates=['ts']).set_index('ts')
+                # 附加寫入中途中斷只會損壞最後一列；丟掉無法解析的列即可。
+                stored['score'] = pd.to_numeric(stored['score'], errors='coerce')
+                stored = stored.dropna(subset=['score'])
+                stored = stored[~stored.index.duplicated(keep='first')].sort_index()
+                if 'gap' not in stored.columns:
+                    stored = _migrate_market_temperature_history(path, stored)
+                stored['gap'] = stored['gap'].astype(str).str.lower().eq('true')
+                history = stored.reindex(columns=MARKET_TEMPERATURE_HISTORY_COLUMNS + ['gap'])
+        except (OSError, ValueError, TypeError, KeyError):
+            pass
+        store['series'][series_key] = history
+        store['events'][series_key] = market_temperature_regime_events(history)
+        return history
+
+
+def record_market_temperature_history(series_key, result):
+    """把溫度計結果中比已存最後一根更新、且已收完的 K 棒附加到序列；每次只寫新增的列。"""
+    history = load_market_temperature_history(series_key)
+    if not result or result.get('history') is None:
+        return history
+    store = get_market_temperature_history_store()
+    with store['lock']:
+        history = store['series'][series_key]
+        eligible = result['history'].iloc[MARKET_TEMPERATURE_FULL_WINDOW_BARS - 1:-1].dropna(subset=['score'])
+        completed = eligible[MARKET_TEMPERATURE_HISTORY_COLUMNS].assign(gap=False)
+        if not history.empty:
+            completed = completed[completed.index > history.index[-1]]
+            # 已存最後一根不在本次可寫範圍內，代表中間有 K 棒沒抓到；之後的報酬統計不跨越此處。
+            if not completed.empty and history.index[-1] not in eligible.index:
+                completed.iloc[0, completed.columns.get_loc('gap')] = True
+        if completed.empty:
+            return history
+        path = _market_temperature_history_path(series_key)
+        try:
+            os.makedirs(MARKET_TEMPERATURE_HISTORY_DIR, exist_ok=True)
+            write_header = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, 'a', encoding='utf-8', newline='') as file:
+                completed.rename_axis('ts').to_csv(file, header=write_header)
+        except OSError:
+            pass
+        previous_status = history['status'].iloc[-1] if not history.empty else None
+        new_events = market_temperature_regime_events(completed, previous_status)
+        history = pd.concat([history, completed]) if not history.empty else completed
+        store['series'][series_key] = history
+        if not new_events.empty:
+            store['events'][series_key] = pd.concat([store['events'][series_key], new_events])
+        return history
+
+
+def get_market_temperature_events(series_key):
+    load_market_temperature_history(series_key)
+    return get_market_temperature_history_store()['events'].get(series_key, pd.DataFrame())
+
+
+def market_temperature_forward_stats(history, horizons=MARKET_TEMPERATURE_FORWARD_HORIZONS):
+    """統計各溫度條件出現後 N 根 K 的報酬：平均報酬、上漲比例與樣本數；樣本取自已存序列。"""
+    if history is None or len(history) < 2:
+        return pd.DataFrame()
+    close = pd.to_numeric(history['close'], errors='coerce')
+    score = pd.to_numeric(history['score'], errors='coerce')
+    conditions = [
+        ("溫度 ≥ 80（過熱）", score >= 80),
+        ("溫度 60–79（偏多）", (score >= 60) & (score < 80)),
+        ("溫度 41–59（盤整）", (score > 40) & (score < 60)),
+        ("溫度 21–40（偏空）", (score > 20) & (score <= 40)),
+        ("溫度 ≤ 20（過冷）", score <= 20),
+    ]
+    # 序列在 gap 處斷開；第 N 根之後的價格只在同一段連續資料內取，不跨越未抓到的空檔。
+    gap = history['gap'] if 'gap' in history.columns else pd.Series(False, index=history.index)
+    segment_close = close.groupby(gap.fillna(False).astype(bool).cumsum().to_numpy())
+    forward = {horizon: (segment_close.shift(-horizon) / close - 1) * 100 for horizon in horizons}
+    rows = []
+    for label, mask in conditions:
+        row = {"條件": label, "出現次數": int(mask.sum())}
+        for horizon, returns in forward.items():
+            sample = returns[mask].dropna()
+            row[f"後{horizon}根 樣本"] = int(len(sample))
+            row[f"後{horizon}根 平均%"] = round(float(sample.mean()), 2) if len(sample) else None
+            row[f"後{horizon}根 上漲%"] = round(float((sample > 0).mean() * 100), 1) if len(sample) else None
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def build_market_temperature_history_chart(history, title):
+    """溫度分數走勢與收盤價雙軸圖；40／60 為狀態分界，80／20 為過熱／過冷。長序列以 LTTB 降採樣。"""
+    x = chart_time_axis(history.index)
+    # 分數與收盤各自降採樣後取聯集，兩條線的轉折都保留。
+    keep = np.union1d(
+        lttb_indices(x, history['score'].to_numpy(), CHART_MAX_POINTS // 2),
+        lttb_indices(x, history['close'].to_numpy(), CHART_MAX_POINTS // 2),
+    )
+    x, history = x[keep], history.iloc[keep]
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    fig.add_trace(chart_line_trace(
+        x, history['close'].to_numpy(), name="收盤", line=dict(color='#74b9ff', width=1),
+        opacity=0.55, hovertemplate='%{y:,.0f}<extra>收盤</extra>',
+    ), secondary_y=True)
+    fig.add_trace(chart_line_trace(
+        x, history['score'].to_numpy(), name="溫度", line=dict(color='#ffc107', width=2),
+        hovertemplate='%{y:.0f}°<extra>溫度</extra>',
+    ), secondary_y=False)
+    for level, color in ((80, '#d90429'), (60, '#ff8a80'), (40, '#66bb6a'), (20, '#087f5b')):
+        fig.add_hline(y=level, line=dict(color=color, width=1, dash='dot'), secondary_y=False)
+    fig.update_xaxes(type='date')
+    fig.update_yaxes(range=[0, 100], title_text="溫度", secondary_y=False)
+    fig.update_yaxes(showgrid=False, title_text="收盤", secondary_y=True)
+    fig.update_layout(
+        title=title, height=360, margin=dict(l=10, r=10, t=48, b=10), hovermode='x unified',
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='#dfe6e9'),
+        legend=dict(orientation='h', y=1.08, x=1, xanchor='right'),
+    )
+    return fig
+
+
+# 全市場廣度引擎：上市櫃普通股的日 K 以「股票 × 交易日」陣列常駐記憶體，
+# 每日只補抓一天的全市場收盤行情（證交所＋櫃買各一次請求）再附加一欄。
+MARKET_BREADTH_DIR = "market_breadth"
+MARKET_BREADTH_FILE = os.path.join(MARKET_BREADTH_DIR, "daily_bars.npz")
+MARKET_BREADTH_TWSE_URL = "https://www.twse.com.tw/rwd/zh/afterTrading/MI_INDEX?date={date_str}&type=ALLBUT0999&response=json"
+MARKET_BREADTH_TPEX_URL = "https://www.tpex.org.tw/www/zh-tw/afterTrading/dailyQuotes?date={date_slash}&id=&response=json"
+MARKET_BREADTH_FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+# MA60 需 60 根，再保留 20 日新高低比較窗。
+MARKET_BREADTH_MAX_DAYS = 80
+MARKET_BREADTH_REQUEST_GAP_SECONDS = 2.5
+
+
+def _parse_market_quote_table(fields, rows, column_keywords):
+    """依欄名關鍵字取出代號與 OHLCV；不同交易所欄名略有差異，例如「收盤價」與「收盤」。"""
+    fields = [re.sub(r'<[^>]+>|\s+', '', str(field)) for field in fields]
+    positions = {}
+    for target, keywords in column_keywords.items():
+        position = next((index for index, field in enumerate(fields) if any(keyword == field for keyword in keywords)), None)
+        if position is None:
+            position = next((index for index, field in enumerate(fields) if any(keyword in field for keyword in keywords)), None)
+        if position is None:
+            return pd.DataFrame()
+        positions[target] = position
+    raw = pd.DataFrame([row for row in rows if len(row) > max(positions.values())])
+    if raw.empty:
+        return pd.DataFrame()
+    frame = pd.DataFrame({'代號': raw[positions['代號']].astype(str).str.strip()})
+    for field in MARKET_BREADTH_FIELDS:
+        frame[field] = pd.to_numeric(
+            raw[positions[field]].astype(str).str.replace(',', '', regex=False).str.strip(), errors='coerce'
+        )
+    return frame
+
+
+def fetch_market_daily_bars(date_str):
+    """抓取單日上市＋上櫃全部個股開高低收量。
+
+    兩個市場都有資料才算成功；兩邊都正常回應但皆無資料視為休市，回傳空表；
+    其餘情況（任一市場請求失敗或只有單邊有資料）拋出例外，讓該日留待下次補抓，
+    避免只含半個市場的一欄被當成完整交易日寫入倉庫。
+    """
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept': 'application/json'}
+    trading_day = datetime.strptime(date_str, '%Y%m%d')
+    frames, errors = [], []
+    sources = [
+        ('上市', MARKET_BREADTH_TWSE_URL.format(date_str=date_str), {
+            '代號': ('證券代號',), 'Open': ('開盤價',), 'High': ('最高價',), 'Low': ('最低價',),
+            'Close': ('收盤價',), 'Volume': ('成交股數',),
+        }),
+        ('上櫃', MARKET_BREADTH_TPEX_URL.format(date_slash=trading_day.strftime('%Y/%m/%d')), {
+            '代號': ('代號',), 'Open': ('開盤',), 'High': ('最高',), 'Low': ('最低',),
+            'Close': ('收盤',), 'Volume': ('成交股數',),
+        }),
+    ]
+    for exchange, url, column_keywords in sources:
+        try:
+            response = requests.get(url, headers=headers, timeout=15, verify=False)
+            response.raise_for_status()
+            payload = response.json()
+            tables = list(payload.get('tables', []))
+            if payload.get('fields') and payload.get('data'):
+                tables.append({'fields': payload['fields'], 'data': payload['data']})
+            if payload.get('aaData'):
+                tables.append({'fields': payload.get('fields', []), 'data': payload['aaData']})
+            for table in tables:
+                parsed = _parse_market_quote_table(table.get('fields', []), table.get('data', []), column_keywords)
+                if not parsed.empty:
+                    frames.append(parsed)
+                    break
+        except (requests.RequestException, ValueError, TypeError, KeyError) as exc:
+            errors.append(f"{exchange}：{exc}")
+    if errors:
+        raise requests.RequestException("；".join(errors))
+    if not frames:
+        return pd.DataFrame(columns=['代號', *MARKET_BREADTH_FIELDS])
+    if len(frames) < len(sources):
+        raise requests.RequestException(f"{date_str} 只有部分市場有收盤行情")
+    daily = pd.concat(frames, ignore_index=True)
+    return daily.drop_duplicates('代號', keep='first').reset_index(drop=True)
+
+
+def market_breadth_universe():
+    """廣度母體：stock_names.csv 中 4 碼、非 00 開頭的上市櫃普通股。"""
+    code_map, _ = load_local_stock_names()
+    return sorted(code for code in code_map if re.fullmatch(r'[1-9]\d{3}', str(code)))
+
+
+@st.cache_resource(show_spinner=False)
+def get_market_breadth_engine():
+    """跨 session 共用的廣度引擎；陣列形狀皆為（股票數, 交易日數）。"""
+    return {
+        'codes': [], 'code_index': {}, 'dates': [], 'closed_dates': [], 'bars': None,
+        'breadth': None, 'loaded': False, 'lock': threading.RLock(),
+    }
+
+
+def _empty_market_breadth_bars(code_count, day_count):
+    return {field: np.full((code_count, day_count), np.nan, dtype=np.float32) for field in MARKET_BREADTH_FIELDS}
+
+
+def load_market_breadth_engine():
+    """第一次使用時讀入本地陣列檔，並把母體對齊到目前的 stock_names.csv。"""
+    engine = get_market_breadth_engine()
+    with engine['lock']:
+        if engine['loaded']:
+            return engine
+        codes, dates, closed_dates, bars = [], [], [], None
+        if os.path.exists(MARKET_BREADTH_FILE):
+            try:
+                with np.load(MARKET_BREADTH_FILE, allow_pickle=False) as stored:
+                    codes = [str(code) for code in stored['codes']]
+                    dates = [str(day) for day in stored['dates']]
+                    # 舊版檔案沒有休市日欄位。
+                    if 'closed_dates' in stored.files:
+                        closed_dates = [str(day) for day in stored['closed_dates']]
+                    bars = {field: stored[field].astype(np.float32) for field in MARKET_BREADTH_FIELDS}
+            except (OSError, ValueError, KeyError):
+                codes, dates, closed_dates, bars = [], [], [], None
+        universe = market_breadth_universe() or codes
+        aligned = _empty_market_breadth_bars(len(universe), len(dates))
+        if bars is not None and codes:
+            stored_index = {code: position for position, code in enumerate(codes)}
+            source_rows = np.array([stored_index.get(code, -1) for code in universe], dtype=int)
+            found = source_rows >= 0
+            for field in MARKET_BREADTH_FIELDS:
+                aligned[field][found] = bars[field][source_rows[found]]
+        engine.update({
+            'codes': universe, 'code_index': {code: position for position, code in enumerate(universe)},
+            'dates': dates, 'closed_dates': closed_dates, 'bars': aligned, 'breadth': None, 'loaded': True,
+        })
+    return engine
+
+
+def _save_market_breadth_engine(engine):
+    os.makedirs(MARKET_BREADTH_DIR, exist_ok=True)
+    temp_path = f"{MARKET_BREADTH_FILE}.tmp.npz"
+    np.savez_compressed(
+        temp_path, codes=np.array(engine['codes'], dtype=str), dates=np.array(engine['dates'], dtype=str),
+        closed_dates=np.array(engine['closed_dates'], dtype=str), **engine['bars']
+    )
+    os.replace(temp_path, MARKET_BREADTH_FILE)
+
+
+def append_market_breadth_day(date_str, daily):
+    """把單日全市場行情寫成陣列的一欄；同日重抓會覆寫該欄，超過保留天數時丟棄最舊欄。"""
+    engine = load_market_breadth_engine()
+    with engine['lock']:
+        dates = list(engine['dates'])
+        bars = engine['bars']
+        if date_str in dates:
+            column = dates.index(date_str)
+        else:
+            dates.append(date_str)
+            order = np.argsort(dates)
+            dates = [dates[position] for position in order]
+            bars = {
+                field: np.hstack([values, np.full((values.shape[0], 1), np.nan, dtype=np.float32)])[:, order]
+                for field, values in bars.items()
+            }
+            column = dates.index(date_str)
+        rows = daily['代號'].astype(str).map(engine['code_index'])
+        matched = rows.notna().to_numpy()
+        row_positions = rows[matched].astype(int).to_numpy()
+        for field in MARKET_BREADTH_FIELDS:
+            bars[field][:, column] = np.nan
+            bars[field][row_positions, column] = daily.loc[matched, field].to_numpy(dtype=np.float32)
+        if len(dates) > MARKET_BREADTH_MAX_DAYS:
+            dates = dates[-MARKET_BREADTH_MAX_DAYS:]
+            bars = {field: values[:, -MARKET_BREADTH_MAX_DAYS:] for field, values in bars.items()}
+        engine.update({'dates': dates, 'bars': bars, 'breadth': None})
+        _save_market_breadth_engine(engine)
+    return int(matched.sum())
+
+
+def mark_market_breadth_closed(date_str):
+    """記下兩個市場都無資料的日子（颱風假等臨時休市），之後補抓時略過。"""
+    engine = load_market_breadth_engine()
+    with engine['lock']:
+        closed_dates = sorted(set(engine['closed_dates']) | {date_str})
+        engine['closed_dates'] = closed_dates[-MARKET_BREADTH_MAX_DAYS:]
+        _save_market_breadth_engine(engine)
+
+
+def update_market_breadth(progress_callback=None):
+    """補抓保留窗內所有尚未入庫的交易日；先前抓取失敗的日子也會在下次更新時重抓。"""
+    engine = load_market_breadth_engine()
+    now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
+    today_tw = now_tw.date()
+    # 收盤資料約 14:30 後公布，之前只補到前一交易日。
+    last_day = today_tw if now_tw.time() >= dt_time(14, 30) else today_tw - timedelta(days=1)
+    with engine['lock']:
+        stored = set(engine['dates']) | set(engine['closed_dates'])
+    start_day = last_day - timedelta(days=int(MARKET_BREADTH_MAX_DAYS * 1.5))
+    window = [
+        day.date() for day in pd.date_range(start_day, last_day, freq='D')
+        if not is_market_closed_func(day.date())
+    ][-MARKET_BREADTH_MAX_DAYS:]
+    pending = [day for day in window if day.strftime('%Y%m%d') not in stored]
+    added, failed = 0, 0
+    for position, trading_day in enumerate(pending):
+        date_str = trading_day.strftime('%Y%m%d')
+        try:
+            daily = fetch_market_daily_bars(date_str)
+            if daily.empty:
+                mark_market_breadth_closed(date_str)
+            else:
+                append_market_breadth_day(date_str, daily)
+                added += 1
+        except (requests.RequestException, ValueError, KeyError):
+            failed += 1
+        if progress_callback is not None:
+            progress_callback(position + 1, len(pending))
+        if position + 1 < len(pending):
+            time.sleep(MARKET_BREADTH_REQUEST_GAP_SECONDS)
+    return added, failed
+
+
+def compute_market_breadth():
+    """以陣列運算產生每日廣度：漲跌家數、漲跌停、站上 MA20／MA60、20 日新高低與廣度溫度。"""
+    engine = load_market_breadth_engine()
+    with engine['lock']:
+        if engine['breadth'] is not None:
+            return engine['breadth']
+        dates = list(engine['dates'])
+        bars = engine['bars']
+        if len(dates) < 2 or not engine['codes']:
+            return pd.DataFrame()
+        # 倉庫以 float32 保存，先還原成到分的 float64，漲跌停收盤才能與計算出的價格精確比對。
+        close = np.round(bars['Close'].astype(np.float64), 2)
+        high = np.round(bars['High'].astype(np.float64), 2)
+        low = np.round(bars['Low'].astype(np.float64), 2)
+
+    previous_close = np.hstack([np.full((close.shape[0], 1), np.nan), close[:, :-1]])
+    traded = np.isfinite(close) & np.isfinite(previous_close) & (close > 0) & (previous_close > 0)
+    advancers = (traded & (close > previous_close)).sum(axis=0)
+    decliners = (traded & (close < previous_close)).sum(axis=0)
+    unchanged = (traded & (close == previous_close)).sum(axis=0)
+    limit_up, limit_down = calculate_limits_array(previous_close)
+    limit_up_count = (traded & (limit_up > 0) & (close >= limit_up - 1e-6)).sum(axis=0)
+    limit_down_count = (traded & (limit_down > 0) & (close <= limit_down + 1e-6)).sum(axis=0)
+
+    close_by_day = pd.DataFrame(close.T)
+    ma20 = close_by_day.rolling(20, min_periods=20).mean().to_numpy().T
+    ma60 = close_by_day.rolling(60, min_periods=60).mean().to_numpy().T
+    with np.errstate(invalid='ignore'):
+        above_ma20 = np.where(np.isfinite(ma20).sum(axis=0) > 0,
+                              (close > ma20).sum(axis=0) / np.maximum(np.isfinite(ma20).sum(axis=0), 1) * 100, np.nan)
+        above_ma60 = np.where(np.isfinite(ma60).sum(axis=0) > 0,
+                              (close > ma60).sum(axis=0) / np.maximum(np.isfinite(ma60).sum(axis=0), 1) * 100, np.nan)
+        prior_high = pd.DataFrame(high.T).shift(1).rolling(20, min_periods=20).max().to_numpy().T
+        prior_low = pd.DataFrame(low.T).shift(1).rolling(20, min_periods=20).min().to_numpy().T
+        new_highs = (np.isfinite(prior_high) & (high > prior_high)).sum(axis=0)
+        new_lows = (np.isfinite(prior_low) & (low < prior_low)).sum(axis=0)
+
+    breadth = pd.DataFrame({
+        '上漲家數': advancers, '下跌家數': decliners, '平盤家數': unchanged,
+        '漲停家數': limit_up_count, '跌停家數': limit_down_count,
+        '站上MA20(%)': above_ma20, '站上MA60(%)': above_ma60,
+        '創20日新高': new_highs, '創20日新低': new_lows,
+    }, index=pd.to_datetime(dates, format='%Y%m%d'))
+    breadth = breadth[(breadth['上漲家數'] + breadth['下跌家數'] + breadth['平盤家數']) > 0]
+    breadth['騰落線'] = (breadth['上漲家數'] - breadth['下跌家數']).cumsum()
+    advance_share = breadth['上漲家數'] / (breadth['上漲家數'] + breadth['下跌家數']).replace(0, np.nan) * 100
+    high_low_share = breadth['創20日新高'] / (breadth['創20日新高'] + breadth['創20日新低']).replace(0, np.nan) * 100
+    breadth['廣度溫度'] = (
+        0.35 * breadth['站上MA20(%)'].fillna(50) + 0.25 * breadth['站上MA60(%)'].fillna(50)
+        + 0.25 * advance_share.fillna(50) + 0.15 * high_low_share.fillna(50)
+    ).clip(0, 100).round()
+    with engine['lock']:
+        engine['breadth'] = breadth
+    return breadth
+
+
+def summarize_market_breadth(breadth):
+    """把最新一日廣度整理成與指數溫度計相同格式，可直接交給儀表板繪製。"""
+    if breadth is None or breadth.empty:
+        return None
+    latest = breadth.iloc[-1]
+    score = int(latest['廣度溫度'])
+    if score >= 60:
+        status, color = "廣度偏多", "#ff4b4b"
+    elif score <= 40:
+        status, color = "廣度偏空", "#00c853"
+    else:
+        status, color = "廣度中性", "#ffc107"
+    return {'score': score, 'status': status, 'color': color, 'latest': latest, 'updated_at': breadth.index[-1]}
+
+
 def get_futures_intraday_state(api, direction):
     """Return 15-minute confirmation, VWAP and active-session opening range."""
     empty_state = {
@@ -2940,31 +3536,16 @@ def get_live_futures_snapshot(api, product='TMF'):
         return None
 
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_taifex_index_margin_map():
-    """Read current initial margin requirements from the TAIFEX OpenAPI."""
-    margin_map = {}
+    """Read current initial margin requirements from the shared TAIFEX reference store."""
     try:
-        response = requests.get(
-            'https://openapi.taifex.com.tw/v1/IndexFuturesAndOptionsMargining',
-            headers={'accept': 'application/json', 'If-Modified-Since': 'Mon, 26 Jul 1997 05:00:00 GMT'},
-            timeout=8,
-            verify=False,
-        )
-        for item in response.json() if response.status_code == 200 else []:
-            raw_name = str(item.get('Contract', '')).replace(' ', '')
-            raw_margin = str(item.get('InitialMargin', '0')).replace(',', '')
-            try:
-                margin = float(raw_margin)
-            except ValueError:
-                continue
-            if raw_name in ('TMF', 'MXF') or '微型臺' in raw_name or '微型台' in raw_name:
-                margin_map['TMF'] = margin
-            elif raw_name == 'TX' or '臺股期貨' in raw_name or '台指期貨' in raw_name:
-                margin_map['TX'] = margin
-    except (requests.RequestException, ValueError, TypeError):
-        pass
-    return margin_map
+        index_futures = get_taifex_reference_tables(['IndexFuturesAndOptionsMargining'])['index_futures']
+    except Exception:
+        return {}
+    return {
+        root: float(margin) for root, margin in index_futures['原始保證金'].items()
+        if root in ('TX', 'TMF') and pd.notna(margin)
+    }
 
 
 def calculate_short_wave_plan(api, direction):
@@ -3687,8 +4268,12 @@ def render_option_metric_cards(title, items):
     )
 
 
-def build_txo_payoff_chart(option_quote, plan, is_spread=False):
-    """Build an interactive expiry payoff curve in TWD per option position."""
+def txo_payoff_profile(option_quote, plan, is_spread=False):
+    """Compute the expiry payoff curve and its static version key.
+
+    The key covers everything except the live spot price, so a quote tick that
+    only moves the spot marker reuses the already-built curve figure.
+    """
     if not option_quote or not plan:
         return None
     spot = float(plan.get('latest', 0) or 0)
@@ -3707,6 +4292,7 @@ def build_txo_payoff_chart(option_quote, plan, is_spread=False):
         long_strike = float(option_quote['long_strike'])
         strikes = [short_strike, long_strike]
         is_put = option_quote.get('right') == 'Put'
+        cost_points = float(credit_points)
     else:
         premium = option_quote.get('premium')
         if premium is None:
@@ -3714,10 +4300,13 @@ def build_txo_payoff_chart(option_quote, plan, is_spread=False):
         strike = float(option_quote['strike'])
         strikes = [strike]
         is_call = option_quote.get('right') == 'Call'
+        cost_points = float(premium)
 
+    breakeven = option_quote.get('breakeven')
+    breakeven = float(breakeven) if breakeven is not None else None
     key_points = [spot, target, stop, *strikes]
-    if option_quote.get('breakeven') is not None:
-        key_points.append(float(option_quote['breakeven']))
+    if breakeven is not None:
+        key_points.append(breakeven)
     span = max(max(key_points) - min(key_points), float(plan.get('atr', 0) or 0) * 2, 400.0)
     lower = math.floor((min(key_points) - span * 0.35) / 50) * 50
     upper = math.ceil((max(key_points) + span * 0.35) / 50) * 50
@@ -3726,20 +4315,36 @@ def build_txo_payoff_chart(option_quote, plan, is_spread=False):
     if is_spread:
         if is_put:
             payoff_points = (
-                float(credit_points)
+                cost_points
                 - np.maximum(short_strike - underlying, 0)
                 + np.maximum(long_strike - underlying, 0)
             )
         else:
             payoff_points = (
-                float(credit_points)
+                cost_points
                 - np.maximum(underlying - short_strike, 0)
                 + np.maximum(underlying - long_strike, 0)
             )
     else:
         intrinsic = np.maximum(underlying - strike, 0) if is_call else np.maximum(strike - underlying, 0)
-        payoff_points = intrinsic - float(premium)
-    payoff_twd = payoff_points * 50
+        payoff_points = intrinsic - cost_points
+    return {
+        'spot': spot, 'target': target, 'stop': stop, 'breakeven': breakeven,
+        'underlying': underlying, 'payoff_twd': payoff_points * 50,
+        'static_key': (
+            bool(is_spread), option_quote.get('right'), tuple(strikes), cost_points,
+            target, stop, breakeven, lower, upper,
+        ),
+    }
+
+
+def build_txo_payoff_chart(option_quote, plan, is_spread=False, profile=None):
+    """Build an interactive expiry payoff curve in TWD per option position."""
+    if profile is None:
+        profile = txo_payoff_profile(option_quote, plan, is_spread)
+    if profile is None:
+        return None
+    underlying, payoff_twd = profile['underlying'], profile['payoff_twd']
 
     fig = go.Figure()
     fig.add_trace(go.Scatter(
@@ -3759,14 +4364,16 @@ def build_txo_payoff_chart(option_quote, plan, is_spread=False):
     ))
     fig.add_hline(y=0, line_color='#7f8c8d', line_width=1)
     markers = [
-        ('目前', spot, '#29b6f6'), ('目標', target, '#ff4b4b'), ('停損', stop, '#00c853'),
+        ('目前', profile['spot'], '#29b6f6'), ('目標', profile['target'], '#ff4b4b'), ('停損', profile['stop'], '#00c853'),
     ]
-    if option_quote.get('breakeven') is not None:
-        markers.append(('損益兩平', float(option_quote['breakeven']), '#ffb300'))
+    if profile['breakeven'] is not None:
+        markers.append(('損益兩平', profile['breakeven'], '#ffb300'))
     for label, value, color in markers:
-        fig.add_vline(x=value, line_color=color, line_dash='dot', line_width=1)
+        # The spot marker is named so patch_txo_payoff_spot can move it in place.
+        name = 'payoff_spot' if label == '目前' else None
+        fig.add_vline(x=value, line_color=color, line_dash='dot', line_width=1, name=name)
         fig.add_annotation(
-            x=value, y=1, yref='paper', text=f"{label} {value:,.0f}",
+            x=value, y=1, yref='paper', text=f"{label} {value:,.0f}", name=name,
             showarrow=False, xanchor='left', yanchor='bottom', font=dict(size=11, color=color),
         )
     fig.update_layout(
@@ -3779,6 +4386,17 @@ def build_txo_payoff_chart(option_quote, plan, is_spread=False):
     return fig
 
 
+def patch_txo_payoff_spot(fig, spot):
+    """Move only the live spot marker of a payoff chart; curves and plan markers stay untouched."""
+    with fig.batch_update():
+        for shape in fig.layout.shapes:
+            if shape.name == 'payoff_spot':
+                shape.update(x0=spot, x1=spot)
+        for annotation in fig.layout.annotations:
+            if annotation.name == 'payoff_spot':
+                annotation.update(x=spot, text=f"目前 {spot:,.0f}")
+
+
 def _taifex_number(value):
     """Convert a TAIFEX table cell to float, retaining unavailable values as None."""
     text = str(value).strip().replace(',', '')
@@ -3959,13 +4577,8 @@ def calculate_index_trade_plan(index_df, index_result, futures_df, futures_resul
     resistance_idx = min((i for i, level in enumerate(levels) if level >= latest), default=len(levels) - 1)
     support = levels[support_idx]
     resistance = levels[resistance_idx]
-    prev_close = data['Close'].shift(1)
-    true_range = pd.concat([
-        data['High'] - data['Low'],
-        (data['High'] - prev_close).abs(),
-        (data['Low'] - prev_close).abs(),
-    ], axis=1).max(axis=1)
-    atr = float(true_range.rolling(14, min_periods=10).mean().iloc[-1])
+    # ATR 直接取溫度計逐 K 指標的最後一列，與溫度分數同一次計算。
+    atr = float(primary_result['atr'])
     zone_points = max(20.0, (atr * 0.15) if np.isfinite(atr) else 20.0)
     log_returns = np.log(pd.to_numeric(data['Close'], errors='coerce')).diff().dropna()
     realized_volatility = float(log_returns.tail(20).std() * math.sqrt(252)) if len(log_returns) >= 10 else 0.25
@@ -4081,59 +4694,137 @@ def _format_fibo_trade_price(value, asset_type):
     return _format_fibo_number(rounded, decimals)
 
 
+FIBO_RETRACEMENT_RATIOS = (0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0)
+FIBO_EXTENSION_RATIOS = (-2.618, -2.0, -1.618, -1.0, 1.618, 2.0, 2.618)
+
+
+def fibo_true_range(highs, lows, closes):
+    """真實波幅陣列；第一根沒有前收，只取高低差（與 pandas 逐列 max 略過 NaN 的結果相同）。"""
+    previous_close = np.concatenate(([np.nan], closes[:-1]))
+    with np.errstate(invalid='ignore'):
+        return np.fmax(highs - lows, np.fmax(np.abs(highs - previous_close), np.abs(lows - previous_close)))
+
+
+def _fibo_pivot_points(highs, lows, width=2):
+    """以滑動視窗一次找出所有區域高低點，再把連續同向的候選壓成一點（取最極端、同值取較晚者）。"""
+    size = 2 * width + 1
+    if len(highs) < size:
+        return []
+    high_windows = np.lib.stride_tricks.sliding_window_view(highs, size)
+    low_windows = np.lib.stride_tricks.sliding_window_view(lows, size)
+    center_highs = highs[width:len(highs) - width]
+    center_lows = lows[width:len(lows) - width]
+    with np.errstate(invalid='ignore'):
+        is_high = (center_highs >= high_windows.max(axis=1)) & (center_highs > np.maximum(high_windows[:, 0], high_windows[:, -1]))
+        is_low = (center_lows <= low_windows.min(axis=1)) & (center_lows < np.minimum(low_windows[:, 0], low_windows[:, -1]))
+    high_index = np.flatnonzero(is_high) + width
+    low_index = np.flatnonzero(is_low) + width
+    if not len(high_index) and not len(low_index):
+        return []
+
+    index = np.concatenate([high_index, low_index])
+    kind = np.concatenate([np.zeros(len(high_index), dtype=np.int8), np.ones(len(low_index), dtype=np.int8)])
+    order = np.lexsort((kind, index))
+    index, kind = index[order], kind[order]
+    values = np.where(kind == 0, highs[index], lows[index])
+    runs = np.concatenate(([0], np.cumsum(kind[1:] != kind[:-1])))
+    extremity = np.where(kind == 0, values, -values)
+    ranked = np.lexsort((np.arange(len(index)), extremity, runs))
+    keep = np.sort(ranked[np.append(runs[ranked][1:] != runs[ranked][:-1], True)])
+    return [(int(index[i]), 'H' if kind[i] == 0 else 'L', float(values[i])) for i in keep]
+
+
 def _fibo_pivots(data, width=2):
     """Return alternating local swing points, newest point last."""
-    highs = data['High'].astype(float).to_numpy()
-    lows = data['Low'].astype(float).to_numpy()
-    candidates = []
-    for i in range(width, len(data) - width):
-        high_window = highs[i - width:i + width + 1]
-        low_window = lows[i - width:i + width + 1]
-        if highs[i] >= high_window.max() and highs[i] > max(high_window[0], high_window[-1]):
-            candidates.append((i, 'H', float(highs[i])))
-        if lows[i] <= low_window.min() and lows[i] < min(low_window[0], low_window[-1]):
-            candidates.append((i, 'L', float(lows[i])))
-
-    pivots = []
-    for point in sorted(candidates, key=lambda item: item[0]):
-        if pivots and point[1] == pivots[-1][1]:
-            is_more_extreme = (point[1] == 'H' and point[2] >= pivots[-1][2]) or (
-                point[1] == 'L' and point[2] <= pivots[-1][2]
-            )
-            if is_more_extreme:
-                pivots[-1] = point
-        else:
-            pivots.append(point)
-    return pivots
+    return _fibo_pivot_points(
+        data['High'].astype(float).to_numpy(), data['Low'].astype(float).to_numpy(), width
+    )
+
+
+def analyze_fibo_structure(data, widths=(2,), lookbacks=(60, 45, 30), pivot_bars=45, atr_bars=14):
+    """單一週期的費波結構一次算完：ATR、各寬度擺盪點，以及各回看長度的高低區間與回撤／延伸價位。
+
+    區間高低以尾端累積極值一次取得所有回看長度；擺盪點沿用 123／2B 判讀的最近 pivot_bars 根。
+    """
+    source = data.dropna(subset=['High', 'Low', 'Close'])
+    highs = source['High'].astype(float).to_numpy()
+    lows = source['Low'].astype(float).to_numpy()
+    closes = source['Close'].astype(float).to_numpy()
+    if not len(source):
+        return None
+    true_range = fibo_true_range(highs, lows, closes)
+    atr = float(np.nanmean(true_range[-atr_bars:])) if len(true_range) else 0.0
+
+    trailing_highs = np.maximum.accumulate(highs[::-1])
+    trailing_lows = np.minimum.accumulate(lows[::-1])
+    ranges = {}
+    for lookback in lookbacks:
+        bars = min(int(lookback), len(source))
+        range_high, range_low = float(trailing_highs[bars - 1]), float(trailing_lows[bars - 1])
+        span = range_high - range_low
+        ranges[lookback] = {
+            'high': range_high, 'low': range_low, 'bars': bars,
+            'levels': {ratio: range_low + span * ratio for ratio in FIBO_RETRACEMENT_RATIOS + FIBO_EXTENSION_RATIOS},
+        }
+    pivot_highs, pivot_lows = highs[-pivot_bars:], lows[-pivot_bars:]
+    return {
+        'close': float(closes[-1]), 'atr': atr, 'true_range': true_range, 'bars': len(source),
+        'updated_at': source.index[-1],
+        'pivots': {width: _fibo_pivot_points(pivot_highs, pivot_lows, width) for width in widths},
+        'ranges': ranges,
+    }
+
+
+def fibo_confluence_levels(structures, tolerance_pct=0.3, ratios=FIBO_RETRACEMENT_RATIOS):
+    """把多個週期（例如 1d／60m／15m）、多個回看長度的費波價位合併成匯聚區。
+
+    structures 為 {週期: analyze_fibo_structure 結果}；價位排序後相鄰差距在 tolerance_pct% 內者歸為同一區，
+    回傳依涵蓋週期數與價位數排序的表格。
+    """
+    rows = [
+        (level, interval, lookback, ratio)
+        for interval, structure in structures.items() if structure
+        for lookback, price_range in structure['ranges'].items()
+        if price_range['high'] > price_range['low']
+        for ratio, level in price_range['levels'].items() if ratio in ratios
+    ]
+    if not rows:
+        return pd.DataFrame(columns=['價位', '週期數', '價位數', '來源'])
+    levels = pd.DataFrame(rows, columns=['level', 'interval', 'lookback', 'ratio']).sort_values('level', kind='stable')
+    prices = levels['level'].to_numpy()
+    gaps = np.diff(prices) > np.abs(prices[:-1]) * tolerance_pct / 100
+    levels['zone'] = np.concatenate(([0], np.cumsum(gaps)))
+    levels['label'] = levels['interval'] + "/" + levels['lookback'].astype(str) + "@" + levels['ratio'].map('{:g}'.format)
+    zones = levels.groupby('zone').agg(
+        價位=('level', 'mean'), 週期數=('interval', 'nunique'), 價位數=('level', 'size'),
+        來源=('label', '、'.join),
+    )
+    return zones.sort_values(['週期數', '價位數'], ascending=False, kind='stable').reset_index(drop=True)
 
 
-def build_fibonacci_trade_suggestion(data, range_high, range_low, ticker_code, interval):
+def build_fibonacci_trade_suggestion(data, range_high, range_low, ticker_code, interval, structure=None):
     """Create a compact, rule-based Fibonacci / 123 / 2B trade reference.
 
     The result is deliberately conditional: it presents a level to wait for,
     instead of turning a lagging trend label into an unconditional market order.
+    structure 可傳入同一份資料已算好的 analyze_fibo_structure 結果，省去重算 ATR 與擺盪點。
     """
-    source = data.dropna(subset=['Open', 'High', 'Low', 'Close']).copy()
+    source = data.dropna(subset=['Open', 'High', 'Low', 'Close'])
     if len(source) < 12 or range_high <= range_low:
         return None
 
     close = float(source['Close'].iloc[-1])
-    previous_close = source['Close'].astype(float).shift(1)
-    true_range = pd.concat([
-        source['High'].astype(float) - source['Low'].astype(float),
-        (source['High'].astype(float) - previous_close).abs(),
-        (source['Low'].astype(float) - previous_close).abs(),
-    ], axis=1).max(axis=1)
+    if structure is None:
+        structure = analyze_fibo_structure(source, lookbacks=())
     is_futures = ticker_code in ('TWF=F', 'TMF=F')
     asset_type = 'futures' if is_futures else ('index' if str(ticker_code).startswith('^') else 'stock')
-    atr = float(true_range.tail(14).mean()) if not true_range.empty else 0.0
+    atr = structure['atr']
     atr_floor = get_taiwan_tick_size(close) if asset_type == 'stock' else 1.0
     atr = max(atr if np.isfinite(atr) else 0.0, (range_high - range_low) * 0.01, atr_floor)
     buffer = max(atr * 0.18, (range_high - range_low) * 0.006, atr_floor)
 
-    ratios = (0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0)
-    levels = {ratio: range_low + (range_high - range_low) * ratio for ratio in ratios}
-    ordered_levels = [levels[ratio] for ratio in ratios]
+    levels = {ratio: range_low + (range_high - range_low) * ratio for ratio in FIBO_RETRACEMENT_RATIOS}
+    ordered_levels = [levels[ratio] for ratio in FIBO_RETRACEMENT_RATIOS]
     below = [price for price in ordered_levels if price <= close]
     above = [price for price in ordered_levels if price >= close]
     support = max(below) if below else range_low
@@ -4141,7 +4832,7 @@ def build_fibonacci_trade_suggestion(data, range_high, range_low, ticker_code, i
     lower_support = max([price for price in ordered_levels if price < support], default=range_low)
     upper_resistance = min([price for price in ordered_levels if price > resistance], default=range_high)
 
-    pivots = _fibo_pivots(source.tail(45))
+    pivots = structure['pivots'][2]
     signal_parts = []
     direction = None
     trigger = None
@@ -4229,7 +4920,7 @@ def build_fibonacci_trade_suggestion(data, range_high, range_low, ticker_code, i
             'note': '價格在 0.382–0.618 洗盤區，中央位置不追價。',
             'long': (long_entry, long_stop, long_target),
             'short': (short_entry, short_stop, short_target),
-            'is_futures': is_futures, 'asset_type': asset_type,
+            'is_futures': is_futures, 'asset_type': asset_type, 'confirmed': False,
         }
 
     entry, stop, target = (
@@ -4250,8 +4941,129 @@ def build_fibonacci_trade_suggestion(data, range_high, range_low, ticker_code, i
         'note': note, 'entry': entry, 'stop': stop, 'target': target,
         'risk': risk, 'reward': reward,
         'rr': reward / risk if risk > 0 else None,
-        'is_futures': is_futures, 'asset_type': asset_type,
+        'is_futures': is_futures, 'asset_type': asset_type, 'confirmed': structural_confirmed,
+    }
+
+
+FIBO_SCAN_INTERVALS = {'1d': "日", '60m': "60分", '15m': "15分"}
+FIBO_SCAN_LOOKBACKS = (60, 45, 30)
+# 與費波圖表向永豐索取的天數一致，掃描後開圖可直接命中同一份 K 棒快取。
+FIBO_SCAN_INTRADAY_DAYS = {'60m': 12, '15m': 5}
+
+
+def fibo_scan_universe(stock_data, tags):
+    """掃描母體：股票表格的代號，加上快速標籤「名稱(代號)」中的個股代號；保留原順序並去重。"""
+    code_map, _ = load_local_stock_names()
+    codes = []
+    if isinstance(stock_data, pd.DataFrame) and '代號' in stock_data.columns:
+        codes.extend(stock_data['代號'].astype(str).str.strip().tolist())
+    for tag in tags:
+        match = re.search(r'\(([0-9A-Za-z]{4,6})\)\s*$', str(tag or '')) or re.fullmatch(r'\s*(\d{4,6})\s*', str(tag or ''))
+        if match:
+            codes.append(match.group(1))
+    return [(code, code_map.get(code, '')) for code in dict.fromkeys(code for code in codes if code)]
+
+
+def market_breadth_symbol_bars(codes):
+    """從全市場廣度的日 K 陣列切出指定個股的 OHLCV；純本地讀取，不發出任何網路請求。"""
+    engine = load_market_breadth_engine()
+    with engine['lock']:
+        dates, bars, code_index = list(engine['dates']), engine['bars'], dict(engine['code_index'])
+    if not dates or bars is None:
+        return {}
+    index = pd.to_datetime(dates, format='%Y%m%d')
+    frames = {}
+    for code in codes:
+        row = code_index.get(str(code))
+        if row is None:
+            continue
+        frame = pd.DataFrame({field: bars[field][row].astype(float) for field in MARKET_BREADTH_FIELDS}, index=index)
+        frame = frame.dropna(subset=['Open', 'High', 'Low', 'Close'])
+        if not frame.empty:
+            frames[str(code)] = frame
+    return frames
+
+
+def scan_fibo_symbol(item):
+    """單一標的的多週期費波掃描。
+
+    每個週期只算一次費波結構，找出收盤價最接近的回撤價位；距離在 max_atr 個 ATR 內才列出，
+    並附上跨週期匯聚數與 123／2B 結構訊號。每個週期保留距離最近的回看長度。
+    """
+    code, name, frames, max_atr = item
+    structures = {
+        interval: analyze_fibo_structure(frame, lookbacks=FIBO_SCAN_LOOKBACKS)
+        for interval, frame in frames.items() if len(frame) >= 12
     }
+    zones = fibo_confluence_levels(structures)
+    rows = []
+    for interval, structure in structures.items():
+        if structure is None or structure['atr'] <= 0:
+            continue
+        close, atr = structure['close'], structure['atr']
+        best = None
+        for lookback, price_range in structure['ranges'].items():
+            if price_range['high'] <= price_range['low']:
+                continue
+            ratio, level = min(
+                ((ratio, price_range['levels'][ratio]) for ratio in FIBO_RETRACEMENT_RATIOS),
+                key=lambda pair: abs(pair[1] - close),
+            )
+            distance = abs(close - level) / atr
+            if distance <= max_atr and (best is None or distance < best[0]):
+                best = (distance, lookback, ratio, level, price_range)
+        if best is None:
+            continue
+        distance, lookback, ratio, level, price_range = best
+        subset = frames[interval].tail(lookback)
+        # 回看長度不短於擺盪點視窗時，結構與子區間相同，可直接沿用。
+        suggestion = build_fibonacci_trade_suggestion(
+            subset, price_range['high'], price_range['low'], code, interval,
+            structure=structure if lookback >= 45 else None,
+        ) or {}
+        confluence = 1
+        if not zones.empty:
+            confluence = int(zones['週期數'].iloc[int(np.argmin(np.abs(zones['價位'].to_numpy() - level)))])
+        rows.append({
+            '代號': code, '名稱': name, '週期': FIBO_SCAN_INTERVALS.get(interval, interval),
+            '回看': lookback, '收盤': close, '費波': f"{ratio:g}", '價位': level,
+            '距離(ATR)': round(distance, 2), '距離%': round((close - level) / level * 100, 2) if level else None,
+            '匯聚週期': confluence, '結構確認': bool(suggestion.get('confirmed')),
+            '結構訊號': suggestion.get('signal', ''), '建議': suggestion.get('action', ''),
+        })
+    return rows
+
+
+def scan_fibonacci_watchlist(symbols, intervals, max_atr=0.5, api=None, progress_callback=None):
+    """批次掃描多檔多週期的費波價位；日 K 讀本地廣度陣列，分 K 需登入永豐並共用圖表快取。
+
+    資料讀齊後逐一計算各標的，回傳依結構確認、匯聚週期數與距離排序的表格。
+    """
+    codes = [code for code, _ in symbols]
+    frames_by_code = {code: {} for code in codes}
+    if '1d' in intervals:
+        for code, frame in market_breadth_symbol_bars(codes).items():
+            frames_by_code[code]['1d'] = frame
+    # 本地陣列沒有的日 K（例如 ETF）與所有分 K 才向永豐補抓。
+    fetch_plan = [
+        (code, interval) for code in codes for interval in intervals
+        if api is not None and interval not in frames_by_code[code]
+    ]
+    for position, (code, interval) in enumerate(fetch_plan):
+        lookback_days = FIBO_SCAN_INTRADAY_DAYS.get(interval, 150)
+        frame = get_cached_fibonacci_kbars(api, code, interval=interval, lookback_days=lookback_days)
+        if not frame.empty:
+            frames_by_code[code][interval] = frame
+        if progress_callback is not None:
+            progress_callback(position + 1, len(fetch_plan))
+    items = [(code, name, frames_by_code[code], float(max_atr)) for code, name in symbols if frames_by_code[code]]
+    rows = [row for item in items for row in scan_fibo_symbol(item)]
+    if not rows:
+        return pd.DataFrame(), len(items)
+    table = pd.DataFrame(rows).sort_values(
+        ['結構確認', '匯聚週期', '距離(ATR)'], ascending=[False, False, True], kind='stable',
+    ).reset_index(drop=True)
+    return table, len(items)
 
 
 def render_fibonacci_trade_suggestion(suggestion):
@@ -4325,6 +5137,189 @@ def render_fibonacci_trade_suggestion(suggestion):
         )
 
 
+def prepare_fibonacci_chart_data(df, ticker, interval, lookback, ma_flags):
+    """費波圖的資料準備：均線、近期波段（60 → 45 → 30 根回落）與交易建議，不含任何畫面呼叫。"""
+    data = df.copy()
+    for window in ('5', '10', '20', '60'):
+        if ma_flags.get(window):
+            data[f'MA{window}'] = data['Close'].rolling(window=int(window)).mean()
+
+    lookbacks_to_try = [60, 45, 30] if lookback == 60 else [lookback]
+    for lb in lookbacks_to_try:
+        temp_subset = data.tail(lb).copy().dropna(subset=['High', 'Low'])
+        if not temp_subset.empty:
+            h = float(temp_subset['High'].max())
+            l = float(temp_subset['Low'].min())
+            if h != l:
+                return {
+                    'status': 'ok', 'subset': temp_subset, 'high': h, 'low': l,
+                    'suggestion': build_fibonacci_trade_suggestion(temp_subset, h, l, ticker, interval),
+                }
+    temp_subset = data.tail(lookback).dropna(subset=['High', 'Low'])
+    return {'status': 'empty' if temp_subset.empty else 'flat'}
+
+
+def _bucket_chart_bars(frame, max_bars=CHART_MAX_CANDLES):
+    """K 棒超過上限時等分成 max_bars 組合併：開取首、高取最大、低取最小、收取末、量加總，極值不會被抹掉。"""
+    if len(frame) <= max_bars:
+        return frame
+    groups = np.arange(len(frame)) * max_bars // len(frame)
+    aggregations = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'}
+    if 'Volume' in frame.columns:
+        aggregations['Volume'] = 'sum'
+    aggregations.update({column: 'last' for column in frame.columns if str(column).startswith('MA')})
+    bucketed = frame.groupby(groups).agg(aggregations)
+    bucketed.index = frame.index[np.searchsorted(groups, np.arange(max_bars))]
+    return bucketed
+
+
+def build_fibonacci_chart_figure(df_subset, high, low, interval, ma_flags, ma_width, font_size, show_vol, title_html):
+    """費波 K 線圖。x 軸改用 K 棒序號（整數），跳過休市空檔的效果與類別軸相同，
+    但漲／跌／平三組 K 棒各自只帶自己的資料列，不再各送一份補 NaN 的完整序列。
+    最後一根放在獨立的即時 trace，由 patch_fibonacci_chart_figure 原地更新。"""
+    bars = _bucket_chart_bars(df_subset)
+    has_volume = show_vol and 'Volume' in bars.columns
+    target = dict(row=1, col=1) if has_volume else {}
+    positions = np.arange(len(bars))
+    labels = bars.index.strftime('%Y-%m-%d' if interval in ["1d", "1wk", "1mo"] else '%m-%d %H:%M').to_numpy()
+    opens, highs = bars['Open'].to_numpy(dtype=float), bars['High'].to_numpy(dtype=float)
+    lows, closes = bars['Low'].to_numpy(dtype=float), bars['Close'].to_numpy(dtype=float)
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.8, 0.2]) if has_volume else go.Figure()
+
+    # Plotly 的 Candlestick 只支援漲跌兩色，收盤=開盤會被強制當作漲(紅)；
+    # 改用三條 trace 分別承載紅漲／綠跌／白平盤的歷史 K 棒。
+    direction = np.sign(closes[:-1] - opens[:-1])
+    legend_shown = False
+    for sign, color in ((1, '#ff4b4b'), (-1, '#00e676'), (0, '#ffffff')):
+        mask = direction == sign
+        if not mask.any():
+            continue
+        fig.add_trace(go.Candlestick(
+            x=positions[:-1][mask], open=opens[:-1][mask], high=highs[:-1][mask], low=lows[:-1][mask],
+            close=closes[:-1][mask], text=labels[:-1][mask], hoverinfo='text+y', name="K線",
+            increasing=dict(line=dict(color=color), fillcolor=color),
+            decreasing=dict(line=dict(color=color), fillcolor=color),
+            showlegend=not legend_shown,
+        ), **target)
+        legend_shown = True
+    fig.add_trace(go.Candlestick(
+        x=positions[-1:], open=opens[-1:], high=highs[-1:], low=lows[-1:], close=closes[-1:],
+        text=labels[-1:], hoverinfo='text+y', name="K線", uid='fibo_live_candle', showlegend=not legend_shown,
+    ), **target)
+
+    for ma_name, color, flag in (('MA5', 'orange', '5'), ('MA10', 'lightblue', '10'), ('MA20', 'green', '20'), ('MA60', 'yellow', '60')):
+        if ma_flags.get(flag) and ma_name in bars.columns:
+            fig.add_trace(chart_line_trace(
+                positions, bars[ma_name].to_numpy(dtype=float), mode='lines', name=ma_name, uid=f"fibo_{ma_name}",
+                line=dict(color=color, width=ma_width), customdata=labels,
+                hovertemplate=f"%{{customdata}}<br>%{{y:,.2f}}<extra>{ma_name}</extra>",
+            ), **target)
+
+    if has_volume:
+        colors = np.select([closes > opens, closes < opens], ['#ff4b4b', '#00e676'], '#ffffff')
+        fig.add_trace(go.Bar(
+            x=positions, y=bars['Volume'].to_numpy(dtype=float), name="成交量", uid='fibo_volume', marker_color=colors,
+            customdata=labels, hovertemplate="%{customdata}<br>%{y:,.0f}<extra>成交量</extra>",
+        ), row=2, col=1)
+
+    fig.add_annotation(x=int(np.nanargmax(highs)), y=high, text=f"最高:{round_to_tick(high):g}", showarrow=True, arrowhead=1, yshift=10, font=dict(color="red", size=font_size), **target)
+    fig.add_annotation(x=int(np.nanargmin(lows)), y=low, text=f"最低:{round_to_tick(low):g}", showarrow=True, arrowhead=1, ay=40, font=dict(color="green", size=font_size), **target)
+
+    # 費波顏色映射表
+    color_map = {
+        1.0: "#ff4b4b",
+        0.786: "#ff9d00",
+        0.618: "#7fff00",
+        0.5: "#00ffff",
+        0.382: "#1e90ff",
+        0.236: "#9370db",
+        0.0: "#ffffff"
+    }
+    diff = high - low
+    last_position = int(positions[-1])
+    for r in sorted(FIBO_EXTENSION_RATIOS + FIBO_RETRACEMENT_RATIOS):
+        price = low + r * diff
+        line_col = color_map.get(r, "rgba(150, 150, 150, 0.5)")
+        fig.add_shape(type="line", x0=0, y0=price, x1=last_position, y1=price,
+            line=dict(color=line_col, width=1, dash="dash" if r not in [0, 1] else "solid"), **target)
+        r_label = "1" if r == 1.0 else ("0" if r == 0.0 else f"{r:g}")
+        fig.add_annotation(x=last_position, y=price, text=f"{r_label} ({round_to_tick(price):g})",
+            showarrow=False, xanchor="left", xshift=10, font=dict(size=font_size, color=line_col), **target)
+
+    y_min_view = low - diff * 1.05
+    y_max_view = high + diff * 0.05
+    if pd.isna(y_min_view) or pd.isna(y_max_view): y_min_view, y_max_view = None, None
+    y_range = [y_min_view, y_max_view] if y_min_view and y_max_view else None
+    tick_step = max(1, len(positions) // 10)
+    x_ticks = dict(tickmode='array', tickvals=positions[::tick_step], ticktext=labels[::tick_step], showgrid=False)
+
+    layout_update = dict(
+        title=dict(text=title_html, font=dict(size=16)),
+        template="plotly_dark",
+        height=800 if show_vol else 700,
+        showlegend=True,
+    )
+    if has_volume:
+        fig.update_yaxes(title_text="點數", range=y_range, autorange=y_range is None, fixedrange=False, row=1, col=1)
+        fig.update_yaxes(title_text="成交量", fixedrange=False, row=2, col=1)
+        fig.update_xaxes(**x_ticks, rangeslider_visible=False, row=2, col=1)
+        fig.update_xaxes(showgrid=False, rangeslider_visible=False, showticklabels=False, row=1, col=1)
+    else:
+        layout_update.update(
+            yaxis_title="點數",
+            yaxis=dict(range=y_range, autorange=y_range is None, fixedrange=False),
+            xaxis=x_ticks,
+            xaxis_rangeslider_visible=False
+        )
+    fig.update_layout(**layout_update)
+    patch_fibonacci_chart_figure(fig, df_subset, interval, title_html)
+    return fig
+
+
+def fibonacci_chart_static_key(df_subset, interval, high, low, ma_flags, ma_width, font_size, show_vol):
+    """費波圖靜態部分的版本：最後一根以外的 K 棒、區間高低（決定費波線與縱軸）與顯示設定。
+
+    K 棒多到需合併時最後一組會隨即時價變動，改把整份資料納入版本。
+    """
+    history = df_subset if len(df_subset) > CHART_MAX_CANDLES else df_subset.iloc[:-1]
+    return (
+        frame_job_key('fibonacci_chart', history, interval), len(df_subset), str(df_subset.index[-1]),
+        float(high), float(low), tuple(sorted(ma_flags.items())), ma_width, font_size, show_vol,
+    )
+
+
+def patch_fibonacci_chart_figure(fig, df_subset, interval, title_html):
+    """即時更新：只改寫最後一根 K 棒、各均線與成交量的最後一點以及標題；歷史 K 棒與費波線維持原物件。"""
+    bars = _bucket_chart_bars(df_subset)
+    last = bars.iloc[-1]
+    live = bars.iloc[-1:]
+    open_, close = float(last['Open']), float(last['Close'])
+    color = '#ff4b4b' if close > open_ else ('#00e676' if close < open_ else '#ffffff')
+    label = bars.index[-1:].strftime('%Y-%m-%d' if interval in ["1d", "1wk", "1mo"] else '%m-%d %H:%M').to_numpy()
+    with fig.batch_update():
+        for trace in fig.data:
+            uid = trace.uid or ''
+            if uid == 'fibo_live_candle':
+                trace.update(
+                    x=np.arange(len(bars) - 1, len(bars)), open=live['Open'].to_numpy(dtype=float),
+                    high=live['High'].to_numpy(dtype=float), low=live['Low'].to_numpy(dtype=float),
+                    close=live['Close'].to_numpy(dtype=float),
+                    text=label, increasing=dict(line=dict(color=color), fillcolor=color),
+                    decreasing=dict(line=dict(color=color), fillcolor=color),
+                )
+            elif uid.startswith('fibo_MA') and uid[5:] in bars.columns:
+                values = np.array(trace.y, dtype=float)
+                values[-1] = float(last[uid[5:]])
+                trace.y = values
+            elif uid == 'fibo_volume':
+                values = np.array(trace.y, dtype=float)
+                values[-1] = float(last['Volume'])
+                colors = np.array(trace.marker.color, dtype=object)
+                colors[-1] = color
+                trace.update(y=values, marker_color=colors)
+        fig.layout.title.text = title_html
+
+
 def plot_fibonacci_chart(
     symbol, interval, lookback=60, font_size=15, ma_flags=None,
     ma_width=1.5, show_vol=True, advice_container=None,
@@ -4701,140 +5696,31 @@ def plot_fibonacci_chart(
         st.warning(f"無法獲取有效的交易數據 ({ticker}, {interval})，可能是該區間無資料或代號錯誤。")
         return
     
-    # 計算均線
-    if ma_flags['5']: df['MA5'] = df['Close'].rolling(window=5).mean()
-    if ma_flags['10']: df['MA10'] = df['Close'].rolling(window=10).mean()
-    if ma_flags['20']: df['MA20'] = df['Close'].rolling(window=20).mean()
-    if ma_flags['60']: df['MA60'] = df['Close'].rolling(window=60).mean()
+    # 均線、波段裁切與交易建議皆為純計算，送入分析計算池；相同資料的重跑直接共用結果。
+    prepared = run_analysis_job(
+        frame_job_key('fibonacci', df, ticker, interval, lookback, tuple(sorted(ma_flags.items()))),
+        prepare_fibonacci_chart_data, df, ticker, interval, lookback, ma_flags,
+    )
+    if prepared['status'] == 'empty':
+        st.error(f"該股票 ({ticker}, {interval}) 的近期 K 線資料不完整或為空。")
+        return
+    if prepared['status'] == 'flat':
+        st.warning(f"該股票 ({ticker}, {interval}) 近期高低點相同，無法畫出波段比例。")
+        return
+    df_subset = prepared['subset']
+    high_60 = prepared['high']
+    low_60 = prepared['low']
 
-    # 裁切近期 K 棒，加入 60 -> 45 -> 30 的回落機制
-    lookbacks_to_try = [60, 45, 30] if lookback == 60 else [lookback]
+    interval_display_map = {"1m": "1分K", "5m": "5分K", "15m": "15分K", "60m": "60分K", "1d": "日K", "1wk": "週K", "1mo": "月K"}
+    interval_name = interval_display_map.get(interval, interval)
+    ticker_suffix = ".TW" if ticker.endswith(".TW") else (".TWO" if ticker.endswith(".TWO") else "")
     
-    df_subset = pd.DataFrame()
-    for lb in lookbacks_to_try:
-        temp_subset = df.tail(lb).copy()
-        temp_subset = temp_subset.dropna(subset=['High', 'Low'])
-        if not temp_subset.empty:
-            h = float(temp_subset['High'].max())
-            l = float(temp_subset['Low'].min())
-            if h != l:
-                df_subset = temp_subset
-                high_60 = h
-                low_60 = l
-                break
-
-    if df_subset.empty:
-        temp_subset = df.tail(lookback).copy().dropna(subset=['High', 'Low'])
-        if temp_subset.empty:
-            st.error(f"該股票 ({ticker}, {interval}) 的近期 K 線資料不完整或為空。")
-            return
+    try:
+        last_date_obj = df_subset.index[-1]
+        if interval in ["1d", "1wk", "1mo"]:
+            date_str = last_date_obj.strftime('%Y/%m/%d')
         else:
-            st.warning(f"該股票 ({ticker}, {interval}) 近期高低點相同，無法畫出波段比例。")
-            return
-
-    diff = high_60 - low_60
-    ratios = [-2.618, -2.0, -1.618, -1.0, 0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0, 1.618, 2.0, 2.618]
-    
-    # 費波顏色映射表
-    color_map = {
-        1.0: "#ff4b4b",
-        0.786: "#ff9d00",
-        0.618: "#7fff00",
-        0.5: "#00ffff",
-        0.382: "#1e90ff",
-        0.236: "#9370db",
-        0.0: "#ffffff"
-    }
-    
-    fmt = '%Y-%m-%d %H:%M:%S'
-    x_strings = df_subset.index.strftime(fmt).tolist()
-    if interval in ["1d", "1wk", "1mo"]: x_display = df_subset.index.strftime('%Y-%m-%d').tolist()
-    else: x_display = df_subset.index.strftime('%m-%d %H:%M').tolist()
-
-    if show_vol and 'Volume' in df_subset.columns:
-        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.8, 0.2])
-    else:
-        fig = go.Figure()
-
-    # Plotly 的 Candlestick 只支援漲跌兩色，收盤=開盤會被強制當作漲(紅)；
-    # 改用三條trace疊加(各自只保留該類別資料、其餘設NaN)，正確呈現紅漲/綠跌/白平盤
-    up_mask = df_subset['Close'] > df_subset['Open']
-    down_mask = df_subset['Close'] < df_subset['Open']
-    flat_mask = df_subset['Close'] == df_subset['Open']
-
-    def _masked(col, mask):
-        return df_subset[col].where(mask)
-
-    for mask, color, show_legend in [(up_mask, '#ff4b4b', True), (down_mask, '#00e676', False), (flat_mask, '#ffffff', False)]:
-        kline_trace = go.Candlestick(
-            x=x_strings, open=_masked('Open', mask), high=_masked('High', mask),
-            low=_masked('Low', mask), close=_masked('Close', mask), name="K線",
-            increasing=dict(line=dict(color=color), fillcolor=color),
-            decreasing=dict(line=dict(color=color), fillcolor=color),
-            showlegend=show_legend
-        )
-        if show_vol and 'Volume' in df_subset.columns: fig.add_trace(kline_trace, row=1, col=1)
-        else: fig.add_trace(kline_trace)
-
-    # 繪製均線
-    ma_settings = {
-        'MA5': ('orange', ma_flags['5']),
-        'MA10': ('lightblue', ma_flags['10']),
-        'MA20': ('green', ma_flags['20']),
-        'MA60': ('yellow', ma_flags['60'])
-    }
-    for ma_name, (color, is_show) in ma_settings.items():
-        if is_show and ma_name in df_subset.columns:
-            ma_trace = go.Scatter(x=x_strings, y=df_subset[ma_name], mode='lines', name=ma_name, line=dict(color=color, width=ma_width))
-            if show_vol and 'Volume' in df_subset.columns: fig.add_trace(ma_trace, row=1, col=1)
-            else: fig.add_trace(ma_trace)
-
-    # 繪製成交量
-    if show_vol and 'Volume' in df_subset.columns:
-        colors = ['#ff4b4b' if close > open else ('#00e676' if close < open else '#ffffff') for close, open in zip(df_subset['Close'], df_subset['Open'])]
-        vol_trace = go.Bar(x=x_strings, y=df_subset['Volume'], name="成交量", marker_color=colors)
-        fig.add_trace(vol_trace, row=2, col=1)
-
-    high_idx_str = df_subset['High'].idxmax().strftime(fmt)
-    low_idx_str = df_subset['Low'].idxmin().strftime(fmt)
-    disp_high = round_to_tick(high_60)
-    disp_low = round_to_tick(low_60)
-    
-    target_row = 1 if (show_vol and 'Volume' in df_subset.columns) else None
-    target_col = 1 if (show_vol and 'Volume' in df_subset.columns) else None
-
-    fig.add_annotation(x=high_idx_str, y=high_60, text=f"最高:{disp_high:g}", showarrow=True, arrowhead=1, yshift=10, font=dict(color="red", size=font_size), row=target_row, col=target_col)
-    fig.add_annotation(x=low_idx_str, y=low_60, text=f"最低:{disp_low:g}", showarrow=True, arrowhead=1, ay=40, font=dict(color="green", size=font_size), row=target_row, col=target_col)
-
-    last_date_str = x_strings[-1]
-    first_date_str = x_strings[0]
-    
-    for r in ratios:
-        price = low_60 + r * diff
-        rounded_price = round_to_tick(price)
-        line_col = color_map.get(r, "rgba(150, 150, 150, 0.5)")
-        
-        fig.add_shape(type="line", x0=first_date_str, y0=price, x1=last_date_str, y1=price,
-            line=dict(color=line_col, width=1, dash="dash" if r not in [0, 1] else "solid"), row=target_row, col=target_col)
-            
-        r_label = "1" if r == 1.0 else ("0" if r == 0.0 else f"{r:g}")
-        fig.add_annotation(x=last_date_str, y=price, text=f"{r_label} ({rounded_price:g})",
-            showarrow=False, xanchor="left", xshift=10, font=dict(size=font_size, color=line_col), row=target_row, col=target_col)
-
-    y_min_view = low_60 - diff * 1.05
-    y_max_view = high_60 + diff * 0.05
-    if pd.isna(y_min_view) or pd.isna(y_max_view): y_min_view, y_max_view = None, None
-
-    interval_display_map = {"1m": "1分K", "5m": "5分K", "15m": "15分K", "60m": "60分K", "1d": "日K", "1wk": "週K", "1mo": "月K"}
-    interval_name = interval_display_map.get(interval, interval)
-    ticker_suffix = ".TW" if ticker.endswith(".TW") else (".TWO" if ticker.endswith(".TWO") else "")
-    
-    try:
-        last_date_obj = df_subset.index[-1]
-        if interval in ["1d", "1wk", "1mo"]:
-            date_str = last_date_obj.strftime('%Y/%m/%d')
-        else:
-            date_str = last_date_obj.strftime('%Y/%m/%d %H:%M')
+            date_str = last_date_obj.strftime('%Y/%m/%d %H:%M')
 
         op = float(df_subset['Open'].iloc[-1])
         hi = float(df_subset['High'].iloc[-1])
@@ -4915,36 +5801,21 @@ def plot_fibonacci_chart(
     except Exception:
         title_html = f"{display_name}{ticker_suffix} - {interval_name}"
 
-    layout_update = dict(
-        title=dict(text=title_html, font=dict(size=16)),
-        template="plotly_dark",
-        height=800 if show_vol else 700,
-        showlegend=True,
-    )
-
-    if show_vol and 'Volume' in df_subset.columns:
-        fig.update_yaxes(title_text="點數", range=[y_min_view, y_max_view] if y_min_view and y_max_view else None, autorange=False if y_min_view and y_max_view else True, fixedrange=False, row=1, col=1)
-        fig.update_yaxes(title_text="成交量", fixedrange=False, row=2, col=1)
-        fig.update_xaxes(type='category', tickmode='array', tickvals=x_strings[::max(1, len(x_strings)//10)], ticktext=x_display[::max(1, len(x_display)//10)], showgrid=False, rangeslider_visible=False, row=2, col=1)
-        fig.update_xaxes(type='category', showgrid=False, rangeslider_visible=False, showticklabels=False, row=1, col=1) 
-    else:
-        layout_update.update(
-            yaxis_title="點數",
-            yaxis=dict(range=[y_min_view, y_max_view] if y_min_view and y_max_view else None, autorange=False if y_min_view and y_max_view else True, fixedrange=False),
-            xaxis=dict(type='category', tickmode='array', tickvals=x_strings[::max(1, len(x_strings)//10)], ticktext=x_display[::max(1, len(x_display)//10)], showgrid=False),
-            xaxis_rangeslider_visible=False
-        )
-
-    trade_suggestion = build_fibonacci_trade_suggestion(
-        df_subset, high_60, low_60, ticker, interval
-    )
+    trade_suggestion = prepared['suggestion']
     if advice_container is None:
         render_fibonacci_trade_suggestion(trade_suggestion)
     else:
         with advice_container:
             render_fibonacci_trade_suggestion(trade_suggestion)
 
-    fig.update_layout(**layout_update)
+    # 歷史 K 棒與費波線只在靜態版本改變時重建；即時報價只改寫最後一根與標題。
+    fig = live_chart_figure(
+        'fibonacci',
+        fibonacci_chart_static_key(df_subset, interval, high_60, low_60, ma_flags, ma_width, font_size, show_vol),
+        build_fibonacci_chart_figure,
+        (df_subset, high_60, low_60, interval, ma_flags, ma_width, font_size, show_vol, title_html),
+        patch_fibonacci_chart_figure, (df_subset, interval, title_html),
+    )
     st.plotly_chart(fig, width='stretch')
     
     fetch_time_str = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y-%m-%d %H:%M:%S')
@@ -5069,57 +5940,209 @@ def get_report_list():
     except Exception as e:
         return []
 
-@st.cache_data(ttl=600, max_entries=1, show_spinner=False)
-def fetch_and_parse_pdf(pdf_url):
-    """下載、解析數值並將 PDF 轉為圖片供直接預覽"""
-    headers = {'User-Agent': 'Mozilla/5.0'}
+REPORT_CACHE_DIR = "report_cache"
+REPORT_INDEX_FILE = os.path.join(REPORT_CACHE_DIR, "index.json")
+REPORT_RATIO_PATTERN = re.compile(r"散戶小台多空比[:：]\s*([-+]?[\d\.]+)%")
+REPORT_THUMBNAIL_PAGES = 2
+# 多空比抽取規則的版本；找不到比值的報告只在規則更新後才重新解析。
+REPORT_RATIO_PARSER_VERSION = 2
+
+
+@st.cache_resource(show_spinner=False)
+def get_report_store_lock():
+    """報告索引跨 session 共用，寫入時以同一把鎖避免回補與預覽互相覆蓋。"""
+    return threading.RLock()
+
+
+def _report_cache_key(pdf_url):
+    return hashlib.sha1(str(pdf_url).encode("utf-8")).hexdigest()[:20]
+
+
+def _write_bytes_atomic(path, payload):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(payload)
+    os.replace(temp_path, path)
+
+
+def load_report_index():
+    """讀取已解析報告索引：URL 雜湊 → 日期、標題、多空比與縮圖頁數。"""
+    if not os.path.exists(REPORT_INDEX_FILE):
+        return {}
     try:
-        if not pdf_url.lower().endswith('.pdf'):
-            r_inner = requests.get(pdf_url, headers=headers, timeout=10, verify=False)
-            soup_inner = BeautifulSoup(r_inner.text, 'html.parser')
-            for tag in soup_inner.find_all(['a', 'iframe']):
-                link = tag.get('href') or tag.get('src')
-                if link and link.lower().endswith('.pdf'):
-                    pdf_url = link
-                    if not pdf_url.startswith('http'):
-                        pdf_url = "https://www.spf.com.tw" + pdf_url
-                    break
+        with open(REPORT_INDEX_FILE, "r", encoding="utf-8") as file:
+            index = json.load(file)
+        return index if isinstance(index, dict) else {}
+    except (OSError, ValueError, TypeError):
+        return {}
 
-        response = requests.get(pdf_url, headers=headers, timeout=15, verify=False)
-        pdf_bytes = response.content
-        
-        text = ""
-        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-            
-        ratio_match = re.search(r"散戶小台多空比[:：]\s*([-+]?[\d\.]+)%", text)
-        ratio = ratio_match.group(1) if ratio_match else "N/A"
-        
-        images = []
+
+def _save_report_index(index):
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    _write_bytes_atomic(REPORT_INDEX_FILE, json.dumps(index, ensure_ascii=False).encode("utf-8"))
+
+
+def _resolve_report_pdf_url(pdf_url, headers):
+    """列表連結有時是中介頁；找出真正的 PDF 位址。"""
+    if pdf_url.lower().endswith('.pdf'):
+        return pdf_url
+    r_inner = requests.get(pdf_url, headers=headers, timeout=10, verify=False)
+    soup_inner = BeautifulSoup(r_inner.text, 'html.parser')
+    for tag in soup_inner.find_all(['a', 'iframe']):
+        link = tag.get('href') or tag.get('src')
+        if link and link.lower().endswith('.pdf'):
+            return link if link.startswith('http') else "https://www.spf.com.tw" + link
+    return pdf_url
+
+
+def load_report_pdf_bytes(pdf_url):
+    """每份 PDF 依 URL 雜湊只下載一次，之後直接讀本地檔。"""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    pdf_path = os.path.join(REPORT_CACHE_DIR, f"{_report_cache_key(pdf_url)}.pdf")
+    if os.path.exists(pdf_path):
+        with open(pdf_path, "rb") as file:
+            return file.read()
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    response = requests.get(_resolve_report_pdf_url(pdf_url, headers), headers=headers, timeout=15, verify=False)
+    response.raise_for_status()
+    pdf_bytes = response.content
+    if not pdf_bytes.startswith(b"%PDF"):
+        raise ValueError("下載內容不是 PDF")
+    _write_bytes_atomic(pdf_path, pdf_bytes)
+    return pdf_bytes
+
+
+def extract_report_retail_ratio(pdf_bytes):
+    """逐頁抽字，找到散戶小台多空比即停止，不再掃完整份報告。"""
+    carry = ""
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        for page in pdf.pages:
+            # 保留上一頁尾端，避免標籤與數值剛好被分頁切開。
+            text = carry + (page.extract_text() or "")
+            ratio_match = REPORT_RATIO_PATTERN.search(text)
+            if ratio_match:
+                return ratio_match.group(1)
+            carry = text[-40:]
+    return None
+
+
+def _report_ratio_pending(entry):
+    """尚未以目前版本的規則解析過的報告才需抽字；已確認沒有比值者不再重複掃描 PDF。"""
+    if entry.get('ratio') not in (None, "N/A"):
+        return False
+    return entry.get('ratio_parser') != REPORT_RATIO_PARSER_VERSION
+
+
+def _report_thumbnail_path(cache_key, page_idx):
+    return os.path.join(REPORT_CACHE_DIR, f"{cache_key}_p{page_idx + 1}.png")
+
+
+def render_report_thumbnails(cache_key, pdf_bytes):
+    """PyMuPDF 輸出的 PNG 直接落檔，不再經 PIL 重新編碼。"""
+    page_count = 0
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        # 記憶體優化：最多只轉譯前 2 頁，並將解析度降到 100 dpi，防止大檔撐爆記憶體
+        for page_idx in range(min(len(doc), REPORT_THUMBNAIL_PAGES)):
+            pix = doc[page_idx].get_pixmap(dpi=100)
+            _write_bytes_atomic(_report_thumbnail_path(cache_key, page_idx), pix.tobytes("png"))
+            page_count += 1
+    finally:
+        doc.close()
+    return page_count
+
+
+def ingest_report(report, with_thumbnails=True):
+    """解析單份報告並寫入索引；已解析的欄位直接沿用，不重抽文字。"""
+    pdf_url = report['url']
+    cache_key = _report_cache_key(pdf_url)
+    with get_report_store_lock():
+        entry = dict(load_report_index().get(cache_key, {}))
+    pdf_bytes = None
+    if _report_ratio_pending(entry):
+        pdf_bytes = load_report_pdf_bytes(pdf_url)
+        entry['ratio'] = extract_report_retail_ratio(pdf_bytes)
+        entry['ratio_parser'] = REPORT_RATIO_PARSER_VERSION
+        entry['ratio_checked_at'] = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S')
+    if with_thumbnails and not entry.get('thumbnail_pages'):
+        if pdf_bytes is None:
+            pdf_bytes = load_report_pdf_bytes(pdf_url)
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            # 記憶體優化：最多只轉譯前 2 頁，並將解析度降到 72 dpi，防止大檔撐爆記憶體
-            for page_idx in range(min(len(doc), 2)):
-                page = doc[page_idx]
-                pix = page.get_pixmap(dpi=100)
-                img_bytes = io.BytesIO(pix.tobytes("png"))
-                img_obj = Image.open(img_bytes)
-                img_obj.load()
-                buf = io.BytesIO()
-                img_obj.save(buf, format='PNG')
-                images.append(buf.getvalue())
-                del img_obj
-            doc.close()  
-        except Exception as e:
-            pass
-            
-        return {
-            "ratio": ratio,
-            "images": images
-        }
-    except Exception as e:
+            entry['thumbnail_pages'] = render_report_thumbnails(cache_key, pdf_bytes)
+        except Exception:
+            entry['thumbnail_pages'] = 0
+    entry['url'] = pdf_url
+    for field in ('日期', 'title'):
+        if report.get(field):
+            entry[field] = report[field]
+    with get_report_store_lock():
+        index = load_report_index()
+        index[cache_key] = {**index.get(cache_key, {}), **entry}
+        _save_report_index(index)
+    return cache_key, entry
+
+
+def backfill_report_history(reports, max_workers=2):
+    """回補清單內尚未解析的報告多空比；縮圖留到實際預覽時才轉譯。
+
+    回傳 (取得比值份數, 報告內找不到比值份數, 下載或解析失敗份數)。
+    """
+    index = load_report_index()
+    pending = [report for report in reports if _report_ratio_pending(index.get(_report_cache_key(report['url']), {}))]
+    added, missing, failed = 0, 0, 0
+    if pending:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(ingest_report, report, False) for report in pending]
+            for future in as_completed(futures):
+                try:
+                    _cache_key, entry = future.result()
+                except Exception:
+                    failed += 1
+                    continue
+                if entry.get('ratio') is None:
+                    missing += 1
+                else:
+                    added += 1
+    return added, missing, failed
+
+
+def build_report_ratio_history(reports=None):
+    """由索引組出散戶小台多空比時間序列，不重新解析任何 PDF。"""
+    index = load_report_index()
+    entries = index.values() if reports is None else [
+        index.get(_report_cache_key(report['url']), {}) for report in reports
+    ]
+    rows = []
+    for entry in entries:
+        ratio = _safe_number(entry.get('ratio'))
+        report_date = pd.to_datetime(entry.get('日期'), errors='coerce')
+        if ratio is None or pd.isna(report_date):
+            continue
+        rows.append({'日期': report_date, '散戶小台多空比(%)': ratio})
+    if not rows:
+        return pd.DataFrame(columns=['日期', '散戶小台多空比(%)'])
+    history = pd.DataFrame(rows).drop_duplicates('日期', keep='last')
+    return history.sort_values('日期').reset_index(drop=True)
+
+
+@st.cache_data(ttl=600, max_entries=8, show_spinner=False)
+def fetch_and_parse_pdf(pdf_url, report_date="", title=""):
+    """從本地報告庫取出多空比與預覽圖；首次遇到的報告才下載與解析。"""
+    try:
+        cache_key, entry = ingest_report({'url': pdf_url, '日期': report_date, 'title': title})
+    except Exception:
         return {"ratio": "解析錯誤", "images": []}
+    images = []
+    for page_idx in range(int(entry.get('thumbnail_pages') or 0)):
+        try:
+            with open(_report_thumbnail_path(cache_key, page_idx), "rb") as file:
+                images.append(file.read())
+        except OSError:
+            break
+    return {
+        "ratio": entry.get('ratio') or "N/A",
+        "images": images
+    }
 
 @st.cache_data(ttl=1800, max_entries=2, show_spinner=False)
 def get_major_institutional_data(date_str):
@@ -5145,6 +6168,15 @@ def get_major_institutional_data(date_str):
             # 拒絕回傳 None，透過拋出異常來阻止 Streamlit 將失敗狀態寫入快取
             raise RuntimeError(f"連線異常不寫入快取: {e}")
 
+def default_institutional_date(today=None):
+    """三大法人預設查詢日：週六、週日切回上週五。"""
+    today = today or datetime.today()
+    if today.weekday() == 5:
+        return today - timedelta(days=1)
+    if today.weekday() == 6:
+        return today - timedelta(days=2)
+    return today
+
 def color_negative_positive(val):
     """定義表格文字顏色：正數紅、負數綠"""
     if isinstance(val, (int, float)):
@@ -5173,6 +6205,196 @@ def get_tw_stocker_data(direction):
         pass
     return pd.DataFrame()
 
+INSTITUTIONAL_FLOW_DIR = "institutional_flow"
+INSTITUTIONAL_FLOW_URL = "https://www.twse.com.tw/rwd/zh/fund/T86?date={date_str}&selectType=ALLBUT0999&response=json"
+INSTITUTIONAL_FLOW_COLUMNS = ['外資', '投信', '自營商', '三大法人']
+# 證交所對短時間大量查詢會暫時封鎖 IP，回補時每日之間固定間隔。
+INSTITUTIONAL_FLOW_REQUEST_GAP_SECONDS = 2.5
+
+
+def fetch_twse_institutional_by_stock(date_str):
+    """抓取單日上市個股三大法人買賣超股數；非交易日或尚未公布回傳空表。"""
+    url = INSTITUTIONAL_FLOW_URL.format(date_str=date_str)
+    response = requests.get(url, timeout=10, verify=False)
+    response.raise_for_status()
+    data = response.json()
+    empty = pd.DataFrame(columns=['代號', '名稱', *INSTITUTIONAL_FLOW_COLUMNS])
+    if data.get("stat") != "OK" or not data.get("data"):
+        return empty
+    raw = pd.DataFrame(data["data"], columns=data["fields"])
+
+    def pick_column(keyword, exact=None):
+        if exact and exact in raw.columns:
+            return raw[exact]
+        for column in raw.columns:
+            if keyword in column:
+                return raw[column]
+        return pd.Series(0, index=raw.index)
+
+    def shares(series):
+        return pd.to_numeric(series.astype(str).str.replace(',', '', regex=False), errors='coerce').fillna(0).astype('int64')
+
+    frame = pd.DataFrame({
+        '代號': raw.iloc[:, 0].astype(str).str.strip(),
+        '名稱': raw.iloc[:, 1].astype(str).str.strip(),
+        '外資': shares(pick_column('外陸資買賣超')),
+        '投信': shares(pick_column('投信買賣超')),
+        '自營商': shares(pick_column('自營商買賣超', exact='自營商買賣超股數')),
+        '三大法人': shares(pick_column('三大法人買賣超')),
+    })
+    return frame[frame['代號'] != ''].reset_index(drop=True)
+
+
+def _institutional_flow_path(date_str):
+    return os.path.join(INSTITUTIONAL_FLOW_DIR, f"{date_str}.csv")
+
+
+@st.cache_resource(show_spinner=False)
+def get_institutional_flow_warehouse():
+    """跨 session 共用的法人買賣超資料庫；第一次使用時才讀入本地日檔。"""
+    return {'by_date': None, 'by_code': None, 'dates': set(), 'lock': threading.RLock()}
+
+
+def _rebuild_institutional_flow_indexes(warehouse, frame):
+    frame = frame.drop_duplicates(['日期', '代號'], keep='last')
+    warehouse['by_date'] = frame.set_index(['日期', '代號']).sort_index()
+    warehouse['by_code'] = frame.set_index(['代號', '日期']).sort_index()
+
+
+def load_institutional_flow_warehouse():
+    """讀入所有已儲存日檔並建立日期與個股兩組索引。"""
+    warehouse = get_institutional_flow_warehouse()
+    with warehouse['lock']:
+        if warehouse['by_date'] is not None:
+            return warehouse
+        frames = []
+        stored_dates = set()
+        if os.path.isdir(INSTITUTIONAL_FLOW_DIR):
+            for file_name in sorted(os.listdir(INSTITUTIONAL_FLOW_DIR)):
+                if not re.fullmatch(r"\d{8}\.csv", file_name):
+                    continue
+                stored_dates.add(file_name[:8])
+                try:
+                    daily = pd.read_csv(os.path.join(INSTITUTIONAL_FLOW_DIR, file_name), dtype={'代號': str})
+                except (OSError, ValueError):
+                    continue
+                if not daily.empty:
+                    daily.insert(0, '日期', pd.Timestamp(file_name[:8]))
+                    frames.append(daily)
+        frame = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['日期', '代號', '名稱', *INSTITUTIONAL_FLOW_COLUMNS])
+        _rebuild_institutional_flow_indexes(warehouse, frame)
+        warehouse['dates'] = stored_dates
+    return warehouse
+
+
+def append_institutional_flow_day(date_str, daily):
+    """寫入單日資料並併入記憶體索引；空表代表該日確定無資料，也會記錄以免重抓。"""
+    os.makedirs(INSTITUTIONAL_FLOW_DIR, exist_ok=True)
+    path = _institutional_flow_path(date_str)
+    daily.to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    warehouse = load_institutional_flow_warehouse()
+    with warehouse['lock']:
+        warehouse['dates'].add(date_str)
+        if not daily.empty:
+            current = warehouse['by_date'].reset_index()
+            current = current[current['日期'] != pd.Timestamp(date_str)]
+            _rebuild_institutional_flow_indexes(
+                warehouse, pd.concat([current, daily.assign(日期=pd.Timestamp(date_str))], ignore_index=True)
+            )
+
+
+def backfill_institutional_flow(start_date, end_date, progress_callback=None):
+    """補齊區間內尚未入庫的交易日；當日盤後資料未公布時不寫入空檔，留待下次再抓。"""
+    warehouse = load_institutional_flow_warehouse()
+    today_tw = datetime.now(pytz.timezone('Asia/Taipei')).date()
+    pending = [
+        day.date() for day in pd.date_range(start_date, end_date, freq='D')
+        if not is_market_closed_func(day.date()) and day.date() <= today_tw
+        and day.strftime('%Y%m%d') not in warehouse['dates']
+    ]
+    added, failed = 0, 0
+    for position, trading_day in enumerate(pending):
+        date_str = trading_day.strftime('%Y%m%d')
+        try:
+            daily = fetch_twse_institutional_by_stock(date_str)
+            if not daily.empty or trading_day < today_tw:
+                append_institutional_flow_day(date_str, daily)
+                added += int(not daily.empty)
+        except (requests.RequestException, ValueError, KeyError):
+            failed += 1
+        if progress_callback is not None:
+            progress_callback(position + 1, len(pending))
+        if position + 1 < len(pending):
+            time.sleep(INSTITUTIONAL_FLOW_REQUEST_GAP_SECONDS)
+    return added, failed
+
+
+INSTITUTIONAL_FLOW_PUBLISH_TIME = dt_time(15, 0)
+INSTITUTIONAL_FLOW_AUTO_RETRY_SECONDS = 600
+
+
+def latest_institutional_flow_day(now_tw=None):
+    """應已公布法人日報的最近交易日：今日 15:00 後為今日，否則往前找上一個交易日。"""
+    now_tw = now_tw or datetime.now(pytz.timezone('Asia/Taipei'))
+    day = now_tw.date()
+    if now_tw.time() < INSTITUTIONAL_FLOW_PUBLISH_TIME:
+        day -= timedelta(days=1)
+    while is_market_closed_func(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def ensure_institutional_flow_latest():
+    """最近交易日尚未入庫時送背景工作補抓一日；同一日的工作在重試間隔內共用，不阻塞畫面。"""
+    latest_day = latest_institutional_flow_day()
+    date_str = latest_day.strftime('%Y%m%d')
+    if date_str in load_institutional_flow_warehouse()['dates']:
+        return None
+    return submit_analysis_job(
+        ('institutional_flow_latest', date_str), backfill_institutional_flow, latest_day, latest_day,
+        backend='thread', ttl=INSTITUTIONAL_FLOW_AUTO_RETRY_SECONDS,
+    )
+
+
+def query_institutional_flow(start_date, end_date, codes=None):
+    """以日期索引切出區間資料；指定代號時改走個股索引。"""
+    warehouse = load_institutional_flow_warehouse()
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    with warehouse['lock']:
+        if codes:
+            by_code = warehouse['by_code']
+            wanted = [str(code) for code in codes if str(code) in by_code.index.get_level_values(0)]
+            if not wanted:
+                return pd.DataFrame()
+            sliced = by_code.loc[pd.IndexSlice[wanted, start:end], :]
+            return sliced.reset_index()
+        sliced = warehouse['by_date'].loc[pd.IndexSlice[start:end, :], :]
+    return sliced.reset_index()
+
+
+def summarize_institutional_flow(flow, investor='三大法人'):
+    """彙總區間累計買賣超、買超天數與最近連買／連賣天數（單位：張）。"""
+    if flow.empty:
+        return pd.DataFrame()
+    net = flow.pivot_table(index='日期', columns='代號', values=investor, aggfunc='sum').sort_index()
+    # 由最後一天往回累乘，遇到第一個非同向日即歸零，得到連續天數。
+    buy_streak = (net[::-1] > 0).cumprod().sum()
+    sell_streak = (net[::-1] < 0).cumprod().sum()
+    names = flow.drop_duplicates('代號', keep='last').set_index('代號')['名稱']
+    summary = pd.DataFrame({
+        '名稱': names.reindex(net.columns),
+        '累計(張)': (net.sum() / 1000).round(0),
+        '最新一日(張)': (net.iloc[-1].fillna(0) / 1000).round(0),
+        '買超天數': (net > 0).sum(),
+        '賣超天數': (net < 0).sum(),
+        '連買天數': buy_streak.astype(int),
+        '連賣天數': sell_streak.astype(int),
+    })
+    summary.index.name = '代號'
+    return summary.reset_index()
+
+
 def _parse_goodinfo_turnover_table(page_html):
     """挑出 Goodinfo 週轉率排行表，並拒絕阻擋頁或尚未載入的空表。"""
     try:
@@ -5346,26 +6568,284 @@ DEFAULT_FIBO_TAGS = ["台積電(2330)", "鴻海(2317)", "聯發科(2454)", "和
 ANALYSIS_MAX_WORKERS = 2
 API_REQUEST_GAP_SECONDS = 0.1
 
-def load_config():
-    if os.path.exists(CONFIG_FILE):
+# 分析工作佇列只處理帶 key 的可共用工作：相同 key 的工作在存活期間只執行一次，
+# 多個畫面同時請求（溫度計、費波資料準備）會共用同一個 Future，背景補抓與預先載入也靠 key 去重。
+# 純計算走 compute 池、抓取走 thread 池，兩者互不排隊；無法共用結果的一次性計算直接在呼叫端執行，
+# 不必繞經執行緒池（GIL 下只多一次排隊，不會更快）。
+ANALYSIS_COMPUTE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+ANALYSIS_IO_WORKERS = 4
+ANALYSIS_JOB_CACHE_SIZE = 128
+ANALYSIS_JOB_TTL_SECONDS = 60
+
+
+@st.cache_resource(show_spinner=False)
+def get_analysis_job_service():
+    service = {
+        'lock': threading.RLock(),
+        'pools': {
+            'compute': ThreadPoolExecutor(max_workers=ANALYSIS_COMPUTE_WORKERS, thread_name_prefix="analysis-compute"),
+            'thread': ThreadPoolExecutor(max_workers=ANALYSIS_IO_WORKERS, thread_name_prefix="analysis-io"),
+        },
+        'jobs': OrderedDict(),
+    }
+    atexit.register(shutdown_analysis_jobs, service)
+    return service
+
+
+def shutdown_analysis_jobs(service):
+    for pool in service['pools'].values():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_analysis_job(key, func, *args, backend='compute', ttl=ANALYSIS_JOB_TTL_SECONDS, **kwargs):
+    """送出分析工作並回傳 Future；key 相同且未過期時直接共用既有結果。"""
+    if key is None:
+        raise ValueError("分析工作需要 key；不需共用結果的計算請直接呼叫")
+    service = get_analysis_job_service()
+    now_mono = time.monotonic()
+    with service['lock']:
+        cached = service['jobs'].get(key)
+        if cached is not None:
+            future, created_at = cached
+            failed = future.done() and (future.cancelled() or future.exception() is not None)
+            if not failed and (not future.done() or now_mono - created_at < ttl):
+                service['jobs'].move_to_end(key)
+                return future
+        future = service['pools'][backend].submit(func, *args, **kwargs)
+        service['jobs'][key] = (future, now_mono)
+        while len(service['jobs']) > ANALYSIS_JOB_CACHE_SIZE:
+            service['jobs'].popitem(last=False)
+    return future
+
+
+def run_analysis_job(key, func, *args, backend='compute', ttl=ANALYSIS_JOB_TTL_SECONDS, **kwargs):
+    """同步取得工作結果。"""
+    return submit_analysis_job(key, func, *args, backend=backend, ttl=ttl, **kwargs).result()
+
+
+def map_analysis_jobs(func, items):
+    """executor.map 的批次版本，保留輸入順序。
+
+    抓取批次各自只開 ANALYSIS_MAX_WORKERS 條執行緒，對 Yahoo／永豐的並行數不因多個畫面同時操作而疊加，
+    也不會排在其他 session 的批次或預先載入工作之後。
+    """
+    with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
+        return list(executor.map(func, items))
+
+
+def frame_job_key(name, frame, *extra):
+    """以資料長度、最後時間與最後一列數值作為工作 key，資料更新後自然換新 key。"""
+    if frame is None or frame.empty:
+        return (name, 0, *extra)
+    last_values = tuple(
+        None if pd.isna(value) else float(value)
+        for value in frame.iloc[-1].reindex(['Open', 'High', 'Low', 'Close', 'Volume'])
+    )
+    return (name, len(frame), str(frame.index[0]), str(frame.index[-1]), last_values, *extra)
+
+
+# 設定檔寫入改由單一背景佇列處理：同一檔案的連續更新在短時間內合併成一次
+# 原子寫入（暫存檔 + rename），避免多個 UI 事件各自整檔覆寫而互相蓋掉。
+PERSIST_DEBOUNCE_SECONDS = 0.6
+PERSIST_MAX_DELAY_SECONDS = 3.0
+PERSIST_DELETE = object()
+
+
+def _write_json_atomic(path, payload, **dump_kwargs):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(payload, file, ensure_ascii=False, **dump_kwargs)
+    os.replace(temp_path, path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_persistence_service():
+    """跨 session 共用的寫入佇列；背景執行緒只有一條，程式結束前會清空佇列。"""
+    service = {
+        'condition': threading.Condition(threading.RLock()),
+        'pending': {},
+        'worker': None,
+        'errors': [],
+    }
+    atexit.register(flush_persistence_queue, service)
+    return service
+
+
+def _read_json_file(path, default=None):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError, TypeError):
+        return default
+
+
+def _chain_persist_updater(previous, updater):
+    """新的更新器需要舊值時，才向前一個尚未寫入的更新器取值。"""
+    if previous is None:
+        return updater
+    return lambda get_current: updater(lambda: previous(get_current))
+
+
+def _pending_entry(service, path, kind):
+    now_mono = time.monotonic()
+    entry = service['pending'].get(path)
+    if entry is None:
+        entry = {'kind': kind, 'keys': {}, 'constants': {}, 'payload': None, 'dump_kwargs': {}, 'first_at': now_mono}
+        service['pending'][path] = entry
+    entry['due_at'] = min(now_mono + PERSIST_DEBOUNCE_SECONDS, entry['first_at'] + PERSIST_MAX_DELAY_SECONDS)
+    return entry
+
+
+def _ensure_persistence_worker(service):
+    worker = service['worker']
+    if worker is None or not worker.is_alive():
+        worker = threading.Thread(target=_persistence_worker_loop, args=(service,), daemon=True, name="config-persistence")
+        service['worker'] = worker
+        worker.start()
+
+
+def queue_config_update(updates=None, remove=(), path=CONFIG_FILE):
+    """合併設定檔的部分鍵值；值可為常數或 `updater(get_current)`，於背景寫入時才計算。"""
+    service = get_persistence_service()
+    with service['condition']:
+        entry = _pending_entry(service, path, 'merge')
+        for key in remove:
+            entry['keys'][key] = lambda _get_current: PERSIST_DELETE
+            entry['constants'][key] = PERSIST_DELETE
+        for key, value in (updates or {}).items():
+            if callable(value):
+                entry['keys'][key] = _chain_persist_updater(entry['keys'].get(key), value)
+                entry['constants'].pop(key, None)
+            else:
+                entry['keys'][key] = lambda _get_current, constant=value: constant
+                entry['constants'][key] = value
+        _ensure_persistence_worker(service)
+        service['condition'].notify_all()
+
+
+def queue_json_file_write(path, payload, **dump_kwargs):
+    """整檔覆寫的 JSON 檔；payload 可為函式，延後到背景執行緒才序列化。"""
+    service = get_persistence_service()
+    with service['condition']:
+        entry = _pending_entry(service, path, 'replace')
+        entry['payload'] = payload
+        entry['dump_kwargs'] = dump_kwargs
+        _ensure_persistence_worker(service)
+        service['condition'].notify_all()
+
+
+def _resolve_pending_key(entry, key, file_config):
+    """只在背景寫入時計算尚未寫入的鍵值。"""
+    return entry['keys'][key](lambda: file_config.get(key))
+
+
+def _resolve_pending_payload(entry):
+    if callable(entry['payload']):
+        entry['payload'] = entry['payload']()
+    return entry['payload']
+
+
+def _apply_pending_keys(config, entry):
+    """套用各鍵的更新器；單一鍵失敗時保留檔案原值，其餘鍵照常寫入。"""
+    failed = []
+    for key in list(entry['keys']):
         try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f: return json.load(f)
-        except Exception: return {}
-    return {}
+            value = _resolve_pending_key(entry, key, config)
+        except Exception as exc:
+            failed.append(f"{key}: {type(exc).__name__}: {exc}")
+            continue
+        if value is PERSIST_DELETE:
+            config.pop(key, None)
+        else:
+            config[key] = value
+    entry['failed'] = failed
+    return config
+
+
+def read_pending_json(path, default=None):
+    """讀取檔案並疊上尚未寫入的常數更新，確保重整後立即讀到剛儲存的設定。
+
+    需要計算的更新器與延後序列化的 payload 只在背景寫入執行緒執行；
+    讀取端對這些內容回傳最後一次落檔的版本，不在腳本執行緒上代為計算。
+    """
+    service = get_persistence_service()
+    with service['condition']:
+        entry = service['pending'].get(path)
+        if entry is not None and entry['kind'] == 'replace' and not callable(entry['payload']):
+            return copy.deepcopy(entry['payload'])
+        data = _read_json_file(path, default)
+        if entry is not None and entry['kind'] == 'merge' and isinstance(data, dict):
+            for key, value in entry['constants'].items():
+                if value is PERSIST_DELETE:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+        return copy.deepcopy(data)
+
+
+def _write_pending_entry(path, entry):
+    if entry['kind'] == 'replace':
+        _write_json_atomic(path, _resolve_pending_payload(entry), **entry['dump_kwargs'])
+        return
+    config = _read_json_file(path, {})
+    if not isinstance(config, dict):
+        config = {}
+    _write_json_atomic(path, _apply_pending_keys(config, entry))
+    if entry['failed']:
+        raise RuntimeError("; ".join(entry['failed']))
+
+
+def _take_due_entries(service, force=False):
+    now_mono = time.monotonic()
+    due_paths = [path for path, entry in service['pending'].items() if force or entry['due_at'] <= now_mono]
+    return [(path, service['pending'].pop(path)) for path in due_paths]
+
+
+def _persistence_worker_loop(service):
+    condition = service['condition']
+    while True:
+        with condition:
+            while not service['pending']:
+                condition.wait()
+            next_due = min(entry['due_at'] for entry in service['pending'].values())
+            wait_seconds = next_due - time.monotonic()
+            if wait_seconds > 0:
+                condition.wait(wait_seconds)
+                continue
+            # 寫入期間持有鎖，讀取端不會看到「已離開佇列但尚未落檔」的空窗。
+            for path, entry in _take_due_entries(service):
+                try:
+                    _write_pending_entry(path, entry)
+                except Exception as exc:
+                    service['errors'] = (service['errors'] + [f"{path}: {type(exc).__name__}: {exc}"])[-8:]
+
+
+def flush_persistence_queue(service=None):
+    """立即寫出所有待寫入內容；供程式結束或需要確定落檔的操作使用。"""
+    service = service or get_persistence_service()
+    with service['condition']:
+        for path, entry in _take_due_entries(service, force=True):
+            try:
+                _write_pending_entry(path, entry)
+            except Exception as exc:
+                service['errors'] = (service['errors'] + [f"{path}: {type(exc).__name__}: {exc}"])[-8:]
+
+
+def load_config():
+    config = read_pending_json(CONFIG_FILE, {})
+    return config if isinstance(config, dict) else {}
 
 def save_config(font_size, limit_rows, sj_key="", sj_secret="", remember_sj=False):
     try:
-        config = load_config()
-        config.pop('auto_update', None)
-        config.pop('delay_sec', None)
-        config.update({
+        queue_config_update({
             "font_size": font_size, 
             "limit_rows": limit_rows, 
             "sj_key": sj_key if remember_sj else "",
             "sj_secret": sj_secret if remember_sj else "",
             "remember_sj": remember_sj
-        })
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f: json.dump(config, f)
+        }, remove=('auto_update', 'delay_sec'))
         return True
     except Exception: return False
 
@@ -5397,26 +6877,33 @@ def save_futures_strategy_state(
     universe=None, metadata=None, rank_cache=None, live_cache=None,
     manual=None, ignored=None, rank_time=None, live_time=None,
 ):
-    """持久化期貨表格快照，重整後仍能還原最後成功資料。"""
+    """持久化期貨表格快照，重整後仍能還原最後成功資料；序列化延後到背景寫入時才做。"""
     try:
-        config = load_config()
-        config.pop('futures_strategy_custom_prices', None)
-        existing = config.get('futures_strategy_state', {})
-        records = existing.get('universe', []) if isinstance(existing, dict) else []
-        if isinstance(universe, pd.DataFrame) and not universe.empty:
-            records = json.loads(universe.to_json(orient='records', force_ascii=False))
-        config['futures_strategy_state'] = _json_safe({
-            'universe': records,
-            'metadata': metadata or (existing.get('metadata', {}) if isinstance(existing, dict) else {}),
-            'rank_cache': rank_cache if rank_cache is not None else (existing.get('rank_cache', {}) if isinstance(existing, dict) else {}),
-            'live_cache': live_cache if live_cache is not None else (existing.get('live_cache', {}) if isinstance(existing, dict) else {}),
-            'manual': list(manual if manual is not None else (existing.get('manual', []) if isinstance(existing, dict) else [])),
-            'ignored': list(ignored if ignored is not None else (existing.get('ignored', []) if isinstance(existing, dict) else [])),
-            'rank_time': rank_time if rank_time is not None else (existing.get('rank_time') if isinstance(existing, dict) else None),
-            'live_time': live_time if live_time is not None else (existing.get('live_time') if isinstance(existing, dict) else None),
-        })
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as file:
-            json.dump(config, file, ensure_ascii=False)
+        snapshot = universe.copy() if isinstance(universe, pd.DataFrame) and not universe.empty else None
+        overrides = {
+            'metadata': metadata or None,
+            'rank_cache': copy.deepcopy(rank_cache),
+            'live_cache': copy.deepcopy(live_cache),
+            'manual': list(manual) if manual is not None else None,
+            'ignored': list(ignored) if ignored is not None else None,
+            'rank_time': rank_time,
+            'live_time': live_time,
+        }
+
+        def build_state(get_existing):
+            needs_existing = snapshot is None or any(value is None for value in overrides.values())
+            existing = get_existing() if needs_existing else {}
+            existing = existing if isinstance(existing, dict) else {}
+            records = existing.get('universe', [])
+            if snapshot is not None:
+                records = json.loads(snapshot.to_json(orient='records', force_ascii=False))
+            state = {'universe': records}
+            for key, value in overrides.items():
+                default = [] if key in ('manual', 'ignored') else ({} if key.endswith(('cache', 'metadata')) else None)
+                state[key] = value if value is not None else existing.get(key, default)
+            return _json_safe(state)
+
+        queue_config_update({'futures_strategy_state': build_state}, remove=('futures_strategy_custom_prices',))
         return True
     except (OSError, TypeError, ValueError):
         return False
@@ -5441,8 +6928,26 @@ def save_strategy_signal_log(records):
     except (OSError, TypeError, ValueError):
         return False
 
+TRADE_PLAN_PRICE_COLUMNS = {
+    'entry': '_進場價', 'stop': '_停損價', 'target': '_目標價', 'trigger': '_觸發價',
+}
+
+def format_trade_plan(entry, stop, target):
+    """由數值計畫產生「進／停／目」顯示字串；數值仍另存於 TRADE_PLAN_PRICE_COLUMNS。"""
+    if None in (entry, stop, target) or any(pd.isna(value) for value in (entry, stop, target)):
+        return '—'
+    return f"進 {fmt_price(entry)}｜停 {fmt_price(stop)}｜目 {fmt_price(target)}"
+
+def trade_plan_record(row):
+    """從表格列取得數值計畫；只有舊快取缺數值欄時才解析顯示字串。"""
+    plan = {key: _safe_number(row.get(column)) for key, column in TRADE_PLAN_PRICE_COLUMNS.items()}
+    if None in (plan['entry'], plan['stop'], plan['target']):
+        parsed = parse_trade_plan_numbers(row.get('進出場點位', row.get('進出場預判')))
+        plan.update({key: plan[key] if plan[key] is not None else value for key, value in parsed.items()})
+    return plan
+
 def parse_trade_plan_numbers(plan_text):
-    """從「進／停／目」摘要解析三個價位。"""
+    """從「進／停／目」摘要解析三個價位；僅供舊資料相容。"""
     text = str(plan_text or '')
     values = {}
     for label, key in [('進', 'entry'), ('停', 'stop'), ('目', 'target')]:
@@ -5450,6 +6955,20 @@ def parse_trade_plan_numbers(plan_text):
         values[key] = float(match.group(1).replace(',', '')) if match else None
     return values
 
+def trade_plan_frame(rows):
+    """取得整表的進／停／目數值欄；舊快取只有顯示字串時才一次性向量化解析。"""
+    plan = pd.DataFrame(index=rows.index)
+    text_column = next((column for column in ('進出場點位', '進出場預判') if column in rows.columns), None)
+    text = rows[text_column].fillna('').astype(str) if text_column else None
+    for key, column in TRADE_PLAN_PRICE_COLUMNS.items():
+        values = pd.to_numeric(rows[column], errors='coerce') if column in rows.columns else pd.Series(np.nan, index=rows.index)
+        if text is not None and key != 'trigger' and values.isna().any():
+            label = {'entry': '進', 'stop': '停', 'target': '目'}[key]
+            parsed = text.str.extract(rf'{label}\s*([0-9][0-9,]*(?:\.[0-9]+)?)', expand=False)
+            values = values.fillna(pd.to_numeric(parsed.str.replace(',', '', regex=False), errors='coerce'))
+        plan[key] = values.astype(float)
+    return plan
+
 def classify_signal_state(rule, eligible, score=None, minimum_score=0):
     """把文字條件轉成簡短狀態，原始規則文字仍保留在明細。"""
     text = str(rule or '')
@@ -5493,6 +7012,28 @@ def build_data_health(data_time=None, required_ready=True, live_expected=False):
         return f'🟡 {int(age_seconds // 60)}分前'
     return '🔴 報價過期'
 
+def build_data_health_series(data_time, required_ready=True, live_expected=False):
+    """build_data_health 的整欄版本；時間只對不重複值解析一次。"""
+    data_time = pd.Series(data_time)
+    index = data_time.index
+    required_ready = pd.Series(required_ready, index=index).astype(bool)
+    live_expected = pd.Series(live_expected, index=index).astype(bool)
+    unique_times = {value: parse_strategy_data_time(value) for value in data_time.dropna().unique()}
+    timestamps = pd.to_datetime(data_time.map(unique_times), errors='coerce')
+    age_seconds = ((pd.Timestamp(datetime.now()) - timestamps).dt.total_seconds()).clip(lower=0)
+    minutes_text = '🟡 ' + (age_seconds // 60).fillna(0).astype(int).astype(str) + '分前'
+    return pd.Series(np.select(
+        [
+            ~required_ready,
+            timestamps.isna() & ~live_expected,
+            timestamps.isna(),
+            age_seconds <= 90,
+            age_seconds <= 600,
+        ],
+        ['⚪ 資料不足', '🔵 官方日行情', '⚪ 尚未即時更新', '🟢 即時', minutes_text],
+        default='🔴 報價過期',
+    ), index=index)
+
 def calculate_market_alignment(direction, market_bias):
     """比較策略方向與臺指期環境，只作附加標示，不改動原選股排序。"""
     normalized_direction = '偏多' if direction in ('多頭', '偏多') else '偏空'
@@ -5500,6 +7041,16 @@ def calculate_market_alignment(direction, market_bias):
         return '⚪ 盤整／未確認'
     return '🟢 同向' if normalized_direction == market_bias else '🟡 逆勢'
 
+def calculate_market_alignment_series(direction, market_bias):
+    """calculate_market_alignment 的整欄版本。"""
+    direction = pd.Series(direction).fillna('').astype(str)
+    if market_bias not in ('偏多', '偏空'):
+        return pd.Series('⚪ 盤整／未確認', index=direction.index)
+    normalized_direction = direction.isin(['多頭', '偏多']).map({True: '偏多', False: '偏空'})
+    return pd.Series(
+        np.where(normalized_direction == market_bias, '🟢 同向', '🟡 逆勢'), index=direction.index
+    )
+
 def futures_expiry_date(contract_month):
     """以月契約第三個星期三估算到期日；休市時往前調整至交易日。"""
     match = re.fullmatch(r'(\d{4})(\d{2})', str(contract_month or ''))
@@ -5516,16 +7067,17 @@ def futures_expiry_date(contract_month):
     return expiry
 
 def calculate_entry_confidence(
-    base_score, state, current_price, plan_text, direction,
+    base_score, state, current_price, plan, direction,
     data_health='', market_alignment='', base_detail=''
 ):
-    """把條件一致度轉成進場信心；分數是觀察品質，不是歷史勝率。"""
+    """把條件一致度轉成進場信心；分數是觀察品質，不是歷史勝率。plan 為含 entry／stop／target 的數值計畫。"""
     score = max(0, min(100, int(round(float(base_score or 0)))))
     reasons = [base_detail] if base_detail else []
     state_text = str(state or '')
     data_text = str(data_health or '')
     alignment_text = str(market_alignment or '')
-    plan = parse_trade_plan_numbers(plan_text)
+    if not isinstance(plan, dict):
+        plan = parse_trade_plan_numbers(plan)
     price = _safe_number(current_price)
     direction_text = str(direction or '')
     is_long = direction_text in ('多頭', '偏多')
@@ -5587,6 +7139,69 @@ def calculate_entry_confidence(
     unique_reasons = list(dict.fromkeys(reason for reason in reasons if reason))
     return {'score': score, 'label': label, 'detail': '｜'.join(unique_reasons)}
 
+def calculate_entry_confidence_frame(
+    base_score, state, current_price, entry, stop, target, direction,
+    data_health, market_alignment, base_detail=''
+):
+    """calculate_entry_confidence 的整表版本；規則與分數上限完全相同。"""
+    index = state.index
+    score = pd.to_numeric(base_score, errors='coerce').fillna(0).round().clip(0, 100)
+    maximum_score = pd.Series(100.0, index=index)
+    state = state.fillna('').astype(str)
+    data_health = data_health.fillna('').astype(str)
+    market_alignment = market_alignment.fillna('').astype(str)
+    is_long = direction.fillna('').astype(str).isin(['多頭', '偏多'])
+
+    state_blocked = state.str.startswith(('⛔', '⚪ 資料不足'))
+    state_triggered = ~state_blocked & (state == '✅ 已觸發')
+    state_waiting = ~state_blocked & ~state_triggered & state.str.startswith(('🟡', '⚪'))
+    maximum_score = maximum_score.mask(state_blocked, maximum_score.clip(upper=20))
+    score = score.mask(state_triggered, (score + 5).clip(upper=100))
+    score = score.mask(state_waiting, (score - 8).clip(lower=0))
+    state_reason = np.select(
+        [state_blocked, state_triggered, state_waiting],
+        ['條件失效或資料不足', '進場條件已成立', '尚待觸發確認'], default=''
+    )
+
+    plan_ready = current_price.notna() & entry.notna() & stop.notna() & target.notna()
+    invalidated = plan_ready & np.where(is_long, current_price <= stop, current_price >= stop)
+    target_reached = plan_ready & ~invalidated & np.where(is_long, current_price >= target, current_price <= target)
+    trigger_distance = (entry - stop).abs()
+    progress = (np.where(is_long, current_price - entry, entry - current_price) / trigger_distance).where(trigger_distance > 0)
+    open_plan = plan_ready & ~invalidated & ~target_reached
+    far_beyond = open_plan & (progress > 1)
+    drifting = open_plan & ~far_beyond & (progress > 0.5)
+    early = open_plan & ~far_beyond & ~drifting & (progress >= 0)
+    maximum_score = maximum_score.mask(invalidated, maximum_score.clip(upper=10))
+    maximum_score = maximum_score.mask(target_reached, maximum_score.clip(upper=25))
+    maximum_score = maximum_score.mask(far_beyond, maximum_score.clip(upper=45))
+    score = score.mask(drifting, (score - 15).clip(lower=0))
+    plan_reason = np.select(
+        [invalidated, target_reached, far_beyond, drifting, early],
+        ['已越過失效點', '已到第一目標，不宜追價', '已離進場點超過一個進場－失效距離', '已離進場點偏遠', '仍在觸發初段'],
+        default=''
+    )
+
+    data_unready = data_health.str.startswith(('🔴', '⚪'))
+    data_aging = ~data_unready & data_health.str.startswith('🟡')
+    maximum_score = maximum_score.mask(data_unready, maximum_score.clip(upper=45))
+    maximum_score = maximum_score.mask(data_aging, maximum_score.clip(upper=70))
+    data_reason = np.select([data_unready, data_aging], ['即時資料待確認', '使用手動或較舊報價'], default='')
+    aligned = market_alignment.str.startswith('🟢')
+    against = ~aligned & market_alignment.str.startswith('🟡')
+    score = score.mask(aligned, (score + 5).clip(upper=100))
+    score = score.mask(against, (score - 10).clip(lower=0))
+    alignment_reason = np.select([aligned, against], ['與市場方向一致', '與市場方向相反'], default='')
+    score = score.clip(upper=maximum_score).astype(int)
+
+    label = np.select([score >= 80, score >= 65, score >= 50], ['🟢 高', '🟡 中高', '🟠 中'], default='🔴 低')
+    reasons = pd.DataFrame({
+        'base': base_detail, 'state': state_reason, 'plan': plan_reason,
+        'data': data_reason, 'alignment': alignment_reason,
+    }, index=index)
+    detail = reasons.apply(lambda row: '｜'.join(reason for reason in row if reason), axis=1)
+    return pd.DataFrame({'score': score, 'label': label, 'detail': detail}, index=index)
+
 def register_strategy_signals(records):
     """新增未重複的訊號；同商品同交易日、策略與進場價只留一筆。"""
     existing = load_strategy_signal_log()
@@ -5749,7 +7364,7 @@ def render_strategy_validation_room():
         st.markdown("<div style='height:28px'></div>", unsafe_allow_html=True)
         export_columns = [
             '建立時間', '市場', '代碼', '名稱', '策略', '方向', '訊號狀態', '評分', '信心判讀',
-            '進場價', '實際進場價', '停損價', '目標價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
+            '進場價', '實際進場價', '停損價', '目標價', '觸發價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
             '結果', 'MFE(R)', 'MAE(R)', '結果(R)', '資料狀態'
         ]
         csv_data = filtered.reindex(columns=export_columns).to_csv(index=False).encode('utf-8-sig')
@@ -5816,7 +7431,7 @@ def render_strategy_validation_room():
 
     display_columns = [
         '建立時間', '市場', '代碼', '名稱', '策略', '方向', '訊號狀態', '評分', '信心判讀',
-        '進場價', '實際進場價', '停損價', '目標價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
+        '進場價', '實際進場價', '停損價', '目標價', '觸發價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
         '結果', 'MFE(R)', 'MAE(R)', '結果(R)', '資料狀態'
     ]
     for column in display_columns:
@@ -5826,7 +7441,7 @@ def render_strategy_validation_room():
     validation_display = filtered[['_紀錄ID'] + display_columns].sort_values('建立時間', ascending=False).copy()
     validation_display.insert(0, '刪除', False)
     compact_number_columns = [
-        '進場價', '停損價', '目標價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
+        '進場價', '停損價', '目標價', '觸發價', '最新價', '15分(R)', '30分(R)', '60分(R)', '收盤(R)',
         'MFE(R)', 'MAE(R)', '結果(R)'
     ]
     for column in compact_number_columns:
@@ -5904,6 +7519,7 @@ def render_strategy_validation_room():
             ),
             '停損價': st.column_config.TextColumn(),
             '目標價': st.column_config.TextColumn(),
+            '觸發價': st.column_config.TextColumn(help='計畫的突破／跌破參考價；舊紀錄未保存時留白。'),
             '最新價': st.column_config.TextColumn(),
             '15分(R)': st.column_config.TextColumn(help='建立訊號滿 15 分鐘時的表現；1R 為進場到失效點距離。'),
             '30分(R)': st.column_config.TextColumn(help='建立訊號滿 30 分鐘時的表現。'),
@@ -5981,18 +7597,11 @@ def render_strategy_validation_room():
 
 def load_fibo_tag_cache():
     """快速標籤使用獨立檔案，避免其他設定寫入或股票快取清除時被覆蓋。"""
-    if not os.path.exists(FIBO_TAG_CACHE_FILE):
-        return []
-    try:
-        with open(FIBO_TAG_CACHE_FILE, 'r', encoding='utf-8') as file:
-            tags = json.load(file)
-        return [str(tag) for tag in tags[:5]] if isinstance(tags, list) and len(tags) >= 5 else []
-    except (OSError, ValueError, TypeError):
-        return []
+    tags = read_pending_json(FIBO_TAG_CACHE_FILE, [])
+    return [str(tag) for tag in tags[:5]] if isinstance(tags, list) and len(tags) >= 5 else []
 
 
 def save_fibo_config():
-    config = load_config()
     fibo_tags = [
         st.session_state.get('custom_tag_1', "台積電(2330)"), 
         st.session_state.get('custom_tag_2', "鴻海(2317)"), 
@@ -6000,100 +7609,499 @@ def save_fibo_config():
         st.session_state.get('custom_tag_4', "和椿(6215)"), 
         st.session_state.get('custom_tag_5', "晶彩科(3535)")
     ]
-    config['fibo_tags'] = fibo_tags
     st.session_state.fibo_tags = fibo_tags
+    config_updates = {'fibo_tags': fibo_tags}
     if 'ma_w' in st.session_state:
-        config['ma_width'] = st.session_state.ma_w
+        config_updates['ma_width'] = st.session_state.ma_w
     try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False)
-        with open(FIBO_TAG_CACHE_FILE, "w", encoding="utf-8") as file:
-            json.dump(fibo_tags, file, ensure_ascii=False, indent=2)
+        queue_config_update(config_updates)
+        queue_json_file_write(FIBO_TAG_CACHE_FILE, list(fibo_tags), indent=2)
     except Exception: pass
     # 同步寫入 Google Sheets
     save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes, fibo_tags)
 
-def save_data_cache(df, ignored_set, candidates=None, saved_notes=None, fibo_tags=None):
-    if candidates is None:
-        candidates = []
-    if saved_notes is None:
-        saved_notes = {}
-    if fibo_tags is None:
-        fibo_tags = st.session_state.get('fibo_tags', list(DEFAULT_FIBO_TAGS))
+DATA_SNAPSHOT_DIR = "data_snapshot"
+DATA_SNAPSHOT_TABLE_FILE = os.path.join(DATA_SNAPSHOT_DIR, "stock_data.parquet")
+DATA_CACHE_MIGRATED_FILE = f"{DATA_CACHE_FILE}.migrated"
+DATA_SNAPSHOT_META_FILE = os.path.join(DATA_SNAPSHOT_DIR, "meta.json")
+# 增量檔累積超過此數量時改寫一次完整表格，讓載入時要套用的增量維持在少數幾個。
+DATA_SNAPSHOT_MAX_DELTAS = 20
+
+
+def _snapshot_table(df):
+    """轉成可寫入 Parquet 的欄位型別；清單／字典欄位以 JSON 字串保存。"""
+    table = df.drop(columns=['_auto_note'], errors='ignore').reset_index(drop=True).copy()
+    json_columns = []
+    for column in table.columns:
+        series = table[column]
+        if series.dtype != object:
+            continue
+        values = series.dropna()
+        if values.map(lambda value: isinstance(value, (list, dict, tuple))).any():
+            table[column] = series.map(lambda value: json.dumps(_json_safe(value), ensure_ascii=False) if isinstance(value, (list, dict, tuple)) else None)
+            json_columns.append(column)
+            continue
+        try:
+            pa.array(series, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            table[column] = series.map(lambda value: None if _is_missing_value(value) else str(value))
+    return table, json_columns
+
+
+def _is_missing_value(value):
     try:
-        # 只在主執行緒做最輕量的複製，避免鎖死 UI
-        df_save = df.fillna("").copy()
-        ignored_list = list(ignored_set)
-        # 快取完整備註供重整後還原（須在 drop 內部欄位前執行）
-        empty_col = pd.Series("", index=df_save.index, dtype=str)
-        codes = df_save.get('代號', empty_col).astype(str).str.strip()
-        notes = df_save.get('戰略備註', empty_col).astype(str).str.strip()
-        auto_notes = df_save.get('_auto_note', empty_col).astype(str).str.strip()
-        cached_notes = {
-            code: {'note': note, 'auto': auto}
-            for code, note, auto in zip(codes, notes, auto_notes)
-            if code
-        }
+        return bool(pd.isna(value))
+    except (TypeError, ValueError):
+        return False
 
-        # 移除只供執行期間使用的欄位，避免重新載入時污染資料。
-        df_save.drop(columns=['_auto_note'], errors='ignore', inplace=True)
-        
-        # 本地存檔維持在主執行緒 (若不想寫入本地也可將此段一併移入背景)
-        signal_records = load_strategy_signal_log()
-        data_to_save_local = {
-            "stock_data": df_save.to_dict(orient='records'), "ignored_stocks": ignored_list,
-            "all_candidates": candidates, "saved_notes": saved_notes, "fibo_tags": fibo_tags,
-            "cached_notes": cached_notes, "strategy_signal_log": signal_records,
-        }
-        with open(DATA_CACHE_FILE, "w", encoding='utf-8') as f: 
-            json.dump(data_to_save_local, f, ensure_ascii=False, indent=4)
-        
-        # 記憶體與速度終極優化：將「轉換 Dict」與「轉 JSON 字串」等高耗 RAM 動作全部移入背景執行緒
-        gsheet_api_url = get_app_secret('gsheet_api_url')
-        if gsheet_api_url:
-            def bg_save(bg_df, bg_ignored, bg_cands, bg_notes, bg_tags, bg_cn, bg_signals):
-                try:
-                    data_to_save = {
-                        "stock_data": bg_df.to_dict(orient='records'), 
-                        "ignored_stocks": bg_ignored, 
-                        "all_candidates": bg_cands, 
-                        "saved_notes": bg_notes, 
-                        "fibo_tags": bg_tags,
-                        "cached_notes": bg_cn,
-                        "strategy_signal_log": bg_signals,
-                    }
-                    json_str = json.dumps(data_to_save, ensure_ascii=False)
-                    requests.post(gsheet_api_url, json={"action": "save", "data": json_str}, timeout=5)
-                except Exception: pass
-                finally:
-                    # 強制回收背景執行緒產生的巨大 JSON 與 Dict 記憶體
-                    gc.collect()
-
-            import threading
-            threading.Thread(
-                target=bg_save,
-                args=(df_save, ignored_list, candidates, saved_notes, fibo_tags, cached_notes, signal_records),
-                daemon=True,
-            ).start()
-    except Exception: pass
 
-def load_data_cache():
-    gsheet_api_url = get_app_secret('gsheet_api_url')
-    if gsheet_api_url:
-        try:
-            r = requests.get(gsheet_api_url, timeout=5)
-            if r.status_code == 200 and r.text.strip():
-                data = json.loads(r.text)
-                df = pd.DataFrame(data.get('stock_data', []))
-                ignored = set(data.get('ignored_stocks', []))
-                candidates = data.get('all_candidates', [])
-                saved_notes = data.get('saved_notes', {}) 
-                fibo_tags = data.get('fibo_tags', [])
-                if isinstance(data.get('strategy_signal_log'), list):
-                    save_strategy_signal_log(data['strategy_signal_log'])
-                return df, ignored, candidates, saved_notes, fibo_tags, data.get('cached_notes', {})
+def _snapshot_row_hashes(table):
+    if table.empty or '代號' not in table.columns:
+        return {}
+    hashes = pd.util.hash_pandas_object(table, index=False)
+    return dict(zip(table['代號'].astype(str), hashes.tolist()))
+
+
+def _load_snapshot_meta():
+    try:
+        with open(DATA_SNAPSHOT_META_FILE, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        return meta if isinstance(meta, dict) else None
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_data_snapshot_lock():
+    """本地快照跨 session 共用，寫入時以同一把鎖串行化。"""
+    return threading.Lock()
+
+
+def _write_snapshot_parquet(frame, file_name):
+    path = os.path.join(DATA_SNAPSHOT_DIR, file_name)
+    frame.to_parquet(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def _remove_snapshot_files(keep=()):
+    """刪除快照目錄中未列在 keep 的表格與增量檔。"""
+    if not os.path.isdir(DATA_SNAPSHOT_DIR):
+        return
+    for file_name in os.listdir(DATA_SNAPSHOT_DIR):
+        if file_name.startswith("stock_data") and file_name not in keep:
+            try:
+                os.remove(os.path.join(DATA_SNAPSHOT_DIR, file_name))
+            except OSError:
+                pass
+
+
+def write_data_snapshot(df, metadata):
+    """表格以 Parquet 保存；同一 session 之後的儲存只寫有變動的列。"""
+    os.makedirs(DATA_SNAPSHOT_DIR, exist_ok=True)
+    table, json_columns = _snapshot_table(df)
+    hashes = _snapshot_row_hashes(table)
+    # 讀 meta、決定增量檔名到寫回 meta 必須一氣呵成，否則兩個 session 會寫出同名增量互相覆蓋。
+    with get_data_snapshot_lock():
+        state = st.session_state.get('_data_snapshot_state')
+        stored_meta = _load_snapshot_meta()
+        can_append = (
+            state is not None and hashes and stored_meta is not None
+            and stored_meta.get('generation') == state['generation']
+            and stored_meta.get('deltas') == state['deltas']
+            and state['columns'] == list(table.columns)
+            and len(state['deltas']) < DATA_SNAPSHOT_MAX_DELTAS
+        )
+        if can_append:
+            changed_codes = [code for code, row_hash in hashes.items() if state['hashes'].get(code) != row_hash]
+            removed_codes = [code for code in state['hashes'] if code not in hashes]
+            deltas = list(state['deltas'])
+            if changed_codes or removed_codes:
+                delta = table[table['代號'].astype(str).isin(changed_codes)].assign(_deleted=False)
+                if removed_codes:
+                    tombstones = pd.DataFrame({'代號': removed_codes, '_deleted': True})
+                    delta = pd.concat([delta, tombstones], ignore_index=True)
+                delta_name = f"stock_data_delta_{state['generation']}_{len(deltas) + 1:03d}.parquet"
+                _write_snapshot_parquet(delta, delta_name)
+                deltas.append(delta_name)
+            generation = state['generation']
+            base = stored_meta.get('base', os.path.basename(DATA_SNAPSHOT_TABLE_FILE))
+        else:
+            # 新世代的完整表格寫到新檔名；meta 換上之前，舊 meta 指向的表格與增量都原封不動。
+            generation = f"{time.time_ns():x}"
+            base = f"stock_data_{generation}.parquet"
+            _write_snapshot_parquet(table, base)
+            deltas = []
+
+        meta = {
+            **metadata,
+            'generation': generation,
+            'base': base,
+            'columns': list(table.columns),
+            'json_columns': json_columns,
+            'row_order': table['代號'].astype(str).tolist() if '代號' in table.columns else [],
+            'deltas': deltas,
+        }
+        if meta != stored_meta:
+            _write_json_atomic(DATA_SNAPSHOT_META_FILE, meta)
+        # meta 落檔後才清掉不再被引用的表格與增量；中途中斷只會留下多餘檔案，不會讓 meta 指向缺檔。
+        _remove_snapshot_files(keep={base, *deltas})
+        if os.path.exists(DATA_CACHE_FILE):
+            os.replace(DATA_CACHE_FILE, DATA_CACHE_MIGRATED_FILE)
+        st.session_state['_data_snapshot_state'] = {
+            'generation': generation, 'columns': list(table.columns),
+            'hashes': hashes, 'deltas': deltas,
+        }
+
+
+def read_data_snapshot():
+    """讀取 Parquet 快照並依序套用增量；回傳 (表格, metadata)，不存在時回傳 None。"""
+    meta = _load_snapshot_meta()
+    if pa is None or meta is None:
+        return None
+    # 舊版 meta 沒有 base 欄位，完整表格固定為 stock_data.parquet。
+    base_path = os.path.join(DATA_SNAPSHOT_DIR, meta.get('base', os.path.basename(DATA_SNAPSHOT_TABLE_FILE)))
+    if not os.path.exists(base_path):
+        return None
+    table = pd.read_parquet(base_path)
+    if meta.get('deltas') and '代號' in table.columns:
+        table = table.assign(代號=table['代號'].astype(str)).set_index('代號', drop=False)
+        for delta_name in meta['deltas']:
+            delta = pd.read_parquet(os.path.join(DATA_SNAPSHOT_DIR, delta_name))
+            delta['代號'] = delta['代號'].astype(str)
+            table = table.drop(index=delta['代號'], errors='ignore')
+            upserts = delta[~delta['_deleted'].astype(bool)].drop(columns=['_deleted'])
+            table = pd.concat([table, upserts.set_index('代號', drop=False)])
+        order = [code for code in meta.get('row_order', []) if code in table.index]
+        table = table.loc[order].reset_index(drop=True)
+    table = table.reindex(columns=meta.get('columns', list(table.columns)))
+    for column in meta.get('json_columns', []):
+        if column in table.columns:
+            table[column] = table[column].map(lambda value: json.loads(value) if isinstance(value, str) and value else None)
+    # 與舊版 JSON 快取一致：缺值一律還原成空字串。
+    for column in table.columns:
+        if table[column].isna().any():
+            table[column] = table[column].astype(object).where(table[column].notna(), "")
+    return table, meta
+
+
+def clear_data_cache_files():
+    """移除本地表格快照與舊版 JSON 快取。"""
+    for path in (DATA_CACHE_FILE, DATA_CACHE_MIGRATED_FILE, DATA_SNAPSHOT_META_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    _remove_snapshot_files()
+    st.session_state.pop('_data_snapshot_state', None)
+
+
+SHEET_SYNC_STATE_FILE = "sheet_sync_state.json"
+SHEET_SYNC_KEYS = (
+    "stock_data", "ignored_stocks", "all_candidates", "saved_notes",
+    "fibo_tags", "cached_notes", "strategy_signal_log",
+)
+# 連續編輯在此時間內合併成一次上傳；持續編輯時最多延後到上限秒數。
+SHEET_SYNC_DEBOUNCE_SECONDS = 2.0
+SHEET_SYNC_MAX_DELAY_SECONDS = 10.0
+SHEET_SYNC_RETRY_SECONDS = 30.0
+
+
+def _empty_sheet_sync_state():
+    return {"version": 0, "key_versions": {}, "synced_hashes": {}, "updated_at": ""}
+
+
+def _sheet_sync_hash(value):
+    text = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheet_sync_engine():
+    """Google Sheets 同步引擎：本地快照為主，單一背景執行緒負責上傳與啟動時的比對。"""
+    state = _read_json_file(SHEET_SYNC_STATE_FILE, None)
+    if not isinstance(state, dict):
+        state = _empty_sheet_sync_state()
+    return {
+        'condition': threading.Condition(threading.RLock()),
+        'state': state,
+        'pending': None,
+        'worker': None,
+        'reconcile_requested': False,
+        'reconciled': False,
+        'adopted': {},
+        'remote_revision': 0,
+        'errors': [],
+        'last_upload': '',
+    }
+
+
+def _remember_sheet_sync_error(engine, message):
+    engine['errors'] = (engine['errors'] + [f"{datetime.now(pytz.timezone('Asia/Taipei')).strftime('%H:%M:%S')} {message}"])[-8:]
+
+
+def _save_sheet_sync_state(engine):
+    _write_json_atomic(SHEET_SYNC_STATE_FILE, engine['state'])
+
+
+def _fetch_sheet_document(gsheet_api_url, timeout=5):
+    response = requests.get(gsheet_api_url, timeout=timeout)
+    if response.status_code != 200 or not response.text.strip():
+        return None
+    data = json.loads(response.text)
+    return data if isinstance(data, dict) else None
+
+
+def _ensure_sheet_sync_worker(engine):
+    worker = engine['worker']
+    if worker is None or not worker.is_alive():
+        worker = threading.Thread(target=_sheet_sync_worker_loop, args=(engine,), daemon=True, name="sheet-sync")
+        engine['worker'] = worker
+        worker.start()
+
+
+def queue_sheet_sync(df_save, metadata):
+    """登記最新待上傳內容；連續儲存只保留最後一份，由背景執行緒合併上傳。"""
+    gsheet_api_url = get_app_secret('gsheet_api_url')
+    if not gsheet_api_url:
+        return
+    engine = get_sheet_sync_engine()
+    now_mono = time.monotonic()
+    with engine['condition']:
+        first_at = engine['pending']['first_at'] if engine['pending'] else now_mono
+        engine['pending'] = {
+            'url': gsheet_api_url, 'df': df_save, 'metadata': copy.deepcopy(metadata),
+            'first_at': first_at,
+            'due_at': min(now_mono + SHEET_SYNC_DEBOUNCE_SECONDS, first_at + SHEET_SYNC_MAX_DELAY_SECONDS),
+        }
+        _ensure_sheet_sync_worker(engine)
+        engine['condition'].notify_all()
+
+
+def request_sheet_reconcile():
+    """本地快照已載入後，於背景向雲端比對一次；每個行程只執行一次。"""
+    gsheet_api_url = get_app_secret('gsheet_api_url')
+    if not gsheet_api_url:
+        return
+    engine = get_sheet_sync_engine()
+    with engine['condition']:
+        if engine['reconciled'] or engine['reconcile_requested']:
+            return
+        engine['reconcile_requested'] = gsheet_api_url
+        _ensure_sheet_sync_worker(engine)
+        engine['condition'].notify_all()
+
+
+def adopt_sheet_document(engine, data):
+    """冷啟動直接採用雲端文件時，記下其版本與雜湊，之後未變動的鍵不會重傳。"""
+    remote_sync = data.get('_sync', {}) if isinstance(data.get('_sync'), dict) else {}
+    with engine['condition']:
+        state = engine['state']
+        state['version'] = max(int(state.get('version', 0)), int(remote_sync.get('version', 0) or 0))
+        for key in SHEET_SYNC_KEYS:
+            if key in data:
+                state['key_versions'][key] = int((remote_sync.get('key_versions') or {}).get(key, 0) or 0)
+                state['synced_hashes'][key] = _sheet_sync_hash(data[key])
+        engine['reconciled'] = True
+        _save_sheet_sync_state(engine)
+
+
+def _reconcile_sheet_document(engine, gsheet_api_url):
+    """逐鍵比較版本：雲端較新且本地未改動者採用雲端值，其餘保留本地並於下次上傳覆寫。"""
+    data = _fetch_sheet_document(gsheet_api_url, timeout=15)
+    if data is None:
+        return
+    remote_sync = data.get('_sync', {}) if isinstance(data.get('_sync'), dict) else {}
+    remote_versions = remote_sync.get('key_versions') or {}
+    with engine['condition']:
+        state = engine['state']
+        adopted = {}
+        for key in SHEET_SYNC_KEYS:
+            if key not in data:
+                continue
+            remote_hash = _sheet_sync_hash(data[key])
+            local_version = int(state['key_versions'].get(key, 0) or 0)
+            remote_version = int(remote_versions.get(key, 0) or 0)
+            if remote_hash == state['synced_hashes'].get(key):
+                continue
+            # 沒有版本資訊的舊雲端文件，只在本地從未同步過該鍵時採用。
+            if remote_version > local_version or (not remote_versions and key not in state['synced_hashes']):
+                adopted[key] = data[key]
+                state['key_versions'][key] = remote_version
+                state['synced_hashes'][key] = remote_hash
+        state['version'] = max(int(state.get('version', 0)), int(remote_sync.get('version', 0) or 0))
+        _save_sheet_sync_state(engine)
+        if adopted:
+            engine['adopted'] = {**engine['adopted'], **adopted}
+            engine['remote_revision'] += 1
+
+
+def _upload_sheet_document(engine, pending):
+    """只有內容雜湊與上次成功同步不同的鍵才遞增版本；全部未變時不發出請求。"""
+    document = {
+        "stock_data": pending['df'].fillna("").to_dict(orient='records'),
+        **pending['metadata'],
+        "strategy_signal_log": load_strategy_signal_log(),
+    }
+    with engine['condition']:
+        state = engine['state']
+        hashes = {key: _sheet_sync_hash(document.get(key)) for key in SHEET_SYNC_KEYS}
+        changed = [key for key in SHEET_SYNC_KEYS if hashes[key] != state['synced_hashes'].get(key)]
+        if not changed:
+            return
+        version = int(state.get('version', 0)) + 1
+        key_versions = dict(state['key_versions'])
+        for key in changed:
+            key_versions[key] = version
+    document['_sync'] = {
+        'version': version, 'key_versions': key_versions, 'changed_keys': changed,
+        'updated_at': datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S'),
+    }
+    json_str = json.dumps(document, ensure_ascii=False, default=str)
+    response = requests.post(pending['url'], json={"action": "save", "data": json_str}, timeout=15)
+    response.raise_for_status()
+    with engine['condition']:
+        state = engine['state']
+        state['version'] = version
+        state['key_versions'] = key_versions
+        state['updated_at'] = document['_sync']['updated_at']
+        for key in changed:
+            state['synced_hashes'][key] = hashes[key]
+        _save_sheet_sync_state(engine)
+        engine['last_upload'] = document['_sync']['updated_at']
+
+
+def _sheet_sync_worker_loop(engine):
+    condition = engine['condition']
+    while True:
+        with condition:
+            while not engine['pending'] and not engine['reconcile_requested']:
+                condition.wait()
+            reconcile_url = engine['reconcile_requested']
+            pending = None
+            if not reconcile_url:
+                wait_seconds = engine['pending']['due_at'] - time.monotonic()
+                if wait_seconds > 0:
+                    condition.wait(wait_seconds)
+                    continue
+                pending, engine['pending'] = engine['pending'], None
+        if reconcile_url:
+            try:
+                _reconcile_sheet_document(engine, reconcile_url)
+            except Exception as exc:
+                _remember_sheet_sync_error(engine, f"雲端比對失敗：{type(exc).__name__}: {exc}")
+            with condition:
+                engine['reconcile_requested'] = False
+                engine['reconciled'] = True
+            continue
+        try:
+            _upload_sheet_document(engine, pending)
+        except Exception as exc:
+            _remember_sheet_sync_error(engine, f"雲端上傳失敗：{type(exc).__name__}: {exc}")
+            with condition:
+                # 失敗時若期間沒有更新的內容，稍後以同一份資料重試。
+                if engine['pending'] is None:
+                    pending['due_at'] = time.monotonic() + SHEET_SYNC_RETRY_SECONDS
+                    pending['first_at'] = pending['due_at']
+                    engine['pending'] = pending
+        finally:
+            # 強制回收背景執行緒產生的巨大 JSON 與 Dict 記憶體
+            gc.collect()
+
+
+def apply_sheet_sync_updates():
+    """把背景比對時採用的雲端內容套入本 session；沒有新內容時不做任何事。"""
+    if not get_app_secret('gsheet_api_url'):
+        return False
+    engine = get_sheet_sync_engine()
+    with engine['condition']:
+        revision = engine['remote_revision']
+        adopted = dict(engine['adopted'])
+    if not revision or st.session_state.get('_sheet_sync_revision') == revision:
+        return False
+    st.session_state._sheet_sync_revision = revision
+    if not adopted:
+        # 採用內容已由其他 session 寫入本地快照，不再重複套用舊的雲端文件。
+        return False
+    if 'stock_data' in adopted:
+        st.session_state.stock_data = pd.DataFrame(adopted['stock_data'])
+        st.session_state.stock_strategy_editor_revision = st.session_state.get('stock_strategy_editor_revision', 0) + 1
+    if 'ignored_stocks' in adopted:
+        st.session_state.ignored_stocks = set(adopted['ignored_stocks'])
+    if 'all_candidates' in adopted:
+        st.session_state.all_candidates = adopted['all_candidates']
+    if 'saved_notes' in adopted:
+        st.session_state.saved_notes = adopted['saved_notes']
+    if 'cached_notes' in adopted:
+        st.session_state.cached_notes = adopted['cached_notes']
+    if 'strategy_signal_log' in adopted and isinstance(adopted['strategy_signal_log'], list):
+        save_strategy_signal_log(adopted['strategy_signal_log'])
+    if isinstance(adopted.get('fibo_tags'), list) and len(adopted['fibo_tags']) >= 5:
+        # 快速標籤以專用檔與設定檔為來源，兩處都要更新，否則下次啟動又讀回舊標籤並覆寫雲端。
+        fibo_tags = [str(tag) for tag in adopted['fibo_tags'][:5]]
+        st.session_state.fibo_tags = fibo_tags
+        for position, tag in enumerate(fibo_tags, start=1):
+            st.session_state[f"custom_tag_{position}"] = tag
+        try:
+            queue_config_update({'fibo_tags': fibo_tags})
+            queue_json_file_write(FIBO_TAG_CACHE_FILE, list(fibo_tags), indent=2)
         except Exception: pass
+    return True
+
+
+def mark_sheet_sync_persisted():
+    """採用的雲端內容已寫入本地快照並排入上傳後即清空，之後的 session 直接讀本地。"""
+    engine = get_sheet_sync_engine()
+    with engine['condition']:
+        if engine['remote_revision'] == st.session_state.get('_sheet_sync_revision'):
+            engine['adopted'] = {}
+
+
+def save_data_cache(df, ignored_set, candidates=None, saved_notes=None, fibo_tags=None):
+    if candidates is None:
+        candidates = []
+    if saved_notes is None:
+        saved_notes = {}
+    if fibo_tags is None:
+        fibo_tags = st.session_state.get('fibo_tags', list(DEFAULT_FIBO_TAGS))
+    try:
+        ignored_list = list(ignored_set)
+        # 快取完整備註供重整後還原（須在 drop 內部欄位前執行）
+        empty_col = pd.Series("", index=df.index, dtype=str)
+        codes = df.get('代號', empty_col).fillna("").astype(str).str.strip()
+        notes = df.get('戰略備註', empty_col).fillna("").astype(str).str.strip()
+        auto_notes = df.get('_auto_note', empty_col).fillna("").astype(str).str.strip()
+        cached_notes = {
+            code: {'note': note, 'auto': auto}
+            for code, note, auto in zip(codes, notes, auto_notes)
+            if code
+        }
+        metadata = {
+            "ignored_stocks": ignored_list, "all_candidates": candidates,
+            "saved_notes": saved_notes, "fibo_tags": fibo_tags, "cached_notes": cached_notes,
+        }
+
+        # 本地只寫 Parquet 快照與有變動的列；訊號紀錄本身已有獨立檔案，不再重複嵌入。
+        if pa is not None:
+            write_data_snapshot(df, metadata)
+        else:
+            df_local = df.drop(columns=['_auto_note'], errors='ignore').fillna("")
+            _write_json_atomic(DATA_CACHE_FILE, {"stock_data": df_local.to_dict(orient='records'), **metadata})
+        
+        # 雲端同步交給背景引擎：連續儲存會合併成一次上傳，JSON 轉換也在背景執行。
+        queue_sheet_sync(df.drop(columns=['_auto_note'], errors='ignore'), metadata)
+    except Exception: pass
+
+def _load_local_data_cache():
+    try:
+        snapshot = read_data_snapshot()
+    except Exception:
+        snapshot = None
+    if snapshot is not None:
+        df, meta = snapshot
+        return (
+            df, set(meta.get('ignored_stocks', [])), meta.get('all_candidates', []),
+            meta.get('saved_notes', {}), meta.get('fibo_tags', []), meta.get('cached_notes', {}),
+        )
 
+    # 舊版 JSON 快取：僅在尚未建立 Parquet 快照時讀取，下一次儲存即轉為新格式。
     if os.path.exists(DATA_CACHE_FILE):
         try:
             with open(DATA_CACHE_FILE, "r", encoding='utf-8') as f: data = json.load(f)
@@ -6102,10 +8110,46 @@ def load_data_cache():
             candidates = data.get('all_candidates', [])
             saved_notes = data.get('saved_notes', {}) 
             fibo_tags = data.get('fibo_tags', [])
-            if isinstance(data.get('strategy_signal_log'), list):
+            if isinstance(data.get('strategy_signal_log'), list) and not os.path.exists(STRATEGY_SIGNAL_LOG_FILE):
                 save_strategy_signal_log(data['strategy_signal_log'])
             return df, ignored, candidates, saved_notes, fibo_tags, data.get('cached_notes', {})
-        except Exception: return pd.DataFrame(), set(), [], {}, [], {}
+        except Exception: return None
+    return None
+
+def _seed_sheet_sync_revision():
+    """新 session 由本地或雲端載入後，視為已看過目前的雲端版本，只套用之後才到的內容。
+
+    尚未有 session 落檔的採用內容仍要套用，否則剛載入的舊快照會蓋掉它。
+    """
+    engine = get_sheet_sync_engine()
+    with engine['condition']:
+        if not engine['adopted']:
+            st.session_state._sheet_sync_revision = engine['remote_revision']
+
+
+def load_data_cache():
+    """先用本地快照立即啟動，雲端比對在背景進行；只有本地完全沒有資料時才同步等待雲端。"""
+    _seed_sheet_sync_revision()
+    local_result = _load_local_data_cache()
+    if local_result is not None:
+        request_sheet_reconcile()
+        return local_result
+
+    gsheet_api_url = get_app_secret('gsheet_api_url')
+    if gsheet_api_url:
+        try:
+            data = _fetch_sheet_document(gsheet_api_url, timeout=5)
+            if data is not None:
+                df = pd.DataFrame(data.get('stock_data', []))
+                ignored = set(data.get('ignored_stocks', []))
+                candidates = data.get('all_candidates', [])
+                saved_notes = data.get('saved_notes', {}) 
+                fibo_tags = data.get('fibo_tags', [])
+                if isinstance(data.get('strategy_signal_log'), list):
+                    save_strategy_signal_log(data['strategy_signal_log'])
+                adopt_sheet_document(get_sheet_sync_engine(), data)
+                return df, ignored, candidates, saved_notes, fibo_tags, data.get('cached_notes', {})
+        except Exception: pass
     return pd.DataFrame(), set(), [], {}, [], {}
 
 def load_url_history():
@@ -6156,6 +8200,11 @@ if 'stock_data' not in st.session_state:
 if 'stock_strategy_editor_revision' not in st.session_state:
     st.session_state.stock_strategy_editor_revision = 0
 
+if apply_sheet_sync_updates():
+    save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+    mark_sheet_sync_persisted()
+    st.toast("已套用雲端較新的股票資料", icon="☁️")
+
 if 'ignored_stocks' not in st.session_state: st.session_state.ignored_stocks = set()
 if 'all_candidates' not in st.session_state: st.session_state.all_candidates = []
 if 'calc_base_price' not in st.session_state: st.session_state.calc_base_price = 100.0
@@ -6446,8 +8495,7 @@ def render_stock_strategy_controls():
                     st.session_state.saved_notes = {}
                     st.session_state.pop('stock_independent_raw_results', None)
                     save_search_cache([])
-                    if os.path.exists(DATA_CACHE_FILE):
-                        os.remove(DATA_CACHE_FILE)
+                    clear_data_cache_files()
                     st.rerun()
             st.info("在股票表格左側勾選「刪除」，會立即隱藏並自動遞補下一檔。")
 
@@ -6494,6 +8542,66 @@ def render_stock_strategy_controls():
             )
     return hide_non_stock, show_3d_hilo
 
+def render_market_screener_source():
+    """全市場篩選：以本地日 K 陣列＋一次分批快照排名，結果可直接作為選股資料來源。"""
+    engine = load_market_breadth_engine()
+    if not engine['dates']:
+        st.info("尚無全市場日 K；請先在溫度計分頁按「更新全市場廣度」建立本地資料。")
+        return
+    st.caption(
+        f"母體 {len(engine['codes'])} 檔上市櫃普通股，日 K 至 {engine['dates'][-1]}；"
+        "登入 Shioaji 時另以分批快照帶入即時成交，當沖模式以快照的開高低與均價近似開盤動能。"
+    )
+    mode_col, direction_col, score_col, limit_col = st.columns(4)
+    with mode_col:
+        screener_mode = st.radio("策略模式", ["隔日／波段", "當沖預覽"], horizontal=True, key="market_screener_mode")
+    with direction_col:
+        screener_direction = st.radio("判斷方向", ["多頭", "空頭"], horizontal=True, key="market_screener_direction")
+    with score_col:
+        screener_min_score = st.slider("最低信心", min_value=60, max_value=100, value=75, key="market_screener_min_score")
+    with limit_col:
+        screener_limit = st.number_input("候選檔數", min_value=5, max_value=200, value=30, step=5, key="market_screener_limit")
+
+    is_daytrade_mode = screener_mode == "當沖預覽"
+    sj_api = st.session_state.get('sj_api') if st.session_state.get('sj_logged_in', False) else None
+    if st.button("🔎 執行全市場篩選", key="run_market_screener", use_container_width=True):
+        if is_daytrade_mode and sj_api is None:
+            st.warning("當沖預覽需要先登入永豐 Shioaji，才能取得全市場快照。")
+        else:
+            market_risk_data = market_risk_list_state()
+            with st.spinner("正在計算全市場篩選..."):
+                ranked, _ = run_market_screener(
+                    screener_direction, is_daytrade_mode,
+                    st.session_state.get('risk_filter_max_extension', 2.0), screener_min_score,
+                    bool(market_risk_data.get('updated')) and not market_risk_data.get('errors'),
+                    st.session_state.get('risk_filter_block_attention', True),
+                    api=sj_api, limit=int(screener_limit)
+                )
+            st.session_state.market_screener_result = ranked
+
+    ranked = st.session_state.get('market_screener_result')
+    if ranked is None:
+        return
+    if ranked.empty:
+        st.info("目前沒有符合條件的候選標的。")
+        return
+    preview = ranked[['代號', '名稱', '收盤價', 'score', 'rule', '成交金額(億)']].rename(
+        columns={'收盤價': '成交價', 'score': '信心分', 'rule': '規則'}
+    )
+    preview['成交價'] = preview['成交價'].apply(fmt_price)
+    st.dataframe(preview, hide_index=True, width='stretch', height=min(36 * (len(preview) + 1), 360))
+    seed_col, clear_col = st.columns(2)
+    with seed_col:
+        if st.button("📥 帶入股票戰略室", key="seed_from_market_screener", use_container_width=True):
+            st.session_state['market_screener_df'] = ranked[['代號', '名稱']].astype(str)
+            st.toast("已帶入全市場篩選結果；按「執行分析」即可載入。", icon="📥")
+    with clear_col:
+        if 'market_screener_df' in st.session_state and st.button(
+            "↩️ 取消帶入", key="clear_market_screener_seed", use_container_width=True
+        ):
+            st.session_state.pop('market_screener_df', None)
+            st.rerun()
+
 def render_stock_strategy_explanation():
     """股票戰略室的靜態說明，與操作設定分開並預設折疊。"""
     with st.expander("📖 股票戰略室說明", expanded=False):
@@ -6527,24 +8635,12 @@ def render_futures_strategy_explanation():
 @st.cache_data(ttl=86400)
 def fetch_futures_list():
     try:
-        url = "https://openapi.taifex.com.tw/v1/SingleStockFuturesMargining"
-        r = requests.get(url, headers={'accept': 'application/json'}, timeout=5, verify=False)
-        if r.status_code == 200:
-            data = r.json()
-            stock_contracts = {}
-            for item in data:
-                code = str(item.get("UnderlyingSecurityCode", "")).strip()
-                contract = str(item.get("Contract", "")).strip()
-                if code and contract:
-                    if code not in stock_contracts:
-                        stock_contracts[code] = set()
-                    stock_contracts[code].add(contract)
-            
-            futures_dict = {}
-            for code, contracts in stock_contracts.items():
-                futures_dict[code] = "✅(有小型)" if len(contracts) > 1 else "✅"
-            if futures_dict:
-                return futures_dict
+        by_underlying = get_taifex_reference_tables(['SingleStockFuturesMargining'])['by_underlying']
+        futures_dict = {
+            code: "✅(有小型)" if has_small else "✅" for code, has_small in by_underlying['有小型'].items()
+        }
+        if futures_dict:
+            return futures_dict
     except: pass
 
     try:
@@ -6621,6 +8717,240 @@ def price_change_amount(price, change_rate):
     return current_price - current_price / denominator
 
 
+# 期交所 OpenAPI 參考資料：保證金與契約清單每個發布日只下載一次，原始回應存檔並跨 session 共用，
+# 解析後的表格依標的代號、契約代碼與保證金級距建索引，供股期清單、保證金計算與期貨戰略室共用。
+TAIFEX_REFERENCE_DIR = "taifex_reference"
+TAIFEX_REFERENCE_DATASETS = (
+    'SingleStockFuturesMargining',
+    'SingleStockFuturesETFMargining',
+    'IndexFuturesAndOptionsMargining',
+)
+TAIFEX_REFERENCE_RETRY_SECONDS = 120
+TAIFEX_OPENAPI_HEADERS = {
+    'Accept': 'application/json, text/plain, */*',
+    'User-Agent': 'Mozilla/5.0 (compatible; StockApp/1.0; +https://openapi.taifex.com.tw/)',
+    'Referer': 'https://openapi.taifex.com.tw/',
+    'Cache-Control': 'no-cache',
+}
+
+
+def fetch_taifex_openapi(endpoint):
+    """下載期交所 OpenAPI 資料集；空白或非清單回應視為失敗，重試時附加時間戳避開 CDN 快取。"""
+    url = f'https://openapi.taifex.com.tw/v1/{endpoint}'
+    last_error = None
+    for attempt in range(3):
+        try:
+            response = requests.get(
+                url,
+                headers=TAIFEX_OPENAPI_HEADERS,
+                params={'_': int(time.time())} if attempt else None,
+                timeout=(8, 25),
+                verify=False,
+            )
+            response.raise_for_status()
+            response.encoding = 'utf-8-sig'
+            payload = response.json()
+            if not isinstance(payload, list) or not payload:
+                raise ValueError("期交所回傳空白或非預期格式")
+            return payload
+        except (requests.RequestException, ValueError, json.JSONDecodeError) as exc:
+            last_error = exc
+            if attempt < 2:
+                time.sleep(0.6 * (attempt + 1))
+    raise RuntimeError(f'{endpoint} 連線失敗（已重試 3 次）：{last_error}')
+
+
+def taifex_index_margin_root(raw_name):
+    """把指數期貨保證金表的契約名稱（中文或代碼）正規化為期貨代碼；無法對應時回傳 None。"""
+    name = str(raw_name or '').replace(' ', '')
+    if not name or '客製化' in name:
+        return None
+    if name in ('TMF', 'MXF') or '微型臺' in name or '微型台' in name:
+        return 'TMF'
+    if name == 'MTX' or '小型臺指' in name or '小型台指' in name:
+        return 'MTX'
+    if name == 'TX' or any(word in name for word in ('臺股期貨', '台股期貨', '臺指期貨', '台指期貨')):
+        return 'TX'
+    if '電子期貨' in name:
+        return 'TE'
+    if '金融期貨' in name:
+        return 'TF'
+    return None
+
+
+@st.cache_resource(show_spinner=False)
+def get_taifex_reference_store():
+    """跨 session 共用的期交所參考資料；datasets 保存原始回應，tables 為解析後的唯讀索引。"""
+    return {'datasets': {}, 'tables': None, 'loaded': False, 'refreshing': set(), 'lock': threading.RLock()}
+
+
+def _taifex_reference_path(endpoint):
+    return os.path.join(TAIFEX_REFERENCE_DIR, f"{endpoint}.json")
+
+
+def load_taifex_reference_store():
+    store = get_taifex_reference_store()
+    with store['lock']:
+        if store['loaded']:
+            return store
+        for endpoint in TAIFEX_REFERENCE_DATASETS:
+            try:
+                with open(_taifex_reference_path(endpoint), "r", encoding="utf-8") as file:
+                    entry = json.load(file)
+                if isinstance(entry, dict) and isinstance(entry.get('payload'), list):
+                    store['datasets'][endpoint] = entry
+            except (OSError, ValueError, TypeError):
+                continue
+        store['loaded'] = True
+    return store
+
+
+def _taifex_reference_stale(entry, today_str, now_ts):
+    """同一台北日已成功下載即視為最新；失敗後間隔一段時間才重試，避免每次重跑都打期交所。"""
+    if not entry:
+        return True
+    if entry.get('error'):
+        return now_ts - float(entry.get('failed_at') or 0) >= TAIFEX_REFERENCE_RETRY_SECONDS
+    return entry.get('fetched_day') != today_str
+
+
+def refresh_taifex_reference(endpoints=None, force=False):
+    """只下載過期的資料集；下載在鎖外進行，完成後才於鎖內換上新內容。
+
+    其他 session 遇到正在下載的資料集時直接沿用目前內容，不會等待期交所回應。
+    """
+    store = load_taifex_reference_store()
+    now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
+    today_str, now_ts = now_tw.strftime('%Y%m%d'), now_tw.timestamp()
+    with store['lock']:
+        refreshing = store['refreshing']
+        claimed = [
+            endpoint for endpoint in endpoints or TAIFEX_REFERENCE_DATASETS
+            if endpoint not in refreshing
+            and (force or _taifex_reference_stale(store['datasets'].get(endpoint), today_str, now_ts))
+        ]
+        refreshing.update(claimed)
+    for endpoint in claimed:
+        try:
+            try:
+                payload = fetch_taifex_openapi(endpoint)
+            except Exception as exc:
+                # 保留上次成功的內容，只標記錯誤與失敗時間。
+                with store['lock']:
+                    entry = dict(store['datasets'].get(endpoint) or {'payload': []})
+                    entry.update({'error': str(exc), 'failed_at': now_ts})
+                    store['datasets'][endpoint] = entry
+                    store['tables'] = None
+                continue
+            entry = {
+                'payload': payload,
+                'date': max((str(item.get('Date', '')) for item in payload), default=''),
+                'fetched_at': now_ts,
+                'fetched_day': today_str,
+                'error': None,
+            }
+            with store['lock']:
+                store['datasets'][endpoint] = entry
+                store['tables'] = None
+            try:
+                os.makedirs(TAIFEX_REFERENCE_DIR, exist_ok=True)
+                _write_json_atomic(_taifex_reference_path(endpoint), entry)
+            except (OSError, ValueError, TypeError):
+                pass
+        finally:
+            with store['lock']:
+                store['refreshing'].discard(endpoint)
+    return store
+
+
+def _build_taifex_reference_tables(datasets):
+    def payload(endpoint):
+        return (datasets.get(endpoint) or {}).get('payload') or []
+
+    stock_rows = []
+    for item in payload('SingleStockFuturesMargining'):
+        root = str(item.get('Contract', '')).strip().upper()
+        if not root:
+            continue
+        name = str(item.get('ContractName', root)).strip() or root
+        stock_rows.append({
+            '契約': root, '標的代號': str(item.get('UnderlyingSecurityCode', '')).strip(), '名稱': name,
+            '小型期貨': '小型' in name,
+            '原始保證金率': _safe_number(item.get('InitialMarginRate')),
+            '維持保證金率': _safe_number(item.get('MaintenanceMarginRate')),
+            '級距': str(item.get('GroupLevel', '')).strip(), '日期': str(item.get('Date', '')),
+        })
+    etf_rows = []
+    for item in payload('SingleStockFuturesETFMargining'):
+        root = str(item.get('Contract', '')).strip().upper()
+        if not root:
+            continue
+        underlying_code = str(item.get('UnderlyingSecurityCode', '')).strip()
+        name = _decode_taifex_legacy_text(item.get('ContractName', root))
+        etf_rows.append({
+            '契約': root, '標的代號': underlying_code, '名稱': name or f'{underlying_code} ETF期貨',
+            '小型期貨': '小型' in name,
+            '原始保證金': _safe_number(item.get('InitialMargin')),
+            '維持保證金': _safe_number(item.get('MaintenanceMargin')),
+            '日期': str(item.get('Date', '')),
+        })
+    index_rows = []
+    for item in payload('IndexFuturesAndOptionsMargining'):
+        raw_name = str(item.get('Contract', '')).strip()
+        if not raw_name:
+            continue
+        index_rows.append({
+            '契約名稱': raw_name, '期貨代碼': taifex_index_margin_root(raw_name),
+            '原始保證金': _safe_number(item.get('InitialMargin')),
+            '維持保證金': _safe_number(item.get('MaintenanceMargin')),
+            '日期': str(item.get('Date', '')),
+        })
+
+    stock_table = pd.DataFrame(stock_rows, columns=['契約', '標的代號', '名稱', '小型期貨', '原始保證金率', '維持保證金率', '級距', '日期'])
+    etf_table = pd.DataFrame(etf_rows, columns=['契約', '標的代號', '名稱', '小型期貨', '原始保證金', '維持保證金', '日期'])
+    index_contracts = pd.DataFrame(index_rows, columns=['契約名稱', '期貨代碼', '原始保證金', '維持保證金', '日期'])
+    listed = stock_table[stock_table['標的代號'] != '']
+    # 同一標的的一般與小型契約共用保證金比例；沿用原本「後出現者為準」的取值順序。
+    by_underlying = listed.groupby('標的代號', sort=False).agg(
+        契約=('契約', lambda roots: tuple(dict.fromkeys(roots))),
+        原始保證金率=('原始保證金率', 'last'), 維持保證金率=('維持保證金率', 'last'),
+        級距=('級距', lambda levels: next((level for level in reversed(list(levels)) if level), '')),
+    )
+    by_underlying['有小型'] = by_underlying['契約'].map(len) > 1
+    margin_groups = {
+        level: tuple(codes)
+        for level, codes in by_underlying[by_underlying['級距'] != ''].groupby('級距').groups.items()
+    }
+    return {
+        'stock_futures': stock_table.drop_duplicates('契約', keep='last').set_index('契約'),
+        'etf_futures': etf_table.drop_duplicates('契約', keep='last').set_index('契約'),
+        'index_contracts': index_contracts,
+        'index_futures': index_contracts.dropna(subset=['期貨代碼']).drop_duplicates('期貨代碼', keep='last').set_index('期貨代碼'),
+        'by_underlying': by_underlying,
+        'margin_groups': margin_groups,
+        'dates': {endpoint: (datasets.get(endpoint) or {}).get('date') or None for endpoint in TAIFEX_REFERENCE_DATASETS},
+        'errors': {
+            endpoint: (datasets.get(endpoint) or {}).get('error')
+            for endpoint in TAIFEX_REFERENCE_DATASETS if (datasets.get(endpoint) or {}).get('error')
+        },
+    }
+
+
+def get_taifex_reference_tables(endpoints=None, force=False):
+    """回傳共用的期交所參考資料表（唯讀）；資料集更新後才重新解析。"""
+    store = refresh_taifex_reference(endpoints, force=force)
+    with store['lock']:
+        if store['tables'] is None:
+            store['tables'] = _build_taifex_reference_tables(store['datasets'])
+        return store['tables']
+
+
+def taifex_reference_sync_date(tables, endpoint):
+    """把 YYYYMMDD 發布日轉為畫面顯示用的 YYYY/MM/DD。"""
+    date_text = str(tables['dates'].get(endpoint) or '')
+    return f"{date_text[:4]}/{date_text[4:6]}/{date_text[6:]}" if len(date_text) == 8 else ""
+
+
 @st.cache_data(ttl=300, max_entries=1, show_spinner=False)
 def fetch_futures_strategy_universe():
     """整併期交所成交量、近月契約名稱與保證金，供期貨戰略室排序。"""
@@ -6628,111 +8958,56 @@ def fetch_futures_strategy_universe():
         'TX', 'MTX', 'TMF', 'T5F', 'TE', 'ZEF', 'TF', 'ZFF', 'TBF', 'GTF',
         'TQF', 'E4F', 'BTF', 'SOF', 'SHF', 'JTF', 'UDF', 'SPF', 'UNF', 'PUF', 'UKF'
     }
-    headers = {
-        'Accept': 'application/json, text/plain, */*',
-        'User-Agent': 'Mozilla/5.0 (compatible; StockApp/1.0; +https://openapi.taifex.com.tw/)',
-        'Referer': 'https://openapi.taifex.com.tw/',
-        'Cache-Control': 'no-cache',
+    reference_labels = {
+        'SingleStockFuturesMargining': '個股期貨保證金',
+        'SingleStockFuturesETFMargining': 'ETF期貨保證金',
+        'IndexFuturesAndOptionsMargining': '指數期貨保證金',
     }
-
-    def fetch_endpoint(endpoint):
-        url = f'https://openapi.taifex.com.tw/v1/{endpoint}'
-        last_error = None
-        for attempt in range(3):
-            try:
-                response = requests.get(
-                    url,
-                    headers=headers,
-                    params={'_': int(time.time())} if attempt else None,
-                    timeout=(8, 25),
-                    verify=False,
-                )
-                response.raise_for_status()
-                response.encoding = 'utf-8-sig'
-                payload = response.json()
-                if not isinstance(payload, list) or not payload:
-                    raise ValueError("期交所回傳空白或非預期格式")
-                return payload
-            except (requests.RequestException, ValueError, json.JSONDecodeError) as exc:
-                last_error = exc
-                if attempt < 2:
-                    time.sleep(0.6 * (attempt + 1))
-        raise RuntimeError(f'{endpoint} 連線失敗（已重試 3 次）：{last_error}')
-
     product_meta = {}
     errors = []
-    sync_dates = []
-
     try:
-        for item in fetch_endpoint('SingleStockFuturesMargining'):
-            root = str(item.get('Contract', '')).strip().upper()
-            if not root:
-                continue
-            name = str(item.get('ContractName', root)).strip()
-            underlying_code = str(item.get('UnderlyingSecurityCode', '')).strip()
-            is_small = '小型' in name
-            product_meta[root] = {
-                '名稱': name, '標的代號': underlying_code, 'ETF期貨': False, '指數期貨': False,
-                '小型期貨': is_small, '乘數': 100 if is_small else 2000,
-                '原始保證金率': _safe_number(item.get('InitialMarginRate'), 0) or 0,
-                '維持保證金率': _safe_number(item.get('MaintenanceMarginRate'), 0) or 0,
-                '原始保證金固定': None, '維持保證金固定': None,
-            }
-            if item.get('Date'):
-                sync_dates.append(str(item['Date']))
+        tables = get_taifex_reference_tables()
     except Exception as exc:
-        errors.append(f'個股期貨保證金：{exc}')
+        tables = _build_taifex_reference_tables({})
+        errors.append(f'期交所保證金：{exc}')
+    # 參考資料下載失敗但仍有上一版可用時照常排序；完全沒有資料才列為錯誤。
+    for endpoint, message in tables['errors'].items():
+        if not tables['dates'].get(endpoint):
+            errors.append(f'{reference_labels[endpoint]}：{message}')
+    sync_dates = [date for date in tables['dates'].values() if date]
+
+    for root, row in tables['stock_futures'].iterrows():
+        is_small = bool(row['小型期貨'])
+        product_meta[root] = {
+            '名稱': row['名稱'], '標的代號': row['標的代號'], 'ETF期貨': False, '指數期貨': False,
+            '小型期貨': is_small, '乘數': 100 if is_small else 2000,
+            '原始保證金率': _safe_number(row['原始保證金率'], 0) or 0,
+            '維持保證金率': _safe_number(row['維持保證金率'], 0) or 0,
+            '原始保證金固定': None, '維持保證金固定': None,
+        }
 
-    try:
-        for item in fetch_endpoint('SingleStockFuturesETFMargining'):
-            root = str(item.get('Contract', '')).strip().upper()
-            if not root:
-                continue
-            name = _decode_taifex_legacy_text(item.get('ContractName', root))
-            underlying_code = str(item.get('UnderlyingSecurityCode', '')).strip()
-            is_small = '小型' in name
-            product_meta[root] = {
-                '名稱': name or f'{underlying_code} ETF期貨', '標的代號': underlying_code,
-                'ETF期貨': True, '指數期貨': False, '小型期貨': is_small,
-                '乘數': 100 if is_small else 1000,
-                '原始保證金率': 0, '維持保證金率': 0,
-                '原始保證金固定': _safe_number(item.get('InitialMargin')),
-                '維持保證金固定': _safe_number(item.get('MaintenanceMargin')),
-            }
-            if item.get('Date'):
-                sync_dates.append(str(item['Date']))
-    except Exception as exc:
-        errors.append(f'ETF期貨保證金：{exc}')
+    for root, row in tables['etf_futures'].iterrows():
+        is_small = bool(row['小型期貨'])
+        product_meta[root] = {
+            '名稱': row['名稱'], '標的代號': row['標的代號'],
+            'ETF期貨': True, '指數期貨': False, '小型期貨': is_small,
+            '乘數': 100 if is_small else 1000,
+            '原始保證金率': 0, '維持保證金率': 0,
+            '原始保證金固定': _safe_number(row['原始保證金']),
+            '維持保證金固定': _safe_number(row['維持保證金']),
+        }
 
-    index_root_map = {
-        '臺股期貨': ('TX', False), '台股期貨': ('TX', False),
-        '小型臺指': ('MTX', True), '小型台指': ('MTX', True),
-        '微型臺指': ('TMF', True), '微型台指': ('TMF', True),
-        '電子期貨': ('TE', False), '金融期貨': ('TF', False),
-    }
-    try:
-        for item in fetch_endpoint('IndexFuturesAndOptionsMargining'):
-            raw_name = str(item.get('Contract', '')).strip()
-            if '客製化' in raw_name:
-                continue
-            match = next((value for key, value in index_root_map.items() if key in raw_name), None)
-            if not match:
-                continue
-            root, is_small = match
-            product_meta[root] = {
-                '名稱': raw_name, '標的代號': root, 'ETF期貨': False, '指數期貨': True,
-                '小型期貨': is_small, '乘數': 1,
-                '原始保證金率': 0, '維持保證金率': 0,
-                '原始保證金固定': _safe_number(item.get('InitialMargin')),
-                '維持保證金固定': _safe_number(item.get('MaintenanceMargin')),
-            }
-            if item.get('Date'):
-                sync_dates.append(str(item['Date']))
-    except Exception as exc:
-        errors.append(f'指數期貨保證金：{exc}')
+    for root, row in tables['index_futures'].iterrows():
+        product_meta[root] = {
+            '名稱': row['契約名稱'], '標的代號': root, 'ETF期貨': False, '指數期貨': True,
+            '小型期貨': root in {'MTX', 'TMF'}, '乘數': 1,
+            '原始保證金率': 0, '維持保證金率': 0,
+            '原始保證金固定': _safe_number(row['原始保證金']),
+            '維持保證金固定': _safe_number(row['維持保證金']),
+        }
 
     try:
-        market_rows = fetch_endpoint('DailyMarketReportFut')
+        market_rows = fetch_taifex_openapi('DailyMarketReportFut')
     except Exception as exc:
         return pd.DataFrame(), {'updated': None, 'margin_date': max(sync_dates) if sync_dates else None, 'errors': errors + [f'每日行情：{exc}']}
 
@@ -6820,31 +9095,118 @@ def fetch_futures_strategy_universe():
         'errors': errors,
     }
 
-def resolve_shioaji_futures_contract(api, root, contract_month):
-    """依商品代碼與年月尋找 Shioaji 實際契約，支援日盤與夜盤快照。"""
-    if api is None:
-        return None
-    candidates = []
-    try:
-        for category in api.Contracts.Futures:
-            try:
-                contracts = list(category)
-            except TypeError:
-                continue
-            for contract in contracts:
-                code = str(getattr(contract, 'code', '')).upper()
-                delivery = str(getattr(contract, 'delivery_month', getattr(contract, 'delivery_date', ''))).replace('-', '').replace('/', '')
-                if code.startswith(str(root).upper()) and str(contract_month) in delivery[:6] and code[-2:] not in ('R1', 'R2'):
-                    candidates.append(contract)
-        if candidates:
-            return min(candidates, key=lambda item: str(getattr(item, 'delivery_date', getattr(item, 'delivery_month', '999999'))))
-    except Exception:
-        pass
-    return None
-
-def calculate_futures_strategy_levels(row, strategy_mode='當沖', direction_choice='自動', kbars=None):
-    """計算期貨支撐壓力與條件式進出場點位；無即時 K 棒時採官方日行情備援。"""
-    root = str(row.get('期貨代碼', ''))
+@st.cache_resource(show_spinner=False)
+def get_futures_contract_index():
+    """跨工作階段共用的期貨契約索引；每個期貨交易日只掃描一次 api.Contracts.Futures。"""
+    return {
+        'day': None, 'built_at': 0.0, 'by_month': {}, 'codes_by_month': {},
+        'root_tries': {}, 'lock': threading.Lock(),
+    }
+
+
+def _futures_delivery_text(contract):
+    return str(
+        getattr(contract, 'delivery_month', getattr(contract, 'delivery_date', ''))
+    ).replace('-', '').replace('/', '')
+
+
+def ensure_futures_contract_index(api):
+    """建立（年月 → 依代碼排序的契約）索引；契約清單尚未載入時每分鐘最多重試一次。"""
+    index = get_futures_contract_index()
+    trading_day = get_futures_trading_date(datetime.now(pytz.timezone('Asia/Taipei'))).date()
+    with index['lock']:
+        if index['day'] == trading_day and index['by_month']:
+            return index
+        if api is None or (index['day'] == trading_day and time.monotonic() - index['built_at'] < 60):
+            return index
+        by_month = {}
+        try:
+            for category in api.Contracts.Futures:
+                try:
+                    contracts = list(category)
+                except TypeError:
+                    continue
+                for contract in contracts:
+                    code = str(getattr(contract, 'code', '')).upper()
+                    if not code or code[-2:] in ('R1', 'R2'):
+                        continue
+                    month_match = re.search(r'\d{6}', _futures_delivery_text(contract))
+                    if month_match:
+                        by_month.setdefault(month_match.group(), []).append((code, contract))
+        except Exception:
+            by_month = {}
+        for entries in by_month.values():
+            entries.sort(key=lambda item: item[0])
+        index.update({
+            'day': trading_day, 'built_at': time.monotonic(), 'by_month': by_month,
+            'codes_by_month': {month: [code for code, _ in entries] for month, entries in by_month.items()},
+            'root_tries': {},
+        })
+    return index
+
+
+def _futures_root_trie(index, roots):
+    key = frozenset(str(root).upper() for root in roots)
+    trie = index['root_tries'].get(key)
+    if trie is None:
+        trie = {}
+        for root in key:
+            node = trie
+            for char in root:
+                node = node.setdefault(char, {})
+            node['$'] = root
+        index['root_tries'][key] = trie
+    return trie
+
+
+def _longest_futures_root(trie, code):
+    node, matched = trie, None
+    for char in code:
+        node = node.get(char)
+        if node is None:
+            break
+        matched = node.get('$', matched)
+    return matched
+
+
+def lookup_futures_contract(api, root, contract_month, roots=None):
+    """以索引查詢（商品代碼, 年月）的實際契約；給定 roots 時只接受最長前綴相符的代碼。"""
+    index = ensure_futures_contract_index(api)
+    root = str(root).upper()
+    month = str(contract_month)
+    codes = index['codes_by_month'].get(month)
+    if not root or not codes:
+        return None
+    entries = index['by_month'][month]
+    trie = _futures_root_trie(index, roots) if roots else None
+    candidates = []
+    for position in range(bisect_left(codes, root), len(codes)):
+        code = codes[position]
+        if not code.startswith(root):
+            break
+        if trie is not None and _longest_futures_root(trie, code) != root:
+            continue
+        candidates.append(entries[position][1])
+    if not candidates:
+        return None
+    return min(candidates, key=lambda item: str(getattr(item, 'delivery_date', getattr(item, 'delivery_month', '999999'))))
+
+
+def resolve_shioaji_futures_contract(api, root, contract_month):
+    """依商品代碼與年月尋找 Shioaji 實際契約，支援日盤與夜盤快照。"""
+    if api is None:
+        return None
+    try:
+        return lookup_futures_contract(api, root, contract_month)
+    except Exception:
+        return None
+
+def calculate_futures_strategy_levels(row, strategy_mode='當沖', direction_choice='自動', kbars=None, daily_bars=None):
+    """計算期貨支撐壓力與條件式進出場點位；無即時 K 棒時採官方日行情備援。
+
+    波段模式可傳入已彙整的 daily_bars，避免每次重算都重新把 1 分 K 彙整成日 K。
+    """
+    root = str(row.get('期貨代碼', ''))
     close = _safe_number(row.get('收盤價'))
     open_price = _safe_number(row.get('開盤價'))
     high = _safe_number(row.get('當日高'))
@@ -6872,13 +9234,7 @@ def calculate_futures_strategy_levels(row, strategy_mode='當沖', direction_cho
                     typical = (recent['High'] + recent['Low'] + recent['Close']) / 3
                     vwap = float((typical * recent['Volume']).sum() / recent['Volume'].sum())
             else:
-                trade_date = pd.Series(data.index.normalize(), index=data.index)
-                after_hours = data.index.time >= dt_time(15, 0)
-                trade_date.loc[after_hours] = trade_date.loc[after_hours] + pd.Timedelta(days=1)
-                daily = data.assign(_trade_date=trade_date.values).groupby('_trade_date').agg({
-                    'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last',
-                    **({'Volume': 'sum'} if 'Volume' in data.columns else {})
-                }).dropna()
+                daily = daily_bars if isinstance(daily_bars, pd.DataFrame) else resample_futures_daily_bars(data)
                 recent_daily = daily.tail(min(20, len(daily)))
                 if not recent_daily.empty:
                     reference_daily = recent_daily.iloc[:-1] if len(recent_daily) >= 4 else recent_daily
@@ -6899,7 +9255,10 @@ def calculate_futures_strategy_levels(row, strategy_mode='當沖', direction_cho
         support, resistance = low, high
 
     if close is None or support is None or resistance is None:
-        return {'支撐壓力': '資料不足', '進出場點位': '資料不足', '方向': '—'}
+        return {
+            '支撐壓力': '資料不足', '進出場點位': '資料不足', '方向': '—',
+            **{column: None for column in TRADE_PLAN_PRICE_COLUMNS.values()},
+        }
 
     direction = direction_choice
     if direction == '自動':
@@ -6910,20 +9269,23 @@ def calculate_futures_strategy_levels(row, strategy_mode='當沖', direction_cho
     observed_range = max(float(resistance) - float(support), tick * 2)
     risk_distance = max((atr or observed_range) * (0.55 if strategy_mode == '當沖' else 1.0), tick * 2)
     if direction == '偏多':
-        entry = round_future(float(resistance) + tick)
+        trigger_price = float(resistance)
+        entry = round_future(trigger_price + tick)
         stop = round_future(entry - risk_distance)
         target = round_future(entry + (entry - stop) * 1.5)
         trigger = '突破壓力後回測不破'
     else:
-        entry = round_future(float(support) - tick)
+        trigger_price = float(support)
+        entry = round_future(trigger_price - tick)
         stop = round_future(entry + risk_distance)
         target = round_future(entry - (stop - entry) * 1.5)
         trigger = '跌破支撐、反彈未能站回'
     return {
         '支撐壓力': f'支 {fmt_price(support)}｜壓 {fmt_price(resistance)}',
-        '進出場點位': f'進 {fmt_price(entry)}｜停 {fmt_price(stop)}｜目 {fmt_price(target)}',
+        '進出場點位': format_trade_plan(entry, stop, target),
         '方向': direction, '觸發條件': trigger,
         'VWAP': vwap, 'ATR': atr,
+        '_進場價': entry, '_停損價': stop, '_目標價': target, '_觸發價': trigger_price,
     }
 
 def enrich_futures_strategy_rows(rows, strategy_mode, market_bias='盤整'):
@@ -6932,109 +9294,275 @@ def enrich_futures_strategy_rows(rows, strategy_mode, market_bias='盤整'):
         return rows
     enriched = rows.copy()
     trading_date = get_futures_trading_date(datetime.now(pytz.timezone('Asia/Taipei'))).date()
-    for index, row in enriched.iterrows():
-        volume = int(_safe_number(row.get('當日成交口數'), 0) or 0)
-        open_interest = int(_safe_number(row.get('未平倉量'), 0) or 0)
-        volume_oi_ratio = volume / open_interest if open_interest > 0 else None
-        bid = _safe_number(row.get('買價'))
-        ask = _safe_number(row.get('賣價'))
-        price = _safe_number(row.get('收盤價'))
-        tick = get_tick_size(price) if price is not None else 1.0
-        spread_ticks = (ask - bid) / tick if bid is not None and ask is not None and ask >= bid and tick > 0 else None
-        quote_time = row.get('報價時間')
-        if quote_time:
-            data_health = build_data_health(quote_time, required_ready=price is not None, live_expected=True)
-        else:
-            data_health = build_data_health(None, required_ready=price is not None, live_expected=False)
-
-        if data_health.startswith('🔴'):
-            liquidity = '⛔ 報價過期'
-        elif spread_ticks is not None and spread_ticks > 2:
-            liquidity = f'🟡 價差 {spread_ticks:.0f} 跳'
-        elif spread_ticks is not None and spread_ticks <= 1 and volume >= 1000 and open_interest >= 100:
-            liquidity = '🟢 良好'
-        elif volume >= 100 and open_interest > 0:
-            liquidity = '🟡 普通'
-        else:
-            liquidity = '🔴 偏低'
-
-        expiry = futures_expiry_date(row.get('契約月份'))
-        days_to_expiry = (expiry - trading_date).days if expiry else None
-        if days_to_expiry is None:
-            rollover = '—'
-        elif days_to_expiry < 0:
-            rollover = '⛔ 已到期'
-        elif days_to_expiry <= 3:
-            rollover = f'🔴 {days_to_expiry}日'
-        elif days_to_expiry <= 7:
-            rollover = f'🟡 {days_to_expiry}日'
+    empty = pd.Series(np.nan, index=enriched.index)
+
+    def numeric(column):
+        return pd.to_numeric(enriched[column], errors='coerce') if column in enriched.columns else empty.copy()
+
+    volume = numeric('當日成交口數').fillna(0).astype(int)
+    open_interest = numeric('未平倉量').fillna(0).astype(int)
+    bid, ask, price = numeric('買價'), numeric('賣價'), numeric('收盤價')
+    tick = pd.Series(get_tick_size_array(price), index=enriched.index).where(price.notna(), 1.0)
+    spread_ticks = ((ask - bid) / tick).where(bid.notna() & ask.notna() & (ask >= bid) & (tick > 0))
+    volume_oi_ratio = (volume / open_interest.where(open_interest > 0)).round(2)
+
+    quote_time = enriched['報價時間'] if '報價時間' in enriched.columns else pd.Series(None, index=enriched.index, dtype=object)
+    has_quote_time = quote_time.map(bool).astype(bool)
+    data_health = build_data_health_series(
+        quote_time.where(has_quote_time), required_ready=price.notna(), live_expected=has_quote_time
+    )
+    is_stale = data_health.str.startswith('🔴')
+    has_spread = spread_ticks.notna()
+    liquidity = pd.Series(np.select(
+        [
+            is_stale,
+            has_spread & (spread_ticks > 2),
+            has_spread & (spread_ticks <= 1) & (volume >= 1000) & (open_interest >= 100),
+            (volume >= 100) & (open_interest > 0),
+        ],
+        ['⛔ 報價過期', '🟡 價差 ' + spread_ticks.round(0).fillna(0).astype(int).astype(str) + ' 跳', '🟢 良好', '🟡 普通'],
+        default='🔴 偏低',
+    ), index=enriched.index)
+
+    # 到期日只依契約月份決定，先對不重複月份計算再映射回全表。
+    contract_months = enriched.get('契約月份', pd.Series('', index=enriched.index)).fillna('').astype(str)
+    expiry_map = {month: futures_expiry_date(month) for month in contract_months.unique()}
+    days_to_expiry = contract_months.map(
+        lambda month: (expiry_map[month] - trading_date).days if expiry_map[month] else np.nan
+    ).astype(float)
+    days_text = days_to_expiry.fillna(0).astype(int).astype(str) + '日'
+    rollover = pd.Series(np.select(
+        [days_to_expiry.isna(), days_to_expiry < 0, days_to_expiry <= 3, days_to_expiry <= 7],
+        ['—', '⛔ 已到期', '🔴 ' + days_text, '🟡 ' + days_text],
+        default=days_text,
+    ), index=enriched.index)
+
+    plan = trade_plan_frame(enriched)
+    entry, stop, target = plan['entry'], plan['stop'], plan['target']
+    direction = enriched.get('方向', pd.Series('', index=enriched.index)).fillna('').astype(str)
+    is_long = direction == '偏多'
+    plan_ready = price.notna() & entry.notna() & stop.notna() & target.notna()
+    risk_distance = (entry - stop).abs()
+    near_entry = (risk_distance > 0) & ((entry - price).abs() <= risk_distance * 0.5)
+    state = pd.Series(np.select(
+        [
+            ~plan_ready,
+            is_stale | rollover.str.startswith('⛔'),
+            (is_long & (price <= stop)) | (~is_long & (price >= stop)),
+            (is_long & (price >= target)) | (~is_long & (price <= target)),
+            (is_long & (price >= entry)) | (~is_long & (price <= entry)),
+            near_entry,
+        ],
+        ['⚪ 資料不足', '⛔ 暫停', '⛔ 條件失效', '⛔ 已過目標', '✅ 已觸發', '🟡 接近觸發'],
+        default='⚪ 等待',
+    ), index=enriched.index)
+    state = state.mask(plan_ready & ~has_quote_time & data_health.str.startswith('⚪'), '⚪ 待即時報價')
+
+    alignment = calculate_market_alignment_series(direction, market_bias)
+    confidence_base = (
+        np.select([volume >= 1000, volume >= 100], [20, 12], default=4)
+        + np.select([open_interest >= 100, open_interest > 0], [10, 5], default=0)
+        + np.select([has_spread & (spread_ticks <= 1), ~has_spread | (spread_ticks <= 2)], [15, 8], default=0)
+        + np.select([data_health.str.startswith('🟢'), ~data_health.str.startswith(('🔴', '⚪'))], [15, 8], default=0)
+        + np.select([alignment.str.startswith('🟢'), alignment.str.startswith('⚪')], [15, 8], default=0)
+        + np.select([state == '✅ 已觸發', state.str.startswith('🟡'), state == '⚪ 等待'], [25, 15, 8], default=0)
+    )
+    confidence = calculate_entry_confidence_frame(
+        pd.Series(confidence_base, index=enriched.index), state, price, entry, stop, target,
+        direction, data_health, alignment, '量能／未平倉、價差、報價、方向與觸發位置綜合判讀'
+    )
+    enriched['量倉比'] = volume_oi_ratio.astype(object).where(volume_oi_ratio.notna(), None)
+    enriched['買賣價差'] = (spread_ticks.round(0).fillna(0).astype(int).astype(str) + '跳').where(has_spread, '—')
+    enriched['可交易性'] = liquidity
+    enriched['資料狀態'] = data_health
+    enriched['到期提醒'] = rollover
+    enriched['訊號狀態'] = state
+    enriched['市場一致'] = alignment
+    enriched['信心分'] = confidence['score']
+    enriched['信心判讀'] = confidence['label']
+    enriched['_信心明細'] = confidence['detail']
+    enriched['_附加可記錄'] = (state == '✅ 已觸發') & ~liquidity.str.startswith(('⛔', '🔴'))
+    for key in ('entry', 'stop', 'target'):
+        enriched[TRADE_PLAN_PRICE_COLUMNS[key]] = plan[key]
+    return enriched
+
+FUTURES_KBAR_STORE_DIR = "futures_kbar_store"
+FUTURES_KBAR_RETENTION_DAYS = 75
+FUTURES_KBAR_COVERAGE_FILE = os.path.join(FUTURES_KBAR_STORE_DIR, "coverage.json")
+
+
+@st.cache_resource(show_spinner=False)
+def get_futures_kbar_store():
+    """各工作階段共用的期貨 1 分 K 倉庫；每個契約一份，只補抓最新尾段。"""
+    return {
+        'frames': {},
+        'daily': {},
+        'coverage': None,
+        'contract_locks': {},
+        'lock': threading.Lock(),
+        'rate_lock': threading.Lock(),
+        'next_request_at': 0.0,
+    }
+
+
+def _futures_kbar_store_path(code):
+    safe_code = re.sub(r'[^A-Za-z0-9_-]', '_', str(code))
+    extension = 'parquet' if pa is not None else 'csv.gz'
+    return os.path.join(FUTURES_KBAR_STORE_DIR, f"{safe_code}.{extension}")
+
+
+def _read_futures_kbar_file(code):
+    path = _futures_kbar_store_path(code)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    try:
+        data = pd.read_parquet(path) if path.endswith('.parquet') else pd.read_csv(path, parse_dates=['ts'])
+        return data.set_index('ts').sort_index() if 'ts' in data.columns else pd.DataFrame()
+    except (OSError, ValueError, TypeError, KeyError):
+        return pd.DataFrame()
+
+
+def _write_futures_kbar_file(code, data):
+    path = _futures_kbar_store_path(code)
+    temp_path = f"{path}.tmp"
+    try:
+        os.makedirs(FUTURES_KBAR_STORE_DIR, exist_ok=True)
+        frame = data.reset_index()
+        if path.endswith('.parquet'):
+            frame.to_parquet(temp_path, index=False)
         else:
-            rollover = f'{days_to_expiry}日'
+            frame.to_csv(temp_path, index=False, compression='gzip')
+        os.replace(temp_path, path)
+    except (OSError, ValueError, TypeError):
+        pass
 
-        plan_text = row.get('進出場點位')
-        plan = parse_trade_plan_numbers(plan_text)
-        direction = str(row.get('方向', ''))
-        state = '⚪ 資料不足'
-        if price is not None and plan['entry'] is not None and plan['stop'] is not None and plan['target'] is not None:
-            is_long = direction == '偏多'
-            if data_health.startswith('🔴') or rollover.startswith('⛔'):
-                state = '⛔ 暫停'
-            elif (is_long and price <= plan['stop']) or (not is_long and price >= plan['stop']):
-                state = '⛔ 條件失效'
-            elif (is_long and price >= plan['target']) or (not is_long and price <= plan['target']):
-                state = '⛔ 已過目標'
-            elif (is_long and price >= plan['entry']) or (not is_long and price <= plan['entry']):
-                state = '✅ 已觸發'
+
+def _futures_kbar_covered_start(store, code):
+    """倉庫已完整下載過的起始日；新契約或冷門個股期的第一根 K 棒可能晚於此日。"""
+    with store['lock']:
+        if store['coverage'] is None:
+            coverage = _read_json_file(FUTURES_KBAR_COVERAGE_FILE, {})
+            store['coverage'] = coverage if isinstance(coverage, dict) else {}
+        covered = store['coverage'].get(code)
+    try:
+        return datetime.strptime(covered, '%Y-%m-%d') if covered else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _remember_futures_kbar_coverage(store, code, start):
+    with store['lock']:
+        covered = store['coverage'].get(code)
+        start_text = start.strftime('%Y-%m-%d')
+        if covered and covered <= start_text:
+            return
+        store['coverage'][code] = start_text
+        try:
+            os.makedirs(FUTURES_KBAR_STORE_DIR, exist_ok=True)
+            _write_json_atomic(FUTURES_KBAR_COVERAGE_FILE, store['coverage'])
+        except (OSError, TypeError, ValueError):
+            pass
+
+
+def _rate_limited_kbars(api, contract, start, end):
+    """所有背景執行緒共用同一個請求節流閘，避免並行下載觸發券商限流。"""
+    store = get_futures_kbar_store()
+    with store['rate_lock']:
+        wait_seconds = store['next_request_at'] - time.monotonic()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+        store['next_request_at'] = time.monotonic() + API_REQUEST_GAP_SECONDS
+    raw = api.kbars(contract=contract, start=start, end=end)
+    if not raw or not hasattr(raw, 'ts') or len(raw.ts) == 0:
+        return pd.DataFrame()
+    data = pd.DataFrame({**raw})
+    data['ts'] = pd.to_datetime(data['ts'])
+    if data['ts'].dt.tz is not None:
+        data['ts'] = data['ts'].dt.tz_convert('Asia/Taipei').dt.tz_localize(None)
+    return data.set_index('ts').sort_index()
+
+
+def load_futures_minute_bars(api, contract, lookback_days=20):
+    """讀取契約 1 分 K：先用記憶體／磁碟倉庫，只向 API 補抓最後一根之後的尾段。"""
+    code = str(getattr(contract, 'code', '') or '')
+    if api is None or contract is None or not code:
+        return pd.DataFrame()
+    store = get_futures_kbar_store()
+    with store['lock']:
+        contract_lock = store['contract_locks'].setdefault(code, threading.Lock())
+    now = datetime.now(pytz.timezone('Asia/Taipei')).replace(tzinfo=None)
+    window_start = now - timedelta(days=lookback_days)
+    with contract_lock:
+        cached = store['frames'].get(code)
+        if cached is None:
+            cached = _read_futures_kbar_file(code)
+        # 以「曾請求過的起始日」判斷覆蓋範圍，而非第一根 K 棒；舊倉庫沒有紀錄時才退回第一根。
+        covered_start = _futures_kbar_covered_start(store, code)
+        if covered_start is None and not cached.empty:
+            covered_start = cached.index[0]
+        try:
+            if cached.empty or covered_start > window_start + timedelta(days=3):
+                # 倉庫沒有資料或歷史不夠長（例如當沖 20 日後改查波段 60 日）時才整段下載。
+                fetched = _rate_limited_kbars(
+                    api, contract, window_start.strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d')
+                )
+                merged = pd.concat([fetched, cached]) if not cached.empty else fetched
+                _remember_futures_kbar_coverage(store, code, window_start)
             else:
-                risk_distance = abs(plan['entry'] - plan['stop'])
-                entry_distance = abs(plan['entry'] - price)
-                state = '🟡 接近觸發' if risk_distance > 0 and entry_distance <= risk_distance * 0.5 else '⚪ 等待'
-            if not quote_time and data_health.startswith('⚪'):
-                state = '⚪ 待即時報價'
-
-        confidence_base = 0
-        confidence_base += 20 if volume >= 1000 else (12 if volume >= 100 else 4)
-        confidence_base += 10 if open_interest >= 100 else (5 if open_interest > 0 else 0)
-        confidence_base += 15 if spread_ticks is not None and spread_ticks <= 1 else (8 if spread_ticks is None or spread_ticks <= 2 else 0)
-        confidence_base += 15 if data_health.startswith('🟢') else (8 if not data_health.startswith(('🔴', '⚪')) else 0)
-        alignment = calculate_market_alignment(direction, market_bias)
-        confidence_base += 15 if alignment.startswith('🟢') else (8 if alignment.startswith('⚪') else 0)
-        confidence_base += 25 if state == '✅ 已觸發' else (15 if state.startswith('🟡') else (8 if state == '⚪ 等待' else 0))
-        confidence = calculate_entry_confidence(
-            confidence_base, state, price, plan_text, direction, data_health, alignment,
-            '量能／未平倉、價差、報價、方向與觸發位置綜合判讀'
-        )
-        enriched.at[index, '量倉比'] = round(volume_oi_ratio, 2) if volume_oi_ratio is not None else None
-        enriched.at[index, '買賣價差'] = f'{spread_ticks:.0f}跳' if spread_ticks is not None else '—'
-        enriched.at[index, '可交易性'] = liquidity
-        enriched.at[index, '資料狀態'] = data_health
-        enriched.at[index, '到期提醒'] = rollover
-        enriched.at[index, '訊號狀態'] = state
-        enriched.at[index, '市場一致'] = alignment
-        enriched.at[index, '信心分'] = confidence['score']
-        enriched.at[index, '信心判讀'] = confidence['label']
-        enriched.at[index, '_信心明細'] = confidence['detail']
-        enriched.at[index, '_附加可記錄'] = state == '✅ 已觸發' and not liquidity.startswith(('⛔', '🔴'))
-    return enriched
+                fetched = _rate_limited_kbars(
+                    api, contract, cached.index[-1].strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d')
+                )
+                merged = pd.concat([cached, fetched]) if not fetched.empty else cached
+        except Exception:
+            fetched, merged = pd.DataFrame(), cached
+        if not fetched.empty:
+            merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+            merged = merged[merged.index >= now - timedelta(days=FUTURES_KBAR_RETENTION_DAYS)]
+            _write_futures_kbar_file(code, merged)
+        store['frames'][code] = merged
+    return merged[merged.index >= window_start] if not merged.empty else merged
+
+
+def resample_futures_daily_bars(data):
+    """把 1 分 K 依期貨交易日（15:00 後夜盤歸次一交易日）彙整為日 K。"""
+    if data is None or data.empty:
+        return pd.DataFrame()
+    data = data.dropna(subset=['High', 'Low', 'Close'])
+    trade_date = pd.Series(data.index.normalize(), index=data.index)
+    after_hours = data.index.time >= dt_time(15, 0)
+    trade_date.loc[after_hours] = trade_date.loc[after_hours] + pd.Timedelta(days=1)
+    return data.assign(_trade_date=trade_date.values).groupby('_trade_date').agg({
+        'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last',
+        **({'Volume': 'sum'} if 'Volume' in data.columns else {})
+    }).dropna()
+
+
+def get_futures_daily_bars(code, minute_bars):
+    """同一契約的日 K 只在 1 分 K 有新資料時重算一次。"""
+    if minute_bars is None or minute_bars.empty:
+        return pd.DataFrame()
+    store = get_futures_kbar_store()
+    # 最後一根會被串流報價覆寫，簽章需包含其數值才不會沿用過期的日 K。
+    signature = (
+        minute_bars.index[0], minute_bars.index[-1], len(minute_bars),
+        tuple(minute_bars.iloc[-1].tolist()),
+    )
+    cached = store['daily'].get(code)
+    if cached and cached[0] == signature:
+        return cached[1]
+    daily = resample_futures_daily_bars(minute_bars)
+    store['daily'][code] = (signature, daily)
+    return daily
+
 
 def fetch_futures_contract_kbars(api, contract, lookback_days=20):
     """取得指定期貨契約 K 棒；保留夜盤資料供當沖與波段分析。"""
     if api is None or contract is None:
         return pd.DataFrame()
     try:
-        now = datetime.now(pytz.timezone('Asia/Taipei'))
-        raw = api.kbars(
-            contract=contract,
-            start=(now - timedelta(days=lookback_days)).strftime('%Y-%m-%d'),
-            end=now.strftime('%Y-%m-%d')
-        )
-        if not raw or not hasattr(raw, 'ts') or len(raw.ts) == 0:
-            return pd.DataFrame()
-        data = pd.DataFrame({**raw})
-        data['ts'] = pd.to_datetime(data['ts'])
-        if data['ts'].dt.tz is not None:
-            data['ts'] = data['ts'].dt.tz_convert('Asia/Taipei').dt.tz_localize(None)
-        data = data.set_index('ts').sort_index()
+        data = load_futures_minute_bars(api, contract, lookback_days)
+        if data.empty:
+            return data
         stream_quote = get_stream_quotes(api, [contract], snapshot_fallback=False)
         return merge_stream_quote_into_intraday(
             data, stream_quote[0] if stream_quote else None, '1m'
@@ -7042,6 +9570,22 @@ def fetch_futures_contract_kbars(api, contract, lookback_days=20):
     except Exception:
         return pd.DataFrame()
 
+
+def prefetch_futures_contract_kbars(api, contracts, lookback_days=20):
+    """並行補齊多個契約的 1 分 K；並行數與請求間隔沿用 ANALYSIS_MAX_WORKERS／API_REQUEST_GAP_SECONDS。"""
+    unique = {}
+    for contract in contracts:
+        code = str(getattr(contract, 'code', '') or '')
+        if code and code not in unique:
+            unique[code] = contract
+    if api is None or not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
+        frames = list(executor.map(
+            lambda contract: fetch_futures_contract_kbars(api, contract, lookback_days), unique.values()
+        ))
+    return dict(zip(unique, frames))
+
 def update_futures_live_rows(rows, api, strategy_mode, direction_choice, include_analysis=True):
     """批次更新顯示中的實際契約快照，並選擇性重算支撐壓力。"""
     if rows.empty or api is None:
@@ -7065,6 +9609,13 @@ def update_futures_live_rows(rows, api, strategy_mode, direction_choice, include
     except Exception:
         snapshots = {}
 
+    kbar_map = {}
+    if include_analysis:
+        # 先並行補齊所有契約的 1 分 K（倉庫只抓尾段），再逐列計算支撐壓力。
+        kbar_map = prefetch_futures_contract_kbars(
+            api, [contract for _, contract in resolved], 20 if strategy_mode == '當沖' else 60
+        )
+
     update_count = 0
     for index, contract in resolved:
         snapshot = snapshots.get(index)
@@ -7096,8 +9647,15 @@ def update_futures_live_rows(rows, api, strategy_mode, direction_choice, include
                     updated.at[index, '所需保證金'] = round(price * multiplier * initial_rate / 100)
                     updated.at[index, '維持保證金'] = round(price * multiplier * maintenance_rate / 100)
                 update_count += 1
-        kbars = fetch_futures_contract_kbars(api, contract, 20 if strategy_mode == '當沖' else 60) if include_analysis else None
-        analysis = calculate_futures_strategy_levels(updated.loc[index], strategy_mode, direction_choice, kbars)
+        contract_code = str(getattr(contract, 'code', '') or '')
+        kbars = kbar_map.get(contract_code) if include_analysis else None
+        daily_bars = (
+            get_futures_daily_bars(contract_code, kbars)
+            if strategy_mode != '當沖' and isinstance(kbars, pd.DataFrame) and not kbars.empty else None
+        )
+        analysis = calculate_futures_strategy_levels(
+            updated.loc[index], strategy_mode, direction_choice, kbars, daily_bars
+        )
         for column, value in analysis.items():
             updated.at[index, column] = value
         updated.at[index, '實際契約'] = str(getattr(contract, 'code', updated.at[index, '期貨代碼']))
@@ -7108,32 +9666,16 @@ def update_futures_universe_live(rows, api):
     if rows.empty or api is None:
         return rows, 0
     updated = rows.copy()
-    roots = sorted(set(updated['期貨代碼'].astype(str).str.upper()), key=len, reverse=True)
-    contract_map = {}
+    roots = set(updated['期貨代碼'].astype(str).str.upper())
     try:
-        for category in api.Contracts.Futures:
-            try:
-                contracts = list(category)
-            except TypeError:
-                continue
-            for contract in contracts:
-                code = str(getattr(contract, 'code', '')).upper()
-                if not code or code[-2:] in ('R1', 'R2'):
-                    continue
-                delivery = str(
-                    getattr(contract, 'delivery_month', getattr(contract, 'delivery_date', ''))
-                ).replace('-', '').replace('/', '')
-                month_match = re.search(r'\d{6}', delivery)
-                root = next((candidate for candidate in roots if code.startswith(candidate)), None)
-                if root and month_match:
-                    contract_map.setdefault((root, month_match.group()), contract)
+        resolved = [
+            (index, lookup_futures_contract(api, root, month, roots))
+            for index, root, month in zip(
+                updated.index, updated['期貨代碼'].astype(str), updated['契約月份'].astype(str)
+            )
+        ]
     except Exception:
         return updated, 0
-
-    resolved = [
-        (index, contract_map.get((str(row['期貨代碼']).upper(), str(row['契約月份']))))
-        for index, row in updated.iterrows()
-    ]
     resolved = [(index, contract) for index, contract in resolved if contract is not None]
     if not resolved:
         return updated, 0
@@ -7181,7 +9723,7 @@ OPENING_SIGNAL_WEIGHTS = {
     'NQ_FUT': 12, 'YM_FUT': 8,
     'NIKKEI': 10, 'KOSPI': 10,
 }
-OPENING_SIGNAL_CACHE_VERSION = 5
+OPENING_SIGNAL_CACHE_VERSION = 6
 
 NASDAQ_MARKET_HEADERS = {
     'User-Agent': (
@@ -7483,7 +10025,6 @@ def _opening_night_change(series, cutoff_at):
     }
 
 
-@st.cache_data(ttl=300, max_entries=6, show_spinner=False)
 def fetch_opening_overseas_signals(trading_date_text, cutoff_text):
     """批次取得美股收盤、美期與日韓盤；固定以 08:30 前資料計算。"""
     tz_tw = pytz.timezone('Asia/Taipei')
@@ -7610,54 +10151,158 @@ def calculate_opening_direction(rows):
     }
 
 
+# 試搓方向排程：伺服器端背景執行緒在 07:55–08:40 每 5 分鐘計算一次並存檔，
+# 所有 session 只讀取同一份結果；N 個畫面仍只花一次外部請求。
+OPENING_SIGNAL_STORE_FILE = "opening_signal_cache.json"
+OPENING_SIGNAL_SCHEDULE_WINDOW = (dt_time(7, 55), dt_time(8, 40))
+
+
+def opening_signal_cutoff(now_tw):
+    """資料截止點：以 5 分鐘為單位，08:30 後固定在 08:30。"""
+    cutoff_time = min(now_tw.time(), dt_time(8, 30))
+    return datetime.combine(now_tw.date(), dt_time(cutoff_time.hour, (cutoff_time.minute // 5) * 5))
+
+
+def _opening_signal_slot(now_tw):
+    """排程時段內每 5 分鐘一格；時段外每日前、後各一格，只在缺資料時計算。"""
+    start, end = OPENING_SIGNAL_SCHEDULE_WINDOW
+    if start <= now_tw.time() <= end:
+        return now_tw.strftime('%Y-%m-%d ') + f"{now_tw.hour:02d}:{(now_tw.minute // 5) * 5:02d}"
+    return now_tw.strftime('%Y-%m-%d ') + ('pre' if now_tw.time() < start else 'post')
+
+
+@st.cache_resource(show_spinner=False)
+def get_opening_signal_scheduler():
+    """跨 session 共用的試搓方向結果；啟動時先載入上次存檔，重啟後可立即顯示。
+
+    只保存公開行情（Yahoo／Nasdaq）；需登入券商的台指期夜盤由各 session 以自己的連線補上。
+    """
+    stored = _read_json_file(OPENING_SIGNAL_STORE_FILE, {}) or {}
+    if stored.get('version') != OPENING_SIGNAL_CACHE_VERSION:
+        stored = {}
+    return {
+        'condition': threading.Condition(threading.RLock()),
+        'fetch_lock': threading.Lock(),
+        'worker': None,
+        'signal': stored.get('signal'),
+        'requested': False,
+    }
+
+
+def refresh_opening_signals(now_tw, force=False):
+    """同一時段只計算一次；多個 session 同時觸發時，後到者等待並沿用先到者的結果。"""
+    scheduler = get_opening_signal_scheduler()
+    slot = _opening_signal_slot(now_tw)
+    with scheduler['fetch_lock']:
+        current = scheduler['signal']
+        if not force and current and current.get('slot') == slot:
+            return current
+        cutoff_at = opening_signal_cutoff(now_tw)
+        rows, errors = fetch_opening_overseas_signals(
+            now_tw.strftime('%Y-%m-%d'), cutoff_at.strftime('%Y-%m-%d %H:%M'),
+        )
+        signal = {
+            'slot': slot, 'date': now_tw.strftime('%Y-%m-%d'),
+            'cutoff': cutoff_at.strftime('%Y-%m-%d %H:%M'),
+            'computed_at': now_tw.strftime('%Y-%m-%d %H:%M:%S'),
+            'rows': rows, 'errors': errors,
+        }
+        with scheduler['condition']:
+            scheduler['signal'] = signal
+        try:
+            _write_json_atomic(OPENING_SIGNAL_STORE_FILE, {'version': OPENING_SIGNAL_CACHE_VERSION, 'signal': signal})
+        except (OSError, TypeError, ValueError):
+            pass
+    return signal
+
+
+def _opening_signal_worker_loop(scheduler):
+    tz_tw = pytz.timezone('Asia/Taipei')
+    start, end = OPENING_SIGNAL_SCHEDULE_WINDOW
+    while True:
+        now_tw = datetime.now(tz_tw)
+        with scheduler['condition']:
+            requested, scheduler['requested'] = scheduler['requested'], False
+        if requested or (start <= now_tw.time() <= end and not is_market_closed_func(now_tw.date())):
+            try:
+                refresh_opening_signals(now_tw)
+            except Exception:
+                pass
+        # 對齊下一個 5 分鐘整點後數秒，讓 5 分線已收完；畫面要求補算時提前喚醒。
+        wait_seconds = 300 - (now_tw.minute % 5) * 60 - now_tw.second + 5
+        with scheduler['condition']:
+            if not scheduler['requested']:
+                scheduler['condition'].wait(timeout=wait_seconds)
+
+
+def ensure_opening_signal_scheduler():
+    """啟動背景排程；排程只抓公開行情，不持有任何 session 的券商連線。"""
+    scheduler = get_opening_signal_scheduler()
+    with scheduler['condition']:
+        worker = scheduler['worker']
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(
+                target=_opening_signal_worker_loop, args=(scheduler,), daemon=True, name="opening-signal"
+            )
+            scheduler['worker'] = worker
+            worker.start()
+    return scheduler
+
+
+def get_opening_signals(now_tw):
+    """取得目前時段的試搓資料；只讀排程結果，缺資料時請背景補算，不在畫面執行緒上抓取。"""
+    scheduler = ensure_opening_signal_scheduler()
+    signal = scheduler['signal']
+    if signal and signal.get('date') == now_tw.strftime('%Y-%m-%d'):
+        start, end = OPENING_SIGNAL_SCHEDULE_WINDOW
+        if start <= now_tw.time() <= end:
+            # 時段內由排程每 5 分鐘更新，畫面先沿用最近一格，不阻塞使用者。
+            return signal
+        if now_tw.time() < start and signal.get('slot', '').endswith('pre'):
+            return signal
+        if now_tw.time() > end and signal.get('cutoff', '').endswith('08:30'):
+            return signal
+    with scheduler['condition']:
+        scheduler['requested'] = True
+        scheduler['condition'].notify_all()
+    if signal and signal.get('date') == now_tw.strftime('%Y-%m-%d'):
+        return signal
+    return {'slot': None, 'rows': [], 'errors': ['試搓資料背景計算中，稍後自動更新']}
+
+
+def get_session_tx_night_signal(api, now_tw, slot, force=False):
+    """以本 session 自己登入的 Shioaji 連線取得台指期夜盤；同一時段只抓一次。"""
+    cached = st.session_state.get('_opening_tx_night')
+    if not force and cached and cached[0] == slot:
+        return cached[1]
+    try:
+        tx_signal = fetch_shioaji_tx_night_signal(api, now_tw)
+    except Exception:
+        tx_signal = None
+    st.session_state['_opening_tx_night'] = (slot, tx_signal)
+    return tx_signal
+
+
 @st.fragment(run_every=60)
 def render_opening_direction_prompt():
     """在股期戰略室頂端顯示 08:30 試搓用的跨市場方向提示。"""
     tz_tw = pytz.timezone('Asia/Taipei')
     now_tw = datetime.now(tz_tw)
     active_window = dt_time(8, 20) <= now_tw.time() <= dt_time(9, 0)
-    auto_refresh_window = dt_time(8, 0) <= now_tw.time() <= dt_time(8, 40)
-    cutoff_time = min(now_tw.time(), dt_time(8, 30))
-    cutoff_minute = (cutoff_time.minute // 5) * 5
-    cutoff_at = datetime.combine(now_tw.date(), dt_time(cutoff_time.hour, cutoff_minute))
 
     title_col, refresh_col = st.columns([9, 1], vertical_alignment='center')
     with title_col:
         st.markdown('<span style="font-size:18px;font-weight:800;">🧭 台股試搓方向</span>', unsafe_allow_html=True)
     with refresh_col:
         refresh = st.button('🔄 更新', key='refresh_opening_direction', width='stretch')
-    if refresh:
-        fetch_opening_overseas_signals.clear()
-        st.session_state.pop('opening_overseas_signal', None)
-        st.session_state.pop('opening_tx_night_signal', None)
-
-    trading_date_text = now_tw.strftime('%Y-%m-%d')
-    overseas_cache = st.session_state.get('opening_overseas_signal')
-    cache_outdated = (
-        not overseas_cache
-        or overseas_cache.get('date') != trading_date_text
-        or overseas_cache.get('version') != OPENING_SIGNAL_CACHE_VERSION
-    )
-    if refresh or auto_refresh_window or cache_outdated:
-        rows, errors = fetch_opening_overseas_signals(
-            trading_date_text, cutoff_at.strftime('%Y-%m-%d %H:%M'),
+    logged_in = st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api') is not None
+    signal = refresh_opening_signals(now_tw, force=True) if refresh else get_opening_signals(now_tw)
+    rows = list(signal.get('rows', []))
+    errors = list(signal.get('errors', []))
+    if logged_in:
+        tx_signal = get_session_tx_night_signal(
+            st.session_state.sj_api, now_tw, signal.get('slot') or _opening_signal_slot(now_tw), force=refresh,
         )
-        st.session_state.opening_overseas_signal = {
-            'version': OPENING_SIGNAL_CACHE_VERSION,
-            'date': trading_date_text, 'rows': rows, 'errors': errors,
-        }
-    else:
-        rows = list(overseas_cache.get('rows', []))
-        errors = list(overseas_cache.get('errors', []))
-    if st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api') is not None:
-        cache = st.session_state.get('opening_tx_night_signal')
-        cache_stale = not cache or cache.get('date') != now_tw.strftime('%Y-%m-%d')
-        if refresh or cache_stale:
-            tx_signal = fetch_shioaji_tx_night_signal(st.session_state.sj_api, now_tw)
-            st.session_state.opening_tx_night_signal = {
-                'date': now_tw.strftime('%Y-%m-%d'), 'row': tx_signal,
-            }
-        tx_signal = st.session_state.get('opening_tx_night_signal', {}).get('row')
         if tx_signal:
             rows = [row for row in rows if row['key'] != 'TX_NIGHT'] + [tx_signal]
 
@@ -7760,12 +10405,36 @@ def render_opening_direction_prompt():
             st.warning('部分行情來源暫時無法取得：' + '；'.join(errors))
 
 
-@st.cache_data(ttl=900, max_entries=1, show_spinner=False)
-def fetch_market_risk_lists():
-    """取得上市、上櫃注意／處置名單；僅在使用者手動更新時呼叫。"""
-    attention_counts = {}
-    disposition_codes = set()
-    errors = []
+# 注意／處置名單索引：各官方來源解析成「代號 × 名單」列表，依日期版本存檔並跨 session 共用；
+# 只重抓過期的來源，處置列過了迄日即失效，整表以一次 merge 併入股票表格。
+MARKET_RISK_INDEX_DIR = "market_risk_index"
+MARKET_RISK_INDEX_TTL_SECONDS = 900
+MARKET_RISK_INDEX_COLUMNS = ['代號', '名單', '注意次數', '處置起日', '處置迄日', '版本']
+MARKET_RISK_LIST_SOURCES = {
+    '上市注意': ('https://www.twse.com.tw/announcement/notice?response=json', 'twse', 'attention'),
+    '上市處置': ('https://www.twse.com.tw/announcement/punish?response=json', 'twse', 'disposition'),
+    '上櫃注意': ('https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_information', 'tpex', 'attention'),
+    '上櫃注意累計異常': ('https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_note', 'tpex', 'accumulated'),
+    '上櫃處置': ('https://www.tpex.org.tw/openapi/v1/tpex_disposal_information', 'tpex', 'disposition'),
+}
+
+
+def _parse_risk_list_period(text):
+    """解析「115/10/16～115/10/29」或「1151016～1151029」等處置期間，回傳西元 YYYYMMDD 起迄。"""
+    dates = []
+    for year, month, day in re.findall(r'(\d{2,4})[/.-](\d{1,2})[/.-](\d{1,2})', str(text or '')) or re.findall(r'(\d{3})(\d{2})(\d{2})', str(text or '')):
+        year = int(year) + 1911 if int(year) < 1911 else int(year)
+        try:
+            dates.append(datetime(year, int(month), int(day)).strftime('%Y%m%d'))
+        except ValueError:
+            continue
+    if not dates:
+        return None, None
+    return dates[0], dates[-1]
+
+
+def fetch_market_risk_list_records(source_names=None):
+    """取得指定的上市、上櫃注意／處置名單來源；回傳名單列與各來源錯誤訊息。"""
     headers = {
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124 Safari/537.36',
         'Accept': 'application/json, text/plain, */*',
@@ -7796,53 +10465,229 @@ def fetch_market_risk_lists():
                     time.sleep(0.8 * (attempt + 1))
         raise RuntimeError(f"{name} 已重試 3 次仍失敗：{last_error}")
 
-    def parse_twse_rows(payload, target, is_attention=False):
+    def iter_twse_records(payload):
         fields = payload.get('fields', [])
         for values in payload.get('data', []):
             record = dict(zip(fields, values))
-            raw_code = str(record.get('證券代號', record.get('有價證券代號', '')))
-            code_match = re.search(r'\d{4,6}', raw_code)
-            if not code_match:
-                continue
-            code = code_match.group(0)
-            if is_attention:
-                raw_count = str(record.get('累計次數', record.get('累計', '1')))
-                count_match = re.search(r'\d+', raw_count)
-                target[code] = max(target.get(code, 0), int(count_match.group()) if count_match else 1)
-            else:
-                target.add(code)
+            yield record, str(record.get('證券代號', record.get('有價證券代號', '')))
 
-    for name, url, target, is_attention in [
-        ('上市注意', 'https://www.twse.com.tw/announcement/notice?response=json', attention_counts, True),
-        ('上市處置', 'https://www.twse.com.tw/announcement/punish?response=json', disposition_codes, False),
-    ]:
-        try:
-            parse_twse_rows(fetch_json(name, url, dict), target, is_attention)
-        except Exception as exc:
-            errors.append(f'{name}: {exc}')
+    def iter_tpex_records(payload):
+        for record in payload:
+            yield record, str(record.get('SecuritiesCompanyCode', ''))
 
-    for name, url, is_attention, is_accumulated_note in [
-        ('上櫃注意', 'https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_information', True, False),
-        ('上櫃注意累計異常', 'https://www.tpex.org.tw/openapi/v1/tpex_trading_warning_note', True, True),
-        ('上櫃處置', 'https://www.tpex.org.tw/openapi/v1/tpex_disposal_information', False, False),
-    ]:
+    records, errors = [], {}
+    for name in source_names or list(MARKET_RISK_LIST_SOURCES):
+        url, market, kind = MARKET_RISK_LIST_SOURCES[name]
         try:
-            for record in fetch_json(name, url, list):
-                code_match = re.search(r'\d{4,6}', str(record.get('SecuritiesCompanyCode', '')))
+            payload = fetch_json(name, url, dict if market == 'twse' else list)
+            iterator = iter_twse_records(payload) if market == 'twse' else iter_tpex_records(payload)
+            for record, raw_code in iterator:
+                code_match = re.search(r'\d{4,6}', raw_code)
                 if not code_match:
                     continue
-                code = code_match.group(0)
-                if is_attention:
+                count, period_start, period_end = 0, None, None
+                if kind == 'attention':
+                    raw_count = str(record.get('累計次數', record.get('累計', '1'))) if market == 'twse' else '1'
+                    count_match = re.search(r'\d+', raw_count)
+                    count = int(count_match.group()) if count_match else 1
+                elif kind == 'accumulated':
                     # 累計異常名單表示隔日再列注意時可能進入處置，至少以 2 次標示。
-                    count = 2 if is_accumulated_note else 1
-                    attention_counts[code] = max(attention_counts.get(code, 0), count)
+                    count = 2
                 else:
-                    disposition_codes.add(code)
+                    period_text = next(
+                        (value for key, value in record.items() if any(word in str(key) for word in ('起迄', '期間', 'Period'))),
+                        None
+                    )
+                    period_start, period_end = _parse_risk_list_period(period_text)
+                records.append({
+                    '代號': code_match.group(0), '名單': name, '注意次數': count,
+                    '處置起日': period_start, '處置迄日': period_end,
+                })
         except Exception as exc:
-            errors.append(f'{name}: {exc}')
+            errors[name] = str(exc)
 
     session.close()
-    return attention_counts, sorted(disposition_codes), errors
+    return pd.DataFrame(records, columns=MARKET_RISK_INDEX_COLUMNS[:-1]), errors
+
+
+@st.cache_resource(show_spinner=False)
+def get_market_risk_index():
+    """跨 session 共用的名單索引；table 每列為一筆代號 × 名單，meta 記錄各來源更新時間與錯誤。"""
+    return {
+        'table': None, 'joined': None, 'meta': {}, 'loaded': False,
+        'refreshing': set(), 'lock': threading.RLock(),
+    }
+
+
+def _market_risk_index_paths():
+    extension = 'parquet' if pa is not None else 'csv.gz'
+    return os.path.join(MARKET_RISK_INDEX_DIR, f"risk_lists.{extension}"), os.path.join(MARKET_RISK_INDEX_DIR, "meta.json")
+
+
+def _prune_market_risk_table(table, today_str):
+    """處置期滿即失效；注意列僅保留最新版本，避免前一日名單被當成今日仍列示。"""
+    if table.empty:
+        return table
+    expired = table['處置迄日'].notna() & (table['處置迄日'].astype(str) < today_str)
+    # 注意／累計名單每日重發，非今日版本的列即使來源今日抓取失敗也不再沿用。
+    stale_attention = ~table['名單'].astype(str).str.endswith('處置') & (table['版本'].fillna('').astype(str) < today_str)
+    return table[~(expired | stale_attention)].reset_index(drop=True)
+
+
+def load_market_risk_index():
+    engine = get_market_risk_index()
+    with engine['lock']:
+        if engine['loaded']:
+            return engine
+        table_path, meta_path = _market_risk_index_paths()
+        table, meta = pd.DataFrame(columns=MARKET_RISK_INDEX_COLUMNS), {}
+        try:
+            if os.path.exists(table_path) and os.path.exists(meta_path):
+                stored = pd.read_parquet(table_path) if table_path.endswith('.parquet') else pd.read_csv(table_path, dtype=str)
+                table = stored.reindex(columns=MARKET_RISK_INDEX_COLUMNS)
+                table['注意次數'] = pd.to_numeric(table['注意次數'], errors='coerce').fillna(0).astype(int)
+                table = table.astype({'代號': str}).replace({np.nan: None})
+                with open(meta_path, "r", encoding="utf-8") as file:
+                    meta = json.load(file)
+        except (OSError, ValueError, TypeError, KeyError):
+            table, meta = pd.DataFrame(columns=MARKET_RISK_INDEX_COLUMNS), {}
+        today_str = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y%m%d')
+        engine.update({'table': _prune_market_risk_table(table, today_str), 'joined': None, 'meta': meta, 'loaded': True})
+    return engine
+
+
+def _save_market_risk_index(engine):
+    table_path, meta_path = _market_risk_index_paths()
+    temp_path = f"{table_path}.tmp"
+    try:
+        os.makedirs(MARKET_RISK_INDEX_DIR, exist_ok=True)
+        if table_path.endswith('.parquet'):
+            engine['table'].to_parquet(temp_path, index=False)
+        else:
+            engine['table'].to_csv(temp_path, index=False, compression='gzip')
+        os.replace(temp_path, table_path)
+        _write_json_atomic(meta_path, engine['meta'], indent=2)
+    except (OSError, ValueError, TypeError):
+        pass
+
+
+def refresh_market_risk_index(force=False):
+    """只重抓超過 15 分鐘或跨日的來源；失敗來源保留上次成功的列並記錄錯誤，不會誤判為安全。
+
+    下載在鎖外進行，其他 session 遇到正在下載的來源時直接沿用目前名單，不會等待官方站回應。
+    """
+    engine = load_market_risk_index()
+    now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
+    today_str = now_tw.strftime('%Y%m%d')
+    with engine['lock']:
+        sources = engine['meta'].get('sources', {})
+        refreshing = engine['refreshing']
+        stale = []
+        for name in MARKET_RISK_LIST_SOURCES:
+            if name in refreshing:
+                continue
+            source_meta = sources.get(name, {})
+            fetched_at = source_meta.get('fetched_at')
+            age = now_tw.timestamp() - fetched_at if fetched_at else None
+            if force or source_meta.get('error') or source_meta.get('version') != today_str or age is None or age >= MARKET_RISK_INDEX_TTL_SECONDS:
+                stale.append(name)
+        if not stale:
+            return engine
+        refreshing.update(stale)
+    try:
+        records, errors = fetch_market_risk_list_records(stale)
+        refreshed = [name for name in stale if name not in errors]
+        records['版本'] = today_str
+        with engine['lock']:
+            # 下載期間其他來源可能已由別的 session 更新，合併時以鎖內的最新內容為準。
+            sources = dict(engine['meta'].get('sources', {}))
+            kept = engine['table'][~engine['table']['名單'].isin(refreshed)]
+            table = pd.concat([kept, records], ignore_index=True) if not kept.empty else records
+            for name in stale:
+                previous = sources.get(name, {})
+                sources[name] = (
+                    {'version': today_str, 'fetched_at': now_tw.timestamp(), 'error': None}
+                    if name in refreshed else {**previous, 'error': errors[name]}
+                )
+            engine.update({
+                'table': _prune_market_risk_table(table.reindex(columns=MARKET_RISK_INDEX_COLUMNS), today_str),
+                'joined': None,
+                'meta': {'sources': sources, 'updated': now_tw.strftime('%Y/%m/%d %H:%M:%S')},
+            })
+            _save_market_risk_index(engine)
+    finally:
+        with engine['lock']:
+            engine['refreshing'].difference_update(stale)
+    return engine
+
+
+def market_risk_index_columns():
+    """每個代號一列的名單欄位：注意次數取各名單最大值、處置中與迄日、所屬名單。"""
+    engine = load_market_risk_index()
+    with engine['lock']:
+        if engine['joined'] is not None:
+            return engine['joined']
+        table = engine['table']
+    if table is None or table.empty:
+        joined = pd.DataFrame(columns=['代號', '_risk_attention', '_risk_disposed', '_risk_disposition_end', '_risk_list_type'])
+    else:
+        disposed_rows = table['名單'].str.endswith('處置')
+        grouped = table.groupby('代號', sort=False)
+        joined = pd.DataFrame({
+            '_risk_attention': grouped['注意次數'].max().astype(int),
+            '_risk_disposed': disposed_rows.groupby(table['代號']).any(),
+            '_risk_disposition_end': table.loc[disposed_rows].groupby('代號')['處置迄日'].max(),
+            '_risk_list_type': grouped['名單'].agg(lambda names: '、'.join(dict.fromkeys(names))),
+        }).reset_index().rename(columns={'index': '代號'})
+    with engine['lock']:
+        engine['joined'] = joined
+    return joined
+
+
+def join_market_risk_columns(frame, code_column='代號'):
+    """把名單索引以一次 merge 併入表格；未列示者注意 0 次、非處置。"""
+    risk_columns = ['_risk_attention', '_risk_disposed', '_risk_disposition_end', '_risk_list_type']
+    if frame is None or frame.empty or code_column not in frame.columns:
+        return frame
+    base = frame.drop(columns=[column for column in risk_columns if column in frame.columns])
+    joined = market_risk_index_columns().rename(columns={'代號': '_risk_join_code'})
+    merged = base.assign(_risk_join_code=base[code_column].astype(str).str.strip()).merge(
+        joined, on='_risk_join_code', how='left'
+    ).drop(columns='_risk_join_code')
+    merged.index = frame.index
+    merged['_risk_attention'] = merged['_risk_attention'].fillna(0).astype(int)
+    merged['_risk_disposed'] = merged['_risk_disposed'].fillna(False).astype(bool)
+    return merged
+
+
+def market_risk_list_state():
+    """整理成既有 risk_filter_market_data 格式；任一來源目前失敗即視為未完整查核。"""
+    engine = load_market_risk_index()
+    meta = engine['meta']
+    sources = meta.get('sources', {})
+    errors = [f"{name}: {source['error']}" for name, source in sources.items() if source.get('error')]
+    today_str = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y%m%d')
+    current = bool(sources) and all(sources.get(name, {}).get('version') == today_str for name in MARKET_RISK_LIST_SOURCES)
+    joined = market_risk_index_columns()
+    return {
+        'attention': {
+            code: int(count) for code, count in zip(joined['代號'], joined['_risk_attention']) if count > 0
+        },
+        'disposition': sorted(joined.loc[joined['_risk_disposed'].astype(bool), '代號']),
+        'updated': meta.get('updated') if current else None,
+        'errors': errors,
+    }
+
+
+def _row_risk_list_status(row, code, attention_counts, disposition_codes):
+    """已 join 名單欄位時直接讀欄位，否則退回逐筆查詢傳入的名單。"""
+    joined_attention = row.get('_risk_attention')
+    if joined_attention is not None and not pd.isna(joined_attention):
+        return int(joined_attention), bool(row.get('_risk_disposed', False))
+    attention_counts = attention_counts or {}
+    disposition_codes = disposition_codes if isinstance(disposition_codes, (set, frozenset)) else set(disposition_codes or [])
+    return attention_counts.get(code, 0), code in disposition_codes
+
 
 def _as_float(value, default=None):
     try:
@@ -7853,8 +10698,6 @@ def _as_float(value, default=None):
 
 def calculate_risk_filter_result(row, direction, max_extension_atr, attention_counts=None, disposition_codes=None, market_lists_updated=False, block_attention=True):
     """建立風險篩選預覽資料；不會改寫原本的選股資料或下單行為。"""
-    attention_counts = attention_counts or {}
-    disposition_codes = set(disposition_codes or [])
     code = str(row.get('代號', '')).strip()
     close = _as_float(row.get('收盤價'))
     ma5 = _as_float(row.get('_ma5'))
@@ -7898,8 +10741,7 @@ def calculate_risk_filter_result(row, direction, max_extension_atr, attention_co
         elif (is_long and close_position >= 50) or (not is_long and close_position <= 50):
             candle_score = 10
 
-    attention_count = attention_counts.get(code, 0)
-    is_disposed = code in disposition_codes
+    attention_count, is_disposed = _row_risk_list_status(row, code, attention_counts, disposition_codes)
     if is_disposed:
         risk_label, risk_score = '🚫 處置中', 0
     elif attention_count >= 2:
@@ -8043,8 +10885,6 @@ def calculate_daytrade_metrics(intraday_df, live_snapshot=None, now_tw=None, int
 
 def calculate_daytrade_filter_result(row, direction, attention_counts=None, disposition_codes=None, market_lists_updated=False, block_attention=True):
     """建立當沖用的盤中預覽；分數代表條件一致性，並非交易指令。"""
-    attention_counts = attention_counts or {}
-    disposition_codes = set(disposition_codes or [])
     code = str(row.get('代號', '')).strip()
     is_long = direction == '多頭'
     close = _as_float(row.get('_daytrade_close'))
@@ -8098,8 +10938,7 @@ def calculate_daytrade_filter_result(row, direction, attention_counts=None, disp
     else:
         volume_score = 0
 
-    attention_count = attention_counts.get(code, 0)
-    is_disposed = code in disposition_codes
+    attention_count, is_disposed = _row_risk_list_status(row, code, attention_counts, disposition_codes)
     if is_disposed or attention_count >= 2:
         risk_score = 0
     elif attention_count == 1:
@@ -8151,28 +10990,336 @@ def calculate_daytrade_filter_result(row, direction, attention_counts=None, disp
         'data_time': row.get('_daytrade_data_time')
     }
 
+# 全市場篩選：沿用廣度引擎的「股票 × 交易日」日 K 陣列，一次算出全部上市櫃普通股的
+# 風險／當沖篩選條件；盤中另以分批快照覆寫最後一根日 K，不逐檔呼叫 fetch_stock_data_raw。
+MARKET_SCREENER_SNAPSHOT_BATCH = 500
+MARKET_SCREENER_SESSION_MINUTES = 270
+
+
+def fetch_market_snapshot_frame(api, codes):
+    """以分批快照取得全市場即時成交；不建立串流訂閱，避免超過訂閱上限。"""
+    columns = ['代號', 'close', 'open', 'high', 'low', 'average_price', 'total_volume']
+    if api is None or not codes:
+        return pd.DataFrame(columns=columns)
+    contracts = []
+    for code in codes:
+        try:
+            contract = api.Contracts.Stocks[str(code)]
+        except (KeyError, TypeError, AttributeError):
+            contract = None
+        if contract is not None:
+            contracts.append(contract)
+    records = []
+    for start in range(0, len(contracts), MARKET_SCREENER_SNAPSHOT_BATCH):
+        if start:
+            time.sleep(API_REQUEST_GAP_SECONDS)
+        try:
+            snapshots = api.snapshots(contracts[start:start + MARKET_SCREENER_SNAPSHOT_BATCH]) or []
+        except Exception:
+            continue
+        for snapshot in snapshots:
+            code = str(getattr(snapshot, 'code', '') or '')
+            if code:
+                records.append({'代號': code, **{column: _safe_number(getattr(snapshot, column, None)) for column in columns[1:]}})
+    frame = pd.DataFrame(records, columns=columns)
+    frame = frame[pd.to_numeric(frame['close'], errors='coerce') > 0]
+    return frame.drop_duplicates('代號', keep='last').reset_index(drop=True)
+
+
+def compute_market_screener_metrics(snapshots=None, now_tw=None):
+    """以陣列運算產生與 fetch_stock_data_raw 相同定義的 _ma5／_risk_* 指標，每檔一列。"""
+    engine = load_market_breadth_engine()
+    with engine['lock']:
+        codes = list(engine['codes'])
+        dates = list(engine['dates'])
+        bars = engine['bars']
+        if not codes or not dates:
+            return pd.DataFrame()
+        opens, high, low, close, volume = (bars[field].astype(float) for field in MARKET_BREADTH_FIELDS)
+
+    current = now_tw or datetime.now(pytz.timezone('Asia/Taipei'))
+    today_str = current.strftime('%Y%m%d')
+    live = np.zeros(len(codes), dtype=bool)
+    includes_today = dates[-1] == today_str
+    daytrade = {}
+    if snapshots is not None and not snapshots.empty:
+        rows = snapshots['代號'].astype(str).map(engine['code_index'])
+        matched = rows.notna().to_numpy()
+        positions = rows[matched].astype(int).to_numpy()
+        snap = snapshots.loc[matched]
+        # 與 fetch_stock_data_raw 相同：14:30 前日 K 指標只算到昨日，盤中價格只作為成交價比較。
+        if current.time() >= dt_time(14, 30):
+            includes_today = True
+            if dates[-1] != today_str:
+                opens, high, low, close, volume = (
+                    np.hstack([values, np.full((len(codes), 1), np.nan)]) for values in (opens, high, low, close, volume)
+                )
+            # 快照量為張，日 K 陣列為股。
+            for values, column, scale in (
+                (opens, 'open', 1), (high, 'high', 1), (low, 'low', 1), (close, 'close', 1), (volume, 'total_volume', 1000)
+            ):
+                values[positions, -1] = pd.to_numeric(snap[column], errors='coerce').to_numpy(dtype=float) * scale
+        live[positions] = True
+        for column in ('close', 'open', 'high', 'low', 'average_price', 'total_volume'):
+            daytrade[column] = np.full(len(codes), np.nan)
+            daytrade[column][positions] = pd.to_numeric(snap[column], errors='coerce').to_numpy(dtype=float)
+
+    # 各檔只取自身有成交的交易日，與逐檔下載的日 K 相同；停牌日不會產生 NaN 缺口。
+    valid = np.isfinite(close) & (close > 0)
+    order = np.argsort(~valid, axis=1, kind='stable')
+    counts = valid.sum(axis=1)
+    width = close.shape[1]
+    shift = width - counts
+    gather = (np.arange(width)[None, :] - shift[:, None]) % width
+    packed_order = np.take_along_axis(order, gather, axis=1)
+    packed_mask = np.arange(width)[None, :] >= shift[:, None]
+
+    def _pack(values):
+        packed = np.take_along_axis(values, packed_order, axis=1)
+        return np.where(packed_mask, packed, np.nan)
+
+    close_p, high_p, low_p, open_p, volume_p = (_pack(values) for values in (close, high, low, opens, volume))
+    high_p = np.fmax(high_p, close_p)
+    low_p = np.fmin(low_p, close_p)
+    previous_close = np.hstack([np.full((len(codes), 1), np.nan), close_p[:, :-1]])
+    true_range = np.fmax(high_p - low_p, np.fmax(np.abs(high_p - previous_close), np.abs(low_p - previous_close)))
+
+    def _row_mean(values):
+        finite = np.isfinite(values)
+        total = np.where(finite, values, 0.0).sum(axis=1)
+        count = finite.sum(axis=1)
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        atr14 = np.where(counts >= 2, _row_mean(true_range[:, -14:]), np.nan)
+        ma5 = np.where(counts >= 5, _row_mean(close_p[:, -5:]), np.nan)
+        ma20 = np.where(counts >= 20, _row_mean(close_p[:, -20:]), np.nan)
+        ma20_prior = np.where(counts >= 25, _row_mean(close_p[:, -25:-5]), np.nan)
+        latest_range = high_p[:, -1] - low_p[:, -1]
+        close_position = np.where(latest_range > 0, (close_p[:, -1] - low_p[:, -1]) / latest_range * 100, np.nan)
+        average_volume = _row_mean(volume_p[:, -6:-1] if includes_today else volume_p[:, -5:])
+
+    last_close = close_p[:, -1]
+    if daytrade:
+        last_close = np.where(np.isfinite(daytrade['close']), daytrade['close'], last_close)
+
+    code_name_map, _ = load_local_stock_names()
+    metrics = pd.DataFrame({
+        '代號': codes,
+        '名稱': [code_name_map.get(code, code) for code in codes],
+        '收盤價': last_close,
+        '_ma5': ma5,
+        '_risk_atr14': atr14,
+        '_risk_ma20': ma20,
+        '_risk_ma20_slope': ma20 - ma20_prior,
+        '_risk_close_position': close_position,
+        '_risk_prev_high': np.where(counts >= 2, high_p[:, -2], np.nan),
+        '_risk_prev_low': np.where(counts >= 2, low_p[:, -2], np.nan),
+        '成交量': volume_p[:, -1],
+        '_avg_volume5': average_volume,
+        '_live': live,
+    })
+    if daytrade:
+        session_start = datetime.combine(current.date(), dt_time(9, 0))
+        elapsed = (current.replace(tzinfo=None) - session_start).total_seconds() / 60
+        session_share = min(max(elapsed, 1.0), MARKET_SCREENER_SESSION_MINUTES) / MARKET_SCREENER_SESSION_MINUTES
+        vwap = np.where(daytrade['average_price'] > 0, daytrade['average_price'],
+                        (daytrade['high'] + daytrade['low'] + daytrade['close']) / 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            volume_ratio = np.where(
+                average_volume > 0, daytrade['total_volume'] * 1000 / (average_volume * session_share), np.nan
+            )
+        metrics = metrics.assign(**{
+            '_daytrade_close': daytrade['close'], '_daytrade_open': daytrade['open'],
+            '_daytrade_or_high': daytrade['high'], '_daytrade_or_low': daytrade['low'],
+            '_daytrade_vwap': vwap, '_daytrade_volume_ratio': volume_ratio,
+        })
+    return metrics.dropna(subset=['收盤價']).reset_index(drop=True)
+
+
+def _risk_list_columns(metrics, attention_counts=None, disposition_codes=None):
+    if '_risk_attention' in metrics.columns:
+        return metrics['_risk_attention'].fillna(0).astype(int).to_numpy(), metrics['_risk_disposed'].fillna(False).astype(bool).to_numpy()
+    codes = metrics['代號'].astype(str)
+    attention = codes.map(attention_counts or {}).fillna(0).astype(int).to_numpy()
+    disposed = codes.isin(set(disposition_codes or [])).to_numpy()
+    return attention, disposed
+
+
+def screen_risk_filter_frame(metrics, direction, max_extension_atr, attention_counts=None, disposition_codes=None, market_lists_updated=False, block_attention=True):
+    """calculate_risk_filter_result 的整表版本；欄位與分數規則逐項對應。"""
+    is_long = direction == '多頭'
+    sign = 1.0 if is_long else -1.0
+    close = pd.to_numeric(metrics['收盤價'], errors='coerce').to_numpy(dtype=float)
+    ma5 = pd.to_numeric(metrics['_ma5'], errors='coerce').to_numpy(dtype=float)
+    ma20 = pd.to_numeric(metrics['_risk_ma20'], errors='coerce').to_numpy(dtype=float)
+    slope = pd.to_numeric(metrics['_risk_ma20_slope'], errors='coerce').to_numpy(dtype=float)
+    atr14 = pd.to_numeric(metrics['_risk_atr14'], errors='coerce').to_numpy(dtype=float)
+    close_position = pd.to_numeric(metrics['_risk_close_position'], errors='coerce').to_numpy(dtype=float)
+    previous_high = pd.to_numeric(metrics['_risk_prev_high'], errors='coerce').to_numpy(dtype=float)
+    previous_low = pd.to_numeric(metrics['_risk_prev_low'], errors='coerce').to_numpy(dtype=float)
+    ready = np.isfinite(close) & np.isfinite(ma5) & np.isfinite(ma20) & np.isfinite(atr14) & (atr14 > 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        extension = np.where(ready, sign * (close - ma20) / atr14, np.nan)
+    trend_score = (
+        10 * (sign * (close - ma5) > 0) + 10 * (sign * (close - ma20) > 0)
+        + 10 * (np.isfinite(slope) & (sign * slope > 0))
+    )
+    extension_score = np.select([extension <= 1, extension <= 1.5, extension <= 2], [20, 15, 8], default=0)
+    strong_candle = close_position >= 65 if is_long else close_position <= 35
+    firm_candle = close_position >= 50 if is_long else close_position <= 50
+    candle_score = np.select([strong_candle, firm_candle], [15, 10], default=5)
+
+    attention, disposed = _risk_list_columns(metrics, attention_counts, disposition_codes)
+    risk_score = np.select(
+        [disposed, attention >= 2, attention == 1], [0, 0, 10], default=20 if market_lists_updated else 12
+    )
+    risk_label = np.select(
+        [disposed, attention >= 2, attention == 1],
+        ['🚫 處置中', pd.Series(attention).map(lambda count: f'🔴 注意 {count}').to_numpy(), '🟡 注意 1'],
+        default='🟢 官方名單未列示' if market_lists_updated else '⚪ 未查核'
+    )
+    has_breakout = (np.isfinite(previous_high) & (close > previous_high)) if is_long else (np.isfinite(previous_low) & (close < previous_low))
+    confirmation_score = np.where(has_breakout, 15, 5)
+    score = trend_score + extension_score + candle_score + risk_score + confirmation_score
+    too_extended = extension > max_extension_atr
+    eligible = ~disposed & ((not block_attention) | (attention < 2)) & ~too_extended
+    base_rule = np.where(
+        has_breakout, '突破昨高後站穩' if is_long else '跌破昨低後確認',
+        '回踩 5／10 日線止穩' if is_long else '反彈不過 5／10 日線'
+    )
+    rule = np.select(
+        [disposed, (attention >= 2) & block_attention, attention >= 2, too_extended],
+        ['排除：處置中', '排除：注意累計偏高', '高風險：僅等待確認',
+         f'排除：乖離超過 {_format_compact_number(max_extension_atr, 1)} ATR'],
+        default=base_rule
+    )
+    detail = (
+        '趨勢 ' + pd.Series(trend_score).astype(str) + '/30｜乖離 ' + pd.Series(extension_score).astype(str)
+        + '/20｜K棒 ' + pd.Series(candle_score).astype(str) + '/15｜風險 ' + pd.Series(risk_score).astype(str)
+        + '/20｜確認 ' + pd.Series(confirmation_score).astype(str) + '/15'
+    ).to_numpy()
+    return pd.DataFrame({
+        'score': np.where(ready, score, 0),
+        'risk': np.where(ready, risk_label, '⚪ 資料不足'),
+        'extension': extension,
+        'rule': np.where(ready, rule, '資料不足，維持原判斷'),
+        'eligible': ready & eligible,
+        'detail': np.where(ready, detail, '缺少計算 20 日趨勢或 ATR 所需資料。'),
+    }, index=metrics.index)
+
+
+def screen_daytrade_filter_frame(metrics, direction, attention_counts=None, disposition_codes=None, market_lists_updated=False, block_attention=True):
+    """calculate_daytrade_filter_result 開盤形成中規則的整表版本；全市場只有快照，沒有逐檔分 K 開盤區間。"""
+    is_long = direction == '多頭'
+    sign = 1.0 if is_long else -1.0
+    columns = ['_daytrade_close', '_daytrade_vwap', '_daytrade_or_high', '_daytrade_or_low', '_daytrade_open', '_daytrade_volume_ratio']
+    frame = metrics.reindex(columns=columns).apply(pd.to_numeric, errors='coerce')
+    close, vwap, opening_high, opening_low, open_price, volume_ratio = (frame[column].to_numpy(dtype=float) for column in columns)
+    ready = np.isfinite(close) & np.isfinite(vwap) & np.isfinite(opening_high) & np.isfinite(opening_low)
+    daily_close = pd.to_numeric(metrics['收盤價'], errors='coerce').to_numpy(dtype=float)
+    ma5 = pd.to_numeric(metrics['_ma5'], errors='coerce').to_numpy(dtype=float)
+    ma20 = pd.to_numeric(metrics['_risk_ma20'], errors='coerce').to_numpy(dtype=float)
+    slope = pd.to_numeric(metrics['_risk_ma20_slope'], errors='coerce').to_numpy(dtype=float)
+
+    daily_trend_score = (
+        10 * (sign * (daily_close - ma5) > 0) + 10 * (sign * (daily_close - ma20) > 0)
+        + 5 * (np.isfinite(slope) & (sign * slope > 0))
+    )
+    vwap_aligned = sign * (close - vwap) > 0
+    vwap_score = np.where(vwap_aligned, 25, 0)
+    range_width = np.maximum(opening_high - opening_low, get_tick_size_array(close))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        close_position = (close - opening_low) / range_width
+    open_aligned = np.isfinite(open_price) & (sign * (close - open_price) > 0)
+    near_live_edge = close_position >= 0.70 if is_long else close_position <= 0.30
+    range_broken = open_aligned & near_live_edge
+    range_score = np.select([range_broken, open_aligned], [12, 6], default=0)
+    has_volume = np.isfinite(volume_ratio)
+    volume_score = np.select(
+        [~has_volume, volume_ratio >= 1.5, volume_ratio >= 1.0, volume_ratio >= 0.8], [8, 20, 12, 8], default=0
+    )
+
+    attention, disposed = _risk_list_columns(metrics, attention_counts, disposition_codes)
+    risk_score = np.select(
+        [disposed | (attention >= 2), attention == 1], [0, 7], default=15 if market_lists_updated else 8
+    )
+    score = daily_trend_score + vwap_score + volume_score + range_score + risk_score
+    risk_blocked = disposed | (block_attention & (attention >= 2))
+    volume_ok = ~has_volume | (volume_ratio >= 0.8)
+    eligible = ~risk_blocked & vwap_aligned & range_broken & volume_ok
+    direction_text = '站上' if is_long else '跌破'
+    range_text = '目前開盤高檔' if is_long else '目前開盤低檔'
+    rule = np.select(
+        [risk_blocked, ~vwap_aligned, ~range_broken, ~volume_ok],
+        ['不交易：處置／注意風險', f'觀察：價格需{direction_text} VWAP',
+         f'觀察：需維持 VWAP 並接近{range_text}', '觀察：量能未達近期同時段平均'],
+        default=f'觸發：開盤動能{direction_text} VWAP＋接近{range_text}'
+    )
+    vwap_status = np.select([close > vwap, close < vwap], ['偏多：站上 VWAP', '偏空：跌破 VWAP'], default='中性：貼近 VWAP')
+    detail = (
+        '日 K 趨勢 ' + pd.Series(daily_trend_score).astype(str) + '/25｜VWAP ' + pd.Series(vwap_score).astype(str)
+        + '/25｜量能 ' + pd.Series(volume_score).astype(str) + '/20｜開盤動能 ' + pd.Series(range_score).astype(str)
+        + '/12｜風險 ' + pd.Series(risk_score).astype(str) + '/15｜來源 全市場快照'
+    ).to_numpy()
+    return pd.DataFrame({
+        'score': np.where(ready, score, 0),
+        'rule': np.where(ready, rule, '資料不足：先更新盤中資料'),
+        'eligible': ready & eligible,
+        'vwap_status': np.where(ready, vwap_status, '—'),
+        'detail': np.where(ready, detail, '尚未取得即時串流／分 K、VWAP 或開盤區間資料。'),
+    }, index=metrics.index)
+
+
+def run_market_screener(direction, is_daytrade_mode, max_extension_atr, min_score, market_lists_updated=False, block_attention=True, api=None, limit=50):
+    """全市場排名：通過篩選且分數達門檻者，依分數與成交金額排序；名單風險由索引一次併入。"""
+    engine = load_market_breadth_engine()
+    snapshots = fetch_market_snapshot_frame(api, engine['codes']) if api is not None else None
+    metrics = compute_market_screener_metrics(snapshots)
+    if metrics.empty:
+        return pd.DataFrame(), metrics
+    metrics = join_market_risk_columns(metrics)
+    risk = screen_risk_filter_frame(
+        metrics, direction, max_extension_atr, market_lists_updated=market_lists_updated, block_attention=block_attention
+    )
+    if is_daytrade_mode:
+        result = screen_daytrade_filter_frame(
+            metrics, direction, market_lists_updated=market_lists_updated, block_attention=block_attention
+        )
+        # 與戰略室相同：日 ATR 乖離與官方風險為當沖的盤前門檻。
+        result['eligible'] = result['eligible'] & risk['eligible']
+    else:
+        result = risk
+    ranked = metrics.join(result)
+    ranked['成交金額(億)'] = (ranked['收盤價'] * ranked['成交量'] / 1e8).round(2)
+    ranked = ranked[ranked['eligible'] & (ranked['score'] >= min_score)]
+    ranked = ranked.sort_values(['score', '成交金額(億)'], ascending=[False, False]).head(limit)
+    return ranked.reset_index(drop=True), metrics
+
+
 def build_trade_plan(row, direction, is_daytrade_mode, filter_result):
     """依已通過的篩選條件建立觀察用進場、停損與目標價，不執行下單。"""
+    def _no_plan(detail):
+        return {'summary': '—', 'detail': detail, **{key: None for key in TRADE_PLAN_PRICE_COLUMNS}}
+
     if not filter_result.get('eligible'):
-        return {
-            'summary': '—',
-            'detail': f"未通過條件，不預判點位（{filter_result.get('rule', '資料不足')}）"
-        }
+        return _no_plan(f"未通過條件，不預判點位（{filter_result.get('rule', '資料不足')}）")
 
     is_long = direction == '多頭'
 
     def _round(value):
         return round_to_tick(max(0.01, value))
 
-    def _format_plan(entry, stop, target, trigger_text):
+    def _format_plan(entry, stop, target, trigger_text, trigger_price):
         if is_long and not (stop < entry < target):
-            return {'summary': '—', 'detail': '風險距離不足，不預判點位。'}
+            return _no_plan('風險距離不足，不預判點位。')
         if not is_long and not (target < entry < stop):
-            return {'summary': '—', 'detail': '風險距離不足，不預判點位。'}
-        summary = f"進 {fmt_price(entry)}｜停 {fmt_price(stop)}｜目 {fmt_price(target)}"
+            return _no_plan('風險距離不足，不預判點位。')
         return {
-            'summary': summary,
-            'detail': f"{trigger_text}；預判進場 {fmt_price(entry)}、策略失效離場 {fmt_price(stop)}、第一目標 {fmt_price(target)}（目標距離約為進場至失效點的 1.5 倍）"
+            'summary': format_trade_plan(entry, stop, target),
+            'detail': f"{trigger_text}；預判進場 {fmt_price(entry)}、策略失效離場 {fmt_price(stop)}、第一目標 {fmt_price(target)}（目標距離約為進場至失效點的 1.5 倍）",
+            'entry': entry, 'stop': stop, 'target': target, 'trigger': trigger_price,
         }
 
     if is_daytrade_mode:
@@ -8181,7 +11328,7 @@ def build_trade_plan(row, direction, is_daytrade_mode, filter_result):
         opening_low = _as_float(row.get('_daytrade_or_low'))
         opening_forming = str(row.get('_daytrade_phase', '')) == '開盤形成中'
         if None in (vwap, opening_high, opening_low):
-            return {'summary': '—', 'detail': '缺少 VWAP 或開盤區間，不預判點位。'}
+            return _no_plan('缺少 VWAP 或開盤區間，不預判點位。')
 
         if is_long:
             entry = _round(opening_high + get_tick_size(opening_high))
@@ -8196,7 +11343,7 @@ def build_trade_plan(row, direction, is_daytrade_mode, filter_result):
                 '突破目前開盤高點且維持 VWAP 上方（區間形成中）'
                 if opening_forming else '開盤區間高點突破後，維持 VWAP 上方'
             )
-            return _format_plan(entry, stop, target, trigger)
+            return _format_plan(entry, stop, target, trigger, opening_high)
 
         entry = _round(opening_low - get_tick_size(opening_low))
         stop = _round(min(vwap, opening_high))
@@ -8210,24 +11357,24 @@ def build_trade_plan(row, direction, is_daytrade_mode, filter_result):
             '跌破目前開盤低點且維持 VWAP 下方（區間形成中）'
             if opening_forming else '開盤區間低點跌破後，維持 VWAP 下方'
         )
-        return _format_plan(entry, stop, target, trigger)
+        return _format_plan(entry, stop, target, trigger, opening_low)
 
     atr14 = _as_float(row.get('_risk_atr14'))
     previous_high = _as_float(row.get('_risk_prev_high'))
     previous_low = _as_float(row.get('_risk_prev_low'))
     if atr14 is None or atr14 <= 0 or previous_high is None or previous_low is None:
-        return {'summary': '—', 'detail': '缺少 ATR 或昨高／昨低，不預判次日開盤點位。'}
+        return _no_plan('缺少 ATR 或昨高／昨低，不預判次日開盤點位。')
 
     if is_long:
         entry = _round(previous_high + get_tick_size(previous_high))
         stop = _round(entry - atr14)
         target = _round(entry + (entry - stop) * 1.5)
-        return _format_plan(entry, stop, target, '次日開盤站穩昨高後再觀察進場')
+        return _format_plan(entry, stop, target, '次日開盤站穩昨高後再觀察進場', previous_high)
 
     entry = _round(previous_low - get_tick_size(previous_low))
     stop = _round(entry + atr14)
     target = _round(entry - (stop - entry) * 1.5)
-    return _format_plan(entry, stop, target, '次日開盤跌破昨低後再觀察進場')
+    return _format_plan(entry, stop, target, '次日開盤跌破昨低後再觀察進場', previous_low)
 
 def build_stock_support_resistance(row, is_daytrade_mode=False):
     """沿用已取得的原策略價位，整理出目前價格最近的支撐與壓力。"""
@@ -8267,6 +11414,15 @@ def get_tick_size(price):
     if price < 1000: return 1.0
     return 5.0
 
+def get_tick_size_array(prices):
+    """get_tick_size 的陣列版本，供整表計算價差跳數。"""
+    prices = pd.to_numeric(pd.Series(prices), errors='coerce').to_numpy(dtype=float)
+    valid = ~np.isnan(prices) & (prices > 0)
+    return np.select(
+        [~valid, prices < 10, prices < 50, prices < 100, prices < 500, prices < 1000],
+        [0.01, 0.01, 0.05, 0.1, 0.5, 1.0], default=5.0
+    )
+
 def apply_tick_rules(price):
     try:
         p = float(price)
@@ -8303,6 +11459,22 @@ def calculate_limits(price):
         return float(f"{limit_up:.2f}"), float(f"{limit_down:.2f}")
     except: return 0, 0
 
+def calculate_limits_array(prices):
+    """calculate_limits 的陣列版本；無效參考價回傳 0。
+
+    參考價一律先四捨五入到分，float32 儲存的收盤價（如 32.1 存成 32.0999985）才不會算錯跳動級距。
+    """
+    prices = np.round(np.asarray(prices, dtype=np.float64), 2)
+    valid = np.isfinite(prices) & (prices > 0)
+    raw_up = np.where(valid, prices * 1.10, np.nan)
+    raw_down = np.where(valid, prices * 0.90, np.nan)
+    tick_up = get_tick_size_array(raw_up.ravel()).reshape(prices.shape)
+    tick_down = get_tick_size_array(raw_down.ravel()).reshape(prices.shape)
+    with np.errstate(invalid='ignore'):
+        limit_up = np.round(np.floor(raw_up / tick_up) * tick_up, 2)
+        limit_down = np.round(np.ceil(raw_down / tick_down) * tick_down, 2)
+    return np.where(valid, limit_up, 0.0), np.where(valid, limit_down, 0.0)
+
 def move_tick(price, steps):
     try:
         curr = float(price)
@@ -8317,6 +11489,259 @@ def move_tick(price, steps):
         return curr
     except: return price
 
+# 台股跳動單位級距（下界、上界、跳動單位），供整段價格階梯一次產生。
+TAIWAN_TICK_BANDS = (
+    (-math.inf, 10.0, 0.01), (10.0, 50.0, 0.05), (50.0, 100.0, 0.1),
+    (100.0, 500.0, 0.5), (500.0, 1000.0, 1.0), (1000.0, math.inf, 5.0),
+)
+STOCK_FEE_RATE = 0.001425
+STOCK_TAX_RATE = 0.003
+
+
+def move_tick_ladder(price, tick_count):
+    """回傳 move_tick(price, i)（i 由 +tick_count 到 -tick_count）的整段價格；同一級距內以 arange 一次展開。"""
+    try:
+        start = float(price)
+        tick_count = int(tick_count)
+    except (TypeError, ValueError):
+        return np.array([], dtype=float)
+    if not math.isfinite(start) or tick_count < 0:
+        return np.full(max(tick_count, 0) * 2 + 1, start, dtype=float)
+
+    def walk(direction):
+        values, curr, remaining = [], start, tick_count
+        while remaining > 0:
+            # 向上沿用目前價格的級距；向下與 move_tick 相同，以略低於目前價格的級距判斷。
+            probe = curr if direction > 0 else curr - 0.0001
+            low, high, tick = next(band for band in TAIWAN_TICK_BANDS if probe < band[1])
+            if direction > 0:
+                room = math.ceil(round((high - curr) / tick, 6)) if math.isfinite(high) else remaining
+            else:
+                room = math.floor(round((curr - 0.0001 - low) / tick, 6)) + 1 if math.isfinite(low) else remaining
+            count = max(1, min(remaining, room))
+            segment = np.round(curr + direction * tick * np.arange(1, count + 1), 2)
+            values.append(segment)
+            curr, remaining = float(segment[-1]), remaining - count
+        return np.concatenate(values) if values else np.array([], dtype=float)
+
+    return np.concatenate([walk(1)[::-1], [start], walk(-1)])
+
+
+TICK_GRID_PADDING_TICKS = 100
+
+
+@lru_cache(maxsize=256)
+def get_tick_grid(base_price):
+    """依參考價預先展開跌停到漲停（兩端各多留一段）的所有合法價位，以分為整數單位避免浮點誤差。
+
+    回傳共用的唯讀結構：prices／cents 為遞增價格陣列，base_index 為參考價對齊後的位置，
+    limit_up_index／limit_down_index 為漲跌停所在位置，捲動、跳到漲跌停與標示都只需切片。
+    """
+    try:
+        base = float(base_price)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(base) or base <= 0:
+        return None
+    limit_up, limit_down = calculate_limits(base)
+    anchor = apply_tick_rules(base)
+    low_cents = int(round(limit_down * 100)) - TICK_GRID_PADDING_TICKS * int(round(get_tick_size(limit_down - 0.0001) * 100))
+    high_cents = int(round(limit_up * 100)) + TICK_GRID_PADDING_TICKS * int(round(get_tick_size(limit_up) * 100))
+    segments = []
+    for band_low, band_high, tick in TAIWAN_TICK_BANDS:
+        tick_cents = int(round(tick * 100))
+        start = max(low_cents, 1, int(round(band_low * 100)) if math.isfinite(band_low) else 1)
+        stop = min(high_cents + 1, int(round(band_high * 100)) if math.isfinite(band_high) else high_cents + 1)
+        start = -(-start // tick_cents) * tick_cents
+        if start < stop:
+            segments.append(np.arange(start, stop, tick_cents, dtype=np.int64))
+    cents = np.concatenate(segments) if segments else np.array([], dtype=np.int64)
+    prices = cents / 100
+    cents.flags.writeable = False
+    prices.flags.writeable = False
+    grid = {'cents': cents, 'prices': prices, 'limit_up': limit_up, 'limit_down': limit_down}
+    grid['base_index'] = tick_grid_index(grid, anchor)
+    grid['limit_up_index'] = tick_grid_index(grid, limit_up)
+    grid['limit_down_index'] = tick_grid_index(grid, limit_down)
+    return grid
+
+
+def tick_grid_index(grid, price):
+    """價格在網格中的位置；不在合法價位上（例如手動輸入未對齊的價格）時回傳 None。"""
+    if grid is None or price is None:
+        return None
+    try:
+        cents = int(round(float(price) * 100))
+    except (TypeError, ValueError):
+        return None
+    index = int(np.searchsorted(grid['cents'], cents))
+    return index if index < len(grid['cents']) and grid['cents'][index] == cents else None
+
+
+def shift_tick_price(base_price, price, steps):
+    """move_tick 的網格版本：價格在參考價網格內時直接位移索引，超出範圍才逐檔計算。"""
+    grid = get_tick_grid(base_price)
+    index = tick_grid_index(grid, price)
+    if index is not None and 0 <= index + steps < len(grid['prices']):
+        return float(grid['prices'][index + steps])
+    return move_tick(price, steps)
+
+
+def tick_ladder_prices(base_price, view_price, tick_count):
+    """損益階梯價格（由高到低）；可由參考價網格切片時直接取用，否則退回 move_tick_ladder。"""
+    grid = get_tick_grid(base_price)
+    index = tick_grid_index(grid, view_price)
+    if index is not None and index - tick_count >= 0 and index + tick_count < len(grid['prices']):
+        return grid['prices'][index - tick_count:index + tick_count + 1][::-1]
+    return move_tick_ladder(view_price, tick_count)
+
+
+def calculate_stock_trade_costs(entry_prices, exit_prices, shares, discount, min_fee, is_long=True, day_trade=False):
+    """台股買賣成本的向量化版本；價格、股數、折扣與最低手續費皆可為陣列並自動廣播。
+
+    多方以進場價買進、出場價賣出，空方相反；當沖交易稅減半。回傳各項金額的 numpy 陣列，
+    捨去規則與原本逐筆計算相同（手續費、稅無條件捨去，手續費不低於最低手續費）。
+    """
+    entry, exit_, shares = np.broadcast_arrays(
+        np.asarray(entry_prices, dtype=float), np.asarray(exit_prices, dtype=float), np.asarray(shares, dtype=float),
+    )
+    buy_price, sell_price = (entry, exit_) if is_long else (exit_, entry)
+    tax_rate = STOCK_TAX_RATE / 2 if day_trade else STOCK_TAX_RATE
+    buy_fee = np.maximum(min_fee, np.floor(buy_price * shares * STOCK_FEE_RATE * (np.asarray(discount, dtype=float) / 10)))
+    sell_fee = np.maximum(min_fee, np.floor(sell_price * shares * STOCK_FEE_RATE * (np.asarray(discount, dtype=float) / 10)))
+    tax = np.floor(sell_price * shares * tax_rate)
+    cost = (buy_price * shares) + buy_fee
+    income = (sell_price * shares) - sell_fee - tax
+    profit = income - cost
+    notional = entry * shares
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi = np.where(notional != 0, (profit / notional) * 100, 0.0)
+    return {
+        'shares': shares, 'buy_price': buy_price, 'sell_price': sell_price, 'buy_fee': buy_fee, 'sell_fee': sell_fee,
+        'tax': tax, 'total_fee': buy_fee + sell_fee, 'cost': cost, 'income': income,
+        'profit': profit, 'roi': roi,
+    }
+
+
+def calculate_swing_trade_costs(entry_prices, exit_prices, shares, discount, min_fee, swing_type,
+                                margin_ratio=0.0, annual_rate=0.0, days=1, short_fee_rate=0.0):
+    """波段現股、融資、融券損益的向量化版本；利息、借券費與維持率算法同波段信用室。"""
+    costs = calculate_stock_trade_costs(
+        entry_prices, exit_prices, shares, discount, min_fee, is_long=swing_type != "融券(空)",
+    )
+    shares = costs['shares']
+    value_buy = costs['buy_price'] * shares
+    value_sell = costs['sell_price'] * shares
+    zeros = np.zeros(value_buy.shape)
+    interest, borrow_fee, maintenance_ratio, call_price = zeros.copy(), zeros.copy(), zeros.copy(), zeros.copy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if swing_type == "融資(多)":
+            margin_loan = np.floor(value_buy * (margin_ratio / 100) / 1000) * 1000
+            self_prepare = value_buy - margin_loan + costs['buy_fee']
+            interest = np.round(margin_loan * (annual_rate / 100) * (days / 365))
+            net_sell = value_sell - costs['sell_fee'] - costs['tax'] - margin_loan - interest
+            profit = net_sell - self_prepare
+            maintenance_ratio = np.where(margin_loan > 0, (value_sell / margin_loan) * 100, 0.0)
+            call_price = np.where(margin_loan > 0, (margin_loan * 1.3) / shares, 0.0)
+            roi = np.where(self_prepare > 0, profit / self_prepare * 100, 0.0)
+        elif swing_type == "融券(空)":
+            margin_deposit = np.ceil(value_sell * (margin_ratio / 100) / 100) * 100
+            borrow_fee = np.floor(value_sell * (short_fee_rate / 10000))
+            sell_guaranty = value_sell - costs['sell_fee'] - costs['tax'] - borrow_fee
+            interest = np.round((margin_deposit + sell_guaranty) * (annual_rate / 100) * (days / 365))
+            refund = margin_deposit + sell_guaranty + interest - (value_buy + costs['buy_fee'])
+            profit = refund - margin_deposit
+            maintenance_ratio = np.where(value_buy > 0, ((margin_deposit + sell_guaranty) / value_buy) * 100, 0.0)
+            call_price = np.where(shares > 0, (margin_deposit + sell_guaranty) / (1.3 * shares), 0.0)
+            roi = np.where(margin_deposit > 0, profit / margin_deposit * 100, 0.0)
+        else:
+            profit = costs['profit']
+            roi = np.where(costs['cost'] > 0, profit / costs['cost'] * 100, 0.0)
+    costs.update({
+        'profit': profit, 'roi': roi, 'interest': interest, 'borrow_fee': borrow_fee,
+        'maintenance_ratio': maintenance_ratio, 'call_price': call_price,
+    })
+    return costs
+
+
+def calculate_derivative_trade_costs(entry_price, exit_price, multiplier, lots, fee_per_side, tax_rate, is_long=True):
+    """期貨／選擇權單筆損益：期交稅買賣兩邊各自四捨五入（銀行家捨入，同 round）。"""
+    entry = np.asarray(entry_price, dtype=float)
+    exit_ = np.asarray(exit_price, dtype=float)
+    points = (exit_ - entry) if is_long else (entry - exit_)
+    gross = points * multiplier * lots
+    tax = np.round(entry * multiplier * tax_rate) * lots + np.round(exit_ * multiplier * tax_rate) * lots
+    fee = fee_per_side * 2 * lots
+    return {'points': points, 'gross': gross, 'tax': tax, 'fee': fee, 'net': gross - tax - fee}
+
+
+def _format_tick_diff(diff):
+    diff_str = f"{diff:+.2f}".rstrip('0').rstrip('.') if diff != 0 else "0"
+    if diff > 0 and not diff_str.startswith('+'):
+        diff_str = "+" + diff_str
+    return diff_str
+
+
+def build_daytrade_pnl_ladder(base_price, view_price, tick_count, shares, discount, min_fee, is_long):
+    """當沖損益階梯：價格、費用與損益整段向量化計算，只在輸出文字欄位時逐列格式化。"""
+    prices = tick_ladder_prices(base_price, view_price, tick_count)
+    costs = calculate_stock_trade_costs(
+        base_price, prices, shares, discount, min_fee, is_long=is_long, day_trade=True,
+    )
+    grid = get_tick_grid(base_price)
+    limit_up, limit_down = (grid['limit_up'], grid['limit_down']) if grid else calculate_limits(base_price)
+    diffs = prices - base_price
+    note_type = np.where(np.abs(prices - limit_up) < 0.001, "up", np.where(np.abs(prices - limit_down) < 0.001, "down", ""))
+    return pd.DataFrame({
+        "成交價": [fmt_price(price) for price in prices],
+        "漲跌": [_format_tick_diff(diff) for diff in diffs],
+        "預估損益": costs['profit'].astype(int),
+        "報酬率%": [f"{_format_compact_number(roi, 2, signed=True)}%" for roi in costs['roi']],
+        "手續費": costs['total_fee'].astype(int),
+        "交易稅": costs['tax'].astype(int),
+        "_profit": costs['profit'],
+        "_note_type": note_type,
+        "_is_base": np.abs(diffs) < 0.001,
+    })
+
+
+def build_swing_pnl_ladder(base_price, view_price, tick_count, shares, discount, min_fee, swing_type,
+                           margin_ratio, annual_rate, days, short_fee_rate):
+    """波段信用損益階梯；融資券欄位（借券費、利息、維持率、強制回補價）依交易選項附加。"""
+    prices = tick_ladder_prices(base_price, view_price, tick_count)
+    costs = calculate_swing_trade_costs(
+        base_price, prices, shares, discount, min_fee, swing_type,
+        margin_ratio=margin_ratio, annual_rate=annual_rate, days=days, short_fee_rate=short_fee_rate,
+    )
+    diffs = prices - base_price
+    ladder = pd.DataFrame({
+        "成交價": [fmt_price(price) for price in prices],
+        "漲跌": [_format_tick_diff(diff) for diff in diffs],
+        "預估損益": costs['profit'].astype(int),
+        "報酬率%": [f"{_format_compact_number(roi, 2, signed=True)}%" for roi in costs['roi']],
+        "手續費": costs['total_fee'].astype(int),
+        "交易稅": costs['tax'].astype(int),
+    })
+    is_credit = swing_type in ["融資(多)", "融券(空)"]
+    if is_credit:
+        if swing_type == "融券(空)":
+            ladder["借券費"] = costs['borrow_fee'].astype(int)
+        ladder["利息"] = costs['interest'].astype(int)
+        ladder["維持率%"] = [
+            f"{_format_compact_number(ratio, 1)}%" if ratio > 0 else "-" for ratio in costs['maintenance_ratio']
+        ]
+        ladder["強制回補價"] = [
+            _format_compact_number(price, 2) if price > 0 else "-" for price in costs['call_price']
+        ]
+    ladder["_profit"] = costs['profit']
+    ladder["_is_base"] = np.abs(diffs) < 0.001
+    ladder["_call"] = (
+        (costs['maintenance_ratio'] > 0) & (costs['maintenance_ratio'] < 130) if is_credit
+        else np.zeros(len(prices), dtype=bool)
+    )
+    return ladder
+
+
 def apply_sr_rules(price, base_price):
     try:
         p = float(price)
@@ -8346,6 +11771,15 @@ def calculate_note_width(series, font_size):
     pixel_width = int(max_w * (font_size * 0.44))
     return max(50, pixel_width)
 
+@lru_cache(maxsize=4096)
+def strategy_note_levels(note_text):
+    """戰略備註內的價位只在備註文字改變時解析一次，盤中重算狀態直接重用。"""
+    levels = []
+    for found_price in re.findall(r'\d+\.?\d*', str(note_text or '')):
+        try: levels.append(float(found_price))
+        except ValueError: pass
+    return tuple(levels)
+
 def recalculate_row(row, points_map):
     # 股票戰略室改以成交價作為唯一計算基準，不再使用舊版自訂價。
     custom_price = row.get('收盤價')
@@ -8364,11 +11798,7 @@ def recalculate_row(row, points_map):
         if isinstance(points, list):
             for p in points: strat_values.append(p['val'])
             
-        note_text = str(row.get('戰略備註', ''))
-        found_prices = re.findall(r'\d+\.?\d*', note_text)
-        for fp in found_prices:
-            try: strat_values.append(float(fp))
-            except: pass
+        strat_values.extend(strategy_note_levels(str(row.get('戰略備註', ''))))
             
         if l_up is not None and abs(price - l_up) < 0.01: status = "漲停"
         elif l_down is not None and abs(price - l_down) < 0.01: status = "跌停"
@@ -8774,8 +12204,7 @@ def refresh_risk_metrics_for_codes(stock_data, futures_set, saved_notes_dict, na
             pass
         return code, None
 
-    with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-        results = list(executor.map(fetch_metrics, tasks))
+    results = map_analysis_jobs(fetch_metrics, tasks)
 
     refreshed = stock_data.copy()
     updated_count = 0
@@ -8853,8 +12282,7 @@ def refresh_daytrade_metrics_for_codes(stock_data, sj_logged_in=False, sj_api=No
         except Exception:
             return code, None
 
-    with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-        results = list(executor.map(fetch_metrics, codes))
+    results = map_analysis_jobs(fetch_metrics, codes)
 
     refreshed = stock_data.copy()
     updated_count = 0
@@ -8911,11 +12339,10 @@ if 'pending_unignore' in st.session_state and st.session_state.pending_unignore:
                 if res: res.update({'_source': t_src, '_order': t_ord, '_source_rank': t_rnk})
                 return res
                 
-            with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-                results = list(executor.map(_fetch_worker, fetch_tasks))
-                valid_results = [r for r in results if r]
-                if valid_results:
-                    st.session_state.stock_data = pd.concat([st.session_state.stock_data, pd.DataFrame(valid_results)], ignore_index=True)
+            results = map_analysis_jobs(_fetch_worker, fetch_tasks)
+            valid_results = [r for r in results if r]
+            if valid_results:
+                st.session_state.stock_data = pd.concat([st.session_state.stock_data, pd.DataFrame(valid_results)], ignore_index=True)
 
         if not st.session_state.stock_data.empty and '_source_rank' in st.session_state.stock_data.columns:
             st.session_state.stock_data = st.session_state.stock_data.sort_values(by=['_source_rank', '_order']).reset_index(drop=True)
@@ -8928,6 +12355,247 @@ if 'pending_unignore' in st.session_state and st.session_state.pending_unignore:
 # 強制釋放不再使用的記憶體與執行緒資源
 gc.collect()
 
+LIVE_VIEW_REFRESH_SECONDS = 0.8
+LIVE_VIEW_PERSIST_SECONDS = 30
+
+
+def resolve_stock_room_contract(api, code):
+    """解析股票戰略室代號對應的 Shioaji 契約；TWF=F／TMF=F 對應臺指近月與微臺連續。"""
+    code = str(code)
+    try:
+        if code == "TWF=F":
+            return min(
+                [c for c in api.Contracts.Futures.TXF if c.code[-2:] not in ["R1", "R2"] and '/' not in c.code],
+                key=lambda c: getattr(c, 'delivery_date', '999999')
+            )
+        if code == "TMF=F":
+            return api.Contracts.Futures.TMF.TMFR1
+        return api.Contracts.Stocks[code]
+    except Exception:
+        return None
+
+
+def apply_stock_stream_quote(stock_data, index, quote, points_map, quote_time):
+    """把一筆串流報價寫回股票戰略室列並重算狀態；無有效成交價時不變更。"""
+    price = _safe_number(getattr(quote, 'close', None))
+    if price is None or price <= 0:
+        return False
+    change_rate = snapshot_change_rate(quote, price)
+    stock_data.at[index, '收盤價'] = price
+    if change_rate is not None:
+        stock_data.at[index, '漲跌幅'] = change_rate
+    stock_data.at[index, '成交價價差'] = price_change_amount(price, change_rate)
+    stock_data.at[index, '_quote_bid'] = _safe_number(getattr(quote, 'buy_price', None))
+    stock_data.at[index, '_quote_ask'] = _safe_number(getattr(quote, 'sell_price', None))
+    stock_data.at[index, '_quote_time'] = quote_time
+    stock_data.at[index, '狀態'] = recalculate_row(stock_data.loc[index], points_map)
+    return True
+
+
+def get_live_view_contracts(scope, api, keys, resolver):
+    """即時看板的契約只在登入期間解析一次，之後每個 tick 只讀串流快取。"""
+    registry = st.session_state.setdefault('_live_view_contracts', {})
+    bucket = registry.get(scope)
+    if bucket is None or bucket.get('api') is not api:
+        bucket = {'api': api, 'contracts': {}}
+        registry[scope] = bucket
+    contracts = bucket['contracts']
+    for key in keys:
+        if key not in contracts:
+            contracts[key] = resolver(key)
+    return {key: contracts[key] for key in keys if contracts.get(key) is not None}
+
+
+def diff_stream_quotes(api, contracts, displayed):
+    """比對串流報價與畫面上次顯示的值，只回傳成交價／買賣價／量有變動的項目。"""
+    keys = list(contracts)
+    if not keys:
+        return {}
+    try:
+        quotes = get_stream_quotes(api, [contracts[key] for key in keys])
+    except Exception:
+        return {}
+    changed = {}
+    for key, quote in zip(keys, quotes):
+        if quote is None:
+            continue
+        signature = tuple(
+            _safe_number(getattr(quote, field, None))
+            for field in ('close', 'buy_price', 'sell_price', 'total_volume')
+        )
+        if signature[0] is None or signature[0] <= 0 or displayed.get(key) == signature:
+            continue
+        displayed[key] = signature
+        changed[key] = quote
+    return changed
+
+
+def _live_view_flash(changed_keys, key_column, flash_columns):
+    def style_row(row):
+        flashing = str(row.get(key_column)) in changed_keys
+        return [
+            'background-color: rgba(255, 193, 7, 0.28); font-weight: bold;'
+            if flashing and column in flash_columns else ''
+            for column in row.index
+        ]
+    return style_row
+
+
+def _live_view_due_for_persist(scope):
+    last_saved = st.session_state.setdefault('_live_view_persisted_at', {})
+    now_mono = time.monotonic()
+    if now_mono - last_saved.get(scope, 0) < LIVE_VIEW_PERSIST_SECONDS:
+        return False
+    last_saved[scope] = now_mono
+    return True
+
+
+@st.fragment(run_every=LIVE_VIEW_REFRESH_SECONDS)
+def render_stock_live_view(points_map):
+    """股票即時看板：比對串流報價，只改寫有變動的列與狀態，不重跑整頁。"""
+    api = st.session_state.get('sj_api')
+    if not st.session_state.get('sj_logged_in', False) or api is None:
+        st.caption("⚡ 即時看板需先登入永豐 API。")
+        return
+    stock_data = st.session_state.get('stock_data')
+    if not isinstance(stock_data, pd.DataFrame) or stock_data.empty or '代號' not in stock_data.columns:
+        return
+
+    codes = stock_data['代號'].astype(str).tolist()
+    contracts = get_live_view_contracts(
+        'stock', api, codes, lambda code: resolve_stock_room_contract(api, code)
+    )
+    displayed = st.session_state.setdefault('_live_view_stock_displayed', {})
+    changed = diff_stream_quotes(api, contracts, displayed)
+    changed_codes = set()
+    if changed:
+        row_lookup = dict(zip(codes, stock_data.index))
+        quote_time = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S')
+        for code, quote in changed.items():
+            index = row_lookup.get(code)
+            if index is not None and apply_stock_stream_quote(stock_data, index, quote, points_map, quote_time):
+                changed_codes.add(code)
+        if changed_codes:
+            st.session_state.last_rt_update_time = quote_time
+            st.session_state._live_view_stock_dirty = True
+    # 串流 tick 只改記憶體中的表格；寫檔與訊號追蹤最多每 30 秒一次。
+    if st.session_state.get('_live_view_stock_dirty') and _live_view_due_for_persist('stock'):
+        st.session_state._live_view_stock_dirty = False
+        update_strategy_signal_outcomes({
+            code: _safe_number(price) for code, price in zip(codes, stock_data['收盤價'])
+        })
+        save_data_cache(
+            stock_data, st.session_state.ignored_stocks,
+            st.session_state.all_candidates, st.session_state.saved_notes
+        )
+
+    board = pd.DataFrame({
+        '代號': codes,
+        '名稱': stock_data.get('名稱', pd.Series('', index=stock_data.index)).astype(str).tolist(),
+        '成交價': stock_data['收盤價'].apply(fmt_price).tolist(),
+        '漲跌幅': stock_data.get('漲跌幅', pd.Series(None, index=stock_data.index)).apply(_signed_percent).tolist(),
+        '買價': stock_data.get('_quote_bid', pd.Series(None, index=stock_data.index)).apply(fmt_price).tolist(),
+        '賣價': stock_data.get('_quote_ask', pd.Series(None, index=stock_data.index)).apply(fmt_price).tolist(),
+        '狀態': stock_data.get('狀態', pd.Series('', index=stock_data.index)).fillna('').astype(str).tolist(),
+    })
+    st.dataframe(
+        board.style.apply(_live_view_flash(changed_codes, '代號', ('成交價', '漲跌幅', '買價', '賣價', '狀態')), axis=1),
+        hide_index=True, width='stretch', row_height=28,
+    )
+    st.caption(
+        f"⚡ 串流即時看板｜已訂閱 {len(contracts)}/{len(codes)} 檔｜本次變動 {len(changed_codes)} 檔｜"
+        f"最後報價 {st.session_state.get('last_rt_update_time', '—')}；主表於下次操作時同步。"
+    )
+
+
+@st.fragment(run_every=LIVE_VIEW_REFRESH_SECONDS)
+def render_futures_live_view(display_rows, strategy_mode, market_bias, enhanced_layer):
+    """期貨即時看板：只把有變動的契約寫回並重算訊號狀態，不重抓 K 棒也不重跑整頁。"""
+    api = st.session_state.get('sj_api')
+    if not st.session_state.get('sj_logged_in', False) or api is None:
+        st.caption("⚡ 即時看板需先登入永豐 Shioaji。")
+        return
+    if display_rows.empty:
+        return
+
+    keys = display_rows['契約鍵'].astype(str).tolist()
+    signature = (tuple(keys), strategy_mode, market_bias, enhanced_layer)
+    board_state = st.session_state.get('_live_view_futures_board')
+    if not board_state or board_state.get('signature') != signature:
+        board_state = {'signature': signature, 'rows': display_rows.copy(), 'displayed': {}}
+        st.session_state._live_view_futures_board = board_state
+    rows = board_state['rows']
+    contract_specs = dict(zip(keys, zip(rows['期貨代碼'], rows['契約月份'])))
+    contracts = get_live_view_contracts(
+        'futures', api, keys,
+        lambda key: resolve_shioaji_futures_contract(api, *contract_specs[key])
+    )
+    changed = diff_stream_quotes(api, contracts, board_state['displayed'])
+    changed_keys = set()
+    if changed:
+        row_lookup = dict(zip(keys, rows.index))
+        quote_time = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S')
+        live_cache = st.session_state.futures_strategy_live_cache
+        for key, quote in changed.items():
+            index = row_lookup.get(key)
+            price = _safe_number(getattr(quote, 'close', None))
+            if index is None or price is None:
+                continue
+            change_rate = snapshot_change_rate(quote, price)
+            patch = {
+                '收盤價': price,
+                '漲跌幅': change_rate if change_rate is not None else rows.at[index, '漲跌幅'],
+                '當日高': _safe_number(getattr(quote, 'high', None), rows.at[index, '當日高']),
+                '當日低': _safe_number(getattr(quote, 'low', None), rows.at[index, '當日低']),
+                '當日成交口數': int(_safe_number(getattr(quote, 'total_volume', None), rows.at[index, '當日成交口數']) or 0),
+                '買價': _safe_number(getattr(quote, 'buy_price', None)),
+                '賣價': _safe_number(getattr(quote, 'sell_price', None)),
+                '報價時間': quote_time,
+            }
+            for column, value in patch.items():
+                rows.at[index, column] = value
+            live_cache.setdefault(key, {}).update(patch)
+            changed_keys.add(key)
+        if changed_keys and enhanced_layer:
+            changed_index = [row_lookup[key] for key in changed_keys]
+            refreshed = enrich_futures_strategy_rows(rows.loc[changed_index], strategy_mode, market_bias)
+            for column in refreshed.columns.difference(rows.columns):
+                rows[column] = None
+            rows.loc[changed_index, refreshed.columns] = refreshed
+        if changed_keys:
+            st.session_state.futures_strategy_live_time = quote_time
+            st.session_state._live_view_futures_dirty = True
+    if st.session_state.get('_live_view_futures_dirty') and _live_view_due_for_persist('futures'):
+        st.session_state._live_view_futures_dirty = False
+        update_strategy_signal_outcomes({
+            key: _safe_number(price) for key, price in zip(keys, rows['收盤價'])
+        })
+
+    board_columns = ['期貨代碼', '契約月份', '名稱', '方向', '收盤價', '漲跌幅', '買價', '賣價', '當日成交口數']
+    if enhanced_layer:
+        board_columns += ['訊號狀態', '信心分', '資料狀態']
+    board = rows.reindex(columns=['契約鍵'] + board_columns).copy()
+    board['收盤價'] = board['收盤價'].apply(fmt_price)
+    board['漲跌幅'] = board['漲跌幅'].apply(_signed_percent)
+    board['買價'] = board['買價'].apply(fmt_price)
+    board['賣價'] = board['賣價'].apply(fmt_price)
+    flash_columns = ('收盤價', '漲跌幅', '買價', '賣價', '當日成交口數', '訊號狀態', '信心分')
+    st.dataframe(
+        board.style.apply(_live_view_flash(changed_keys, '契約鍵', flash_columns), axis=1),
+        hide_index=True, width='stretch', row_height=28,
+        column_order=board_columns,
+        column_config={
+            '收盤價': st.column_config.TextColumn('成交價'),
+            '當日成交口數': st.column_config.NumberColumn(format='%d'),
+            '信心分': st.column_config.ProgressColumn('進場信心', min_value=0, max_value=100, format='%d'),
+        },
+    )
+    st.caption(
+        f"⚡ 串流即時看板｜已訂閱 {len(contracts)}/{len(keys)} 個契約｜本次變動 {len(changed_keys)} 個｜"
+        f"最後報價 {st.session_state.get('futures_strategy_live_time') or '—'}；支撐壓力仍以『即時更新報價與分析』重算。"
+    )
+
+
 def render_futures_strategy_room():
     """期貨成交量排行、即時分析、忽略遞補與獨立計算介面。"""
     persisted_futures_state = load_futures_strategy_state()
@@ -9209,7 +12877,9 @@ def render_futures_strategy_room():
         cached = cache.get(contract_key)
         if cached:
             for column, value in cached.items():
-                if column in display_rows.columns or column in ('支撐壓力', '進出場點位', '方向', '觸發條件', '實際契約'):
+                if column in display_rows.columns or column in (
+                    '支撐壓力', '進出場點位', '方向', '觸發條件', '實際契約', *TRADE_PLAN_PRICE_COLUMNS.values()
+                ):
                     display_rows.at[index, column] = value
         if not cached or cached.get('_策略週期') != strategy_mode or cached.get('_分析方向') != direction_choice:
             analysis = calculate_futures_strategy_levels(display_rows.loc[index], strategy_mode, direction_choice)
@@ -9428,13 +13098,14 @@ def render_futures_strategy_room():
         if record_futures_signals:
             records = []
             for _, row in display_rows[display_rows['_附加可記錄'] == True].iterrows():
-                plan = parse_trade_plan_numbers(row.get('進出場點位'))
+                plan = trade_plan_record(row)
                 records.append({
                     '市場': '期貨', '商品鍵': str(row['契約鍵']), '代碼': str(row['期貨代碼']),
                     '名稱': str(row['名稱']), '策略': strategy_mode, '方向': str(row.get('方向', '')),
                     '訊號狀態': str(row.get('訊號狀態', '')), '評分': _safe_number(row.get('信心分')),
                     '信心判讀': str(row.get('信心判讀', '')),
                     '進場價': plan['entry'], '停損價': plan['stop'], '目標價': plan['target'],
+                    '觸發價': plan['trigger'],
                     '最新價': _safe_number(row.get('收盤價')),
                     '風險': str(row.get('可交易性', '')), '資料狀態': str(row.get('資料狀態', '')),
                 })
@@ -9448,6 +13119,12 @@ def render_futures_strategy_room():
             else:
                 st.error('訊號紀錄儲存失敗，請確認檔案是否可寫入。')
 
+    if not display_rows.empty and st.toggle(
+        "⚡ 串流即時看板", key='futures_live_view_enabled',
+        help='開啟後每秒比對 Shioaji 串流報價，只更新有變動契約的成交價、買賣價與訊號狀態；不重抓 K 棒、不重跑整頁。'
+    ):
+        render_futures_live_view(display_rows, strategy_mode, market_bias, enhanced_layer)
+
     if refresh_live:
         refresh_futures_live_data()
 
@@ -9534,1372 +13211,1603 @@ def render_futures_strategy_room():
         )
 
 # ==========================================
-# 主介面 (Tabs)
+# 行事曆偏好與自訂事件（行事曆、公司財報分頁共用，需在分頁外初始化）
+# ==========================================
+CAL_OVERRIDE_FILE = "cal_override.json"
+CAL_PREFERENCES_FILE = "cal_preferences.json"
+CALENDAR_EVENT_OPTIONS = [
+    "台股開休市",
+    "台股突發休市公告",
+    "FOMC 利率決議",
+    "美國 CPI",
+    "美國大非農",
+    "美國小非農 ADP",
+    "美國初領失業金",
+    "指定股票財報",
+    "台股月營收",
+    "美股季度／年度營收",
+]
+US_HIGH_IMPACT_EVENTS = [
+    "FOMC 利率決議", "美國 CPI", "美國大非農", "美國小非農 ADP", "美國初領失業金"
+]
+US_HIGH_IMPACT_DESCRIPTIONS = {
+    "FOMC 利率決議": "聯準會利率決策與政策聲明",
+    "美國 CPI": "消費者物價指數，觀察通膨",
+    "美國大非農": "非農就業人數與失業率",
+    "美國小非農 ADP": "ADP 民間就業預估",
+    "美國初領失業金": "每週首次申請失業救濟人數",
+}
+TAIWAN_COMPANY_GROUP = "台股公司營收與財報"
+US_COMPANY_GROUP = "美股公司營收與財報"
+CALENDAR_GROUP_OPTIONS = [
+    "台股市場與休市", "美國高影響總經", TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP
+]
+CALENDAR_GROUP_EVENTS = {
+    "台股市場與休市": ["台股開休市", "台股突發休市公告"],
+    "美國高影響總經": US_HIGH_IMPACT_EVENTS,
+    TAIWAN_COMPANY_GROUP: ["台股公司財報", "台股月營收"],
+    US_COMPANY_GROUP: ["美股公司財報", "美股季度／年度營收"],
+}
+
+def normalize_calendar_preferences(saved=None):
+    """將檔案或既有 Streamlit session 的舊版事件設定升級為目前格式。"""
+    default_preferences = {
+        "groups": CALENDAR_GROUP_OPTIONS.copy(),
+        "macro_events": US_HIGH_IMPACT_EVENTS.copy(),
+        "tickers": "2330.TW",
+    }
+    if not isinstance(saved, dict):
+        return default_preferences
+
+    raw_groups = saved.get("groups", [])
+    if isinstance(raw_groups, str):
+        raw_groups = [raw_groups]
+    migrated_groups = []
+    for item in raw_groups if isinstance(raw_groups, (list, tuple, set)) else []:
+        if item in {"個股財報與營收", "公司財報／營收摘要"}:
+            migrated_groups.extend([TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP])
+        else:
+            migrated_groups.append(item)
+    raw_groups = migrated_groups
+    groups = [
+        item for item in raw_groups
+        if isinstance(item, str) and item in CALENDAR_GROUP_OPTIONS
+    ] if isinstance(raw_groups, (list, tuple, set)) else []
+    if not groups:
+        legacy_events = saved.get("events", [])
+        if isinstance(legacy_events, str):
+            legacy_events = [legacy_events]
+        legacy_events = {
+            item for item in legacy_events if isinstance(item, str)
+        } if isinstance(legacy_events, (list, tuple, set)) else set()
+        groups = [
+            group for group, events in CALENDAR_GROUP_EVENTS.items()
+            if legacy_events.intersection(events)
+        ] or CALENDAR_GROUP_OPTIONS.copy()
+
+    raw_macro_events = saved.get("macro_events", saved.get("events", []))
+    if isinstance(raw_macro_events, str):
+        raw_macro_events = [raw_macro_events]
+    macro_events = [
+        item for item in US_HIGH_IMPACT_EVENTS if item in set(raw_macro_events or [])
+    ]
+    if not macro_events:
+        macro_events = US_HIGH_IMPACT_EVENTS.copy()
+    tickers = saved.get("tickers", default_preferences["tickers"])
+    if tickers is None:
+        tickers = default_preferences["tickers"]
+    return {"groups": groups, "macro_events": macro_events, "tickers": str(tickers)}
+
+def calendar_event_types(groups, macro_events):
+    """依追蹤類別與總經勾選展開實際要呈現的事件名稱。"""
+    event_types = []
+    for group in groups:
+        if group != "美國高影響總經":
+            event_types.extend(CALENDAR_GROUP_EVENTS.get(group, []))
+    event_types.extend(macro_events)
+    return event_types
+
+def load_calendar_preferences():
+    saved = read_pending_json(CAL_PREFERENCES_FILE)
+    if saved is None:
+        return normalize_calendar_preferences()
+    return normalize_calendar_preferences(saved)
+
+def save_calendar_preferences(groups, macro_events, tickers, events):
+    queue_json_file_write(CAL_PREFERENCES_FILE, {
+        "groups": list(groups),
+        "macro_events": list(macro_events),
+        "events": copy.deepcopy(events),
+        "tickers": tickers,
+        "calendar_events_version": 4,
+    }, indent=2)
+
+def load_cal_overrides():
+    try:
+        saved = read_pending_json(CAL_OVERRIDE_FILE)
+        if saved is not None:
+            df = pd.DataFrame(saved)
+            if not df.empty and "日期" in df.columns:
+                df["日期"] = pd.to_datetime(df["日期"], errors='coerce').dt.date
+                return df
+    except: pass
+    
+    # 預設給予一列空白資料，並確保日期欄位擁有正確的空值型別 (NaT)
+    df = pd.DataFrame([{"日期": pd.NaT, "事件名稱": "", "文字顏色": "白色"}])
+    df["日期"] = pd.to_datetime(df["日期"], errors='coerce').dt.date
+    return df
+    
+def save_cal_overrides(df):
+    try:
+        # 確保日期格式為字串以利 JSON 儲存
+        df_save = df.copy()
+        df_save['日期'] = df_save['日期'].astype(str)
+        queue_json_file_write(CAL_OVERRIDE_FILE, lambda: json.loads(df_save.to_json(orient="records", force_ascii=False)))
+    except: pass
+
+if 'cal_overrides' not in st.session_state:
+    st.session_state.cal_overrides = load_cal_overrides()
+if 'calendar_preferences' not in st.session_state:
+    st.session_state.calendar_preferences = load_calendar_preferences()
+else:
+    # Streamlit Cloud 部署新版程式時會沿用既有 session，需在讀取欄位前即時遷移。
+    st.session_state.calendar_preferences = normalize_calendar_preferences(
+        st.session_state.calendar_preferences
+    )
+if "company_event_snapshot" not in st.session_state:
+    st.session_state.company_event_snapshot = load_company_event_snapshot()
+
+# ==========================================
+# 分頁導覽：只執行開啟中的畫面，並在背景預抓相鄰畫面的公開資料
 # ==========================================
-tab1, tab_fibo, tab2, tab_db, tab_company, tab3 = st.tabs([
+WORKSPACE_TAB_LABELS = [
     "⚡ 股期戰略室 ⚡",
     "📈 指數操盤室",
     "💰 交易損益室 💰",
     "📚 戰略資料庫",
     "🏢 公司財報與營收",
     "📅 股市行事曆",
-])
+]
+# 使用者最可能接著切換的分頁；只預抓不依賴 session 的 cache_data 來源。
+WORKSPACE_PREFETCH_NEIGHBOURS = {
+    "⚡ 股期戰略室 ⚡": ("📈 指數操盤室", "💰 交易損益室 💰"),
+    "📈 指數操盤室": ("⚡ 股期戰略室 ⚡", "💰 交易損益室 💰"),
+    "💰 交易損益室 💰": ("⚡ 股期戰略室 ⚡", "📈 指數操盤室"),
+    "📚 戰略資料庫": ("⚡ 股期戰略室 ⚡", "📈 指數操盤室"),
+    "🏢 公司財報與營收": ("📅 股市行事曆",),
+    "📅 股市行事曆": ("📚 戰略資料庫",),
+}
+WORKSPACE_PREFETCH_TTL_SECONDS = 300
+
+
+def _run_workspace_prefetch(func, *args):
+    """背景預抓只負責暖快取；失敗時留給分頁開啟後依原流程重試與提示。"""
+    try:
+        return func(*args)
+    except Exception:
+        return None
+
+
+def workspace_prefetch_jobs(view):
+    """回傳分頁開啟時會用到、且可在背景執行緒安全呼叫的資料來源。"""
+    if view == "📈 指數操盤室":
+        return [
+            (fetch_twse_taiex_daily_history, (180,)),
+            (fetch_taifex_txo_daily_quotes, ()),
+            (fetch_taifex_index_margin_map, ()),
+        ]
+    if view == "💰 交易損益室 💰":
+        return [(fetch_futures_list, ())]
+    if view == "📚 戰略資料庫":
+        return [
+            (get_major_institutional_data, (default_institutional_date().strftime("%Y%m%d"),)),
+            (get_report_list, ()),
+        ]
+    if view == "📅 股市行事曆":
+        year = int(st.session_state.get('cal_year', datetime.now(pytz.timezone('Asia/Taipei')).year))
+        preferences = st.session_state.get('calendar_preferences', {})
+        event_types = set(calendar_event_types(
+            preferences.get("groups", CALENDAR_GROUP_OPTIONS),
+            preferences.get("macro_events", US_HIGH_IMPACT_EVENTS),
+        ))
+        jobs = [(fetch_twse_holiday_events, (year,)), (fetch_twse_temporary_closure_events, ())]
+        for event_name, func in (
+            ("FOMC 利率決議", fetch_fomc_events),
+            ("美國 CPI", fetch_bls_cpi_events),
+            ("美國大非農", fetch_bls_employment_events),
+            ("美國小非農 ADP", fetch_adp_employment_events),
+            ("美國初領失業金", build_us_initial_claims_events),
+        ):
+            if event_name in event_types:
+                jobs.append((func, (year,)))
+        return jobs
+    return []
+
+
+def prefetch_workspace_views(active_view):
+    """把相鄰分頁的資料抓取送進共用 IO 執行緒池；同一來源在 TTL 內只送出一次。"""
+    for view in WORKSPACE_PREFETCH_NEIGHBOURS.get(active_view, ()):
+        for func, args in workspace_prefetch_jobs(view):
+            submit_analysis_job(
+                ('workspace_prefetch', func.__name__, args), _run_workspace_prefetch, func, *args,
+                backend='thread', ttl=WORKSPACE_PREFETCH_TTL_SECONDS,
+            )
+
+
+# 分頁只在開啟時執行，關閉分頁內的 widget 沒有渲染，Streamlit 會在該次執行結束時清掉它們的狀態；
+# 交易試算等分頁的輸入因此另存一份非 widget 的 `_tab_value_<key>`，重新開啟時以它作為初值。
+def tab_widget_value(key, default=None):
+    return st.session_state.get(f"_tab_value_{key}", default)
+
+
+def tab_widget_index(key, options, default=0):
+    """選單類 widget 的 index；保存的選項已不在清單內時回到預設。"""
+    saved = tab_widget_value(key)
+    return options.index(saved) if saved in options else default
+
+
+def keep_tab_widget(key, value):
+    """記下 widget 本次的值並原樣回傳。"""
+    st.session_state[f"_tab_value_{key}"] = value
+    return value
+
+
+def reset_tab_widget(key, value):
+    """程式重設 widget 時一併更新保存值，重新開啟分頁才不會還原成重設前的輸入。"""
+    st.session_state[key] = value
+    st.session_state[f"_tab_value_{key}"] = value
+
+
+# ==========================================
+# 主介面 (Tabs)
+# ==========================================
+# Streamlit tabs 預設會執行每個分頁；改用 on_change="rerun" 讓 .open 反映目前畫面，
+# 各分頁內容只在開啟時執行，避免損益計算等小操作連帶重抓指數、選擇權與行事曆資料。
+workspace_tabs = st.tabs(
+    WORKSPACE_TAB_LABELS,
+    default=WORKSPACE_TAB_LABELS[0], key="main_workspace_active_tab", on_change="rerun",
+)
+tab1, tab_fibo, tab2, tab_db, tab_company, tab3 = workspace_tabs
+prefetch_workspace_views(next(
+    (label for label, tab in zip(WORKSPACE_TAB_LABELS, workspace_tabs) if tab.open), WORKSPACE_TAB_LABELS[0]
+))
 
 with tab1:
-    render_opening_direction_prompt()
-    stock_strategy_tab, futures_strategy_tab, validation_strategy_tab = st.tabs([
-        "📈 股票戰略室", "🧭 期貨戰略室", "📊 策略驗證"
-    ])
+    if tab1.open:
+        render_opening_direction_prompt()
+    stock_strategy_tab, futures_strategy_tab, validation_strategy_tab = st.tabs(
+        ["📈 股票戰略室", "🧭 期貨戰略室", "📊 策略驗證"],
+        default="📈 股票戰略室", key="strategy_room_active_tab", on_change="rerun",
+    )
     with stock_strategy_tab:
         stock_strategy_container = st.container()
     with futures_strategy_tab:
-        render_futures_strategy_room()
+        if tab1.open and futures_strategy_tab.open:
+            render_futures_strategy_room()
     with validation_strategy_tab:
-        render_strategy_validation_room()
-
-with stock_strategy_container:
-    stock_settings_col, stock_help_col = st.columns([3, 2])
-    with stock_settings_col:
-        hide_non_stock, show_3d_hilo = render_stock_strategy_controls()
-    with stock_help_col:
-        render_stock_strategy_explanation()
-    col_search = st.expander(
-        "📥 選股資料來源與快速查詢",
-        expanded=st.session_state.stock_data.empty,
-    )
-    with col_search:
-        code_map, name_map = load_local_stock_names()
-        stock_options = []
-        for code, name in sorted(code_map.items()):
-            if not st.session_state.get('allow_warrant_search', False) and is_warrant(code):
-                continue
-            stock_options.append(f"{code} {name}")
+        if tab1.open and validation_strategy_tab.open:
+            render_strategy_validation_room()
+
+if tab1.open and stock_strategy_tab.open:
+    with stock_strategy_container:
+        stock_settings_col, stock_help_col = st.columns([3, 2])
+        with stock_settings_col:
+            hide_non_stock, show_3d_hilo = render_stock_strategy_controls()
+        with stock_help_col:
+            render_stock_strategy_explanation()
+        col_search = st.expander(
+            "📥 選股資料來源與快速查詢",
+            expanded=st.session_state.stock_data.empty,
+        )
+        with col_search:
+            code_map, name_map = load_local_stock_names()
+            stock_options = []
+            for code, name in sorted(code_map.items()):
+                if not st.session_state.get('allow_warrant_search', False) and is_warrant(code):
+                    continue
+                stock_options.append(f"{code} {name}")
         
-        src_tab1, src_tab2 = st.tabs(["📂 本機", "☁️ 雲端"])
-        with src_tab1:
-            uploaded_file = st.file_uploader("上傳檔案 (CSV/XLS/HTML)", type=['xlsx', 'csv', 'html', 'xls'], label_visibility="collapsed")
-            selected_sheet = 0
-            if uploaded_file:
-                try:
-                    if not uploaded_file.name.endswith('.csv'):
-                        xl_file = pd.ExcelFile(uploaded_file)
-                        sheet_options = xl_file.sheet_names
-                        default_idx = sheet_options.index("週轉率") if "週轉率" in sheet_options else 0
-                        selected_sheet = st.selectbox("選擇工作表", sheet_options, index=default_idx)
-                except: pass
+            src_tab1, src_tab2, src_tab3 = st.tabs(["📂 本機", "☁️ 雲端", "🌐 全市場篩選"])
+            with src_tab1:
+                uploaded_file = st.file_uploader("上傳檔案 (CSV/XLS/HTML)", type=['xlsx', 'csv', 'html', 'xls'], label_visibility="collapsed")
+                selected_sheet = 0
+                if uploaded_file:
+                    try:
+                        if not uploaded_file.name.endswith('.csv'):
+                            xl_file = pd.ExcelFile(uploaded_file)
+                            sheet_options = xl_file.sheet_names
+                            default_idx = sheet_options.index("週轉率") if "週轉率" in sheet_options else 0
+                            selected_sheet = st.selectbox("選擇工作表", sheet_options, index=default_idx)
+                    except: pass
 
-        with src_tab2:
-            def on_history_change(): st.session_state.cloud_url_input = st.session_state.history_selected
-            history_opts = st.session_state.url_history if st.session_state.url_history else ["(無紀錄)"]
-            c_sel, c_del = st.columns([8, 1], gap="small")
-            with c_sel:
-                selected = st.selectbox("📜 歷史紀錄 (選取自動填入)", options=history_opts, key="history_selected", index=None, placeholder="請選擇...", on_change=on_history_change, label_visibility="collapsed")
-            with c_del:
-                if st.button("🗑️", help="刪除選取的歷史紀錄"):
-                    if st.session_state.history_selected and st.session_state.history_selected in st.session_state.url_history:
-                        st.session_state.url_history.remove(st.session_state.history_selected)
-                        save_url_history(st.session_state.url_history)
-                        st.toast("已刪除。", icon="🗑️")
-                        st.rerun()
-            st.text_input("輸入連結 (CSV/Excel/Google Sheet)", key="cloud_url_input", placeholder="https://...")
+            with src_tab2:
+                def on_history_change(): st.session_state.cloud_url_input = st.session_state.history_selected
+                history_opts = st.session_state.url_history if st.session_state.url_history else ["(無紀錄)"]
+                c_sel, c_del = st.columns([8, 1], gap="small")
+                with c_sel:
+                    selected = st.selectbox("📜 歷史紀錄 (選取自動填入)", options=history_opts, key="history_selected", index=None, placeholder="請選擇...", on_change=on_history_change, label_visibility="collapsed")
+                with c_del:
+                    if st.button("🗑️", help="刪除選取的歷史紀錄"):
+                        if st.session_state.history_selected and st.session_state.history_selected in st.session_state.url_history:
+                            st.session_state.url_history.remove(st.session_state.history_selected)
+                            save_url_history(st.session_state.url_history)
+                            st.toast("已刪除。", icon="🗑️")
+                            st.rerun()
+                st.text_input("輸入連結 (CSV/Excel/Google Sheet)", key="cloud_url_input", placeholder="https://...")
+            with src_tab3:
+                render_market_screener_source()
         
-        def update_search_cache(): save_search_cache(st.session_state.search_multiselect)
-        search_selection = st.multiselect("🔍 快速查詢 (中文/代號)", options=stock_options, key="search_multiselect", on_change=update_search_cache, placeholder="輸入 2330 或 台積電...")
-
-    c_run, c_space = st.columns([1.5, 5])
-    analysis_source_ready = bool(
-        uploaded_file or st.session_state.cloud_url_input.strip()
-        or search_selection or 'goodinfo_df' in st.session_state
-    )
-    with c_run:
-        btn_run = st.button(
-            "🚀 執行分析", width='stretch', disabled=not analysis_source_ready,
-            help="請先上傳檔案、輸入雲端連結、抓取 Goodinfo，或選擇快速查詢標的。"
+            def update_search_cache(): save_search_cache(st.session_state.search_multiselect)
+            search_selection = st.multiselect("🔍 快速查詢 (中文/代號)", options=stock_options, key="search_multiselect", on_change=update_search_cache, placeholder="輸入 2330 或 台積電...")
+
+        c_run, c_space = st.columns([1.5, 5])
+        analysis_source_ready = bool(
+            uploaded_file or st.session_state.cloud_url_input.strip()
+            or search_selection or 'goodinfo_df' in st.session_state
+            or 'market_screener_df' in st.session_state
         )
+        with c_run:
+            btn_run = st.button(
+                "🚀 執行分析", width='stretch', disabled=not analysis_source_ready,
+                help="請先上傳檔案、輸入雲端連結、抓取 Goodinfo、帶入全市場篩選，或選擇快速查詢標的。"
+            )
 
-    if btn_run:
-        save_search_cache(st.session_state.search_multiselect)
-        if not st.session_state.futures_list: st.session_state.futures_list = fetch_futures_list()
-        targets = []
-        df_up = pd.DataFrame()
-        current_url = st.session_state.cloud_url_input.strip()
-        if current_url:
-            if current_url not in st.session_state.url_history:
-                st.session_state.url_history.insert(0, current_url) 
-                save_url_history(st.session_state.url_history)
+        if btn_run:
+            save_search_cache(st.session_state.search_multiselect)
+            if not st.session_state.futures_list: st.session_state.futures_list = fetch_futures_list()
+            targets = []
+            df_up = pd.DataFrame()
+            current_url = st.session_state.cloud_url_input.strip()
+            if current_url:
+                if current_url not in st.session_state.url_history:
+                    st.session_state.url_history.insert(0, current_url) 
+                    save_url_history(st.session_state.url_history)
         
-        try:
-            if uploaded_file:
-                uploaded_file.seek(0)
-                fname = uploaded_file.name.lower()
-                if fname.endswith('.csv'):
-                    try: df_up = pd.read_csv(uploaded_file, dtype=str, encoding='cp950')
-                    except: 
-                        uploaded_file.seek(0)
-                        df_up = pd.read_csv(uploaded_file, dtype=str)
-                elif fname.endswith('.html') or fname.endswith('.htm') or fname.endswith('.xls'):
-                    try: dfs = pd.read_html(uploaded_file, encoding='cp950')
+            try:
+                if uploaded_file:
+                    uploaded_file.seek(0)
+                    fname = uploaded_file.name.lower()
+                    if fname.endswith('.csv'):
+                        try: df_up = pd.read_csv(uploaded_file, dtype=str, encoding='cp950')
+                        except: 
+                            uploaded_file.seek(0)
+                            df_up = pd.read_csv(uploaded_file, dtype=str)
+                    elif fname.endswith('.html') or fname.endswith('.htm') or fname.endswith('.xls'):
+                        try: dfs = pd.read_html(uploaded_file, encoding='cp950')
+                        except:
+                            uploaded_file.seek(0)
+                            dfs = pd.read_html(uploaded_file, encoding='utf-8')
+                        for df in dfs:
+                            if df.apply(lambda r: r.astype(str).str.contains('代號').any(), axis=1).any():
+                                 df_up = df
+                                 for i, row in df.iterrows():
+                                     if "代號" in row.values:
+                                         df_up.columns = row
+                                         df_up = df_up.iloc[i+1:]
+                                         break
+                                 break
+                        if df_up.empty and dfs: df_up = dfs[0]
+                    elif fname.endswith('.xlsx'):
+                        df_up = pd.read_excel(uploaded_file, sheet_name=selected_sheet, dtype=str)
+
+                elif st.session_state.cloud_url_input:
+                    url = st.session_state.cloud_url_input
+                    if "docs.google.com" in url and "/spreadsheets/" in url and "/edit" in url:
+                        url = url.split("/edit")[0] + "/export?format=csv"
+                    try: df_up = pd.read_csv(url, dtype=str)
                     except:
-                        uploaded_file.seek(0)
-                        dfs = pd.read_html(uploaded_file, encoding='utf-8')
-                    for df in dfs:
-                        if df.apply(lambda r: r.astype(str).str.contains('代號').any(), axis=1).any():
-                             df_up = df
-                             for i, row in df.iterrows():
-                                 if "代號" in row.values:
-                                     df_up.columns = row
-                                     df_up = df_up.iloc[i+1:]
-                                     break
-                             break
-                    if df_up.empty and dfs: df_up = dfs[0]
-                elif fname.endswith('.xlsx'):
-                    df_up = pd.read_excel(uploaded_file, sheet_name=selected_sheet, dtype=str)
-
-            elif st.session_state.cloud_url_input:
-                url = st.session_state.cloud_url_input
-                if "docs.google.com" in url and "/spreadsheets/" in url and "/edit" in url:
-                    url = url.split("/edit")[0] + "/export?format=csv"
-                try: df_up = pd.read_csv(url, dtype=str)
-                except:
-                    try: df_up = pd.read_excel(url, dtype=str)
-                    except: st.error("❌ 無法讀取雲端檔案。")
+                        try: df_up = pd.read_excel(url, dtype=str)
+                        except: st.error("❌ 無法讀取雲端檔案。")
             
-            # 🟢 新增：若無上傳與雲端輸入，且檢測到有 Goodinfo 暫存資料時直接讀取
-            elif 'goodinfo_df' in st.session_state:
-                df_up = st.session_state['goodinfo_df'].copy()
-                st.toast("已直接載入 Goodinfo 週轉率排行暫存資料進行分析！", icon="🔄")
+                # 全市場篩選帶入的候選優先於 Goodinfo 暫存，依信心分排序。
+                elif 'market_screener_df' in st.session_state:
+                    df_up = st.session_state['market_screener_df'].copy()
+                    st.toast("已載入全市場篩選候選進行分析！", icon="🌐")
+
+                # 🟢 新增：若無上傳與雲端輸入，且檢測到有 Goodinfo 暫存資料時直接讀取
+                elif 'goodinfo_df' in st.session_state:
+                    df_up = st.session_state['goodinfo_df'].copy()
+                    st.toast("已直接載入 Goodinfo 週轉率排行暫存資料進行分析！", icon="🔄")
                 
-        except Exception as e: st.error(f"讀取失敗: {e}")
+            except Exception as e: st.error(f"讀取失敗: {e}")
         
-        # 先處理上傳/資料帶入的股票 (優先權高)
-        if not df_up.empty:
-            df_up.columns = df_up.columns.astype(str).str.strip()
-            c_col = next((c for c in df_up.columns if "代號" in str(c)), None)
-            n_col = next((c for c in df_up.columns if "名稱" in str(c)), None)
-            if c_col:
-                limit_rows = st.session_state.limit_rows
-                count = 0
-                for _, row in df_up.iterrows():
-                    c_raw = str(row[c_col]).replace('=', '').replace('"', '').strip()
-                    code_match = re.search(r'(?<!\d)\d{4,6}(?!\d)', c_raw)
-                    if not code_match:
-                        continue
-                    c_raw = code_match.group(0)
-                    if c_raw in st.session_state.ignored_stocks: continue
-                    if hide_non_stock:
-                        is_etf = c_raw.startswith('00')
-                        is_warrant_flag = (len(c_raw) > 4) and c_raw.isdigit()
-                        if is_etf or is_warrant_flag: continue
-                    n = str(row[n_col]) if n_col else ""
-                    if n.lower() == 'nan': n = ""
-                    targets.append((c_raw, n, 'upload', count))
-                    count += 1
-
-        # 再處理快速查詢的股票，確保其排序在後面
-        if search_selection:
-            for i, item in enumerate(search_selection):
-                parts = item.split(' ', 1)
-                targets.append((parts[0], parts[1] if len(parts) > 1 else "", 'search', i))
-
-        st.session_state.all_candidates = targets
-        seen = set()
-        status_text = st.empty()
-        bar = st.progress(0)
+            # 先處理上傳/資料帶入的股票 (優先權高)
+            if not df_up.empty:
+                df_up.columns = df_up.columns.astype(str).str.strip()
+                c_col = next((c for c in df_up.columns if "代號" in str(c)), None)
+                n_col = next((c for c in df_up.columns if "名稱" in str(c)), None)
+                if c_col:
+                    limit_rows = st.session_state.limit_rows
+                    count = 0
+                    for _, row in df_up.iterrows():
+                        c_raw = str(row[c_col]).replace('=', '').replace('"', '').strip()
+                        code_match = re.search(r'(?<!\d)\d{4,6}(?!\d)', c_raw)
+                        if not code_match:
+                            continue
+                        c_raw = code_match.group(0)
+                        if c_raw in st.session_state.ignored_stocks: continue
+                        if hide_non_stock:
+                            is_etf = c_raw.startswith('00')
+                            is_warrant_flag = (len(c_raw) > 4) and c_raw.isdigit()
+                            if is_etf or is_warrant_flag: continue
+                        n = str(row[n_col]) if n_col else ""
+                        if n.lower() == 'nan': n = ""
+                        targets.append((c_raw, n, 'upload', count))
+                        count += 1
+
+            # 再處理快速查詢的股票，確保其排序在後面
+            if search_selection:
+                for i, item in enumerate(search_selection):
+                    parts = item.split(' ', 1)
+                    targets.append((parts[0], parts[1] if len(parts) > 1 else "", 'search', i))
+
+            st.session_state.all_candidates = targets
+            seen = set()
+            status_text = st.empty()
+            bar = st.progress(0)
         
-        upload_limit = st.session_state.limit_rows
-        upload_current = 0
-        existing_data = {}
-        previous_stock_data = st.session_state.stock_data.copy()
+            upload_limit = st.session_state.limit_rows
+            upload_current = 0
+            existing_data = {}
+            previous_stock_data = st.session_state.stock_data.copy()
         
-        futures_copy = dict(st.session_state.futures_list)
-        notes_copy = dict(st.session_state.saved_notes)
-        code_map_copy, _ = load_local_stock_names()
+            futures_copy = dict(st.session_state.futures_list)
+            notes_copy = dict(st.session_state.saved_notes)
+            code_map_copy, _ = load_local_stock_names()
+
+            def process_stock_task(t_code, t_name, t_source, t_extra, f_set, n_dict, c_map, sj_logged, sj_api_obj):
+                # 將原本 0.5~1.5 秒的長時間延遲，改為 0.1 秒的微小緩衝以防 API 封鎖
+                time.sleep(API_REQUEST_GAP_SECONDS)
+                try: return (t_code, t_source, t_extra, fetch_stock_data_raw(t_code, t_name, t_extra, f_set, n_dict, c_map, sj_logged, sj_api_obj))
+                except Exception: return (t_code, t_source, t_extra, None)
+
+            tasks_to_run = []
+            for i, (code, name, source, extra) in enumerate(targets):
+                if source == 'upload' and upload_current >= upload_limit: continue
+                if code in st.session_state.ignored_stocks: continue
+                if (code, source) in seen: continue
+                tasks_to_run.append((code, name, source, extra))
+                if source == 'upload': upload_current += 1
+                seen.add((code, source))
+
+            sj_logged_in_flag = st.session_state.get('sj_logged_in', False)
+            sj_api_obj = st.session_state.get('sj_api', None)
 
-        def process_stock_task(t_code, t_name, t_source, t_extra, f_set, n_dict, c_map, sj_logged, sj_api_obj):
-            # 將原本 0.5~1.5 秒的長時間延遲，改為 0.1 秒的微小緩衝以防 API 封鎖
-            time.sleep(API_REQUEST_GAP_SECONDS)
-            try: return (t_code, t_source, t_extra, fetch_stock_data_raw(t_code, t_name, t_extra, f_set, n_dict, c_map, sj_logged, sj_api_obj))
-            except Exception: return (t_code, t_source, t_extra, None)
-
-        tasks_to_run = []
-        for i, (code, name, source, extra) in enumerate(targets):
-            if source == 'upload' and upload_current >= upload_limit: continue
-            if code in st.session_state.ignored_stocks: continue
-            if (code, source) in seen: continue
-            tasks_to_run.append((code, name, source, extra))
-            if source == 'upload': upload_current += 1
-            seen.add((code, source))
-
-        sj_logged_in_flag = st.session_state.get('sj_logged_in', False)
-        sj_api_obj = st.session_state.get('sj_api', None)
-
-        with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-            future_to_task = {executor.submit(process_stock_task, t[0], t[1], t[2], t[3], futures_copy, notes_copy, code_map_copy, sj_logged_in_flag, sj_api_obj): t for t in tasks_to_run}
-            completed_count = 0
-            total_tasks = len(tasks_to_run) if len(tasks_to_run) > 0 else 1
-            
-            for future in as_completed(future_to_task):
-                t_code, t_source, t_extra, data = future.result()
-                completed_count += 1
-                bar.progress(min(completed_count / total_tasks, 1.0))
-                status_text.text(f"正在分析 ({completed_count}/{total_tasks}): {t_code} ...")
-                if data:
-                    data['_source'] = t_source
-                    data['_order'] = t_extra
-                    data['_source_rank'] = 1 if t_source == 'upload' else 2
-                    
-                    # 檢查是否已存在資料，若存在則依據來源優先權判斷是否覆蓋
-                    if t_code in existing_data:
-                        if existing_data[t_code]['_source'] == 'upload' and t_source == 'search':
-                            pass  # 已有在顯示筆數內的檔案資料，忽略查詢資料的覆蓋，保留檔案排序
-                        elif existing_data[t_code]['_source'] == 'search' and t_source == 'upload':
-                            existing_data[t_code] = data  # 檔案資料優先權高，覆蓋掉原先寫入的查詢資料
+            # 每批抓取各自限制 ANALYSIS_MAX_WORKERS 條執行緒，維持對 Yahoo／永豐的並行上限；進度條依完成順序即時更新。
+            with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
+                future_to_task = {executor.submit(process_stock_task, t[0], t[1], t[2], t[3], futures_copy, notes_copy, code_map_copy, sj_logged_in_flag, sj_api_obj): t for t in tasks_to_run}
+                completed_count = 0
+                total_tasks = len(tasks_to_run) if len(tasks_to_run) > 0 else 1
+        
+                for future in as_completed(future_to_task):
+                    t_code, t_source, t_extra, data = future.result()
+                    completed_count += 1
+                    bar.progress(min(completed_count / total_tasks, 1.0))
+                    status_text.text(f"正在分析 ({completed_count}/{total_tasks}): {t_code} ...")
+                    if data:
+                        data['_source'] = t_source
+                        data['_order'] = t_extra
+                        data['_source_rank'] = 1 if t_source == 'upload' else 2
+                
+                        # 檢查是否已存在資料，若存在則依據來源優先權判斷是否覆蓋
+                        if t_code in existing_data:
+                            if existing_data[t_code]['_source'] == 'upload' and t_source == 'search':
+                                pass  # 已有在顯示筆數內的檔案資料，忽略查詢資料的覆蓋，保留檔案排序
+                            elif existing_data[t_code]['_source'] == 'search' and t_source == 'upload':
+                                existing_data[t_code] = data  # 檔案資料優先權高，覆蓋掉原先寫入的查詢資料
+                            else:
+                                existing_data[t_code] = data
                         else:
                             existing_data[t_code] = data
-                    else:
-                        existing_data[t_code] = data
-                # 每個單一股票任務結束後即時主動回收
-                del data
+                    # 每個單一股票任務結束後即時主動回收
+                    del data
         
-        bar.empty()
-        status_text.empty()
+            bar.empty()
+            status_text.empty()
         
-        if existing_data:
-            df_temp = pd.DataFrame(list(existing_data.values()))
-            # 確保寫入 stock_data 時，嚴格按照來源優先權與順序排序
-            if '_source_rank' in df_temp.columns:
-                df_temp = df_temp.sort_values(by=['_source_rank', '_order']).reset_index(drop=True)
-            st.session_state.stock_data = df_temp
-            st.session_state.stock_strategy_editor_revision += 1
-            save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-        else:
-            st.session_state.stock_data = previous_stock_data
-            if tasks_to_run:
-                st.warning("本次未取得任何有效股票資料，已保留原本表格；請確認連線或稍後再試。")
-            else:
-                st.warning("沒有可分析的標的，已保留原本表格；請檢查忽略名單與篩選設定。")
-            
-        # 強制清除大型臨時變數並回收記憶體
-        del tasks_to_run
-        del existing_data
-        gc.collect()
-
-    if not st.session_state.stock_data.empty:
-        # 舊版股票自訂價不再參與顯示或策略計算；成交價統一採行情資料。
-        legacy_stock_columns = [
-            column for column in ('自訂價(可修)', '自訂價價差')
-            if column in st.session_state.stock_data.columns
-        ]
-        if legacy_stock_columns:
-            st.session_state.stock_data = st.session_state.stock_data.drop(columns=legacy_stock_columns)
-
-        # 新增：當限制筆數減少時，自動隱藏多餘的檔案上傳資料
-        df_check = st.session_state.stock_data
-        if '_source' in df_check.columns:
-            upload_mask = df_check['_source'] == 'upload'
-            if upload_mask.sum() > st.session_state.limit_rows:
-                keep_upload = df_check[upload_mask].head(st.session_state.limit_rows)
-                keep_other = df_check[~upload_mask]
-                st.session_state.stock_data = pd.concat([keep_upload, keep_other]).sort_values(by=['_source_rank', '_order'] if '_source_rank' in df_check.columns else None)
+            if existing_data:
+                df_temp = pd.DataFrame(list(existing_data.values()))
+                # 確保寫入 stock_data 時，嚴格按照來源優先權與順序排序
+                if '_source_rank' in df_temp.columns:
+                    df_temp = df_temp.sort_values(by=['_source_rank', '_order']).reset_index(drop=True)
+                st.session_state.stock_data = df_temp
                 st.session_state.stock_strategy_editor_revision += 1
                 save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+            else:
+                st.session_state.stock_data = previous_stock_data
+                if tasks_to_run:
+                    st.warning("本次未取得任何有效股票資料，已保留原本表格；請確認連線或稍後再試。")
+                else:
+                    st.warning("沒有可分析的標的，已保留原本表格；請檢查忽略名單與篩選設定。")
+            
+            # 強制清除大型臨時變數並回收記憶體
+            del tasks_to_run
+            del existing_data
+            gc.collect()
+
+        if not st.session_state.stock_data.empty:
+            # 舊版股票自訂價不再參與顯示或策略計算；成交價統一採行情資料。
+            legacy_stock_columns = [
+                column for column in ('自訂價(可修)', '自訂價價差')
+                if column in st.session_state.stock_data.columns
+            ]
+            if legacy_stock_columns:
+                st.session_state.stock_data = st.session_state.stock_data.drop(columns=legacy_stock_columns)
+
+            # 新增：當限制筆數減少時，自動隱藏多餘的檔案上傳資料
+            df_check = st.session_state.stock_data
+            if '_source' in df_check.columns:
+                upload_mask = df_check['_source'] == 'upload'
+                if upload_mask.sum() > st.session_state.limit_rows:
+                    keep_upload = df_check[upload_mask].head(st.session_state.limit_rows)
+                    keep_other = df_check[~upload_mask]
+                    st.session_state.stock_data = pd.concat([keep_upload, keep_other]).sort_values(by=['_source_rank', '_order'] if '_source_rank' in df_check.columns else None)
+                    st.session_state.stock_strategy_editor_revision += 1
+                    save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
 
-        df_all = st.session_state.stock_data.copy()
-        if '_source' not in df_all.columns: df_all['_source'] = 'upload'
-        df_all = df_all.rename(columns={"漲停價": "當日漲停價", "跌停價": "當日跌停價", "獲利目標": "+3%", "防守停損": "-3%"})
-        df_all['代號'] = df_all['代號'].astype(str)
-        df_all = df_all[~df_all['代號'].isin(st.session_state.ignored_stocks)]
+            df_all = st.session_state.stock_data.copy()
+            if '_source' not in df_all.columns: df_all['_source'] = 'upload'
+            df_all = df_all.rename(columns={"漲停價": "當日漲停價", "跌停價": "當日跌停價", "獲利目標": "+3%", "防守停損": "-3%"})
+            df_all['代號'] = df_all['代號'].astype(str)
+            df_all = df_all[~df_all['代號'].isin(st.session_state.ignored_stocks)]
         
-        if hide_non_stock:
-             mask_etf = df_all['代號'].str.startswith('00')
-             mask_warrant = (df_all['代號'].str.len() > 4) & df_all['代號'].str.isdigit()
-             df_all = df_all[~(mask_etf | mask_warrant)]
+            if hide_non_stock:
+                 mask_etf = df_all['代號'].str.startswith('00')
+                 mask_warrant = (df_all['代號'].str.len() > 4) & df_all['代號'].str.isdigit()
+                 df_all = df_all[~(mask_etf | mask_warrant)]
         
-        if '_source_rank' in df_all.columns: df_all = df_all.sort_values(by=['_source_rank', '_order'])
-        df_display = df_all.reset_index(drop=True)
+            if '_source_rank' in df_all.columns: df_all = df_all.sort_values(by=['_source_rank', '_order'])
+            df_display = df_all.reset_index(drop=True)
         
-        for i, row in df_display.iterrows():
-            code = row['代號']
-            points = row.get('_points', [])
-            manual = st.session_state.saved_notes.get(code, "")
+            for i, row in df_display.iterrows():
+                code = row['代號']
+                points = row.get('_points', [])
+                manual = st.session_state.saved_notes.get(code, "")
         
-            if not points:
-                cached = st.session_state.get('cached_notes', {}).get(code, {})
-                if cached and cached.get('note'):
-                    new_full_note = cached['note']
-                    new_auto_note = cached.get('auto', '')
+                if not points:
+                    cached = st.session_state.get('cached_notes', {}).get(code, {})
+                    if cached and cached.get('note'):
+                        new_full_note = cached['note']
+                        new_auto_note = cached.get('auto', '')
+                    else:
+                        new_full_note, new_auto_note = generate_note_from_points(points, manual, show_3d_hilo)
                 else:
                     new_full_note, new_auto_note = generate_note_from_points(points, manual, show_3d_hilo)
-            else:
-                new_full_note, new_auto_note = generate_note_from_points(points, manual, show_3d_hilo)
         
-            df_display.at[i, "戰略備註"] = new_full_note
-            df_display.at[i, "_auto_note"] = new_auto_note
-            clean_name = row['名稱'].replace('🔴 ', '').replace('🟢 ', '').replace('⚪ ', '')
-            df_display.at[i, "名稱"] = clean_name
-
-        note_width_px = calculate_note_width(df_display['戰略備註'], 15)
-        df_display["移除"] = False
-        points_map = df_display.set_index('代號')['_points'].to_dict() if '_points' in df_display.columns else {}
-        auto_notes_dict = df_display.set_index('代號')['_auto_note'].to_dict() if '_auto_note' in df_display.columns else {}
-
-        # 成交價價差是相對昨收的點數；5 日線價差則是成交價相對 MA5 的距離。
-        if "成交價價差" not in df_display.columns: df_display["成交價價差"] = None
-        if "5日線價差" not in df_display.columns: df_display["5日線價差"] = None
+                df_display.at[i, "戰略備註"] = new_full_note
+                df_display.at[i, "_auto_note"] = new_auto_note
+                clean_name = row['名稱'].replace('🔴 ', '').replace('🟢 ', '').replace('⚪ ', '')
+                df_display.at[i, "名稱"] = clean_name
+
+            note_width_px = calculate_note_width(df_display['戰略備註'], 15)
+            df_display["移除"] = False
+            points_map = df_display.set_index('代號')['_points'].to_dict() if '_points' in df_display.columns else {}
+            auto_notes_dict = df_display.set_index('代號')['_auto_note'].to_dict() if '_auto_note' in df_display.columns else {}
+
+            # 成交價價差是相對昨收的點數；5 日線價差則是成交價相對 MA5 的距離。
+            if "成交價價差" not in df_display.columns: df_display["成交價價差"] = None
+            if "5日線價差" not in df_display.columns: df_display["5日線價差"] = None
         
-        for i, row in df_display.iterrows():
-            price_difference = price_change_amount(row.get('收盤價'), row.get('漲跌幅'))
-            df_display.at[i, '成交價價差'] = (
-                round(price_difference, 2) if price_difference is not None else None
-            )
-            ma5_val = row.get('_ma5')
-            if pd.isna(ma5_val):
-                for p in row.get('_points', []):
-                    if p.get('tag') in ['多', '空', '平']:
-                        ma5_val = p.get('val')
-                        break
+            for i, row in df_display.iterrows():
+                price_difference = price_change_amount(row.get('收盤價'), row.get('漲跌幅'))
+                df_display.at[i, '成交價價差'] = (
+                    round(price_difference, 2) if price_difference is not None else None
+                )
+                ma5_val = row.get('_ma5')
+                if pd.isna(ma5_val):
+                    for p in row.get('_points', []):
+                        if p.get('tag') in ['多', '空', '平']:
+                            ma5_val = p.get('val')
+                            break
             
-            if pd.notna(ma5_val):
-                close_p = row.get('收盤價')
-                if pd.notna(close_p) and str(close_p).strip() != "":
-                    try: df_display.at[i, '5日線價差'] = round(float(close_p) - float(ma5_val), 2)
-                    except: pass
-
-        # 附加層只讀取原選股結果；關閉後維持既有表格、排序與戰略備註。
-        risk_preview_enabled = st.checkbox(
-            "🛡️ 啟用附加分析層（可隨時關閉回到原表）",
-            value=True,
-            key="risk_filter_preview_enabled",
-            help="加入支撐壓力、進出場點位、訊號、信心、資料品質與成效紀錄；不改動週轉率排序或原始戰略備註。"
-        )
-        risk_details = {}
-        risk_show_only_eligible = False
-        stock_compact_table = False
-        stock_notify = False
-
-        if risk_preview_enabled:
-            if 'risk_filter_market_data' not in st.session_state:
-                st.session_state.risk_filter_market_data = {
-                    'attention': {}, 'disposition': [], 'updated': None, 'errors': []
-                }
+                if pd.notna(ma5_val):
+                    close_p = row.get('收盤價')
+                    if pd.notna(close_p) and str(close_p).strip() != "":
+                        try: df_display.at[i, '5日線價差'] = round(float(close_p) - float(ma5_val), 2)
+                        except: pass
 
-            with st.expander("🧭 選股條件與進場信心設定", expanded=False):
-                strategy_mode = st.radio(
-                    "策略模式", ["當沖預覽", "隔日／波段"], horizontal=True,
-                    key="risk_filter_strategy_mode",
-                    help="隔日／波段維持原有規則；09:00–09:15 採即時串流＋1 分 K，之後採 5 分 K、VWAP 與完整開盤區間，不會自動下單。"
-                )
-                is_daytrade_mode = strategy_mode == "當沖預覽"
-                risk_col1, risk_col2, risk_col3 = st.columns(3)
-                with risk_col1:
-                    risk_direction = st.radio("判斷方向", ["多頭", "空頭"], horizontal=True, key="risk_filter_direction")
-                    risk_min_score = st.slider("最低進場信心", min_value=60, max_value=90, value=75, key="risk_filter_min_score")
-                with risk_col2:
-                    risk_max_extension = st.slider("最大乖離（ATR）", min_value=1.0, max_value=3.0, value=2.0, step=0.1, key="risk_filter_max_extension")
-                    risk_block_attention = st.checkbox("封鎖注意累計 ≥ 2", value=True, key="risk_filter_block_attention")
-                    stock_compact_table = st.checkbox(
-                        "精簡主表", value=True, key='stock_strategy_compact_table',
-                        help='戰略備註維持原樣；其餘細節移到個股明細。'
+            # 附加層只讀取原選股結果；關閉後維持既有表格、排序與戰略備註。
+            risk_preview_enabled = st.checkbox(
+                "🛡️ 啟用附加分析層（可隨時關閉回到原表）",
+                value=True,
+                key="risk_filter_preview_enabled",
+                help="加入支撐壓力、進出場點位、訊號、信心、資料品質與成效紀錄；不改動週轉率排序或原始戰略備註。"
+            )
+            risk_details = {}
+            risk_show_only_eligible = False
+            stock_compact_table = False
+            stock_notify = False
+
+            if risk_preview_enabled:
+                # 名單索引跨 session 共用；其他視窗更新後，本頁重跑即取得最新狀態。
+                st.session_state.risk_filter_market_data = market_risk_list_state()
+
+                with st.expander("🧭 選股條件與進場信心設定", expanded=False):
+                    strategy_mode = st.radio(
+                        "策略模式", ["當沖預覽", "隔日／波段"], horizontal=True,
+                        key="risk_filter_strategy_mode",
+                        help="隔日／波段維持原有規則；09:00–09:15 採即時串流＋1 分 K，之後採 5 分 K、VWAP 與完整開盤區間，不會自動下單。"
                     )
-                with risk_col3:
-                    risk_show_only_eligible = st.checkbox("只顯示可操作候選", value=False, key="risk_filter_show_eligible")
-                    stock_notify = st.checkbox("🔔 訊號變化提醒", value=True, key='stock_strategy_notify')
-                    if st.button("📊 重抓日 K 並計算策略指標", key="refresh_risk_filter_metrics"):
-                        code_name_map, _ = load_local_stock_names()
-                        with st.spinner("正在重抓日 K 並回填策略指標..."):
-                            refreshed_data, updated_count = refresh_risk_metrics_for_codes(
-                                st.session_state.stock_data,
-                                st.session_state.get('futures_list', {}),
-                                st.session_state.get('saved_notes', {}),
-                                code_name_map,
-                                st.session_state.get('sj_logged_in', False),
-                                st.session_state.get('sj_api', None)
-                            )
-                        if updated_count:
-                            st.session_state.stock_data = refreshed_data
-                            save_data_cache(
-                                st.session_state.stock_data,
-                                st.session_state.ignored_stocks,
-                                st.session_state.all_candidates,
-                                st.session_state.saved_notes
-                            )
-                            st.toast(f"已回填 {updated_count} 檔的 20 日趨勢與 ATR 指標。", icon="✅")
-                            st.rerun()
-                        else:
-                            st.warning("沒有可回填的資料；請確認標的至少有 20 個交易日的日 K。")
-                    if is_daytrade_mode:
-                        if st.button("📈 更新盤中資料與當沖條件", key="refresh_daytrade_filter_metrics"):
-                            if not st.session_state.get('sj_logged_in', False) or st.session_state.get('sj_api') is None:
-                                st.warning("當沖預覽需要先登入永豐 Shioaji，才能取得即時串流與分 K 資料。")
+                    is_daytrade_mode = strategy_mode == "當沖預覽"
+                    risk_col1, risk_col2, risk_col3 = st.columns(3)
+                    with risk_col1:
+                        risk_direction = st.radio("判斷方向", ["多頭", "空頭"], horizontal=True, key="risk_filter_direction")
+                        risk_min_score = st.slider("最低進場信心", min_value=60, max_value=90, value=75, key="risk_filter_min_score")
+                    with risk_col2:
+                        risk_max_extension = st.slider("最大乖離（ATR）", min_value=1.0, max_value=3.0, value=2.0, step=0.1, key="risk_filter_max_extension")
+                        risk_block_attention = st.checkbox("封鎖注意累計 ≥ 2", value=True, key="risk_filter_block_attention")
+                        stock_compact_table = st.checkbox(
+                            "精簡主表", value=True, key='stock_strategy_compact_table',
+                            help='戰略備註維持原樣；其餘細節移到個股明細。'
+                        )
+                    with risk_col3:
+                        risk_show_only_eligible = st.checkbox("只顯示可操作候選", value=False, key="risk_filter_show_eligible")
+                        stock_notify = st.checkbox("🔔 訊號變化提醒", value=True, key='stock_strategy_notify')
+                        if st.button("📊 重抓日 K 並計算策略指標", key="refresh_risk_filter_metrics"):
+                            code_name_map, _ = load_local_stock_names()
+                            with st.spinner("正在重抓日 K 並回填策略指標..."):
+                                refreshed_data, updated_count = refresh_risk_metrics_for_codes(
+                                    st.session_state.stock_data,
+                                    st.session_state.get('futures_list', {}),
+                                    st.session_state.get('saved_notes', {}),
+                                    code_name_map,
+                                    st.session_state.get('sj_logged_in', False),
+                                    st.session_state.get('sj_api', None)
+                                )
+                            if updated_count:
+                                st.session_state.stock_data = refreshed_data
+                                save_data_cache(
+                                    st.session_state.stock_data,
+                                    st.session_state.ignored_stocks,
+                                    st.session_state.all_candidates,
+                                    st.session_state.saved_notes
+                                )
+                                st.toast(f"已回填 {updated_count} 檔的 20 日趨勢與 ATR 指標。", icon="✅")
+                                st.rerun()
                             else:
-                                with st.spinner("正在讀取即時串流與分 K、計算 VWAP 與開盤條件..."):
-                                    refreshed_data, updated_count = refresh_daytrade_metrics_for_codes(
-                                        st.session_state.stock_data,
-                                        st.session_state.get('sj_logged_in', False),
-                                        st.session_state.get('sj_api', None)
-                                    )
-                                if updated_count:
-                                    st.session_state.stock_data = refreshed_data
-                                    save_data_cache(
-                                        st.session_state.stock_data,
-                                        st.session_state.ignored_stocks,
-                                        st.session_state.all_candidates,
-                                        st.session_state.saved_notes
-                                    )
-                                    st.toast(f"已更新 {updated_count} 檔的即時成交、VWAP 與開盤條件", icon="📈")
-                                    st.rerun()
+                                st.warning("沒有可回填的資料；請確認標的至少有 20 個交易日的日 K。")
+                        if is_daytrade_mode:
+                            if st.button("📈 更新盤中資料與當沖條件", key="refresh_daytrade_filter_metrics"):
+                                if not st.session_state.get('sj_logged_in', False) or st.session_state.get('sj_api') is None:
+                                    st.warning("當沖預覽需要先登入永豐 Shioaji，才能取得即時串流與分 K 資料。")
                                 else:
-                                    st.warning("沒有取得足夠的盤中 5 分 K；請確認 Shioaji 連線與交易時段資料。")
-                    if st.button("🔄 更新上市／上櫃注意與處置名單", key="refresh_risk_filter_market_data"):
-                        fetch_market_risk_lists.clear()
-                        with st.spinner("正在更新上市／上櫃注意與處置名單..."):
-                            attention, disposition, errors = fetch_market_risk_lists()
-                        st.session_state.risk_filter_market_data = {
-                            'attention': attention,
-                            'disposition': disposition,
-                            'updated': datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S'),
-                            'errors': errors
-                        }
-
-                market_risk_data = st.session_state.risk_filter_market_data
-                if market_risk_data.get('updated') and not market_risk_data.get('errors'):
-                    st.caption(f"上市／上櫃注意與處置名單更新：{market_risk_data['updated']}。")
-                elif market_risk_data.get('errors'):
-                    st.warning("注意／處置名單暫時無法完整更新；本次不會將未查核資料誤標為安全。")
-                else:
-                    st.info("尚未更新上市／上櫃注意與處置名單；資料未查核時不會被誤判為安全。")
+                                    with st.spinner("正在讀取即時串流與分 K、計算 VWAP 與開盤條件..."):
+                                        refreshed_data, updated_count = refresh_daytrade_metrics_for_codes(
+                                            st.session_state.stock_data,
+                                            st.session_state.get('sj_logged_in', False),
+                                            st.session_state.get('sj_api', None)
+                                        )
+                                    if updated_count:
+                                        st.session_state.stock_data = refreshed_data
+                                        save_data_cache(
+                                            st.session_state.stock_data,
+                                            st.session_state.ignored_stocks,
+                                            st.session_state.all_candidates,
+                                            st.session_state.saved_notes
+                                        )
+                                        st.toast(f"已更新 {updated_count} 檔的即時成交、VWAP 與開盤條件", icon="📈")
+                                        st.rerun()
+                                    else:
+                                        st.warning("沒有取得足夠的盤中 5 分 K；請確認 Shioaji 連線與交易時段資料。")
+                        if st.button("🔄 更新上市／上櫃注意與處置名單", key="refresh_risk_filter_market_data"):
+                            with st.spinner("正在更新上市／上櫃注意與處置名單..."):
+                                refresh_market_risk_index()
+                            st.session_state.risk_filter_market_data = market_risk_list_state()
+
+                    market_risk_data = st.session_state.risk_filter_market_data
+                    if market_risk_data.get('updated') and not market_risk_data.get('errors'):
+                        st.caption(f"上市／上櫃注意與處置名單更新：{market_risk_data['updated']}。")
+                    elif market_risk_data.get('errors'):
+                        st.warning("注意／處置名單暫時無法完整更新；本次不會將未查核資料誤標為安全。")
+                    else:
+                        st.info("尚未更新上市／上櫃注意與處置名單；資料未查核時不會被誤判為安全。")
 
-                risk_ready_mask = df_display.reindex(columns=RISK_METRIC_COLUMNS).apply(
-                    lambda row: all(_safe_number(row.get(column)) is not None for column in RISK_METRIC_COLUMNS),
-                    axis=1,
-                )
-                risk_ready_count = int(risk_ready_mask.sum())
-                st.caption(f"日 K 策略指標：{risk_ready_count} / {len(df_display)} 檔可計算；資料不足時，先按「重抓日 K 並計算策略指標」。")
-                if is_daytrade_mode:
-                    daytrade_ready_mask = df_display.reindex(columns=DAYTRADE_METRIC_COLUMNS).apply(
-                        lambda row: (
-                            all(_safe_number(row.get(column)) is not None for column in DAYTRADE_REQUIRED_COLUMNS)
-                            and parse_strategy_data_time(row.get('_daytrade_data_time')) is not None
-                        ),
+                    risk_ready_mask = df_display.reindex(columns=RISK_METRIC_COLUMNS).apply(
+                        lambda row: all(_safe_number(row.get(column)) is not None for column in RISK_METRIC_COLUMNS),
                         axis=1,
                     )
-                    daytrade_ready_count = int(daytrade_ready_mask.sum())
-                    st.caption(f"當沖盤中指標：{daytrade_ready_count} / {len(df_display)} 檔可計算；09:00–09:15 使用快照＋1 分 K，09:15 後使用 5 分 K，僅在手動按更新時抓取。")
-
-            market_risk_data = st.session_state.risk_filter_market_data
-            attention_counts = market_risk_data.get('attention', {})
-            disposition_codes = market_risk_data.get('disposition', [])
-            market_lists_updated = bool(market_risk_data.get('updated')) and not market_risk_data.get('errors')
-            market_environment = st.session_state.get('strategy_market_environment', {})
-            market_bias = str(market_environment.get('bias', '盤整'))
-            market_source = str(market_environment.get('source', '臺指期資料不足'))
-            market_change = _safe_number(market_environment.get('change'))
-            market_change_text = f" {_signed_percent_arrow(market_change)}" if market_change is not None else ''
-            st.caption(f"市場環境：{market_bias}｜依據 {market_source}{market_change_text}；只提供順逆勢標示，不改動原選股順位。")
+                    risk_ready_count = int(risk_ready_mask.sum())
+                    st.caption(f"日 K 策略指標：{risk_ready_count} / {len(df_display)} 檔可計算；資料不足時，先按「重抓日 K 並計算策略指標」。")
+                    if is_daytrade_mode:
+                        daytrade_ready_mask = df_display.reindex(columns=DAYTRADE_METRIC_COLUMNS).apply(
+                            lambda row: (
+                                all(_safe_number(row.get(column)) is not None for column in DAYTRADE_REQUIRED_COLUMNS)
+                                and parse_strategy_data_time(row.get('_daytrade_data_time')) is not None
+                            ),
+                            axis=1,
+                        )
+                        daytrade_ready_count = int(daytrade_ready_mask.sum())
+                        st.caption(f"當沖盤中指標：{daytrade_ready_count} / {len(df_display)} 檔可計算；09:00–09:15 使用快照＋1 分 K，09:15 後使用 5 分 K，僅在手動按更新時抓取。")
 
-            for i, row in df_display.iterrows():
-                result = calculate_daytrade_filter_result(
-                    row, risk_direction, attention_counts, disposition_codes,
-                    market_lists_updated, risk_block_attention
-                ) if is_daytrade_mode else calculate_risk_filter_result(
-                    row, risk_direction, risk_max_extension, attention_counts, disposition_codes,
-                    market_lists_updated, risk_block_attention
-                )
-                code = str(row.get('代號', ''))
-                if is_daytrade_mode:
-                    daily_risk = calculate_risk_filter_result(
+                market_risk_data = st.session_state.risk_filter_market_data
+                attention_counts = market_risk_data.get('attention', {})
+                disposition_codes = market_risk_data.get('disposition', [])
+                market_lists_updated = bool(market_risk_data.get('updated')) and not market_risk_data.get('errors')
+                market_environment = st.session_state.get('strategy_market_environment', {})
+                market_bias = str(market_environment.get('bias', '盤整'))
+                market_source = str(market_environment.get('source', '臺指期資料不足'))
+                market_change = _safe_number(market_environment.get('change'))
+                market_change_text = f" {_signed_percent_arrow(market_change)}" if market_change is not None else ''
+                st.caption(f"市場環境：{market_bias}｜依據 {market_source}{market_change_text}；只提供順逆勢標示，不改動原選股順位。")
+
+                df_display = join_market_risk_columns(df_display)
+                for i, row in df_display.iterrows():
+                    result = calculate_daytrade_filter_result(
+                        row, risk_direction, attention_counts, disposition_codes,
+                        market_lists_updated, risk_block_attention
+                    ) if is_daytrade_mode else calculate_risk_filter_result(
                         row, risk_direction, risk_max_extension, attention_counts, disposition_codes,
                         market_lists_updated, risk_block_attention
                     )
-                    # 日 ATR 乖離與官方風險是當沖的盤前門檻；盤中訊號成立也不放行過度延伸標的。
-                    if not daily_risk['eligible']:
-                        result['eligible'] = False
-                        if result['rule'].startswith('觸發：'):
-                            result['rule'] = f"不交易：盤前門檻未通過（{daily_risk['rule']}）"
-                    df_display.at[i, '風險'] = daily_risk['risk']
-                    df_display.at[i, 'VWAP 狀態'] = result['vwap_status']
-                    df_display.at[i, '開盤區間'] = result['opening_range']
-                    volume_ratio = _as_float(row.get('_daytrade_volume_ratio'))
-                    df_display.at[i, '量能'] = f"{_format_compact_number(volume_ratio, 2)}x" if volume_ratio is not None else "資料不足"
-                    df_display.at[i, '當沖評分'] = result['score']
-                    df_display.at[i, '盤中觸發'] = result['rule']
-                else:
-                    df_display.at[i, '風險'] = result['risk']
-                    df_display.at[i, '評分'] = result['score']
-                    df_display.at[i, '乖離'] = f"{_format_compact_number(result['extension'], 1, signed=True)} ATR" if result['extension'] is not None else "—"
-                    df_display.at[i, '隔日規則'] = result['rule']
-                trade_plan = build_trade_plan(row, risk_direction, is_daytrade_mode, result)
-                result['trade_plan'] = trade_plan
-                risk_details[code] = result
-                df_display.at[i, '進出場預判'] = trade_plan['summary']
-                signal_state = classify_signal_state(result['rule'], result['eligible'], result['score'], risk_min_score)
-                quote_time = row.get('_quote_time') or (row.get('_daytrade_data_time') if is_daytrade_mode else None)
-                required_ready = bool(result.get('data_time')) if is_daytrade_mode else result.get('extension') is not None
-                if row.get('_quote_time'):
-                    data_health = build_data_health(row.get('_quote_time'), required_ready, live_expected=True)
-                else:
-                    data_health = build_data_health(quote_time, required_ready, live_expected=is_daytrade_mode)
-                bid = _safe_number(row.get('_quote_bid'))
-                ask = _safe_number(row.get('_quote_ask'))
-                reference_price = _safe_number(row.get('收盤價'))
-                tick = get_tick_size(reference_price) if reference_price is not None else 0.01
-                spread_ticks = (ask - bid) / tick if bid is not None and ask is not None and ask >= bid and tick > 0 else None
-                market_alignment = calculate_market_alignment(risk_direction, market_bias)
-                current_price = (
-                    _safe_number(row.get('_daytrade_close')) if is_daytrade_mode else None
-                ) or reference_price
-                confidence = calculate_entry_confidence(
-                    result['score'], signal_state, current_price, trade_plan['summary'], risk_direction,
-                    data_health, market_alignment, result.get('detail', '')
+                    code = str(row.get('代號', ''))
+                    if is_daytrade_mode:
+                        daily_risk = calculate_risk_filter_result(
+                            row, risk_direction, risk_max_extension, attention_counts, disposition_codes,
+                            market_lists_updated, risk_block_attention
+                        )
+                        # 日 ATR 乖離與官方風險是當沖的盤前門檻；盤中訊號成立也不放行過度延伸標的。
+                        if not daily_risk['eligible']:
+                            result['eligible'] = False
+                            if result['rule'].startswith('觸發：'):
+                                result['rule'] = f"不交易：盤前門檻未通過（{daily_risk['rule']}）"
+                        df_display.at[i, '風險'] = daily_risk['risk']
+                        df_display.at[i, 'VWAP 狀態'] = result['vwap_status']
+                        df_display.at[i, '開盤區間'] = result['opening_range']
+                        volume_ratio = _as_float(row.get('_daytrade_volume_ratio'))
+                        df_display.at[i, '量能'] = f"{_format_compact_number(volume_ratio, 2)}x" if volume_ratio is not None else "資料不足"
+                        df_display.at[i, '當沖評分'] = result['score']
+                        df_display.at[i, '盤中觸發'] = result['rule']
+                    else:
+                        df_display.at[i, '風險'] = result['risk']
+                        df_display.at[i, '評分'] = result['score']
+                        df_display.at[i, '乖離'] = f"{_format_compact_number(result['extension'], 1, signed=True)} ATR" if result['extension'] is not None else "—"
+                        df_display.at[i, '隔日規則'] = result['rule']
+                    trade_plan = build_trade_plan(row, risk_direction, is_daytrade_mode, result)
+                    result['trade_plan'] = trade_plan
+                    risk_details[code] = result
+                    df_display.at[i, '進出場預判'] = trade_plan['summary']
+                    for key, column in TRADE_PLAN_PRICE_COLUMNS.items():
+                        df_display.at[i, column] = trade_plan[key]
+                    signal_state = classify_signal_state(result['rule'], result['eligible'], result['score'], risk_min_score)
+                    quote_time = row.get('_quote_time') or (row.get('_daytrade_data_time') if is_daytrade_mode else None)
+                    required_ready = bool(result.get('data_time')) if is_daytrade_mode else result.get('extension') is not None
+                    if row.get('_quote_time'):
+                        data_health = build_data_health(row.get('_quote_time'), required_ready, live_expected=True)
+                    else:
+                        data_health = build_data_health(quote_time, required_ready, live_expected=is_daytrade_mode)
+                    bid = _safe_number(row.get('_quote_bid'))
+                    ask = _safe_number(row.get('_quote_ask'))
+                    reference_price = _safe_number(row.get('收盤價'))
+                    tick = get_tick_size(reference_price) if reference_price is not None else 0.01
+                    spread_ticks = (ask - bid) / tick if bid is not None and ask is not None and ask >= bid and tick > 0 else None
+                    market_alignment = calculate_market_alignment(risk_direction, market_bias)
+                    current_price = (
+                        _safe_number(row.get('_daytrade_close')) if is_daytrade_mode else None
+                    ) or reference_price
+                    confidence = calculate_entry_confidence(
+                        result['score'], signal_state, current_price, trade_plan, risk_direction,
+                        data_health, market_alignment, result.get('detail', '')
+                    )
+                    result['confidence'] = confidence
+                    eligible_with_score = result['eligible'] and confidence['score'] >= risk_min_score
+                    df_display.at[i, '訊號狀態'] = signal_state
+                    df_display.at[i, '信心分'] = confidence['score']
+                    df_display.at[i, '信心判讀'] = confidence['label']
+                    df_display.at[i, '支撐壓力'] = build_stock_support_resistance(row, is_daytrade_mode)
+                    df_display.at[i, '市場一致'] = market_alignment
+                    df_display.at[i, '資料狀態'] = data_health
+                    df_display.at[i, '買賣價差'] = f'{spread_ticks:.0f}跳' if spread_ticks is not None else '—'
+                    df_display.at[i, '_risk_eligible'] = eligible_with_score
+                    df_display.at[i, '_附加可記錄'] = eligible_with_score and signal_state in ('✅ 已觸發', '🔵 回測確認')
+
+                notify_signal_state_changes(
+                    'stocks',
+                    {str(row['代號']): str(row.get('訊號狀態', '')) for _, row in df_display.iterrows()},
+                    stock_notify,
                 )
-                result['confidence'] = confidence
-                eligible_with_score = result['eligible'] and confidence['score'] >= risk_min_score
-                df_display.at[i, '訊號狀態'] = signal_state
-                df_display.at[i, '信心分'] = confidence['score']
-                df_display.at[i, '信心判讀'] = confidence['label']
-                df_display.at[i, '支撐壓力'] = build_stock_support_resistance(row, is_daytrade_mode)
-                df_display.at[i, '市場一致'] = market_alignment
-                df_display.at[i, '資料狀態'] = data_health
-                df_display.at[i, '買賣價差'] = f'{spread_ticks:.0f}跳' if spread_ticks is not None else '—'
-                df_display.at[i, '_risk_eligible'] = eligible_with_score
-                df_display.at[i, '_附加可記錄'] = eligible_with_score and signal_state in ('✅ 已觸發', '🔵 回測確認')
-
-            notify_signal_state_changes(
-                'stocks',
-                {str(row['代號']): str(row.get('訊號狀態', '')) for _, row in df_display.iterrows()},
-                stock_notify,
-            )
 
-            if risk_show_only_eligible:
-                df_display = df_display[df_display['_risk_eligible']].reset_index(drop=True)
-                if df_display.empty:
-                    st.warning("目前沒有符合門檻的候選；可降低最低評分、放寬最大乖離，或切換回原表。")
-
-            if stock_compact_table:
-                input_cols = [
-                    "移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅",
-                    "支撐壓力", "進出場預判", "5日線價差", "信心分", "信心判讀",
-                    "訊號狀態", "市場一致", "風險", "資料狀態"
-                ]
-            elif is_daytrade_mode:
-                input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "風險", "VWAP 狀態", "開盤區間", "量能", "信心分", "信心判讀", "支撐壓力", "盤中觸發", "進出場預判", "訊號狀態", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
+                if risk_show_only_eligible:
+                    df_display = df_display[df_display['_risk_eligible']].reset_index(drop=True)
+                    if df_display.empty:
+                        st.warning("目前沒有符合門檻的候選；可降低最低評分、放寬最大乖離，或切換回原表。")
+
+                if stock_compact_table:
+                    input_cols = [
+                        "移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅",
+                        "支撐壓力", "進出場預判", "5日線價差", "信心分", "信心判讀",
+                        "訊號狀態", "市場一致", "風險", "資料狀態"
+                    ]
+                elif is_daytrade_mode:
+                    input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "風險", "VWAP 狀態", "開盤區間", "量能", "信心分", "信心判讀", "支撐壓力", "盤中觸發", "進出場預判", "訊號狀態", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
+                else:
+                    input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "風險", "信心分", "信心判讀", "乖離", "支撐壓力", "隔日規則", "進出場預判", "訊號狀態", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
             else:
-                input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "風險", "信心分", "信心判讀", "乖離", "支撐壓力", "隔日規則", "進出場預判", "訊號狀態", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
-        else:
-            input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "當日漲停價", "當日跌停價", "期貨"]
-        for col in input_cols:
-            if col not in df_display.columns: df_display[col] = None
+                input_cols = ["移除", "代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "狀態", "成交價價差", "5日線價差", "當日漲停價", "當日跌停價", "期貨"]
+            for col in input_cols:
+                if col not in df_display.columns: df_display[col] = None
 
-        cols_to_fmt = ["當日漲停價", "當日跌停價", "成交價價差", "5日線價差"]
-        for c in cols_to_fmt:
-            if c in df_display.columns: df_display[c] = df_display[c].apply(fmt_price)
+            cols_to_fmt = ["當日漲停價", "當日跌停價", "成交價價差", "5日線價差"]
+            for c in cols_to_fmt:
+                if c in df_display.columns: df_display[c] = df_display[c].apply(fmt_price)
 
-        if "收盤價" in df_display.columns: df_display["收盤價"] = df_display["收盤價"].astype(object)
-        if "漲跌幅" in df_display.columns: df_display["漲跌幅"] = df_display["漲跌幅"].astype(object)
+            if "收盤價" in df_display.columns: df_display["收盤價"] = df_display["收盤價"].astype(object)
+            if "漲跌幅" in df_display.columns: df_display["漲跌幅"] = df_display["漲跌幅"].astype(object)
 
-        if "收盤價" in df_display.columns and "漲跌幅" in df_display.columns:
-            for i in range(len(df_display)):
-                try:
-                    p = float(df_display.at[i, "收盤價"])
-                    chg = float(df_display.at[i, "漲跌幅"])
-                    df_display.at[i, "收盤價"] = fmt_price(p)
-                    df_display.at[i, "漲跌幅"] = _signed_percent(chg)
-                except:
-                    df_display.at[i, "收盤價"] = fmt_price(df_display.at[i, "收盤價"])
-                    try: df_display.at[i, "漲跌幅"] = _signed_percent(float(df_display.at[i, '漲跌幅']))
-                    except: pass
+            if "收盤價" in df_display.columns and "漲跌幅" in df_display.columns:
+                for i in range(len(df_display)):
+                    try:
+                        p = float(df_display.at[i, "收盤價"])
+                        chg = float(df_display.at[i, "漲跌幅"])
+                        df_display.at[i, "收盤價"] = fmt_price(p)
+                        df_display.at[i, "漲跌幅"] = _signed_percent(chg)
+                    except:
+                        df_display.at[i, "收盤價"] = fmt_price(df_display.at[i, "收盤價"])
+                        try: df_display.at[i, "漲跌幅"] = _signed_percent(float(df_display.at[i, '漲跌幅']))
+                        except: pass
 
-        df_display = df_display.reset_index(drop=True)
-        for col in input_cols:
-            if col not in ["移除", "信心分"]:
-                df_display[col] = df_display[col].map(_blank_display_text)
-
-        # 定義上色邏輯
-        def style_tab1_df(row):
-            styles = [''] * len(row)
-            note = str(row.get('戰略備註', ''))
-            # 精簡主表不顯示「狀態」，但名稱底色仍必須依原列的漲／跌停狀態判斷。
-            st_val = str(row.get('狀態', ''))
-            if not st_val and row.name in df_display.index:
-                st_val = str(df_display.at[row.name, '狀態'])
-            risk_val = str(row.get('風險', ''))
-            vwap_val = str(row.get('VWAP 狀態', ''))
-            signal_state = str(row.get('訊號狀態', ''))
-            data_health = str(row.get('資料狀態', ''))
-            market_alignment = str(row.get('市場一致', ''))
+            df_display = df_display.reset_index(drop=True)
+            for col in input_cols:
+                if col not in ["移除", "信心分"]:
+                    df_display[col] = df_display[col].map(_blank_display_text)
+
+            # 定義上色邏輯
+            def style_tab1_df(row):
+                styles = [''] * len(row)
+                note = str(row.get('戰略備註', ''))
+                # 精簡主表不顯示「狀態」，但名稱底色仍必須依原列的漲／跌停狀態判斷。
+                st_val = str(row.get('狀態', ''))
+                if not st_val and row.name in df_display.index:
+                    st_val = str(df_display.at[row.name, '狀態'])
+                risk_val = str(row.get('風險', ''))
+                vwap_val = str(row.get('VWAP 狀態', ''))
+                signal_state = str(row.get('訊號狀態', ''))
+                data_health = str(row.get('資料狀態', ''))
+                market_alignment = str(row.get('市場一致', ''))
             
-            if st_val == "漲停":
-                name_c = 'background-color: #ff4b4b; color: #ffffff; font-weight: bold;'
-            elif st_val == "跌停":
-                name_c = 'background-color: #00e676; color: #ffffff; font-weight: bold;'
-            elif st_val == "命中":
-                name_c = 'background-color: #ffeb3b; color: #000000; font-weight: bold;'
-            else:
-                name_c = (
-                    'color: #ff4b4b; font-weight: bold;' if "多" in note
-                    else ('color: #00e676; font-weight: bold;' if "空" in note else 'font-weight: bold;')
-                )
+                if st_val == "漲停":
+                    name_c = 'background-color: #ff4b4b; color: #ffffff; font-weight: bold;'
+                elif st_val == "跌停":
+                    name_c = 'background-color: #00e676; color: #ffffff; font-weight: bold;'
+                elif st_val == "命中":
+                    name_c = 'background-color: #ffeb3b; color: #000000; font-weight: bold;'
+                else:
+                    name_c = (
+                        'color: #ff4b4b; font-weight: bold;' if "多" in note
+                        else ('color: #00e676; font-weight: bold;' if "空" in note else 'font-weight: bold;')
+                    )
             
-            price_c = ''
-            try:
-                c_val = float(
-                    str(row.get('漲跌幅', '0')).replace('%', '').replace('+', '')
-                    .replace('↑', '').replace('↓', '').replace('→', '').strip()
-                )
-                price_c = 'color: #ff4b4b;' if c_val > 0 else ('color: #00e676;' if c_val < 0 else '')
-            except: pass
+                price_c = ''
+                try:
+                    c_val = float(
+                        str(row.get('漲跌幅', '0')).replace('%', '').replace('+', '')
+                        .replace('↑', '').replace('↓', '').replace('→', '').strip()
+                    )
+                    price_c = 'color: #ff4b4b;' if c_val > 0 else ('color: #00e676;' if c_val < 0 else '')
+                except: pass
             
-            status_c = 'color: #ff4b4b;' if st_val in ["漲停", "強"] else ('color: #00e676;' if st_val in ["跌停", "弱"] else ('color: #ffeb3b;' if st_val == "命中" else ''))
+                status_c = 'color: #ff4b4b;' if st_val in ["漲停", "強"] else ('color: #00e676;' if st_val in ["跌停", "弱"] else ('color: #ffeb3b;' if st_val == "命中" else ''))
             
-            for idx, col in enumerate(row.index):
-                if col == "名稱": styles[idx] = name_c
-                elif col in ["收盤價", "漲跌幅"]: styles[idx] = price_c
-                elif col == "狀態": styles[idx] = status_c
-                elif col in ["成交價價差", "5日線價差"]:
-                    val = row[col]
-                    try:
-                        f_val = float(val)
-                        if f_val > 0: styles[idx] = 'color: #ff4b4b;'
-                        elif f_val < 0: styles[idx] = 'color: #00e676;'
-                        else: styles[idx] = 'color: white;'
-                    except: pass
-                elif col == "風險":
-                    if risk_val.startswith('🚫') or risk_val.startswith('🔴'):
-                        styles[idx] = 'color: #ff4b4b; font-weight: bold;'
-                    elif risk_val.startswith('🟡'):
-                        styles[idx] = 'color: #ffeb3b; font-weight: bold;'
-                    elif risk_val.startswith('🟢'):
-                        styles[idx] = 'color: #00e676;'
-                elif col == "VWAP 狀態":
-                    if vwap_val.startswith('偏多'):
-                        styles[idx] = 'color: #ff4b4b; font-weight: bold;'
-                    elif vwap_val.startswith('偏空'):
-                        styles[idx] = 'color: #00e676; font-weight: bold;'
-                    elif vwap_val.startswith('中性'):
-                        styles[idx] = 'color: #ffeb3b;'
-                elif col == "訊號狀態":
-                    if signal_state.startswith('✅'):
-                        styles[idx] = 'color:#ff4b4b;font-weight:bold;'
-                    elif signal_state.startswith('🔵'):
-                        styles[idx] = 'color:#29b6f6;font-weight:bold;'
-                    elif signal_state.startswith('⛔'):
-                        styles[idx] = 'color:#ff9800;font-weight:bold;'
-                    elif signal_state.startswith('🟡'):
-                        styles[idx] = 'color:#ffeb3b;'
-                elif col in ["資料狀態", "市場一致"]:
-                    value = data_health if col == "資料狀態" else market_alignment
-                    if value.startswith('🟢'):
-                        styles[idx] = 'color:#00e676;'
-                    elif value.startswith(('🔴', '⛔')):
-                        styles[idx] = 'color:#ff4b4b;font-weight:bold;'
-                    elif value.startswith('🟡'):
-                        styles[idx] = 'color:#ffeb3b;'
-                elif col == "信心判讀":
-                    confidence = str(row.get('信心判讀', ''))
-                    if confidence.startswith('🟢'):
-                        styles[idx] = 'color:#00e676;font-weight:bold;'
-                    elif confidence.startswith(('🟡', '🟠')):
-                        styles[idx] = 'color:#ffb300;font-weight:bold;'
-                    elif confidence.startswith('🔴'):
-                        styles[idx] = 'color:#ff4b4b;font-weight:bold;'
-            return styles
+                for idx, col in enumerate(row.index):
+                    if col == "名稱": styles[idx] = name_c
+                    elif col in ["收盤價", "漲跌幅"]: styles[idx] = price_c
+                    elif col == "狀態": styles[idx] = status_c
+                    elif col in ["成交價價差", "5日線價差"]:
+                        val = row[col]
+                        try:
+                            f_val = float(val)
+                            if f_val > 0: styles[idx] = 'color: #ff4b4b;'
+                            elif f_val < 0: styles[idx] = 'color: #00e676;'
+                            else: styles[idx] = 'color: white;'
+                        except: pass
+                    elif col == "風險":
+                        if risk_val.startswith('🚫') or risk_val.startswith('🔴'):
+                            styles[idx] = 'color: #ff4b4b; font-weight: bold;'
+                        elif risk_val.startswith('🟡'):
+                            styles[idx] = 'color: #ffeb3b; font-weight: bold;'
+                        elif risk_val.startswith('🟢'):
+                            styles[idx] = 'color: #00e676;'
+                    elif col == "VWAP 狀態":
+                        if vwap_val.startswith('偏多'):
+                            styles[idx] = 'color: #ff4b4b; font-weight: bold;'
+                        elif vwap_val.startswith('偏空'):
+                            styles[idx] = 'color: #00e676; font-weight: bold;'
+                        elif vwap_val.startswith('中性'):
+                            styles[idx] = 'color: #ffeb3b;'
+                    elif col == "訊號狀態":
+                        if signal_state.startswith('✅'):
+                            styles[idx] = 'color:#ff4b4b;font-weight:bold;'
+                        elif signal_state.startswith('🔵'):
+                            styles[idx] = 'color:#29b6f6;font-weight:bold;'
+                        elif signal_state.startswith('⛔'):
+                            styles[idx] = 'color:#ff9800;font-weight:bold;'
+                        elif signal_state.startswith('🟡'):
+                            styles[idx] = 'color:#ffeb3b;'
+                    elif col in ["資料狀態", "市場一致"]:
+                        value = data_health if col == "資料狀態" else market_alignment
+                        if value.startswith('🟢'):
+                            styles[idx] = 'color:#00e676;'
+                        elif value.startswith(('🔴', '⛔')):
+                            styles[idx] = 'color:#ff4b4b;font-weight:bold;'
+                        elif value.startswith('🟡'):
+                            styles[idx] = 'color:#ffeb3b;'
+                    elif col == "信心判讀":
+                        confidence = str(row.get('信心判讀', ''))
+                        if confidence.startswith('🟢'):
+                            styles[idx] = 'color:#00e676;font-weight:bold;'
+                        elif confidence.startswith(('🟡', '🟠')):
+                            styles[idx] = 'color:#ffb300;font-weight:bold;'
+                        elif confidence.startswith('🔴'):
+                            styles[idx] = 'color:#ff4b4b;font-weight:bold;'
+                return styles
             
-        styled_df = df_display[input_cols].style.apply(style_tab1_df, axis=1)
-
-        risk_column_config = {}
-        if risk_preview_enabled:
-            risk_column_config = {
-                "風險": st.column_config.TextColumn("處置／注意", width=95, disabled=True, help="官方注意與處置查核結果；不預測漲跌方向。"),
-                "訊號狀態": st.column_config.TextColumn(width=88, disabled=True, help="將原條件濃縮為等待、接近、觸發或暫停；原規則仍在明細。"),
-                "市場一致": st.column_config.TextColumn(width=90, disabled=True, help="目前方向是否與近月臺指期環境一致；不改變原排序。"),
-                "資料狀態": st.column_config.TextColumn(width=96, disabled=True, help="顯示即時、手動／暫存、官方日行情或資料過期。"),
-                "買賣價差": st.column_config.TextColumn(
-                    width=75, disabled=True,
-                    help="即時最佳賣價與最佳買價的距離，換算為跳動單位；跳數越少通常代表報價較連續、進出成本較低。無即時買賣價時顯示「—」。"
-                ),
-                "信心分": st.column_config.ProgressColumn("進場信心", min_value=0, max_value=100, format="%d", width=100, help="綜合方向條件、觸發位置、市場一致與資料狀態；代表條件一致度，不是勝率。"),
-                "信心判讀": st.column_config.TextColumn(width=70, disabled=True, help="高／中高／中／低；追離進場點、條件失效或資料過期時會降級。"),
-                "支撐壓力": st.column_config.TextColumn(width=120, disabled=True, help="當沖採開盤區間與 VWAP；隔日／波段沿用原戰略價位，顯示最接近目前價格的支撐與壓力。"),
-            }
-            if is_daytrade_mode:
-                risk_column_config.update({
-                    "VWAP 狀態": st.column_config.TextColumn(width=95, disabled=True, help="價格相對成交量加權平均價的位置；上方偏多、下方偏空。"),
-                    "開盤區間": st.column_config.TextColumn(width=100, disabled=True, help="09:00–09:15 顯示形成中的即時低點－高點；09:15 後固定為完整開盤區間。"),
-                    "量能": st.column_config.TextColumn(width=65, disabled=True, help="目前累積量相對最近交易日同時段平均量。"),
-                    "盤中觸發": st.column_config.TextColumn(width=150, disabled=True, help="僅在盤中條件同時成立時提供觀察提示，不是自動買賣指令。"),
-                    "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="通過條件後，以開盤區間與 VWAP 推估進場、策略失效離場與第一目標；僅供觀察與回測。"),
-                })
-            else:
-                risk_column_config.update({
-                    "乖離": st.column_config.TextColumn(width=75, disabled=True, help="收盤價相對 20 日線的 ATR 距離；數值越大越不宜追價或追空。"),
-                    "隔日規則": st.column_config.TextColumn(width=130, disabled=True, help="僅在隔日條件成真時才列入評估，不是自動買賣指令。"),
-                    "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="通過條件後，以昨高／昨低與 ATR 推估進場、策略失效離場與第一目標；僅供觀察與回測。"),
-                })
+            styled_df = df_display[input_cols].style.apply(style_tab1_df, axis=1)
+
+            risk_column_config = {}
+            if risk_preview_enabled:
+                risk_column_config = {
+                    "風險": st.column_config.TextColumn("處置／注意", width=95, disabled=True, help="官方注意與處置查核結果；不預測漲跌方向。"),
+                    "訊號狀態": st.column_config.TextColumn(width=88, disabled=True, help="將原條件濃縮為等待、接近、觸發或暫停；原規則仍在明細。"),
+                    "市場一致": st.column_config.TextColumn(width=90, disabled=True, help="目前方向是否與近月臺指期環境一致；不改變原排序。"),
+                    "資料狀態": st.column_config.TextColumn(width=96, disabled=True, help="顯示即時、手動／暫存、官方日行情或資料過期。"),
+                    "買賣價差": st.column_config.TextColumn(
+                        width=75, disabled=True,
+                        help="即時最佳賣價與最佳買價的距離，換算為跳動單位；跳數越少通常代表報價較連續、進出成本較低。無即時買賣價時顯示「—」。"
+                    ),
+                    "信心分": st.column_config.ProgressColumn("進場信心", min_value=0, max_value=100, format="%d", width=100, help="綜合方向條件、觸發位置、市場一致與資料狀態；代表條件一致度，不是勝率。"),
+                    "信心判讀": st.column_config.TextColumn(width=70, disabled=True, help="高／中高／中／低；追離進場點、條件失效或資料過期時會降級。"),
+                    "支撐壓力": st.column_config.TextColumn(width=120, disabled=True, help="當沖採開盤區間與 VWAP；隔日／波段沿用原戰略價位，顯示最接近目前價格的支撐與壓力。"),
+                }
+                if is_daytrade_mode:
+                    risk_column_config.update({
+                        "VWAP 狀態": st.column_config.TextColumn(width=95, disabled=True, help="價格相對成交量加權平均價的位置；上方偏多、下方偏空。"),
+                        "開盤區間": st.column_config.TextColumn(width=100, disabled=True, help="09:00–09:15 顯示形成中的即時低點－高點；09:15 後固定為完整開盤區間。"),
+                        "量能": st.column_config.TextColumn(width=65, disabled=True, help="目前累積量相對最近交易日同時段平均量。"),
+                        "盤中觸發": st.column_config.TextColumn(width=150, disabled=True, help="僅在盤中條件同時成立時提供觀察提示，不是自動買賣指令。"),
+                        "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="通過條件後，以開盤區間與 VWAP 推估進場、策略失效離場與第一目標；僅供觀察與回測。"),
+                    })
+                else:
+                    risk_column_config.update({
+                        "乖離": st.column_config.TextColumn(width=75, disabled=True, help="收盤價相對 20 日線的 ATR 距離；數值越大越不宜追價或追空。"),
+                        "隔日規則": st.column_config.TextColumn(width=130, disabled=True, help="僅在隔日條件成真時才列入評估，不是自動買賣指令。"),
+                        "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="通過條件後，以昨高／昨低與 ATR 推估進場、策略失效離場與第一目標；僅供觀察與回測。"),
+                    })
 
-        stock_table_signature = abs(hash((
-            tuple(df_display['代號'].astype(str).tolist()), tuple(input_cols)
-        )))
-        stock_editor_key = (
-            f"main_editor_{st.session_state.stock_strategy_editor_revision}_{stock_table_signature}"
-        )
-        edited_df = st.data_editor(
-            styled_df,
-            column_config={
-                **risk_column_config,
-                "移除": st.column_config.CheckboxColumn("刪除", width=40, help="勾選後刪除並自動遞補"),
-                "代號": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("代號"), 44, 62)),
-                "名稱": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("名稱"), 48, 88)),
-                "收盤價": st.column_config.TextColumn("成交價", width=_content_column_width(df_display.get("收盤價"), 52, 78), disabled=True),
-                "漲跌幅": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("漲跌幅"), 56, 78)),
-                "期貨": st.column_config.TextColumn(width=_content_column_width(df_display.get("期貨"), 44, 70), disabled=True),
-                "當日漲停價": st.column_config.TextColumn(width=_content_column_width(df_display.get("當日漲停價"), 54, 78), disabled=True),
-                "當日跌停價": st.column_config.TextColumn(width=_content_column_width(df_display.get("當日跌停價"), 54, 78), disabled=True),
-                "成交價價差": st.column_config.TextColumn(
-                    width=80, disabled=True,
-                    help="目前成交價減去昨日收盤價；正值為上漲點數，負值為下跌點數。"
-                ),
-                "5日線價差": st.column_config.TextColumn(
-                    width=80, disabled=True,
-                    help="目前成交價減去 5 日均線；正值在均線上方，負值在均線下方。"
-                ),
-                "狀態": None, # 設定為 None 即可在資料編輯器中隱藏該欄位
-                "戰略備註": st.column_config.TextColumn("戰略備註 ✏️", width=note_width_px, disabled=False),
-            },
-            hide_index=True, width='stretch' if risk_preview_enabled else 'content', num_rows="fixed", key=stock_editor_key
-        )
+            stock_table_signature = abs(hash((
+                tuple(df_display['代號'].astype(str).tolist()), tuple(input_cols)
+            )))
+            stock_editor_key = (
+                f"main_editor_{st.session_state.stock_strategy_editor_revision}_{stock_table_signature}"
+            )
+            edited_df = st.data_editor(
+                styled_df,
+                column_config={
+                    **risk_column_config,
+                    "移除": st.column_config.CheckboxColumn("刪除", width=40, help="勾選後刪除並自動遞補"),
+                    "代號": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("代號"), 44, 62)),
+                    "名稱": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("名稱"), 48, 88)),
+                    "收盤價": st.column_config.TextColumn("成交價", width=_content_column_width(df_display.get("收盤價"), 52, 78), disabled=True),
+                    "漲跌幅": st.column_config.TextColumn(disabled=True, width=_content_column_width(df_display.get("漲跌幅"), 56, 78)),
+                    "期貨": st.column_config.TextColumn(width=_content_column_width(df_display.get("期貨"), 44, 70), disabled=True),
+                    "當日漲停價": st.column_config.TextColumn(width=_content_column_width(df_display.get("當日漲停價"), 54, 78), disabled=True),
+                    "當日跌停價": st.column_config.TextColumn(width=_content_column_width(df_display.get("當日跌停價"), 54, 78), disabled=True),
+                    "成交價價差": st.column_config.TextColumn(
+                        width=80, disabled=True,
+                        help="目前成交價減去昨日收盤價；正值為上漲點數，負值為下跌點數。"
+                    ),
+                    "5日線價差": st.column_config.TextColumn(
+                        width=80, disabled=True,
+                        help="目前成交價減去 5 日均線；正值在均線上方，負值在均線下方。"
+                    ),
+                    "狀態": None, # 設定為 None 即可在資料編輯器中隱藏該欄位
+                    "戰略備註": st.column_config.TextColumn("戰略備註 ✏️", width=note_width_px, disabled=False),
+                },
+                hide_index=True, width='stretch' if risk_preview_enabled else 'content', num_rows="fixed", key=stock_editor_key
+            )
 
-        if risk_preview_enabled and risk_details:
-            detail_options = {
-                f"{row['代號']} {row['名稱']}": str(row['代號'])
-                for _, row in df_display.iterrows()
-            }
-            if detail_options:
-                selected_risk_label = st.selectbox("查看策略信心明細", list(detail_options), key="risk_filter_detail_code")
-                selected_risk = risk_details[detail_options[selected_risk_label]]
-                rule_label = "盤中觸發" if is_daytrade_mode else "隔日規則"
-                data_time_text = f"｜盤中資料更新：{selected_risk['data_time']}" if is_daytrade_mode and selected_risk.get('data_time') else ""
-                plan_text = selected_risk.get('trade_plan', {}).get('detail', '尚未預判點位。')
-                confidence_detail = selected_risk.get('confidence', {})
-                st.caption(
-                    f"進場信心 {confidence_detail.get('score', '—')} 分（{confidence_detail.get('label', '—')}）｜"
-                    f"{selected_risk['detail']}｜{rule_label}：{selected_risk['rule']}｜進出場預判：{plan_text}{data_time_text}。"
-                    "信心分代表條件一致度，不是勝率；僅供策略觀察與回測。"
-                )
-                selected_code = detail_options[selected_risk_label]
-                selected_rows = df_display[df_display['代號'].astype(str) == selected_code]
-                if not selected_rows.empty:
-                    selected_row = selected_rows.iloc[0]
+            if risk_preview_enabled and risk_details:
+                detail_options = {
+                    f"{row['代號']} {row['名稱']}": str(row['代號'])
+                    for _, row in df_display.iterrows()
+                }
+                if detail_options:
+                    selected_risk_label = st.selectbox("查看策略信心明細", list(detail_options), key="risk_filter_detail_code")
+                    selected_risk = risk_details[detail_options[selected_risk_label]]
+                    rule_label = "盤中觸發" if is_daytrade_mode else "隔日規則"
+                    data_time_text = f"｜盤中資料更新：{selected_risk['data_time']}" if is_daytrade_mode and selected_risk.get('data_time') else ""
+                    plan_text = selected_risk.get('trade_plan', {}).get('detail', '尚未預判點位。')
+                    confidence_detail = selected_risk.get('confidence', {})
                     st.caption(
-                        f"附加狀態：{selected_row.get('訊號狀態', '—')}｜{selected_row.get('市場一致', '—')}｜"
-                        f"{selected_row.get('資料狀態', '—')}｜買賣價差 {selected_row.get('買賣價差', '—')}。"
+                        f"進場信心 {confidence_detail.get('score', '—')} 分（{confidence_detail.get('label', '—')}）｜"
+                        f"{selected_risk['detail']}｜{rule_label}：{selected_risk['rule']}｜進出場預判：{plan_text}{data_time_text}。"
+                        "信心分代表條件一致度，不是勝率；僅供策略觀察與回測。"
                     )
+                    selected_code = detail_options[selected_risk_label]
+                    selected_rows = df_display[df_display['代號'].astype(str) == selected_code]
+                    if not selected_rows.empty:
+                        selected_row = selected_rows.iloc[0]
+                        st.caption(
+                            f"附加狀態：{selected_row.get('訊號狀態', '—')}｜{selected_row.get('市場一致', '—')}｜"
+                            f"{selected_row.get('資料狀態', '—')}｜買賣價差 {selected_row.get('買賣價差', '—')}。"
+                        )
 
-            if st.button(
-                '📝 記錄目前表格的已觸發股票訊號', key='record_stock_strategy_signals',
-                help='一次記錄目前股票表格中所有已觸發或回測確認、且達最低進場信心的個股；不是只記錄單一個股。'
-            ):
-                records = []
-                recordable_rows = df_display[df_display.get('_附加可記錄', False) == True]
-                for _, row in recordable_rows.iterrows():
-                    plan = parse_trade_plan_numbers(row.get('進出場預判'))
-                    score = row.get('信心分')
-                    records.append({
-                        '市場': '股票', '商品鍵': str(row['代號']), '代碼': str(row['代號']),
-                        '名稱': str(row['名稱']), '策略': strategy_mode, '方向': risk_direction,
-                        '訊號狀態': str(row.get('訊號狀態', '')), '評分': _safe_number(score),
-                        '信心判讀': str(row.get('信心判讀', '')),
-                        '進場價': plan['entry'], '停損價': plan['stop'], '目標價': plan['target'],
-                        '最新價': _safe_number(row.get('收盤價')),
-                        '風險': str(row.get('風險', '')), '資料狀態': str(row.get('資料狀態', '')),
-                    })
-                added, saved = register_strategy_signals(records)
-                if saved:
-                    save_data_cache(
-                        st.session_state.stock_data, st.session_state.ignored_stocks,
-                        st.session_state.all_candidates, st.session_state.saved_notes
-                    )
-                    st.toast(f'已新增 {added} 筆股票訊號；重複訊號不另建。', icon='📝')
-                else:
-                    st.error('訊號紀錄儲存失敗，請確認檔案是否可寫入。')
+                if st.button(
+                    '📝 記錄目前表格的已觸發股票訊號', key='record_stock_strategy_signals',
+                    help='一次記錄目前股票表格中所有已觸發或回測確認、且達最低進場信心的個股；不是只記錄單一個股。'
+                ):
+                    records = []
+                    recordable_rows = df_display[df_display.get('_附加可記錄', False) == True]
+                    for _, row in recordable_rows.iterrows():
+                        plan = trade_plan_record(row)
+                        score = row.get('信心分')
+                        records.append({
+                            '市場': '股票', '商品鍵': str(row['代號']), '代碼': str(row['代號']),
+                            '名稱': str(row['名稱']), '策略': strategy_mode, '方向': risk_direction,
+                            '訊號狀態': str(row.get('訊號狀態', '')), '評分': _safe_number(score),
+                            '信心判讀': str(row.get('信心判讀', '')),
+                            '進場價': plan['entry'], '停損價': plan['stop'], '目標價': plan['target'],
+                            '觸發價': plan['trigger'],
+                            '最新價': _safe_number(row.get('收盤價')),
+                            '風險': str(row.get('風險', '')), '資料狀態': str(row.get('資料狀態', '')),
+                        })
+                    added, saved = register_strategy_signals(records)
+                    if saved:
+                        save_data_cache(
+                            st.session_state.stock_data, st.session_state.ignored_stocks,
+                            st.session_state.all_candidates, st.session_state.saved_notes
+                        )
+                        st.toast(f'已新增 {added} 筆股票訊號；重複訊號不另建。', icon='📝')
+                    else:
+                        st.error('訊號紀錄儲存失敗，請確認檔案是否可寫入。')
         
-        if not edited_df.empty:
-            trigger_rerun = False
-            if "移除" in edited_df.columns:
-                to_remove = edited_df[edited_df["移除"] == True]
-                if not to_remove.empty:
-                    remove_codes = to_remove["代號"].unique()
+            if not edited_df.empty:
+                trigger_rerun = False
+                if "移除" in edited_df.columns:
+                    to_remove = edited_df[edited_df["移除"] == True]
+                    if not to_remove.empty:
+                        remove_codes = to_remove["代號"].unique()
                     
-                    # 速度優化：將刪除的股票資料快取起來
-                    for c in remove_codes: 
-                        st.session_state.ignored_stocks.add(str(c))
-                        row_data = st.session_state.stock_data[st.session_state.stock_data["代號"] == c]
-                        if not row_data.empty:
-                            st.session_state.ignored_data_cache[c] = row_data.iloc[0].to_dict()
+                        # 速度優化：將刪除的股票資料快取起來
+                        for c in remove_codes: 
+                            st.session_state.ignored_stocks.add(str(c))
+                            row_data = st.session_state.stock_data[st.session_state.stock_data["代號"] == c]
+                            if not row_data.empty:
+                                st.session_state.ignored_data_cache[c] = row_data.iloc[0].to_dict()
                             
-                    # --- 新增：資源優化，忽略快取超過 5 檔就刪除最舊的 ---
-                    while len(st.session_state.ignored_data_cache) > 5:
-                        oldest_key = next(iter(st.session_state.ignored_data_cache))
-                        del st.session_state.ignored_data_cache[oldest_key]
-                    # ----------------------------------------------------
+                        # --- 新增：資源優化，忽略快取超過 5 檔就刪除最舊的 ---
+                        while len(st.session_state.ignored_data_cache) > 5:
+                            oldest_key = next(iter(st.session_state.ignored_data_cache))
+                            del st.session_state.ignored_data_cache[oldest_key]
+                        # ----------------------------------------------------
                     
-                    # 從表格資料中剃除
-                    st.session_state.stock_data = st.session_state.stock_data[~st.session_state.stock_data["代號"].isin(remove_codes)]
+                        # 從表格資料中剃除
+                        st.session_state.stock_data = st.session_state.stock_data[~st.session_state.stock_data["代號"].isin(remove_codes)]
                     
-                    # 🚀 關鍵修改：立刻儲存並 Rerun，讓畫面「瞬間」移除該行，
-                    # 把耗時的遞補抓取動作交給最下方的區塊去處理，避免畫面卡死！
-                    save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-                    st.session_state.stock_strategy_editor_revision += 1
-                    st.rerun()
+                        # 🚀 關鍵修改：立刻儲存並 Rerun，讓畫面「瞬間」移除該行，
+                        # 把耗時的遞補抓取動作交給最下方的區塊去處理，避免畫面卡死！
+                        save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+                        st.session_state.stock_strategy_editor_revision += 1
+                        st.rerun()
 
-            if trigger_rerun: st.rerun()
+                if trigger_rerun: st.rerun()
 
-        df_curr = st.session_state.stock_data
-        if not df_curr.empty:
-            upload_count = len(df_curr) if '_source' not in df_curr.columns else len(df_curr[df_curr['_source'] == 'upload'])
-            limit = st.session_state.limit_rows
+            df_curr = st.session_state.stock_data
+            if not df_curr.empty:
+                upload_count = len(df_curr) if '_source' not in df_curr.columns else len(df_curr[df_curr['_source'] == 'upload'])
+                limit = st.session_state.limit_rows
             
-            # 若筆數不足且有候補名單，則進行自動遞補
-            if upload_count < limit and st.session_state.all_candidates:
-                needed = limit - upload_count
-                existing_codes = set(st.session_state.stock_data['代號'].astype(str))
-                futures_copy = dict(st.session_state.futures_list)
-                notes_copy = dict(st.session_state.saved_notes)
-                code_map_copy, _ = load_local_stock_names()
+                # 若筆數不足且有候補名單，則進行自動遞補
+                if upload_count < limit and st.session_state.all_candidates:
+                    needed = limit - upload_count
+                    existing_codes = set(st.session_state.stock_data['代號'].astype(str))
+                    futures_copy = dict(st.session_state.futures_list)
+                    notes_copy = dict(st.session_state.saved_notes)
+                    code_map_copy, _ = load_local_stock_names()
                 
-                cand_to_fetch = []
-                for cand in st.session_state.all_candidates:
-                     c_code, c_name, c_source, c_extra = str(cand[0]), cand[1], cand[2], cand[3]
-                     if c_source != 'upload' or c_code in st.session_state.ignored_stocks or c_code in existing_codes: continue
-                     cand_to_fetch.append((c_code, c_name, c_source, c_extra))
-                     if len(cand_to_fetch) >= needed: break
+                    cand_to_fetch = []
+                    for cand in st.session_state.all_candidates:
+                         c_code, c_name, c_source, c_extra = str(cand[0]), cand[1], cand[2], cand[3]
+                         if c_source != 'upload' or c_code in st.session_state.ignored_stocks or c_code in existing_codes: continue
+                         cand_to_fetch.append((c_code, c_name, c_source, c_extra))
+                         if len(cand_to_fetch) >= needed: break
                      
-                if cand_to_fetch:
-                    with st.spinner(f"正在遞補 {len(cand_to_fetch)} 檔股票..."):
-                        # 🚀 1. 優先從「背景預載快取」提取 (瞬間完成)
-                        ready_results = []
-                        remaining_to_fetch = []
+                    if cand_to_fetch:
+                        with st.spinner(f"正在遞補 {len(cand_to_fetch)} 檔股票..."):
+                            # 🚀 1. 優先從「背景預載快取」提取 (瞬間完成)
+                            ready_results = []
+                            remaining_to_fetch = []
                         
-                        for cand in cand_to_fetch:
-                            t_code = cand[0]
-                            if t_code in st.session_state.get('prefetch_cache', {}):
-                                ready_results.append(st.session_state.prefetch_cache.pop(t_code))
-                            else:
-                                remaining_to_fetch.append(cand)
+                            for cand in cand_to_fetch:
+                                t_code = cand[0]
+                                if t_code in st.session_state.get('prefetch_cache', {}):
+                                    ready_results.append(st.session_state.prefetch_cache.pop(t_code))
+                                else:
+                                    remaining_to_fetch.append(cand)
                                 
-                        if ready_results:
-                            st.session_state.stock_data = pd.concat([st.session_state.stock_data, pd.DataFrame(ready_results)], ignore_index=True)
+                            if ready_results:
+                                st.session_state.stock_data = pd.concat([st.session_state.stock_data, pd.DataFrame(ready_results)], ignore_index=True)
                             
-                        # 🚀 2. 若快取不足(例如剛開啟網頁還沒預載完)，才即時抓取剩下的
-                        if remaining_to_fetch:
-                            def _replenish_worker(cand):
-                                time.sleep(API_REQUEST_GAP_SECONDS)
-                                t_code, t_name, t_src, t_extra = cand
-                                res = fetch_stock_data_raw(t_code, t_name, t_extra, futures_copy, notes_copy, code_map_copy, st.session_state.get('sj_logged_in', False), st.session_state.get('sj_api', None))
-                                if res: res.update({'_source': t_src, '_order': t_extra, '_source_rank': 1})
-                                return res
-
-                            with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-                                results = list(executor.map(_replenish_worker, remaining_to_fetch))
+                            # 🚀 2. 若快取不足(例如剛開啟網頁還沒預載完)，才即時抓取剩下的
+                            if remaining_to_fetch:
+                                def _replenish_worker(cand):
+                                    time.sleep(API_REQUEST_GAP_SECONDS)
+                                    t_code, t_name, t_src, t_extra = cand
+                                    res = fetch_stock_data_raw(t_code, t_name, t_extra, futures_copy, notes_copy, code_map_copy, st.session_state.get('sj_logged_in', False), st.session_state.get('sj_api', None))
+                                    if res: res.update({'_source': t_src, '_order': t_extra, '_source_rank': 1})
+                                    return res
+
+                                results = map_analysis_jobs(_replenish_worker, remaining_to_fetch)
                                 valid_results = [r for r in results if r]
                                 if valid_results:
                                     st.session_state.stock_data = pd.concat([st.session_state.stock_data, pd.DataFrame(valid_results)], ignore_index=True)
                         
-                        # 修正：強制依據來源優先權進行排序，讓自動遞補的新股票排在查詢的股票之前
-                        if '_source_rank' in st.session_state.stock_data.columns:
-                            st.session_state.stock_data = st.session_state.stock_data.sort_values(by=['_source_rank', '_order']).reset_index(drop=True)
+                            # 修正：強制依據來源優先權進行排序，讓自動遞補的新股票排在查詢的股票之前
+                            if '_source_rank' in st.session_state.stock_data.columns:
+                                st.session_state.stock_data = st.session_state.stock_data.sort_values(by=['_source_rank', '_order']).reset_index(drop=True)
 
-                        save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-                        st.rerun() # 遞補完成，立刻更新畫面
+                            save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+                            st.rerun() # 遞補完成，立刻更新畫面
 
         
-        st.markdown("---")
-        # 重新配置欄位比例與順序
-        col_rt_update, col_btn, col_clear = st.columns([2, 2.5, 2])
-        with col_rt_update: btn_rt_update = st.button("⏱️ 即時更新報價", width='stretch', type="primary")
-        with col_btn: btn_update = st.button("⚡ 執行更新&儲存手動備註", width='stretch')
-        with col_clear: btn_clear_notes = st.button("🧹 清除手動備註", width='stretch', help="清除所有記憶的戰略備註內容")
-
-        if btn_rt_update:
-            if st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api'):
-                sj_api = st.session_state.sj_api
-                updated = False
-                with st.spinner("正在透過永豐API更新報價..."):
-                    for i, row in st.session_state.stock_data.iterrows():
-                        code = str(row['代號'])
-                        try:
-                            contract = None
-                            if code in ["TWF=F", "TMF=F"]:
-                                if code == "TWF=F":
-                                    contract = min([c for c in sj_api.Contracts.Futures.TXF if c.code[-2:] not in ["R1", "R2"] and '/' not in c.code], key=lambda c: getattr(c, 'delivery_date', '999999'))
-                                else:
-                                    contract = sj_api.Contracts.Futures.TMF.TMFR1
-                            else:
-                                try: contract = sj_api.Contracts.Stocks[code]
-                                except: pass
-                            
-                            if contract:
-                                snap = get_stream_quotes(sj_api, [contract])
-                                if snap and len(snap) > 0:
-                                    snapshot = snap[0]
-                                    rt_price = snapshot.close
-                                    if rt_price > 0:
-                                        rt_change_rate = snapshot_change_rate(snapshot, rt_price)
-                                        st.session_state.stock_data.at[i, '收盤價'] = rt_price
-                                        if rt_change_rate is not None:
-                                            st.session_state.stock_data.at[i, '漲跌幅'] = rt_change_rate
-                                        st.session_state.stock_data.at[i, '成交價價差'] = price_change_amount(
-                                            rt_price, rt_change_rate
-                                        )
-                                        st.session_state.stock_data.at[i, '_quote_bid'] = _safe_number(getattr(snapshot, 'buy_price', None))
-                                        st.session_state.stock_data.at[i, '_quote_ask'] = _safe_number(getattr(snapshot, 'sell_price', None))
-                                        st.session_state.stock_data.at[i, '_quote_time'] = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S')
-                                        st.session_state.stock_data.at[i, '狀態'] = recalculate_row(st.session_state.stock_data.iloc[i], points_map)
-                                        updated = True
-                        except Exception:
-                            pass
-                if updated:
-                    tz_tw = pytz.timezone('Asia/Taipei')
-                    st.session_state.last_rt_update_time = datetime.now(tz_tw).strftime("%Y/%m/%d %H:%M:%S")
-                    update_strategy_signal_outcomes({
-                        str(row['代號']): _safe_number(row.get('收盤價'))
-                        for _, row in st.session_state.stock_data.iterrows()
-                    })
-                    save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-                    st.session_state.stock_strategy_editor_revision += 1
-                    st.rerun()
+            st.markdown("---")
+            # 重新配置欄位比例與順序
+            col_rt_update, col_btn, col_clear = st.columns([2, 2.5, 2])
+            with col_rt_update: btn_rt_update = st.button("⏱️ 即時更新報價", width='stretch', type="primary")
+            with col_btn: btn_update = st.button("⚡ 執行更新&儲存手動備註", width='stretch')
+            with col_clear: btn_clear_notes = st.button("🧹 清除手動備註", width='stretch', help="清除所有記憶的戰略備註內容")
+
+            if btn_rt_update:
+                if st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api'):
+                    sj_api = st.session_state.sj_api
+                    updated = False
+                    with st.spinner("正在透過永豐API更新報價..."):
+                        quote_time = datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S')
+                        for i, row in st.session_state.stock_data.iterrows():
+                            try:
+                                contract = resolve_stock_room_contract(sj_api, row['代號'])
+                                if contract:
+                                    snap = get_stream_quotes(sj_api, [contract])
+                                    if snap and snap[0] is not None:
+                                        updated = apply_stock_stream_quote(
+                                            st.session_state.stock_data, i, snap[0], points_map, quote_time
+                                        ) or updated
+                            except Exception:
+                                pass
+                    if updated:
+                        tz_tw = pytz.timezone('Asia/Taipei')
+                        st.session_state.last_rt_update_time = datetime.now(tz_tw).strftime("%Y/%m/%d %H:%M:%S")
+                        update_strategy_signal_outcomes({
+                            str(row['代號']): _safe_number(row.get('收盤價'))
+                            for _, row in st.session_state.stock_data.iterrows()
+                        })
+                        save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+                        st.session_state.stock_strategy_editor_revision += 1
+                        st.rerun()
+                    else:
+                        st.warning("目前未取得任何有效即時報價，原表格資料未變更。")
                 else:
-                    st.warning("目前未取得任何有效即時報價，原表格資料未變更。")
-            else:
-                st.warning("⚠️ 請先登入永豐 API 才能使用即時更新報價功能。")
-
-        if btn_clear_notes:
-            st.session_state.saved_notes = {}
-            st.toast("手動備註已清除", icon="🧹")
-            if not st.session_state.stock_data.empty:
-                 for idx, row in st.session_state.stock_data.iterrows():
-                     clean_note, _ = generate_note_from_points(row.get('_points', []), "", show_3d_hilo)
-                     st.session_state.stock_data.at[idx, '戰略備註'] = clean_note
-                     if '_auto_note' in st.session_state.stock_data.columns: st.session_state.stock_data.at[idx, '_auto_note'] = clean_note
-            save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-            st.session_state.stock_strategy_editor_revision += 1
-            st.rerun()
+                    st.warning("⚠️ 請先登入永豐 API 才能使用即時更新報價功能。")
+
+            if btn_clear_notes:
+                st.session_state.saved_notes = {}
+                st.toast("手動備註已清除", icon="🧹")
+                if not st.session_state.stock_data.empty:
+                     for idx, row in st.session_state.stock_data.iterrows():
+                         clean_note, _ = generate_note_from_points(row.get('_points', []), "", show_3d_hilo)
+                         st.session_state.stock_data.at[idx, '戰略備註'] = clean_note
+                         if '_auto_note' in st.session_state.stock_data.columns: st.session_state.stock_data.at[idx, '_auto_note'] = clean_note
+                save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+                st.session_state.stock_strategy_editor_revision += 1
+                st.rerun()
         
-        if 'last_rt_update_time' in st.session_state:
-            st.markdown(f"<div style='text-align: left; color: #888; font-size: 14px; margin-top: 5px; margin-bottom: 10px;'>透過永豐API即時更新報價(更新時間:{st.session_state.last_rt_update_time})</div>", unsafe_allow_html=True)
+            if 'last_rt_update_time' in st.session_state:
+                st.markdown(f"<div style='text-align: left; color: #888; font-size: 14px; margin-top: 5px; margin-bottom: 10px;'>透過永豐API即時更新報價(更新時間:{st.session_state.last_rt_update_time})</div>", unsafe_allow_html=True)
 
-        if btn_update:
-             update_map = edited_df.set_index('代號')[['戰略備註']].to_dict('index')
-             for i, row in st.session_state.stock_data.iterrows():
-                code = row['代號']
-                if code in update_map:
-                    new_note = update_map[code]['戰略備註']
-                    if str(row['戰略備註']) != str(new_note):
-                        b_auto = str(auto_notes_dict.get(code, "")).strip()
-                        n_note = str(new_note).strip()
-                        st.session_state.saved_notes[code] = n_note[len(b_auto):] if b_auto and n_note.startswith(b_auto) else f"[M]{n_note}"
-                    st.session_state.stock_data.at[i, '戰略備註'] = new_note
-                st.session_state.stock_data.at[i, '狀態'] = recalculate_row(st.session_state.stock_data.iloc[i], points_map)
-             save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
-             st.session_state.stock_strategy_editor_revision += 1
-             st.rerun()
-
-        st.markdown("### ⚡獨立計算")
-        indep_strategy_mode = None
-        if risk_preview_enabled:
-            if 'risk_filter_market_data' not in st.session_state:
-                st.session_state.risk_filter_market_data = {
-                    'attention': {}, 'disposition': [], 'updated': None, 'errors': []
-                }
-            indep_ctrl1, indep_ctrl2, indep_ctrl3 = st.columns(3)
-            with indep_ctrl1:
-                indep_strategy_mode = st.radio(
-                    "獨立計算模式", ["當沖預覽", "隔日／波段"], horizontal=True,
-                    key="indep_strategy_mode",
-                    help="09:00–09:15 會取得即時串流＋1 分 K；09:15 後改用 5 分 K，計算 VWAP、開盤區間與量能。"
+            if st.toggle(
+                "⚡ 串流即時看板", key='stock_live_view_enabled',
+                help='開啟後每秒比對永豐串流報價，只更新有變動的成交價、買賣價與狀態；不重跑整頁，也不必按即時更新。'
+            ):
+                render_stock_live_view(points_map)
+
+            if btn_update:
+                 update_map = edited_df.set_index('代號')[['戰略備註']].to_dict('index')
+                 for i, row in st.session_state.stock_data.iterrows():
+                    code = row['代號']
+                    if code in update_map:
+                        new_note = update_map[code]['戰略備註']
+                        if str(row['戰略備註']) != str(new_note):
+                            b_auto = str(auto_notes_dict.get(code, "")).strip()
+                            n_note = str(new_note).strip()
+                            st.session_state.saved_notes[code] = n_note[len(b_auto):] if b_auto and n_note.startswith(b_auto) else f"[M]{n_note}"
+                        st.session_state.stock_data.at[i, '戰略備註'] = new_note
+                    st.session_state.stock_data.at[i, '狀態'] = recalculate_row(st.session_state.stock_data.iloc[i], points_map)
+                 save_data_cache(st.session_state.stock_data, st.session_state.ignored_stocks, st.session_state.all_candidates, st.session_state.saved_notes)
+                 st.session_state.stock_strategy_editor_revision += 1
+                 st.rerun()
+
+            st.markdown("### ⚡獨立計算")
+            indep_strategy_mode = None
+            if risk_preview_enabled:
+                st.session_state.risk_filter_market_data = market_risk_list_state()
+                indep_ctrl1, indep_ctrl2, indep_ctrl3 = st.columns(3)
+                with indep_ctrl1:
+                    indep_strategy_mode = st.radio(
+                        "獨立計算模式", ["當沖預覽", "隔日／波段"], horizontal=True,
+                        key="indep_strategy_mode",
+                        help="09:00–09:15 會取得即時串流＋1 分 K；09:15 後改用 5 分 K，計算 VWAP、開盤區間與量能。"
+                    )
+                    indep_direction = st.radio("判斷方向", ["多頭", "空頭"], horizontal=True, key="indep_risk_direction")
+                with indep_ctrl2:
+                    indep_min_score = st.slider("最低進場信心", 60, 90, 75, key="indep_risk_min_score")
+                    indep_max_extension = st.slider("最大乖離（ATR）", 1.0, 3.0, 2.0, 0.1, key="indep_risk_max_extension")
+                with indep_ctrl3:
+                    indep_block_attention = st.checkbox("封鎖注意累計 ≥ 2", value=True, key="indep_risk_block_attention")
+                    indep_show_only_eligible = st.checkbox("只顯示可操作候選", value=False, key="indep_risk_show_eligible")
+                    if st.button("🔄 更新注意／處置名單", key="refresh_indep_market_risk_data"):
+                        with st.spinner("正在更新上市／上櫃注意與處置名單..."):
+                            refresh_market_risk_index()
+                        st.session_state.risk_filter_market_data = market_risk_list_state()
+                if indep_strategy_mode == "當沖預覽":
+                    st.caption("VWAP 判讀：偏多＝站上 VWAP（紅色）；偏空＝跌破 VWAP（綠色）。09:00–09:15 使用快照＋1 分 K，之後使用 5 分 K。")
+            col_q1, col_q2 = st.columns([5, 1.5])
+            with col_q1:
+                indep_selection = st.multiselect(
+                    "🔍 快速查詢 (中文/代號)", 
+                    options=stock_options, 
+                    key="indep_search_multiselect", 
+                    placeholder="輸入 2330 或 台積電..."
                 )
-                indep_direction = st.radio("判斷方向", ["多頭", "空頭"], horizontal=True, key="indep_risk_direction")
-            with indep_ctrl2:
-                indep_min_score = st.slider("最低進場信心", 60, 90, 75, key="indep_risk_min_score")
-                indep_max_extension = st.slider("最大乖離（ATR）", 1.0, 3.0, 2.0, 0.1, key="indep_risk_max_extension")
-            with indep_ctrl3:
-                indep_block_attention = st.checkbox("封鎖注意累計 ≥ 2", value=True, key="indep_risk_block_attention")
-                indep_show_only_eligible = st.checkbox("只顯示可操作候選", value=False, key="indep_risk_show_eligible")
-                if st.button("🔄 更新注意／處置名單", key="refresh_indep_market_risk_data"):
-                    fetch_market_risk_lists.clear()
-                    with st.spinner("正在更新上市／上櫃注意與處置名單..."):
-                        attention, disposition, errors = fetch_market_risk_lists()
-                    st.session_state.risk_filter_market_data = {
-                        'attention': attention,
-                        'disposition': disposition,
-                        'updated': datetime.now(pytz.timezone('Asia/Taipei')).strftime('%Y/%m/%d %H:%M:%S'),
-                        'errors': errors
-                    }
-            if indep_strategy_mode == "當沖預覽":
-                st.caption("VWAP 判讀：偏多＝站上 VWAP（紅色）；偏空＝跌破 VWAP（綠色）。09:00–09:15 使用快照＋1 分 K，之後使用 5 分 K。")
-        col_q1, col_q2 = st.columns([5, 1.5])
-        with col_q1:
-            indep_selection = st.multiselect(
-                "🔍 快速查詢 (中文/代號)", 
-                options=stock_options, 
-                key="indep_search_multiselect", 
-                placeholder="輸入 2330 或 台積電..."
-            )
-        with col_q2:
-            st.markdown("<div style='margin-top: 28px;'></div>", unsafe_allow_html=True)
-            btn_indep_run = st.button("🚀 執行分析", key="btn_indep_run", use_container_width=True)
+            with col_q2:
+                st.markdown("<div style='margin-top: 28px;'></div>", unsafe_allow_html=True)
+                btn_indep_run = st.button("🚀 執行分析", key="btn_indep_run", use_container_width=True)
             
-        cached_indep_data = st.session_state.get('stock_independent_raw_results', [])
-        if btn_indep_run and not indep_selection:
-            st.warning("請先選擇至少一檔股票再執行獨立分析。")
-        if (btn_indep_run and indep_selection) or cached_indep_data:
-            c_map_q, n_map_q = load_local_stock_names()
-            sj_logged = st.session_state.get('sj_logged_in', False)
-            sj_api_obj = st.session_state.get('sj_api', None)
-            indep_data = list(cached_indep_data)
-            if btn_indep_run and indep_selection:
-                if not st.session_state.futures_list:
-                    st.session_state.futures_list = fetch_futures_list()
-                f_set = st.session_state.futures_list
-                notes_copy = dict(st.session_state.get('saved_notes', {}))
-                indep_now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
-                indep_opening_micro = _is_opening_micro_window(indep_now_tw)
-                indep_intraday_interval = '1m' if indep_opening_micro else '5m'
-                indep_interval_label = '1 分 K' if indep_opening_micro else '5 分 K'
-                indep_codes = [item.split(' ', 1)[0] for item in indep_selection]
-                indep_snapshot_map = (
-                    fetch_stock_snapshot_map(sj_api_obj, indep_codes)
-                    if sj_logged and sj_api_obj is not None else {}
-                )
+            cached_indep_data = st.session_state.get('stock_independent_raw_results', [])
+            if btn_indep_run and not indep_selection:
+                st.warning("請先選擇至少一檔股票再執行獨立分析。")
+            if (btn_indep_run and indep_selection) or cached_indep_data:
+                c_map_q, n_map_q = load_local_stock_names()
+                sj_logged = st.session_state.get('sj_logged_in', False)
+                sj_api_obj = st.session_state.get('sj_api', None)
+                indep_data = list(cached_indep_data)
+                if btn_indep_run and indep_selection:
+                    if not st.session_state.futures_list:
+                        st.session_state.futures_list = fetch_futures_list()
+                    f_set = st.session_state.futures_list
+                    notes_copy = dict(st.session_state.get('saved_notes', {}))
+                    indep_now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
+                    indep_opening_micro = _is_opening_micro_window(indep_now_tw)
+                    indep_intraday_interval = '1m' if indep_opening_micro else '5m'
+                    indep_interval_label = '1 分 K' if indep_opening_micro else '5 分 K'
+                    indep_codes = [item.split(' ', 1)[0] for item in indep_selection]
+                    indep_snapshot_map = (
+                        fetch_stock_snapshot_map(sj_api_obj, indep_codes)
+                        if sj_logged and sj_api_obj is not None else {}
+                    )
 
-                with st.spinner("正在獨立分析..."):
-                    def _indep_worker(item):
-                        time.sleep(API_REQUEST_GAP_SECONDS)
-                        parts = item.split(' ', 1)
-                        q_code = parts[0]
-                        q_name = parts[1] if len(parts) > 1 else ""
-                        result = fetch_stock_data_raw(
-                            q_code, q_name, None, f_set, notes_copy,
-                            c_map_q, sj_logged, sj_api_obj
-                        )
-                        if result and risk_preview_enabled and indep_strategy_mode == "當沖預覽" and sj_logged and sj_api_obj is not None:
+                    with st.spinner("正在獨立分析..."):
+                        def _indep_worker(item):
                             time.sleep(API_REQUEST_GAP_SECONDS)
-                            intraday_df = fetch_shioaji_data(
-                                sj_api_obj, q_code, interval=indep_intraday_interval, lookback_days=3
-                            )
-                            snapshot = indep_snapshot_map.get(q_code)
-                            daytrade_metrics = calculate_daytrade_metrics(
-                                intraday_df, live_snapshot=snapshot, now_tw=indep_now_tw,
-                                interval_label=indep_interval_label,
+                            parts = item.split(' ', 1)
+                            q_code = parts[0]
+                            q_name = parts[1] if len(parts) > 1 else ""
+                            result = fetch_stock_data_raw(
+                                q_code, q_name, None, f_set, notes_copy,
+                                c_map_q, sj_logged, sj_api_obj
                             )
-                            if daytrade_metrics:
-                                result.update(daytrade_metrics)
-                                if snapshot is not None:
-                                    price = _safe_number(getattr(snapshot, 'close', None))
-                                    change_rate = snapshot_change_rate(snapshot, price) if price is not None else None
-                                    if price is not None and price > 0:
-                                        result['收盤價'] = price
-                                        if change_rate is not None:
-                                            result['漲跌幅'] = change_rate
-                                            result['成交價價差'] = price_change_amount(price, change_rate)
-                                    result['_quote_bid'] = _safe_number(getattr(snapshot, 'buy_price', None))
-                                    result['_quote_ask'] = _safe_number(getattr(snapshot, 'sell_price', None))
-                                    result['_quote_time'] = indep_now_tw.strftime('%Y/%m/%d %H:%M:%S')
-                        return result
-
-                    with ThreadPoolExecutor(max_workers=ANALYSIS_MAX_WORKERS) as executor:
-                        results = list(executor.map(_indep_worker, indep_selection))
+                            if result and risk_preview_enabled and indep_strategy_mode == "當沖預覽" and sj_logged and sj_api_obj is not None:
+                                time.sleep(API_REQUEST_GAP_SECONDS)
+                                intraday_df = fetch_shioaji_data(
+                                    sj_api_obj, q_code, interval=indep_intraday_interval, lookback_days=3
+                                )
+                                snapshot = indep_snapshot_map.get(q_code)
+                                daytrade_metrics = calculate_daytrade_metrics(
+                                    intraday_df, live_snapshot=snapshot, now_tw=indep_now_tw,
+                                    interval_label=indep_interval_label,
+                                )
+                                if daytrade_metrics:
+                                    result.update(daytrade_metrics)
+                                    if snapshot is not None:
+                                        price = _safe_number(getattr(snapshot, 'close', None))
+                                        change_rate = snapshot_change_rate(snapshot, price) if price is not None else None
+                                        if price is not None and price > 0:
+                                            result['收盤價'] = price
+                                            if change_rate is not None:
+                                                result['漲跌幅'] = change_rate
+                                                result['成交價價差'] = price_change_amount(price, change_rate)
+                                        result['_quote_bid'] = _safe_number(getattr(snapshot, 'buy_price', None))
+                                        result['_quote_ask'] = _safe_number(getattr(snapshot, 'sell_price', None))
+                                        result['_quote_time'] = indep_now_tw.strftime('%Y/%m/%d %H:%M:%S')
+                            return result
+
+                        results = map_analysis_jobs(_indep_worker, indep_selection)
                         indep_data = [res for res in results if res]
+                    if indep_data:
+                        st.session_state.stock_independent_raw_results = indep_data
+                    else:
+                        st.warning("本次未取得有效資料，已保留上一份獨立分析結果。")
+                        indep_data = list(cached_indep_data)
+
                 if indep_data:
-                    st.session_state.stock_independent_raw_results = indep_data
-                else:
-                    st.warning("本次未取得有效資料，已保留上一份獨立分析結果。")
-                    indep_data = list(cached_indep_data)
-
-            if indep_data:
-                df_indep = pd.DataFrame(indep_data)
-                indep_is_daytrade = risk_preview_enabled and indep_strategy_mode == "當沖預覽"
-                indep_risk_details = {}
-
-                if risk_preview_enabled:
-                    indep_market_risk_data = st.session_state.risk_filter_market_data
-                    indep_attention_counts = indep_market_risk_data.get('attention', {})
-                    indep_disposition_codes = indep_market_risk_data.get('disposition', [])
-                    indep_market_lists_updated = bool(indep_market_risk_data.get('updated')) and not indep_market_risk_data.get('errors')
-                    if indep_is_daytrade and (not sj_logged or sj_api_obj is None):
-                        st.info("當沖預覽需要登入永豐 Shioaji 才能取得即時串流與分 K；目前仍會顯示日 K 資料，但盤中條件會標示為資料不足。")
+                    df_indep = pd.DataFrame(indep_data)
+                    indep_is_daytrade = risk_preview_enabled and indep_strategy_mode == "當沖預覽"
+                    indep_risk_details = {}
+
+                    if risk_preview_enabled:
+                        indep_market_risk_data = st.session_state.risk_filter_market_data
+                        indep_attention_counts = indep_market_risk_data.get('attention', {})
+                        indep_disposition_codes = indep_market_risk_data.get('disposition', [])
+                        indep_market_lists_updated = bool(indep_market_risk_data.get('updated')) and not indep_market_risk_data.get('errors')
+                        if indep_is_daytrade and (not sj_logged or sj_api_obj is None):
+                            st.info("當沖預覽需要登入永豐 Shioaji 才能取得即時串流與分 K；目前仍會顯示日 K 資料，但盤中條件會標示為資料不足。")
                 
-                # 重新套用戰略備註與價差邏輯
-                for i, row in df_indep.iterrows():
-                    pts = row.get('_points', [])
-                    manual = st.session_state.saved_notes.get(row['代號'], "")
-                    n_full, n_auto = generate_note_from_points(pts, manual, show_3d_hilo)
-                    df_indep.at[i, "戰略備註"] = n_full
-                    df_indep.at[i, "名稱"] = row['名稱'].replace('🔴 ', '').replace('🟢 ', '').replace('⚪ ', '')
-                    price_difference = price_change_amount(row.get('收盤價'), row.get('漲跌幅'))
-                    df_indep.at[i, '成交價價差'] = (
-                        round(price_difference, 2) if price_difference is not None else None
-                    )
-                    
-                    ma5_val = row.get('_ma5')
-                    if pd.isna(ma5_val):
-                        for p in pts:
-                            if p.get('tag') in ['多', '空', '平']:
-                                ma5_val = p.get('val')
-                                break
-                    if pd.notna(ma5_val):
-                        close_p = row.get('收盤價')
-                        if pd.notna(close_p) and str(close_p).strip() != "":
-                            try: df_indep.at[i, '5日線價差'] = round(float(close_p) - float(ma5_val), 2)
-                            except: pass
-
-                if risk_preview_enabled:
+                    # 重新套用戰略備註與價差邏輯
                     for i, row in df_indep.iterrows():
-                        result = calculate_daytrade_filter_result(
-                            row, indep_direction, indep_attention_counts, indep_disposition_codes,
-                            indep_market_lists_updated, indep_block_attention
-                        ) if indep_is_daytrade else calculate_risk_filter_result(
-                            row, indep_direction, indep_max_extension, indep_attention_counts, indep_disposition_codes,
-                            indep_market_lists_updated, indep_block_attention
+                        pts = row.get('_points', [])
+                        manual = st.session_state.saved_notes.get(row['代號'], "")
+                        n_full, n_auto = generate_note_from_points(pts, manual, show_3d_hilo)
+                        df_indep.at[i, "戰略備註"] = n_full
+                        df_indep.at[i, "名稱"] = row['名稱'].replace('🔴 ', '').replace('🟢 ', '').replace('⚪ ', '')
+                        price_difference = price_change_amount(row.get('收盤價'), row.get('漲跌幅'))
+                        df_indep.at[i, '成交價價差'] = (
+                            round(price_difference, 2) if price_difference is not None else None
                         )
-                        code = str(row.get('代號', ''))
-                        if indep_is_daytrade:
-                            daily_risk = calculate_risk_filter_result(
+                    
+                        ma5_val = row.get('_ma5')
+                        if pd.isna(ma5_val):
+                            for p in pts:
+                                if p.get('tag') in ['多', '空', '平']:
+                                    ma5_val = p.get('val')
+                                    break
+                        if pd.notna(ma5_val):
+                            close_p = row.get('收盤價')
+                            if pd.notna(close_p) and str(close_p).strip() != "":
+                                try: df_indep.at[i, '5日線價差'] = round(float(close_p) - float(ma5_val), 2)
+                                except: pass
+
+                    if risk_preview_enabled:
+                        df_indep = join_market_risk_columns(df_indep)
+                        for i, row in df_indep.iterrows():
+                            result = calculate_daytrade_filter_result(
+                                row, indep_direction, indep_attention_counts, indep_disposition_codes,
+                                indep_market_lists_updated, indep_block_attention
+                            ) if indep_is_daytrade else calculate_risk_filter_result(
                                 row, indep_direction, indep_max_extension, indep_attention_counts, indep_disposition_codes,
                                 indep_market_lists_updated, indep_block_attention
                             )
-                            if not daily_risk['eligible']:
-                                result['eligible'] = False
-                                if result['rule'].startswith('觸發：'):
-                                    result['rule'] = f"不交易：盤前門檻未通過（{daily_risk['rule']}）"
-                            df_indep.at[i, '風險'] = daily_risk['risk']
-                            df_indep.at[i, 'VWAP 狀態'] = result['vwap_status']
-                            df_indep.at[i, '開盤區間'] = result['opening_range']
-                            volume_ratio = _as_float(row.get('_daytrade_volume_ratio'))
-                            df_indep.at[i, '量能'] = f"{_format_compact_number(volume_ratio, 2)}x" if volume_ratio is not None else "資料不足"
-                            df_indep.at[i, '盤中觸發'] = result['rule']
+                            code = str(row.get('代號', ''))
+                            if indep_is_daytrade:
+                                daily_risk = calculate_risk_filter_result(
+                                    row, indep_direction, indep_max_extension, indep_attention_counts, indep_disposition_codes,
+                                    indep_market_lists_updated, indep_block_attention
+                                )
+                                if not daily_risk['eligible']:
+                                    result['eligible'] = False
+                                    if result['rule'].startswith('觸發：'):
+                                        result['rule'] = f"不交易：盤前門檻未通過（{daily_risk['rule']}）"
+                                df_indep.at[i, '風險'] = daily_risk['risk']
+                                df_indep.at[i, 'VWAP 狀態'] = result['vwap_status']
+                                df_indep.at[i, '開盤區間'] = result['opening_range']
+                                volume_ratio = _as_float(row.get('_daytrade_volume_ratio'))
+                                df_indep.at[i, '量能'] = f"{_format_compact_number(volume_ratio, 2)}x" if volume_ratio is not None else "資料不足"
+                                df_indep.at[i, '盤中觸發'] = result['rule']
+                            else:
+                                df_indep.at[i, '風險'] = result['risk']
+                                df_indep.at[i, '乖離'] = f"{_format_compact_number(result['extension'], 1, signed=True)} ATR" if result['extension'] is not None else "—"
+                                df_indep.at[i, '隔日規則'] = result['rule']
+                            trade_plan = build_trade_plan(row, indep_direction, indep_is_daytrade, result)
+                            result['trade_plan'] = trade_plan
+                            signal_state = classify_signal_state(
+                                result['rule'], result['eligible'], result['score'], indep_min_score
+                            )
+                            data_time = row.get('_daytrade_data_time') if indep_is_daytrade else None
+                            required_ready = bool(data_time) if indep_is_daytrade else result.get('extension') is not None
+                            quote_time = row.get('_quote_time') or data_time
+                            data_health = build_data_health(
+                                quote_time, required_ready,
+                                live_expected=bool(row.get('_quote_time')) or indep_is_daytrade
+                            )
+                            bid = _safe_number(row.get('_quote_bid'))
+                            ask = _safe_number(row.get('_quote_ask'))
+                            reference_price = _safe_number(row.get('收盤價'))
+                            tick = get_tick_size(reference_price) if reference_price is not None else 0.01
+                            spread_ticks = (
+                                (ask - bid) / tick
+                                if bid is not None and ask is not None and ask >= bid and tick > 0 else None
+                            )
+                            market_alignment = calculate_market_alignment(indep_direction, market_bias)
+                            current_price = (
+                                _safe_number(row.get('_daytrade_close')) if indep_is_daytrade else None
+                            ) or _safe_number(row.get('收盤價'))
+                            confidence = calculate_entry_confidence(
+                                result['score'], signal_state, current_price, trade_plan, indep_direction,
+                                data_health, market_alignment, result.get('detail', '')
+                            )
+                            result['confidence'] = confidence
+                            indep_risk_details[code] = result
+                            df_indep.at[i, '進出場預判'] = trade_plan['summary']
+                            for key, column in TRADE_PLAN_PRICE_COLUMNS.items():
+                                df_indep.at[i, column] = trade_plan[key]
+                            df_indep.at[i, '支撐壓力'] = build_stock_support_resistance(row, indep_is_daytrade)
+                            df_indep.at[i, '訊號狀態'] = signal_state
+                            df_indep.at[i, '信心分'] = confidence['score']
+                            df_indep.at[i, '信心判讀'] = confidence['label']
+                            df_indep.at[i, '市場一致'] = market_alignment
+                            df_indep.at[i, '資料狀態'] = data_health
+                            df_indep.at[i, '買賣價差'] = f'{spread_ticks:.0f}跳' if spread_ticks is not None else '—'
+                            df_indep.at[i, '_indep_eligible'] = result['eligible'] and confidence['score'] >= indep_min_score
+
+                        if indep_show_only_eligible:
+                            df_indep = df_indep[df_indep['_indep_eligible']].reset_index(drop=True)
+                            if df_indep.empty:
+                                st.warning("目前沒有符合門檻的候選；可降低最低評分、放寬最大乖離，或改看完整結果。")
+
+                        if indep_is_daytrade:
+                            input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "風險", "VWAP 狀態", "開盤區間", "量能", "訊號狀態", "信心分", "信心判讀", "支撐壓力", "盤中觸發", "進出場預判", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
                         else:
-                            df_indep.at[i, '風險'] = result['risk']
-                            df_indep.at[i, '乖離'] = f"{_format_compact_number(result['extension'], 1, signed=True)} ATR" if result['extension'] is not None else "—"
-                            df_indep.at[i, '隔日規則'] = result['rule']
-                        trade_plan = build_trade_plan(row, indep_direction, indep_is_daytrade, result)
-                        result['trade_plan'] = trade_plan
-                        signal_state = classify_signal_state(
-                            result['rule'], result['eligible'], result['score'], indep_min_score
-                        )
-                        data_time = row.get('_daytrade_data_time') if indep_is_daytrade else None
-                        required_ready = bool(data_time) if indep_is_daytrade else result.get('extension') is not None
-                        quote_time = row.get('_quote_time') or data_time
-                        data_health = build_data_health(
-                            quote_time, required_ready,
-                            live_expected=bool(row.get('_quote_time')) or indep_is_daytrade
-                        )
-                        bid = _safe_number(row.get('_quote_bid'))
-                        ask = _safe_number(row.get('_quote_ask'))
-                        reference_price = _safe_number(row.get('收盤價'))
-                        tick = get_tick_size(reference_price) if reference_price is not None else 0.01
-                        spread_ticks = (
-                            (ask - bid) / tick
-                            if bid is not None and ask is not None and ask >= bid and tick > 0 else None
-                        )
-                        market_alignment = calculate_market_alignment(indep_direction, market_bias)
-                        current_price = (
-                            _safe_number(row.get('_daytrade_close')) if indep_is_daytrade else None
-                        ) or _safe_number(row.get('收盤價'))
-                        confidence = calculate_entry_confidence(
-                            result['score'], signal_state, current_price, trade_plan['summary'], indep_direction,
-                            data_health, market_alignment, result.get('detail', '')
-                        )
-                        result['confidence'] = confidence
-                        indep_risk_details[code] = result
-                        df_indep.at[i, '進出場預判'] = trade_plan['summary']
-                        df_indep.at[i, '支撐壓力'] = build_stock_support_resistance(row, indep_is_daytrade)
-                        df_indep.at[i, '訊號狀態'] = signal_state
-                        df_indep.at[i, '信心分'] = confidence['score']
-                        df_indep.at[i, '信心判讀'] = confidence['label']
-                        df_indep.at[i, '市場一致'] = market_alignment
-                        df_indep.at[i, '資料狀態'] = data_health
-                        df_indep.at[i, '買賣價差'] = f'{spread_ticks:.0f}跳' if spread_ticks is not None else '—'
-                        df_indep.at[i, '_indep_eligible'] = result['eligible'] and confidence['score'] >= indep_min_score
-
-                    if indep_show_only_eligible:
-                        df_indep = df_indep[df_indep['_indep_eligible']].reset_index(drop=True)
-                        if df_indep.empty:
-                            st.warning("目前沒有符合門檻的候選；可降低最低評分、放寬最大乖離，或改看完整結果。")
-
-                    if indep_is_daytrade:
-                        input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "風險", "VWAP 狀態", "開盤區間", "量能", "訊號狀態", "信心分", "信心判讀", "支撐壓力", "盤中觸發", "進出場預判", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
+                            input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "風險", "訊號狀態", "信心分", "信心判讀", "乖離", "支撐壓力", "隔日規則", "進出場預判", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
                     else:
-                        input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "風險", "訊號狀態", "信心分", "信心判讀", "乖離", "支撐壓力", "隔日規則", "進出場預判", "市場一致", "當日漲停價", "當日跌停價", "期貨", "資料狀態", "買賣價差"]
-                else:
-                    input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "當日漲停價", "當日跌停價", "期貨"]
-                for col in input_cols:
-                    if col not in df_indep.columns: df_indep[col] = None
+                        input_cols = ["代號", "名稱", "戰略備註", "收盤價", "漲跌幅", "成交價價差", "5日線價差", "當日漲停價", "當日跌停價", "期貨"]
+                    for col in input_cols:
+                        if col not in df_indep.columns: df_indep[col] = None
                     
-                cols_to_fmt = ["當日漲停價", "當日跌停價", "成交價價差", "5日線價差"]
-                for c in cols_to_fmt:
-                    if c in df_indep.columns: df_indep[c] = df_indep[c].apply(fmt_price)
+                    cols_to_fmt = ["當日漲停價", "當日跌停價", "成交價價差", "5日線價差"]
+                    for c in cols_to_fmt:
+                        if c in df_indep.columns: df_indep[c] = df_indep[c].apply(fmt_price)
 
-                # 強制轉換為 object 型別，以防寫入字串時發生 TypeError
-                if "收盤價" in df_indep.columns: df_indep["收盤價"] = df_indep["收盤價"].astype(object)
-                if "漲跌幅" in df_indep.columns: df_indep["漲跌幅"] = df_indep["漲跌幅"].astype(object)
+                    # 強制轉換為 object 型別，以防寫入字串時發生 TypeError
+                    if "收盤價" in df_indep.columns: df_indep["收盤價"] = df_indep["收盤價"].astype(object)
+                    if "漲跌幅" in df_indep.columns: df_indep["漲跌幅"] = df_indep["漲跌幅"].astype(object)
 
-                if "收盤價" in df_indep.columns and "漲跌幅" in df_indep.columns:
-                    for i in range(len(df_indep)):
-                        try:
-                            p = float(df_indep.at[i, "收盤價"])
-                            chg = float(df_indep.at[i, "漲跌幅"])
-                            df_indep.at[i, "收盤價"] = fmt_price(p)
-                            df_indep.at[i, "漲跌幅"] = _signed_percent(chg)
-                        except:
-                            df_indep.at[i, "收盤價"] = fmt_price(df_indep.at[i, "收盤價"])
-                            try: df_indep.at[i, "漲跌幅"] = _signed_percent(float(df_indep.at[i, '漲跌幅']))
-                            except: pass
-
-                for col in input_cols:
-                    if col != "信心分":
-                        df_indep[col] = df_indep[col].map(_blank_display_text)
-
-                # 套用與主表格完全一致的顏色邏輯
-                styled_indep = df_indep[input_cols].style.apply(style_tab1_df, axis=1)
-                indep_column_config = {}
-                if risk_preview_enabled:
-                    indep_column_config.update({
-                        "風險": st.column_config.TextColumn("處置／注意", width=95, disabled=True, help="官方注意與處置查核結果；不預測漲跌方向。"),
-                        "訊號狀態": st.column_config.TextColumn(width=88, disabled=True),
-                        "信心分": st.column_config.ProgressColumn("進場信心", min_value=0, max_value=100, format="%d", width=100, help="條件一致度，不是勝率。"),
-                        "信心判讀": st.column_config.TextColumn(width=80, disabled=True),
-                        "支撐壓力": st.column_config.TextColumn(width=120, disabled=True),
-                        "市場一致": st.column_config.TextColumn(width=90, disabled=True),
-                        "資料狀態": st.column_config.TextColumn(width=96, disabled=True),
-                    })
-                    if indep_is_daytrade:
-                        indep_column_config.update({
-                            "VWAP 狀態": st.column_config.TextColumn(width=95, disabled=True, help="偏多：站上 VWAP；偏空：跌破 VWAP。"),
-                            "開盤區間": st.column_config.TextColumn(width=100, disabled=True, help="09:00–09:15 顯示形成中的即時低點－高點；09:15 後固定為完整開盤區間。"),
-                            "量能": st.column_config.TextColumn(width=65, disabled=True, help="目前累積量相對最近交易日同時段平均量。"),
-                            "盤中觸發": st.column_config.TextColumn(width=150, disabled=True, help="僅為盤中觀察提示，不是自動買賣指令。"),
-                            "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="以開盤區間與 VWAP 推估進場、策略失效離場與第一目標。"),
-                        })
-                    else:
+                    if "收盤價" in df_indep.columns and "漲跌幅" in df_indep.columns:
+                        for i in range(len(df_indep)):
+                            try:
+                                p = float(df_indep.at[i, "收盤價"])
+                                chg = float(df_indep.at[i, "漲跌幅"])
+                                df_indep.at[i, "收盤價"] = fmt_price(p)
+                                df_indep.at[i, "漲跌幅"] = _signed_percent(chg)
+                            except:
+                                df_indep.at[i, "收盤價"] = fmt_price(df_indep.at[i, "收盤價"])
+                                try: df_indep.at[i, "漲跌幅"] = _signed_percent(float(df_indep.at[i, '漲跌幅']))
+                                except: pass
+
+                    for col in input_cols:
+                        if col != "信心分":
+                            df_indep[col] = df_indep[col].map(_blank_display_text)
+
+                    # 套用與主表格完全一致的顏色邏輯
+                    styled_indep = df_indep[input_cols].style.apply(style_tab1_df, axis=1)
+                    indep_column_config = {}
+                    if risk_preview_enabled:
                         indep_column_config.update({
-                            "乖離": st.column_config.TextColumn(width=75, disabled=True),
-                            "隔日規則": st.column_config.TextColumn(width=130, disabled=True),
-                            "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="以昨高／昨低與 ATR 推估進場、策略失效離場與第一目標。"),
+                            "風險": st.column_config.TextColumn("處置／注意", width=95, disabled=True, help="官方注意與處置查核結果；不預測漲跌方向。"),
+                            "訊號狀態": st.column_config.TextColumn(width=88, disabled=True),
+                            "信心分": st.column_config.ProgressColumn("進場信心", min_value=0, max_value=100, format="%d", width=100, help="條件一致度，不是勝率。"),
+                            "信心判讀": st.column_config.TextColumn(width=80, disabled=True),
+                            "支撐壓力": st.column_config.TextColumn(width=120, disabled=True),
+                            "市場一致": st.column_config.TextColumn(width=90, disabled=True),
+                            "資料狀態": st.column_config.TextColumn(width=96, disabled=True),
                         })
+                        if indep_is_daytrade:
+                            indep_column_config.update({
+                                "VWAP 狀態": st.column_config.TextColumn(width=95, disabled=True, help="偏多：站上 VWAP；偏空：跌破 VWAP。"),
+                                "開盤區間": st.column_config.TextColumn(width=100, disabled=True, help="09:00–09:15 顯示形成中的即時低點－高點；09:15 後固定為完整開盤區間。"),
+                                "量能": st.column_config.TextColumn(width=65, disabled=True, help="目前累積量相對最近交易日同時段平均量。"),
+                                "盤中觸發": st.column_config.TextColumn(width=150, disabled=True, help="僅為盤中觀察提示，不是自動買賣指令。"),
+                                "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="以開盤區間與 VWAP 推估進場、策略失效離場與第一目標。"),
+                            })
+                        else:
+                            indep_column_config.update({
+                                "乖離": st.column_config.TextColumn(width=75, disabled=True),
+                                "隔日規則": st.column_config.TextColumn(width=130, disabled=True),
+                                "進出場預判": st.column_config.TextColumn(width=160, disabled=True, help="以昨高／昨低與 ATR 推估進場、策略失效離場與第一目標。"),
+                            })
 
-                st.dataframe(
-                    styled_indep,
-                    column_config={
-                        **indep_column_config,
-                        "代號": st.column_config.TextColumn(width=_content_column_width(df_indep.get("代號"), 44, 62)),
-                        "名稱": st.column_config.TextColumn(width=_content_column_width(df_indep.get("名稱"), 48, 88)),
-                        "收盤價": st.column_config.TextColumn("成交價", width=_content_column_width(df_indep.get("收盤價"), 52, 78)),
-                        "漲跌幅": st.column_config.TextColumn(width=_content_column_width(df_indep.get("漲跌幅"), 56, 78)),
-                        "期貨": st.column_config.TextColumn(width=_content_column_width(df_indep.get("期貨"), 44, 70)),
-                        "當日漲停價": st.column_config.TextColumn(width=_content_column_width(df_indep.get("當日漲停價"), 54, 78)),
-                        "當日跌停價": st.column_config.TextColumn(width=_content_column_width(df_indep.get("當日跌停價"), 54, 78)),
-                        "成交價價差": st.column_config.TextColumn(
-                            width=80,
-                            help="目前成交價減去昨日收盤價；正值為上漲點數，負值為下跌點數。"
-                        ),
-                        "5日線價差": st.column_config.TextColumn(
-                            width=80,
-                            help="目前成交價減去 5 日均線；正值在均線上方，負值在均線下方。"
-                        ),
-                        "買賣價差": st.column_config.TextColumn(
-                            width=75,
-                            help="即時最佳賣價與最佳買價的距離，換算為跳動單位。"
-                        ),
-                        "狀態": None, # 設定為 None 隱藏獨立計算結果的狀態欄位
-                        "戰略備註": st.column_config.TextColumn("戰略備註", width=note_width_px)
-                    },
-                    hide_index=True, width='content', key="indep_table_output"
-                )
-
-                if indep_risk_details and not df_indep.empty:
-                    detail_options = {
-                        f"{row['代號']} {row['名稱']}": str(row['代號'])
-                        for _, row in df_indep.iterrows()
-                    }
-                    selected_label = st.selectbox("查看獨立計算信心明細", list(detail_options), key="indep_risk_detail_code")
-                    selected_result = indep_risk_details[detail_options[selected_label]]
-                    rule_label = "盤中觸發" if indep_is_daytrade else "隔日規則"
-                    data_time_text = f"｜盤中資料更新：{selected_result['data_time']}" if indep_is_daytrade and selected_result.get('data_time') else ""
-                    plan_text = selected_result.get('trade_plan', {}).get('detail', '尚未預判點位。')
-                    confidence_detail = selected_result.get('confidence', {})
-                    st.caption(
-                        f"進場信心 {confidence_detail.get('score', '—')} 分（{confidence_detail.get('label', '—')}）｜"
-                        f"{selected_result['detail']}｜{rule_label}：{selected_result['rule']}｜"
-                        f"進出場預判：{plan_text}{data_time_text}。信心分代表條件一致度，不是勝率。"
+                    st.dataframe(
+                        styled_indep,
+                        column_config={
+                            **indep_column_config,
+                            "代號": st.column_config.TextColumn(width=_content_column_width(df_indep.get("代號"), 44, 62)),
+                            "名稱": st.column_config.TextColumn(width=_content_column_width(df_indep.get("名稱"), 48, 88)),
+                            "收盤價": st.column_config.TextColumn("成交價", width=_content_column_width(df_indep.get("收盤價"), 52, 78)),
+                            "漲跌幅": st.column_config.TextColumn(width=_content_column_width(df_indep.get("漲跌幅"), 56, 78)),
+                            "期貨": st.column_config.TextColumn(width=_content_column_width(df_indep.get("期貨"), 44, 70)),
+                            "當日漲停價": st.column_config.TextColumn(width=_content_column_width(df_indep.get("當日漲停價"), 54, 78)),
+                            "當日跌停價": st.column_config.TextColumn(width=_content_column_width(df_indep.get("當日跌停價"), 54, 78)),
+                            "成交價價差": st.column_config.TextColumn(
+                                width=80,
+                                help="目前成交價減去昨日收盤價；正值為上漲點數，負值為下跌點數。"
+                            ),
+                            "5日線價差": st.column_config.TextColumn(
+                                width=80,
+                                help="目前成交價減去 5 日均線；正值在均線上方，負值在均線下方。"
+                            ),
+                            "買賣價差": st.column_config.TextColumn(
+                                width=75,
+                                help="即時最佳賣價與最佳買價的距離，換算為跳動單位。"
+                            ),
+                            "狀態": None, # 設定為 None 隱藏獨立計算結果的狀態欄位
+                            "戰略備註": st.column_config.TextColumn("戰略備註", width=note_width_px)
+                        },
+                        hide_index=True, width='content', key="indep_table_output"
                     )
 
+                    if indep_risk_details and not df_indep.empty:
+                        detail_options = {
+                            f"{row['代號']} {row['名稱']}": str(row['代號'])
+                            for _, row in df_indep.iterrows()
+                        }
+                        selected_label = st.selectbox("查看獨立計算信心明細", list(detail_options), key="indep_risk_detail_code")
+                        selected_result = indep_risk_details[detail_options[selected_label]]
+                        rule_label = "盤中觸發" if indep_is_daytrade else "隔日規則"
+                        data_time_text = f"｜盤中資料更新：{selected_result['data_time']}" if indep_is_daytrade and selected_result.get('data_time') else ""
+                        plan_text = selected_result.get('trade_plan', {}).get('detail', '尚未預判點位。')
+                        confidence_detail = selected_result.get('confidence', {})
+                        st.caption(
+                            f"進場信心 {confidence_detail.get('score', '—')} 分（{confidence_detail.get('label', '—')}）｜"
+                            f"{selected_result['detail']}｜{rule_label}：{selected_result['rule']}｜"
+                            f"進出場預判：{plan_text}{data_time_text}。信心分代表條件一致度，不是勝率。"
+                        )
+
 with tab2:
-    tab2_1, tab2_2, tab2_3 = st.tabs(["當沖損益室", "波段信用室", "期權交易室"])
+    tab2_1, tab2_2, tab2_3 = st.tabs(
+        ["當沖損益室", "波段信用室", "期權交易室"],
+        default="當沖損益室", key="trade_pnl_active_tab", on_change="rerun",
+    )
     
     with tab2_1:
-        c1, c2, c3, c4, c5 = st.columns(5)
-        with c1:
-            calc_price = st.number_input("基準價格", value=float(st.session_state.calc_base_price), step=0.01, format="%.12g", key="input_base_price")
-            if calc_price != st.session_state.calc_base_price:
-                st.session_state.calc_base_price = calc_price
-                st.session_state.calc_view_price = apply_tick_rules(calc_price)
-        with c2: shares = st.number_input("股數", value=1000, step=1000)
-        with c3: discount = st.number_input("手續費折扣 (折)", value=2.8, step=0.1, min_value=0.1, max_value=10.0)
-        with c4: min_fee = st.number_input("最低手續費 (元)", value=20, step=1)
-        with c5: tick_count = st.number_input("顯示檔數 (檔)", value=10, min_value=1, max_value=50, step=1)
-        direction = st.radio("交易方向", ["當沖多 (先買後賣)", "當沖空 (先賣後買)"], horizontal=True)
-
-        stop_col1, stop_col2, _ = st.columns([1, 1, 3])
-        with stop_col1:
-            day_stop_loss_percent = st.number_input(
-                "停損幅度 (%)", value=5.0, min_value=0.0, max_value=100.0,
-                step=0.5, format="%.12g", key="day_stop_loss_percent"
-            )
-        with stop_col2:
-            day_is_long = "多" in direction
-            day_stop_price = calculate_stop_loss_price(calc_price, day_stop_loss_percent, day_is_long)
-            stop_direction = "下跌" if day_is_long else "上漲"
-            st.metric("停損價", fmt_price(day_stop_price), f"{stop_direction} {day_stop_loss_percent:g}%")
+        if tab2.open and tab2_1.open:
+            c1, c2, c3, c4, c5 = st.columns(5)
+            with c1:
+                calc_price = st.number_input("基準價格", value=float(st.session_state.calc_base_price), step=0.01, format="%.12g", key="input_base_price")
+                if calc_price != st.session_state.calc_base_price:
+                    st.session_state.calc_base_price = calc_price
+                    st.session_state.calc_view_price = apply_tick_rules(calc_price)
+            with c2: shares = keep_tab_widget("day_shares", st.number_input("股數", value=tab_widget_value("day_shares", 1000), step=1000, key="day_shares"))
+            with c3: discount = keep_tab_widget("day_discount", st.number_input("手續費折扣 (折)", value=tab_widget_value("day_discount", 2.8), step=0.1, min_value=0.1, max_value=10.0, key="day_discount"))
+            with c4: min_fee = keep_tab_widget("day_min_fee", st.number_input("最低手續費 (元)", value=tab_widget_value("day_min_fee", 20), step=1, key="day_min_fee"))
+            with c5: tick_count = keep_tab_widget("day_tick_count", st.number_input("顯示檔數 (檔)", value=tab_widget_value("day_tick_count", 10), min_value=1, max_value=50, step=1, key="day_tick_count"))
+            direction_options = ["當沖多 (先買後賣)", "當沖空 (先賣後買)"]
+            direction = keep_tab_widget("day_direction", st.radio(
+                "交易方向", direction_options, index=tab_widget_index("day_direction", direction_options),
+                horizontal=True, key="day_direction",
+            ))
+
+            stop_col1, stop_col2, _ = st.columns([1, 1, 3])
+            with stop_col1:
+                day_stop_loss_percent = keep_tab_widget("day_stop_loss_percent", st.number_input(
+                    "停損幅度 (%)", value=tab_widget_value("day_stop_loss_percent", 5.0), min_value=0.0, max_value=100.0,
+                    step=0.5, format="%.12g", key="day_stop_loss_percent"
+                ))
+            with stop_col2:
+                day_is_long = "多" in direction
+                day_stop_price = calculate_stop_loss_price(calc_price, day_stop_loss_percent, day_is_long)
+                stop_direction = "下跌" if day_is_long else "上漲"
+                st.metric("停損價", fmt_price(day_stop_price), f"{stop_direction} {day_stop_loss_percent:g}%")
         
-        # --- 新增：目標價快速試算區 ---
-        st.markdown("##### 🎯 目標價快速試算")
-        col_t1, col_t2 = st.columns([1, 4])
-        with col_t1:
-            # 將 value 設為 None 並加入 placeholder，實現預設為空值
-            target_p = st.number_input("輸入目標價", value=None, step=0.5, format="%.12g", key="input_target_price", placeholder="請輸入...")
-        with col_t2:
-            fee_rate = 0.001425; tax_rate = 0.0015
-            base_p = st.session_state.calc_base_price
-            is_long = "多" in direction
+            # --- 新增：目標價快速試算區 ---
+            st.markdown("##### 🎯 目標價快速試算")
+            col_t1, col_t2 = st.columns([1, 4])
+            with col_t1:
+                # 將 value 設為 None 並加入 placeholder，實現預設為空值
+                target_p = keep_tab_widget("input_target_price", st.number_input("輸入目標價", value=tab_widget_value("input_target_price"), step=0.5, format="%.12g", key="input_target_price", placeholder="請輸入..."))
+            with col_t2:
+                base_p = st.session_state.calc_base_price
+                is_long = "多" in direction
             
-            # 加入防呆判斷：只有當使用者輸入數字時才進行計算
-            if target_p is not None:
-                if is_long:
-                    t_buy = base_p; t_sell = target_p
-                    t_buy_fee = max(min_fee, math.floor(t_buy * shares * fee_rate * (discount/10)))
-                    t_sell_fee = max(min_fee, math.floor(t_sell * shares * fee_rate * (discount/10)))
-                    t_tax = math.floor(t_sell * shares * tax_rate)
-                    t_cost = (t_buy * shares) + t_buy_fee
-                    t_income = (t_sell * shares) - t_sell_fee - t_tax
-                    t_profit = t_income - t_cost
-                    t_total_fee = t_buy_fee + t_sell_fee
-                else:
-                    t_sell = base_p; t_buy = target_p
-                    t_sell_fee = max(min_fee, math.floor(t_sell * shares * fee_rate * (discount/10)))
-                    t_buy_fee = max(min_fee, math.floor(t_buy * shares * fee_rate * (discount/10)))
-                    t_tax = math.floor(t_sell * shares * tax_rate)
-                    t_income = (t_sell * shares) - t_sell_fee - t_tax
-                    t_cost = (t_buy * shares) + t_buy_fee
-                    t_profit = t_income - t_cost
-                    t_total_fee = t_buy_fee + t_sell_fee
-                
-                t_roi = (t_profit / (base_p * shares) * 100) if (base_p * shares) != 0 else 0
+                # 加入防呆判斷：只有當使用者輸入數字時才進行計算
+                if target_p is not None:
+                    target_costs = calculate_stock_trade_costs(
+                        base_p, target_p, shares, discount, min_fee, is_long=is_long, day_trade=True
+                    )
+                    t_profit = float(target_costs['profit'])
+                    t_total_fee = float(target_costs['total_fee'])
+                    t_tax = float(target_costs['tax'])
+                    t_roi = float(target_costs['roi'])
                 
-                t_color = "#ff4b4b" if t_profit > 0 else ("#00e676" if t_profit < 0 else "white")
-                diff_val = target_p - base_p
-                diff_color = "#ff4b4b" if diff_val > 0 else ("#00e676" if diff_val < 0 else "white")
+                    t_color = "#ff4b4b" if t_profit > 0 else ("#00e676" if t_profit < 0 else "white")
+                    diff_val = target_p - base_p
+                    diff_color = "#ff4b4b" if diff_val > 0 else ("#00e676" if diff_val < 0 else "white")
                 
-                html_str = f"""
+                    html_str = f"""
                 <div style="font-size: 16px; display: flex; flex-wrap: wrap; gap: 15px; padding: 10px; background-color: rgba(255,255,255,0.05); border-radius: 8px; margin-top: 28px;">
                     <div>預估損益: <span style="color: {t_color}; font-weight: bold;">{int(t_profit):,} ({_format_compact_number(t_roi, 2, signed=True)}%)</span></div>
                     <div>手續費總和: <span style="color: #cccccc;">{int(t_total_fee):,}</span></div>
@@ -10907,9 +14815,9 @@ with tab2:
                     <div>價差: <span style="color: {diff_color}; font-weight: bold;">{_format_compact_number(diff_val, 2, signed=True)}</span></div>
                 </div>
                 """
-            else:
-                # 空值時的預設顯示狀態
-                html_str = f"""
+                else:
+                    # 空值時的預設顯示狀態
+                    html_str = f"""
                 <div style="font-size: 16px; display: flex; flex-wrap: wrap; gap: 15px; padding: 10px; background-color: rgba(255,255,255,0.05); border-radius: 8px; margin-top: 28px;">
                     <div>預估損益: <span style="color: white; font-weight: bold;">0 (+0.00%)</span></div>
                     <div>手續費總和: <span style="color: #cccccc;">0</span></div>
@@ -10918,199 +14826,157 @@ with tab2:
                 </div>
                 """
                 
-            st.markdown(html_str, unsafe_allow_html=True)
-        st.markdown("---")
-        
-        limit_up, limit_down = calculate_limits(st.session_state.calc_base_price)
-        b1, b2, _ = st.columns([1, 1, 6])
-        with b1:
-            if st.button("🔽 向下", width='stretch'):
-                if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = st.session_state.calc_base_price
-                st.session_state.calc_view_price = move_tick(st.session_state.calc_view_price, -tick_count)
-                st.rerun()
-        with b2:
-            if st.button("🔼 向上", width='stretch'):
-                if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = st.session_state.calc_base_price
-                st.session_state.calc_view_price = move_tick(st.session_state.calc_view_price, tick_count)
-                st.rerun()
+                st.markdown(html_str, unsafe_allow_html=True)
+            st.markdown("---")
         
-        ticks_range = range(tick_count, -(tick_count + 1), -1)
-        calc_data = []
-        base_p = st.session_state.calc_base_price
-        if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = base_p
-        view_p = st.session_state.calc_view_price
-        is_long = "多" in direction
-        fee_rate = 0.001425; tax_rate = 0.0015 
+            b1, b2, b3, b4, _ = st.columns([1, 1, 1, 1, 4])
+            with b1:
+                if st.button("🔽 向下", width='stretch'):
+                    if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = st.session_state.calc_base_price
+                    st.session_state.calc_view_price = shift_tick_price(st.session_state.calc_base_price, st.session_state.calc_view_price, -tick_count)
+                    st.rerun()
+            with b2:
+                if st.button("🔼 向上", width='stretch'):
+                    if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = st.session_state.calc_base_price
+                    st.session_state.calc_view_price = shift_tick_price(st.session_state.calc_base_price, st.session_state.calc_view_price, tick_count)
+                    st.rerun()
+            calc_grid = get_tick_grid(st.session_state.calc_base_price)
+            with b3:
+                if st.button("⏬ 跌停", width='stretch', disabled=calc_grid is None):
+                    st.session_state.calc_view_price = calc_grid['limit_down']
+                    st.rerun()
+            with b4:
+                if st.button("⏫ 漲停", width='stretch', disabled=calc_grid is None):
+                    st.session_state.calc_view_price = calc_grid['limit_up']
+                    st.rerun()
         
-        for i in ticks_range:
-            p = move_tick(view_p, i)
-            
-            if is_long:
-                buy_price = base_p; sell_price = p
-                buy_fee = max(min_fee, math.floor(buy_price * shares * fee_rate * (discount/10)))
-                sell_fee = max(min_fee, math.floor(sell_price * shares * fee_rate * (discount/10)))
-                tax = math.floor(sell_price * shares * tax_rate)
-                cost = (buy_price * shares) + buy_fee
-                income = (sell_price * shares) - sell_fee - tax
-                profit = income - cost
-                total_fee = buy_fee + sell_fee
-            else: 
-                sell_price = base_p; buy_price = p
-                sell_fee = max(min_fee, math.floor(sell_price * shares * fee_rate * (discount/10)))
-                buy_fee = max(min_fee, math.floor(buy_price * shares * fee_rate * (discount/10)))
-                tax = math.floor(sell_price * shares * tax_rate)
-                income = (sell_price * shares) - sell_fee - tax
-                cost = (buy_price * shares) + buy_fee
-                profit = income - cost
-                total_fee = buy_fee + sell_fee
-            roi = 0
-            if (base_p * shares) != 0: roi = (profit / (base_p * shares)) * 100
-            diff = p - base_p
-            diff_str = f"{diff:+.2f}".rstrip('0').rstrip('.') if diff != 0 else "0"
-            if diff > 0 and not diff_str.startswith('+'): diff_str = "+" + diff_str
-            
-            note_type = ""
-            if abs(p - limit_up) < 0.001: note_type = "up"
-            elif abs(p - limit_down) < 0.001: note_type = "down"
-            is_base = (abs(p - base_p) < 0.001)
-            
-            calc_data.append({
-                "成交價": fmt_price(p), "漲跌": diff_str, "預估損益": int(profit), "報酬率%": f"{_format_compact_number(roi, 2, signed=True)}%",
-                "手續費": int(total_fee), "交易稅": int(tax), "_profit": profit, "_note_type": note_type, "_is_base": is_base
-            })
-            
-        df_calc = pd.DataFrame(calc_data)
+            base_p = st.session_state.calc_base_price
+            if 'calc_view_price' not in st.session_state: st.session_state.calc_view_price = base_p
+            df_calc = build_daytrade_pnl_ladder(
+                base_p, st.session_state.calc_view_price, tick_count, shares, discount, min_fee, "多" in direction
+            )
         
-        def style_calc_row(row):
-            is_base = row['_is_base']
-            prof = row['_profit']
+            def style_calc_row(row):
+                is_base = row['_is_base']
+                prof = row['_profit']
             
-            if is_base: return ['background-color: #ffffcc; color: black; font-weight: bold; border: 2px solid #ffd700;'] * len(row)
-            if prof > 0: return ['color: #ff4b4b; font-weight: bold'] * len(row) 
-            if prof < 0: return ['color: #00cc00; font-weight: bold'] * len(row) 
-            return ['color: gray'] * len(row)
+                if is_base: return ['background-color: #ffffcc; color: black; font-weight: bold; border: 2px solid #ffd700;'] * len(row)
+                if prof > 0: return ['color: #ff4b4b; font-weight: bold'] * len(row) 
+                if prof < 0: return ['color: #00cc00; font-weight: bold'] * len(row) 
+                return ['color: gray'] * len(row)
 
-        if not df_calc.empty:
-            table_height = (len(df_calc) + 1) * 35
-            st.dataframe(
-                df_calc.style.apply(style_calc_row, axis=1), 
-                width=425, 
-                hide_index=True, 
-                height=table_height,
-                column_config={"_profit": None, "_note_type": None, "_is_base": None}
-            )
+            if not df_calc.empty:
+                table_height = (len(df_calc) + 1) * 35
+                st.dataframe(
+                    df_calc.style.apply(style_calc_row, axis=1), 
+                    width=425, 
+                    hide_index=True, 
+                    height=table_height,
+                    column_config={"_profit": None, "_note_type": None, "_is_base": None}
+                )
 
     with tab2_2:
-        c2_1, c2_2, c2_3, c2_4, c2_5 = st.columns(5)
-        with c2_1:
-            swing_calc_price = st.number_input("基準價格", value=None, step=0.5, format="%.12g", key="input_swing_base_price", placeholder="請輸入...")
-        with c2_2: swing_shares = st.number_input("股數", value=1000, step=1000, key="swing_shares")
-        with c2_3: swing_discount = st.number_input("手續費折扣 (折)", value=2.8, step=0.1, min_value=0.1, max_value=10.0, key="swing_discount")
-        with c2_4: swing_min_fee = st.number_input("最低手續費 (元)", value=20, step=1, key="swing_min_fee")
-        with c2_5: swing_tick_count = st.number_input("顯示檔數 (檔)", value=10, min_value=1, max_value=50, step=1, key="swing_tick_count")
+        if tab2.open and tab2_2.open:
+            c2_1, c2_2, c2_3, c2_4, c2_5 = st.columns(5)
+            with c2_1:
+                swing_calc_price = keep_tab_widget("input_swing_base_price", st.number_input("基準價格", value=tab_widget_value("input_swing_base_price"), step=0.5, format="%.12g", key="input_swing_base_price", placeholder="請輸入..."))
+            with c2_2: swing_shares = keep_tab_widget("swing_shares", st.number_input("股數", value=tab_widget_value("swing_shares", 1000), step=1000, key="swing_shares"))
+            with c2_3: swing_discount = keep_tab_widget("swing_discount", st.number_input("手續費折扣 (折)", value=tab_widget_value("swing_discount", 2.8), step=0.1, min_value=0.1, max_value=10.0, key="swing_discount"))
+            with c2_4: swing_min_fee = keep_tab_widget("swing_min_fee", st.number_input("最低手續費 (元)", value=tab_widget_value("swing_min_fee", 20), step=1, key="swing_min_fee"))
+            with c2_5: swing_tick_count = keep_tab_widget("swing_tick_count", st.number_input("顯示檔數 (檔)", value=tab_widget_value("swing_tick_count", 10), min_value=1, max_value=50, step=1, key="swing_tick_count"))
         
-        c2_type, c2_margin, c2_rate, c2_days, c2_fee_rate = st.columns(5)
-        with c2_type:
-            swing_type = st.selectbox("交易選項", ["個股", "融資(多)", "融券(空)"], key="swing_type")
-        with c2_margin:
-            margin_ratio = st.number_input("融資/券成數(%)", value=60.0 if swing_type == "融資(多)" else (90.0 if swing_type == "融券(空)" else 0.0), step=10.0, key="margin_ratio")
-        with c2_rate:
-            annual_rate = st.number_input("年利率(%)", value=6.25 if swing_type == "融資(多)" else (0.2 if swing_type == "融券(空)" else 0.0), step=0.1, key="annual_rate")
-        with c2_days:
-            swing_date_range = st.date_input("選擇區間", value=(datetime.now(tz_tw).date(), datetime.now(tz_tw).date() + timedelta(days=1)), key="swing_date_range")
-            if isinstance(swing_date_range, tuple) and len(swing_date_range) == 2:
-                swing_days = (swing_date_range[1] - swing_date_range[0]).days
-                if swing_days < 1: swing_days = 1
-            else:
-                swing_days = 1
-            st.caption(f"總天數: {swing_days} 天")
-        with c2_fee_rate:
-            short_fee_rate = st.number_input("借券費率(‱)", value=8.0 if swing_type == "融券(空)" else 0.0, step=1.0, key="short_fee_rate")
-
-        swing_stop_col1, swing_stop_col2, _ = st.columns([1, 1, 3])
-        with swing_stop_col1:
-            swing_stop_loss_percent = st.number_input(
-                "停損幅度 (%)", value=5.0, min_value=0.0, max_value=100.0,
-                step=0.5, format="%.12g", key="swing_stop_loss_percent"
-            )
-        with swing_stop_col2:
-            swing_is_long = swing_type != "融券(空)"
-            swing_stop_price = (
-                calculate_stop_loss_price(swing_calc_price, swing_stop_loss_percent, swing_is_long)
-                if swing_calc_price is not None else 0.0
-            )
-            swing_stop_direction = "下跌" if swing_is_long else "上漲"
-            st.metric(
-                "停損價", fmt_price(swing_stop_price) if swing_calc_price is not None else "—",
-                f"{swing_stop_direction} {swing_stop_loss_percent:g}%"
-            )
+            c2_type, c2_margin, c2_rate, c2_days, c2_fee_rate = st.columns(5)
+            with c2_type:
+                swing_type_options = ["個股", "融資(多)", "融券(空)"]
+                swing_type = keep_tab_widget("swing_type", st.selectbox(
+                    "交易選項", swing_type_options, index=tab_widget_index("swing_type", swing_type_options), key="swing_type"
+                ))
+            # 成數、利率與借券費率的預設值隨交易選項而定，保存值也按交易選項分開記。
+            with c2_margin:
+                margin_ratio = keep_tab_widget(f"margin_ratio@{swing_type}", st.number_input(
+                    "融資/券成數(%)",
+                    value=tab_widget_value(f"margin_ratio@{swing_type}", 60.0 if swing_type == "融資(多)" else (90.0 if swing_type == "融券(空)" else 0.0)),
+                    step=10.0, key="margin_ratio"
+                ))
+            with c2_rate:
+                annual_rate = keep_tab_widget(f"annual_rate@{swing_type}", st.number_input(
+                    "年利率(%)",
+                    value=tab_widget_value(f"annual_rate@{swing_type}", 6.25 if swing_type == "融資(多)" else (0.2 if swing_type == "融券(空)" else 0.0)),
+                    step=0.1, key="annual_rate"
+                ))
+            with c2_days:
+                swing_date_range = keep_tab_widget("swing_date_range", st.date_input(
+                    "選擇區間",
+                    value=tab_widget_value("swing_date_range", (datetime.now(tz_tw).date(), datetime.now(tz_tw).date() + timedelta(days=1))),
+                    key="swing_date_range"
+                ))
+                if isinstance(swing_date_range, tuple) and len(swing_date_range) == 2:
+                    swing_days = (swing_date_range[1] - swing_date_range[0]).days
+                    if swing_days < 1: swing_days = 1
+                else:
+                    swing_days = 1
+                st.caption(f"總天數: {swing_days} 天")
+            with c2_fee_rate:
+                short_fee_rate = keep_tab_widget(f"short_fee_rate@{swing_type}", st.number_input(
+                    "借券費率(‱)", value=tab_widget_value(f"short_fee_rate@{swing_type}", 8.0 if swing_type == "融券(空)" else 0.0),
+                    step=1.0, key="short_fee_rate"
+                ))
 
-        # --- 目標價快速試算區 ---
-        st.markdown("##### 🎯 目標價快速試算")
-        col_st1, col_st2 = st.columns([1, 4])
-        with col_st1:
-            swing_target_p = st.number_input("輸入目標價", value=None, step=0.5, format="%.12g", key="swing_target_price", placeholder="請輸入...")
-        with col_st2:
-            if swing_calc_price is not None and swing_target_p is not None:
-                s_base_p = swing_calc_price
-                s_fee_rate = 0.001425; s_tax_rate = 0.003
-                
-                t_buy_price = s_base_p if swing_type in ["個股", "融資(多)"] else swing_target_p
-                t_sell_price = swing_target_p if swing_type in ["個股", "融資(多)"] else s_base_p
-                
-                t_buy_fee = max(swing_min_fee, math.floor(t_buy_price * swing_shares * s_fee_rate * (swing_discount/10)))
-                t_sell_fee = max(swing_min_fee, math.floor(t_sell_price * swing_shares * s_fee_rate * (swing_discount/10)))
-                t_tax = math.floor(t_sell_price * swing_shares * s_tax_rate)
-                t_total_fee = t_buy_fee + t_sell_fee
-                
-                t_stock_value_buy = t_buy_price * swing_shares
-                t_stock_value_sell = t_sell_price * swing_shares
-                
-                t_profit = 0
-                t_interest = 0
-                t_borrow_fee = 0
-                t_roi = 0
-                
-                if swing_type == "個股":
-                    t_cost = t_stock_value_buy + t_buy_fee
-                    t_income = t_stock_value_sell - t_sell_fee - t_tax
-                    t_profit = t_income - t_cost
-                    t_roi = (t_profit / t_cost * 100) if t_cost > 0 else 0
-                elif swing_type == "融資(多)":
-                    t_margin_loan = math.floor(t_stock_value_buy * (margin_ratio/100) / 1000) * 1000
-                    t_self_prepare = t_stock_value_buy - t_margin_loan + t_buy_fee
-                    t_interest = round(t_margin_loan * (annual_rate/100) * (swing_days/365))
-                    t_net_sell = t_stock_value_sell - t_sell_fee - t_tax - t_margin_loan - t_interest
-                    t_profit = t_net_sell - t_self_prepare
-                    t_roi = (t_profit / t_self_prepare * 100) if t_self_prepare > 0 else 0
-                elif swing_type == "融券(空)":
-                    t_margin_deposit = math.ceil(t_stock_value_sell * (margin_ratio/100) / 100) * 100
-                    t_borrow_fee = math.floor(t_stock_value_sell * (short_fee_rate/10000))
-                    t_sell_guaranty = t_stock_value_sell - t_sell_fee - t_tax - t_borrow_fee
-                    t_interest = round((t_margin_deposit + t_sell_guaranty) * (annual_rate/100) * (swing_days/365))
-                    t_buy_cost = t_stock_value_buy + t_buy_fee
-                    t_refund = t_margin_deposit + t_sell_guaranty + t_interest - t_buy_cost
-                    t_profit = t_refund - t_margin_deposit
-                    t_roi = (t_profit / t_margin_deposit * 100) if t_margin_deposit > 0 else 0
-
-                t_color = "#ff4b4b" if t_profit > 0 else ("#00e676" if t_profit < 0 else "white")
-                t_diff_val = swing_target_p - s_base_p
-                t_diff_color = "#ff4b4b" if t_diff_val > 0 else ("#00e676" if t_diff_val < 0 else "white")
-                
-                swing_html_str = (
-                    f"<div style='font-size: 16px; display: flex; flex-wrap: wrap; gap: 15px; padding: 10px; background-color: rgba(255,255,255,0.05); border-radius: 8px; margin-top: 28px;'>"
-                    f"<div>預估損益: <span style='color: {t_color}; font-weight: bold;'>{int(t_profit):,} ({_format_compact_number(t_roi, 2, signed=True)}%)</span></div>"
-                    f"<div>手續費總和: <span style='color: #cccccc;'>{int(t_total_fee):,}</span></div>"
-                    f"<div>交易稅: <span style='color: #cccccc;'>{int(t_tax):,}</span></div>"
+            swing_stop_col1, swing_stop_col2, _ = st.columns([1, 1, 3])
+            with swing_stop_col1:
+                swing_stop_loss_percent = keep_tab_widget("swing_stop_loss_percent", st.number_input(
+                    "停損幅度 (%)", value=tab_widget_value("swing_stop_loss_percent", 5.0), min_value=0.0, max_value=100.0,
+                    step=0.5, format="%.12g", key="swing_stop_loss_percent"
+                ))
+            with swing_stop_col2:
+                swing_is_long = swing_type != "融券(空)"
+                swing_stop_price = (
+                    calculate_stop_loss_price(swing_calc_price, swing_stop_loss_percent, swing_is_long)
+                    if swing_calc_price is not None else 0.0
                 )
-                if swing_type in ["融資(多)", "融券(空)"]:
-                    swing_html_str += f"<div>利息: <span style='color: #cccccc;'>{int(t_interest):,}</span></div>"
-                    if swing_type == "融券(空)":
-                        swing_html_str += f"<div>借券費: <span style='color: #cccccc;'>{int(t_borrow_fee):,}</span></div>"
-                swing_html_str += f"<div>價差: <span style='color: {t_diff_color}; font-weight: bold;'>{_format_compact_number(t_diff_val, 2, signed=True)}</span></div></div>"
-                st.markdown(swing_html_str, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
+                swing_stop_direction = "下跌" if swing_is_long else "上漲"
+                st.metric(
+                    "停損價", fmt_price(swing_stop_price) if swing_calc_price is not None else "—",
+                    f"{swing_stop_direction} {swing_stop_loss_percent:g}%"
+                )
+
+            # --- 目標價快速試算區 ---
+            st.markdown("##### 🎯 目標價快速試算")
+            col_st1, col_st2 = st.columns([1, 4])
+            with col_st1:
+                swing_target_p = keep_tab_widget("swing_target_price", st.number_input("輸入目標價", value=tab_widget_value("swing_target_price"), step=0.5, format="%.12g", key="swing_target_price", placeholder="請輸入..."))
+            with col_st2:
+                if swing_calc_price is not None and swing_target_p is not None:
+                    s_base_p = swing_calc_price
+                    target_costs = calculate_swing_trade_costs(
+                        s_base_p, swing_target_p, swing_shares, swing_discount, swing_min_fee, swing_type,
+                        margin_ratio=margin_ratio, annual_rate=annual_rate, days=swing_days, short_fee_rate=short_fee_rate,
+                    )
+                    t_profit = float(target_costs['profit'])
+                    t_roi = float(target_costs['roi'])
+                    t_total_fee = float(target_costs['total_fee'])
+                    t_tax = float(target_costs['tax'])
+                    t_interest = float(target_costs['interest'])
+                    t_borrow_fee = float(target_costs['borrow_fee'])
+
+                    t_color = "#ff4b4b" if t_profit > 0 else ("#00e676" if t_profit < 0 else "white")
+                    t_diff_val = swing_target_p - s_base_p
+                    t_diff_color = "#ff4b4b" if t_diff_val > 0 else ("#00e676" if t_diff_val < 0 else "white")
+                
+                    swing_html_str = (
+                        f"<div style='font-size: 16px; display: flex; flex-wrap: wrap; gap: 15px; padding: 10px; background-color: rgba(255,255,255,0.05); border-radius: 8px; margin-top: 28px;'>"
+                        f"<div>預估損益: <span style='color: {t_color}; font-weight: bold;'>{int(t_profit):,} ({_format_compact_number(t_roi, 2, signed=True)}%)</span></div>"
+                        f"<div>手續費總和: <span style='color: #cccccc;'>{int(t_total_fee):,}</span></div>"
+                        f"<div>交易稅: <span style='color: #cccccc;'>{int(t_tax):,}</span></div>"
+                    )
+                    if swing_type in ["融資(多)", "融券(空)"]:
+                        swing_html_str += f"<div>利息: <span style='color: #cccccc;'>{int(t_interest):,}</span></div>"
+                        if swing_type == "融券(空)":
+                            swing_html_str += f"<div>借券費: <span style='color: #cccccc;'>{int(t_borrow_fee):,}</span></div>"
+                    swing_html_str += f"<div>價差: <span style='color: {t_diff_color}; font-weight: bold;'>{_format_compact_number(t_diff_val, 2, signed=True)}</span></div></div>"
+                    st.markdown(swing_html_str, unsafe_allow_html=True)
+                else:
+                    st.markdown(f"""
                 <div style="font-size: 16px; display: flex; flex-wrap: wrap; gap: 15px; padding: 10px; background-color: rgba(255,255,255,0.05); border-radius: 8px; margin-top: 28px;">
                     <div>預估損益: <span style="color: white; font-weight: bold;">0 (+0.00%)</span></div>
                     <div>手續費總和: <span style="color: #cccccc;">0</span></div>
@@ -11118,141 +14984,67 @@ with tab2:
                     <div>價差: <span style="color: white; font-weight: bold;">+0.00</span></div>
                 </div>
                 """, unsafe_allow_html=True)
-        st.markdown("---")
-
-        if swing_calc_price is not None:
-            if swing_calc_price != st.session_state.get('swing_base_price', 0):
-                st.session_state.swing_base_price = swing_calc_price
-                st.session_state.swing_view_price = apply_tick_rules(swing_calc_price)
-
-            swing_limit_up, swing_limit_down = calculate_limits(st.session_state.swing_base_price)
-            sb1, sb2, _ = st.columns([1, 1, 6])
-            with sb1:
-                if st.button("🔽 向下", key="swing_btn_down", width='stretch'):
-                    if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = st.session_state.swing_base_price
-                    st.session_state.swing_view_price = move_tick(st.session_state.swing_view_price, -swing_tick_count)
-                    st.rerun()
-            with sb2:
-                if st.button("🔼 向上", key="swing_btn_up", width='stretch'):
-                    if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = st.session_state.swing_base_price
-                    st.session_state.swing_view_price = move_tick(st.session_state.swing_view_price, swing_tick_count)
-                    st.rerun()
-
-            swing_ticks_range = range(swing_tick_count, -(swing_tick_count + 1), -1)
-            swing_calc_data = []
-            s_base_p = st.session_state.swing_base_price
-            if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = s_base_p
-            s_view_p = st.session_state.swing_view_price
-            s_fee_rate = 0.001425; s_tax_rate = 0.003
-            
-            for i in swing_ticks_range:
-                p = move_tick(s_view_p, i)
-                
-                buy_price = s_base_p if swing_type in ["個股", "融資(多)"] else p
-                sell_price = p if swing_type in ["個股", "融資(多)"] else s_base_p
-                
-                buy_fee = max(swing_min_fee, math.floor(buy_price * swing_shares * s_fee_rate * (swing_discount/10)))
-                sell_fee = max(swing_min_fee, math.floor(sell_price * swing_shares * s_fee_rate * (swing_discount/10)))
-                tax = math.floor(sell_price * swing_shares * s_tax_rate)
-                total_fee = buy_fee + sell_fee
-                
-                stock_value_buy = buy_price * swing_shares
-                stock_value_sell = sell_price * swing_shares
-                
-                profit = 0
-                interest = 0
-                borrow_fee = 0
-                maintenance_ratio = 0.0
-                call_price = 0.0
-                
-                if swing_type == "個股":
-                    cost = stock_value_buy + buy_fee
-                    income = stock_value_sell - sell_fee - tax
-                    profit = income - cost
-                    roi = (profit / cost * 100) if cost > 0 else 0
-                elif swing_type == "融資(多)":
-                    margin_loan = math.floor(stock_value_buy * (margin_ratio/100) / 1000) * 1000
-                    self_prepare = stock_value_buy - margin_loan + buy_fee
-                    interest = round(margin_loan * (annual_rate/100) * (swing_days/365))
-                    net_sell = stock_value_sell - sell_fee - tax - margin_loan - interest
-                    profit = net_sell - self_prepare
-                    maintenance_ratio = (stock_value_sell / margin_loan) * 100 if margin_loan > 0 else 0
-                    call_price = (margin_loan * 1.3) / swing_shares if margin_loan > 0 else 0
-                    roi = (profit / self_prepare * 100) if self_prepare > 0 else 0
-                elif swing_type == "融券(空)":
-                    margin_deposit = math.ceil(stock_value_sell * (margin_ratio/100) / 100) * 100
-                    borrow_fee = math.floor(stock_value_sell * (short_fee_rate/10000))
-                    sell_guaranty = stock_value_sell - sell_fee - tax - borrow_fee
-                    interest = round((margin_deposit + sell_guaranty) * (annual_rate/100) * (swing_days/365))
-                    buy_cost = stock_value_buy + buy_fee
-                    refund = margin_deposit + sell_guaranty + interest - buy_cost
-                    profit = refund - margin_deposit
-                    maintenance_ratio = ((margin_deposit + sell_guaranty) / stock_value_buy) * 100 if stock_value_buy > 0 else 0
-                    call_price = (margin_deposit + sell_guaranty) / (1.3 * swing_shares) if swing_shares > 0 else 0
-                    roi = (profit / margin_deposit * 100) if margin_deposit > 0 else 0
-
-                diff = p - s_base_p
-                diff_str = f"{diff:+.2f}".rstrip('0').rstrip('.') if diff != 0 else "0"
-                if diff > 0 and not diff_str.startswith('+'): diff_str = "+" + diff_str
-                
-                is_base = (abs(p - s_base_p) < 0.001)
-                
-                row_data = {
-                    "成交價": fmt_price(p), "漲跌": diff_str, "預估損益": int(profit), "報酬率%": f"{_format_compact_number(roi, 2, signed=True)}%",
-                    "手續費": int(total_fee), "交易稅": int(tax)
-                }
-                if swing_type in ["融資(多)", "融券(空)"]:
-                    if swing_type == "融券(空)":
-                        row_data["借券費"] = int(borrow_fee)
-                    row_data["利息"] = int(interest)
-                    row_data["維持率%"] = f"{_format_compact_number(maintenance_ratio, 1)}%" if maintenance_ratio > 0 else "-"
-                    row_data["強制回補價"] = _format_compact_number(call_price, 2) if call_price > 0 else "-"
-                    
-                row_data["_profit"] = profit
-                row_data["_is_base"] = is_base
-                if swing_type in ["融資(多)", "融券(空)"]:
-                    row_data["_call"] = True if maintenance_ratio > 0 and maintenance_ratio < 130 else False
-                else:
-                    row_data["_call"] = False
-
-                swing_calc_data.append(row_data)
+            st.markdown("---")
+
+            if swing_calc_price is not None:
+                if swing_calc_price != st.session_state.get('swing_base_price', 0):
+                    st.session_state.swing_base_price = swing_calc_price
+                    st.session_state.swing_view_price = apply_tick_rules(swing_calc_price)
+
+                sb1, sb2, _ = st.columns([1, 1, 6])
+                with sb1:
+                    if st.button("🔽 向下", key="swing_btn_down", width='stretch'):
+                        if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = st.session_state.swing_base_price
+                        st.session_state.swing_view_price = shift_tick_price(st.session_state.swing_base_price, st.session_state.swing_view_price, -swing_tick_count)
+                        st.rerun()
+                with sb2:
+                    if st.button("🔼 向上", key="swing_btn_up", width='stretch'):
+                        if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = st.session_state.swing_base_price
+                        st.session_state.swing_view_price = shift_tick_price(st.session_state.swing_base_price, st.session_state.swing_view_price, swing_tick_count)
+                        st.rerun()
 
-            df_swing_calc = pd.DataFrame(swing_calc_data)
+                s_base_p = st.session_state.swing_base_price
+                if 'swing_view_price' not in st.session_state: st.session_state.swing_view_price = s_base_p
+                df_swing_calc = build_swing_pnl_ladder(
+                    s_base_p, st.session_state.swing_view_price, swing_tick_count, swing_shares, swing_discount,
+                    swing_min_fee, swing_type, margin_ratio, annual_rate, swing_days, short_fee_rate,
+                )
             
-            def style_swing_row(row):
-                is_base = row['_is_base']
-                prof = row['_profit']
-                is_call = row['_call']
+                def style_swing_row(row):
+                    is_base = row['_is_base']
+                    prof = row['_profit']
+                    is_call = row['_call']
                 
-                if is_base: return ['background-color: #ffffcc; color: black; font-weight: bold; border: 2px solid #ffd700;'] * len(row)
-                if is_call: return ['background-color: #ffcccc; color: #ff0000; font-weight: bold'] * len(row)
-                if prof > 0: return ['color: #ff4b4b; font-weight: bold'] * len(row) 
-                if prof < 0: return ['color: #00cc00; font-weight: bold'] * len(row) 
-                return ['color: gray'] * len(row)
+                    if is_base: return ['background-color: #ffffcc; color: black; font-weight: bold; border: 2px solid #ffd700;'] * len(row)
+                    if is_call: return ['background-color: #ffcccc; color: #ff0000; font-weight: bold'] * len(row)
+                    if prof > 0: return ['color: #ff4b4b; font-weight: bold'] * len(row) 
+                    if prof < 0: return ['color: #00cc00; font-weight: bold'] * len(row) 
+                    return ['color: gray'] * len(row)
 
-            if not df_swing_calc.empty:
-                st.dataframe(
-                    df_swing_calc.style.apply(style_swing_row, axis=1), 
-                    width='stretch',
-                    hide_index=True, 
-                    height=(len(df_swing_calc) + 1) * 35,
-                    column_config={
-                        "成交價": st.column_config.TextColumn(width="small"),
-                        "漲跌": st.column_config.TextColumn(width="small"),
-                        "預估損益": st.column_config.NumberColumn(width="small"),
-                        "報酬率%": st.column_config.TextColumn(width="small"),
-                        "手續費": st.column_config.NumberColumn(width="small"),
-                        "交易稅": st.column_config.NumberColumn(width="small"),
-                        "借券費": st.column_config.NumberColumn(width="small"),
-                        "利息": st.column_config.NumberColumn(width="small"),
-                        "維持率%": st.column_config.TextColumn(width="small"),
-                        "強制回補價": st.column_config.TextColumn(width="small"),
-                        "_profit": None, "_is_base": None, "_call": None
-                    }
-                )
+                if not df_swing_calc.empty:
+                    st.dataframe(
+                        df_swing_calc.style.apply(style_swing_row, axis=1), 
+                        width='stretch',
+                        hide_index=True, 
+                        height=(len(df_swing_calc) + 1) * 35,
+                        column_config={
+                            "成交價": st.column_config.TextColumn(width="small"),
+                            "漲跌": st.column_config.TextColumn(width="small"),
+                            "預估損益": st.column_config.NumberColumn(width="small"),
+                            "報酬率%": st.column_config.TextColumn(width="small"),
+                            "手續費": st.column_config.NumberColumn(width="small"),
+                            "交易稅": st.column_config.NumberColumn(width="small"),
+                            "借券費": st.column_config.NumberColumn(width="small"),
+                            "利息": st.column_config.NumberColumn(width="small"),
+                            "維持率%": st.column_config.TextColumn(width="small"),
+                            "強制回補價": st.column_config.TextColumn(width="small"),
+                            "_profit": None, "_is_base": None, "_call": None
+                        }
+                    )
 
     with tab2_3:
-        st.markdown("""
+        if tab2.open and tab2_3.open:
+            st.markdown("""
         <style>
         .opt-card {
             background-color: rgba(255, 255, 255, 0.05);
@@ -11297,344 +15089,316 @@ with tab2:
         </style>
         """, unsafe_allow_html=True)
 
-        near_settlement_date = get_near_month_futures_settlement()
-        days_to_settlement = (near_settlement_date - datetime.now(pytz.timezone('Asia/Taipei')).date()).days
-        st.markdown(
-            f"<div class='futures-expiry-reminder'>"
-            f"<span class='futures-expiry-contract'>台指期近月結算</span>"
-            f"<span class='futures-expiry-date'>{near_settlement_date:%m/%d} 結算</span>"
-            f"<span class='futures-expiry-countdown'>⏱ 倒數 <span class='futures-expiry-days'>{days_to_settlement}</span> 日</span>"
-            f"</div>",
-            unsafe_allow_html=True
-        )
+            near_settlement_date = get_near_month_futures_settlement()
+            days_to_settlement = (near_settlement_date - datetime.now(pytz.timezone('Asia/Taipei')).date()).days
+            st.markdown(
+                f"<div class='futures-expiry-reminder'>"
+                f"<span class='futures-expiry-contract'>台指期近月結算</span>"
+                f"<span class='futures-expiry-date'>{near_settlement_date:%m/%d} 結算</span>"
+                f"<span class='futures-expiry-countdown'>⏱ 倒數 <span class='futures-expiry-days'>{days_to_settlement}</span> 日</span>"
+                f"</div>",
+                unsafe_allow_html=True
+            )
 
-        # ---------------- 回呼函數定義 ----------------
-        def sync_taifex_margin():
-            try:
-                url = 'https://openapi.taifex.com.tw/v1/IndexFuturesAndOptionsMargining'
-                headers = {
-                    'accept': 'application/json',
-                    'If-Modified-Since': 'Mon, 26 Jul 1997 05:00:00 GMT',
-                    'Cache-Control': 'no-cache',
-                    'Pragma': 'no-cache'
-                }
-                r = requests.get(url, headers=headers, timeout=5, verify=False)
-                if r.status_code == 200:
-                    data = r.json()
+            # ---------------- 回呼函數定義 ----------------
+            def sync_taifex_margin(force=False):
+                try:
+                    tables = get_taifex_reference_tables(['IndexFuturesAndOptionsMargining'], force=force)
+                    error = tables['errors'].get('IndexFuturesAndOptionsMargining')
+                    index_contracts = tables['index_contracts']
+                    if index_contracts.empty:
+                        raise RuntimeError(error or "期交所回傳空白資料")
                     res = {}
-                    sync_date = ""
-                    for item in data:
-                        sym_api = item.get("Contract", "").strip()
-                        margin_api = item.get("InitialMargin", 0)
-                        if isinstance(margin_api, str): margin_api = float(margin_api.replace(',', ''))
-                        res[sym_api] = margin_api
+                    for sym_api, root, margin_api in zip(
+                        index_contracts['契約名稱'], index_contracts['期貨代碼'], index_contracts['原始保證金']
+                    ):
+                        if pd.isna(margin_api):
+                            continue
+                        res[sym_api] = float(margin_api)
                         # 正規化: 無論 API 回傳中文名稱或英文代碼，統一存為英文代碼
-                        sym_clean = sym_api.replace(' ', '')
-                        if sym_clean in ["MXF", "TMF"] or "微型臺" in sym_clean or "微型台" in sym_clean:
-                            res["MXF"] = margin_api
-                            res["TMF"] = margin_api
-                        elif sym_clean == "MTX" or "小型臺指" in sym_clean or "小型台指" in sym_clean:
-                            res["MTX"] = margin_api
-                        elif sym_clean == "TX" or sym_clean in ["臺股期貨", "台股期貨", "臺指期貨", "台指期貨"]:
-                            res["TX"] = margin_api
-                        if not sync_date and "Date" in item:
-                            d_str = str(item["Date"])
-                            if len(d_str) == 8:
-                                sync_date = f"{d_str[:4]}/{d_str[4:6]}/{d_str[6:]}"
-                    
+                        if root == "TMF":
+                            res["MXF"] = float(margin_api)
+                            res["TMF"] = float(margin_api)
+                        elif root in ("MTX", "TX"):
+                            res[root] = float(margin_api)
+
                     st.session_state.taifex_margin_data = res
+                    sync_date = taifex_reference_sync_date(tables, 'IndexFuturesAndOptionsMargining')
                     if sync_date:
                         st.session_state.taifex_sync_date = sync_date
-                    
+
                     # 立即更新當前選擇的合約保證金數值
                     opt_tx_type = st.session_state.get('opt_tx_type', '大台 (TX)')
                     # 修正期交所 API 的合約代號 (大台 TX, 小台 MTX, 微台 TMF)
                     sym = "TX" if "大台" in opt_tx_type else ("MTX" if "小台" in opt_tx_type else "MXF")
                     if sym in res:
                         st.session_state["margin_display_tx"] = f"{res[sym]:,.0f}"
-                    
-                    st.toast("已同步期交所最新保證金", icon="✅")
-            except Exception as e:
-                st.toast(f"取得期交所保證金失敗: {e}", icon="⚠️")
-
-        @st.cache_data(ttl=3600, show_spinner=False)
-        def fetch_ssf_margin_info():
-            """透過期交所 OpenAPI 獲取個股期貨保證金比例與小型合約資訊"""
-            margin_map = {}
-            has_small_set = set()
-            sync_date = ""
-            group_level_map = {}   # 新增
-            maint_map = {}         # 新增
-            try:
-                url_pct = "https://openapi.taifex.com.tw/v1/SingleStockFuturesMargining"
-                r_pct = requests.get(url_pct, headers={'accept': 'application/json', 'If-Modified-Since': 'Mon, 26 Jul 1997 05:00:00 GMT'}, timeout=5, verify=False)
-                if r_pct.status_code == 200:
-                    data = r_pct.json()
-                    stock_contracts = {}
-                    for item in data:
-                        code = str(item.get("UnderlyingSecurityCode", "")).strip()
-                        contract = str(item.get("Contract", "")).strip()
-                        m_val = str(item.get("InitialMarginRate", "0")).replace('%', '').strip()
-                        
-                        if code:
-                            if code not in stock_contracts:
-                                stock_contracts[code] = set()
-                            if contract:
-                                stock_contracts[code].add(contract)
-                            
-                            try: margin_map[code] = float(m_val)
-                            except: pass
-                            maint_val = str(item.get("MaintenanceMarginRate", "0")).replace('%', '').strip()
-                            try: maint_map[code] = float(maint_val)
-                            except: pass
-                            g_val = str(item.get("GroupLevel", "")).strip()
-                            if g_val: group_level_map[code] = g_val
-                        # 擷取更新日期
-                        if not sync_date and "Date" in item:
-                            d_str = str(item["Date"])
-                            if len(d_str) == 8:
-                                sync_date = f"{d_str[:4]}/{d_str[4:6]}/{d_str[6:]}"
-
-                    # 判斷是否含有小型股期 (若同一股號有多個合約代號，即代表有小型股期)
-                    for code, contracts in stock_contracts.items():
-                        if len(contracts) > 1:
-                            has_small_set.add(code)
-            except: pass
-            return margin_map, maint_map, group_level_map, has_small_set, sync_date
-
-        def do_clear_opt():
-            for k in ['opt_entry_p', 'opt_exit_p', 'opt_sl_p', 'opt_manual_margin_tx', 'opt_manual_margin_opt', 'opt_rt_price', 'opt_ref_price']:
-                if k in st.session_state:
-                    st.session_state[k] = None
-            st.session_state['opt_sf_search'] = None
-            if 'opt_custom_margin' in st.session_state:
-                del st.session_state['opt_custom_margin']
-            st.session_state['opt_lots'] = 1
-            st.session_state['opt_dir'] = "🔴 做多 ▲"
-            st.session_state['opt_margin_level'] = "級距一 | 13.5% (一般股票)"
-
-        def on_opt_tab_change():
-            do_clear_opt()
-            # 新增此行：確保切換商品類別(例如切換至台指期)時，自動觸發抓取預設合約的最新價格
-            st.session_state.opt_rt_trigger = True
+
+                    if error:
+                        st.toast(f"取得期交所保證金失敗，沿用 {sync_date or '上次'} 資料: {error}", icon="⚠️")
+                    else:
+                        st.toast("已同步期交所最新保證金", icon="✅")
+                except Exception as e:
+                    st.toast(f"取得期交所保證金失敗: {e}", icon="⚠️")
+
+            def fetch_ssf_margin_info():
+                """由共用的期交所參考資料取得個股期貨保證金比例、級距與小型合約資訊"""
+                try:
+                    tables = get_taifex_reference_tables(['SingleStockFuturesMargining'])
+                except Exception:
+                    return {}, {}, {}, set(), ""
+                by_underlying = tables['by_underlying']
+                margin_map = by_underlying['原始保證金率'].dropna().to_dict()
+                maint_map = by_underlying['維持保證金率'].dropna().to_dict()
+                group_level_map = by_underlying.loc[by_underlying['級距'] != '', '級距'].to_dict()
+                # 同一股號有多個合約代號，即代表有小型股期
+                has_small_set = set(by_underlying.index[by_underlying['有小型']])
+                sync_date = taifex_reference_sync_date(tables, 'SingleStockFuturesMargining')
+                return margin_map, maint_map, group_level_map, has_small_set, sync_date
+
+            def do_clear_opt():
+                for k in ['opt_manual_margin_tx', 'opt_rt_price', 'opt_ref_price']:
+                    if k in st.session_state:
+                        st.session_state[k] = None
+                for k in ['opt_entry_p', 'opt_exit_p', 'opt_sl_p', 'opt_manual_margin_opt', 'opt_sf_search']:
+                    reset_tab_widget(k, None)
+                if 'opt_custom_margin' in st.session_state:
+                    del st.session_state['opt_custom_margin']
+                reset_tab_widget('opt_lots', 1)
+                reset_tab_widget('opt_dir', "🔴 做多 ▲")
+                st.session_state['opt_margin_level'] = "級距一 | 13.5% (一般股票)"
+
+            def on_opt_tab_change():
+                do_clear_opt()
+                # 新增此行：確保切換商品類別(例如切換至台指期)時，自動觸發抓取預設合約的最新價格
+                st.session_state.opt_rt_trigger = True
         
-        def on_f_contract_change():
-            st.session_state.opt_rt_trigger = True
-        # --------------------------------------------
+            def on_f_contract_change():
+                st.session_state.opt_rt_trigger = True
+            # --------------------------------------------
 
-        if 'taifex_margin_data' not in st.session_state:
-            st.session_state.taifex_margin_data = {}
-            sync_taifex_margin()
+            if 'taifex_margin_data' not in st.session_state:
+                st.session_state.taifex_margin_data = {}
+                sync_taifex_margin()
         
-        # 確保期貨清單有被載入 (穩定來源)
-        if 'futures_list' not in st.session_state or not st.session_state.futures_list:
-            st.session_state.futures_list = fetch_futures_list()
-
-        # 取得 API 保證金與小型股期資料
-        ssf_margin_map, ssf_maint_map, ssf_group_level_map, has_small_set, ssf_sync_date = fetch_ssf_margin_info()
-
-        c_map_opt, _ = load_local_stock_names()
-        sf_opts = []
-        # 改回使用穩定的 futures_list 產生選單，避免 API 異常時選單空白
-        for code, status in st.session_state.futures_list.items():
-            name = c_map_opt.get(code, code)
-            sf_opts.append(f"{code} {name}期貨 (一般 x2000)")
-            # 結合網頁抓取的 "(小)" 標記與 API 回傳的 has_small_set 雙重確認
-            if "(小)" in status or code in has_small_set:
-                sf_opts.append(f"{code} 小型{name}期貨 (小型 x100)")
-        sf_opts = sorted(sf_opts)
-
-        col_left, col_right = st.columns([1.1, 1], gap="large")
-
-        with col_left:
-            st.markdown("###### ① 合約設定")
-            opt_main_tab = st.selectbox(
-                "合約類別", 
-                ["台指期", "個股期貨", "選擇權"], 
-                key="opt_main_tab",
-                on_change=on_opt_tab_change
-            )
+            # 確保期貨清單有被載入 (穩定來源)
+            if 'futures_list' not in st.session_state or not st.session_state.futures_list:
+                st.session_state.futures_list = fetch_futures_list()
+
+            # 取得 API 保證金與小型股期資料
+            ssf_margin_map, ssf_maint_map, ssf_group_level_map, has_small_set, ssf_sync_date = fetch_ssf_margin_info()
+
+            c_map_opt, _ = load_local_stock_names()
+            sf_opts = []
+            # 改回使用穩定的 futures_list 產生選單，避免 API 異常時選單空白
+            for code, status in st.session_state.futures_list.items():
+                name = c_map_opt.get(code, code)
+                sf_opts.append(f"{code} {name}期貨 (一般 x2000)")
+                # 結合網頁抓取的 "(小)" 標記與 API 回傳的 has_small_set 雙重確認
+                if "(小)" in status or code in has_small_set:
+                    sf_opts.append(f"{code} 小型{name}期貨 (小型 x100)")
+            sf_opts = sorted(sf_opts)
+
+            col_left, col_right = st.columns([1.1, 1], gap="large")
+
+            with col_left:
+                st.markdown("###### ① 合約設定")
+                opt_main_tab_options = ["台指期", "個股期貨", "選擇權"]
+                opt_main_tab = keep_tab_widget("opt_main_tab", st.selectbox(
+                    "合約類別", 
+                    opt_main_tab_options, 
+                    index=tab_widget_index("opt_main_tab", opt_main_tab_options),
+                    key="opt_main_tab",
+                    on_change=on_opt_tab_change
+                ))
 
-            if opt_main_tab == "台指期":
-                opt_tx_type = st.radio("合約規格", ["大台 (TX)", "小台 (MTX)", "微台 (TMF)"], horizontal=True, key="opt_tx_type", on_change=on_f_contract_change)
-                mult = 200 if "大台" in opt_tx_type else (50 if "小台" in opt_tx_type else 10)
-                tax_rate = 0.00002
-            elif opt_main_tab == "個股期貨":
-                # 1. 搜尋股期輸入股號只要出現對應的股期就好
-                opt_sf_input = st.text_input("搜尋股期 (輸入代號或名稱)", placeholder="例如: 2330", key="opt_sf_input")
-                filtered_sf_opts = [opt for opt in sf_opts if opt_sf_input in opt] if opt_sf_input else sf_opts
+                if opt_main_tab == "台指期":
+                    opt_tx_type_options = ["大台 (TX)", "小台 (MTX)", "微台 (TMF)"]
+                    opt_tx_type = keep_tab_widget("opt_tx_type", st.radio(
+                        "合約規格", opt_tx_type_options, index=tab_widget_index("opt_tx_type", opt_tx_type_options),
+                        horizontal=True, key="opt_tx_type", on_change=on_f_contract_change
+                    ))
+                    mult = 200 if "大台" in opt_tx_type else (50 if "小台" in opt_tx_type else 10)
+                    tax_rate = 0.00002
+                elif opt_main_tab == "個股期貨":
+                    # 1. 搜尋股期輸入股號只要出現對應的股期就好
+                    opt_sf_input = keep_tab_widget("opt_sf_input", st.text_input("搜尋股期 (輸入代號或名稱)", value=tab_widget_value("opt_sf_input", ""), placeholder="例如: 2330", key="opt_sf_input"))
+                    filtered_sf_opts = [opt for opt in sf_opts if opt_sf_input in opt] if opt_sf_input else sf_opts
                 
-                search_stock_futures = st.selectbox(
-                    "選擇對應股期", 
-                    options=filtered_sf_opts, 
-                    index=0 if filtered_sf_opts else None,
-                    key="opt_sf_search",
-                    on_change=on_f_contract_change
-                )
-                is_small = search_stock_futures is not None and "小型" in search_stock_futures
-                opt_sub_type = st.radio("合約規格", ["一般 (x2000)", "小型 (x100)"], horizontal=True, index=1 if is_small else 0, on_change=on_f_contract_change)
-                mult = 100 if "小型" in opt_sub_type else 2000
-                tax_rate = 0.00002
-            else:
-                st.markdown("<div style='margin-bottom: 10px; font-size: 14px;'>合約規格：選擇權 (x50)</div>", unsafe_allow_html=True)
-                mult = 50
-                tax_rate = 0.001
+                    search_stock_futures = keep_tab_widget("opt_sf_search", st.selectbox(
+                        "選擇對應股期", 
+                        options=filtered_sf_opts, 
+                        index=tab_widget_index("opt_sf_search", filtered_sf_opts, 0 if filtered_sf_opts else None),
+                        key="opt_sf_search",
+                        on_change=on_f_contract_change
+                    ))
+                    is_small = search_stock_futures is not None and "小型" in search_stock_futures
+                    opt_sub_type = st.radio("合約規格", ["一般 (x2000)", "小型 (x100)"], horizontal=True, index=1 if is_small else 0, on_change=on_f_contract_change)
+                    mult = 100 if "小型" in opt_sub_type else 2000
+                    tax_rate = 0.00002
+                else:
+                    st.markdown("<div style='margin-bottom: 10px; font-size: 14px;'>合約規格：選擇權 (x50)</div>", unsafe_allow_html=True)
+                    mult = 50
+                    tax_rate = 0.001
 
-            opt_dir = st.radio("部位方向", ["🔴 做多 ▲", "🟢 做空 ▼"], horizontal=True, key="opt_dir")
-            opt_lots = st.number_input("口數", min_value=1, value=1, step=1, key="opt_lots")
+                opt_dir_options = ["🔴 做多 ▲", "🟢 做空 ▼"]
+                opt_dir = keep_tab_widget("opt_dir", st.radio(
+                    "部位方向", opt_dir_options, index=tab_widget_index("opt_dir", opt_dir_options), horizontal=True, key="opt_dir"
+                ))
+                opt_lots = keep_tab_widget("opt_lots", st.number_input("口數", min_value=1, value=tab_widget_value("opt_lots", 1), step=1, key="opt_lots"))
 
-           # 新增：當最新成交價為空（例如剛切換到期權交易室），自動觸發獲取預設的台指期大台價格
-            if st.session_state.get('opt_rt_price') is None:
-                st.session_state.opt_rt_trigger = True
+               # 新增：當最新成交價為空（例如剛切換到期權交易室），自動觸發獲取預設的台指期大台價格
+                if st.session_state.get('opt_rt_price') is None:
+                    st.session_state.opt_rt_trigger = True
 
-            # --- 獲取最新即時價格邏輯 (支援夜盤) ---
-            if st.session_state.get('opt_rt_trigger', False):
-                st.session_state.opt_rt_trigger = False
-                rt_p, ref_p = None, None
-                try:
-                    sj_logged = st.session_state.get('sj_logged_in', False)
-                    sj_api = st.session_state.get('sj_api', None)
+                # --- 獲取最新即時價格邏輯 (支援夜盤) ---
+                if st.session_state.get('opt_rt_trigger', False):
+                    st.session_state.opt_rt_trigger = False
+                    rt_p, ref_p = None, None
+                    try:
+                        sj_logged = st.session_state.get('sj_logged_in', False)
+                        sj_api = st.session_state.get('sj_api', None)
                     
-                    if opt_main_tab in ["台指期", "個股期貨"] and sj_logged and sj_api:
-                        contract = None
+                        if opt_main_tab in ["台指期", "個股期貨"] and sj_logged and sj_api:
+                            contract = None
                         
-                        tz_now = datetime.now(pytz.timezone('Asia/Taipei'))
-                        today_str = tz_now.strftime("%Y%m%d")
-                        now_time = tz_now.time()
+                            tz_now = datetime.now(pytz.timezone('Asia/Taipei'))
+                            today_str = tz_now.strftime("%Y%m%d")
+                            now_time = tz_now.time()
                         
-                        def is_valid_contract(c):
-                            code_str = getattr(c, 'code', '')
-                            if code_str.endswith('R1') or code_str.endswith('R2') or '/' in code_str:
-                                return False
+                            def is_valid_contract(c):
+                                code_str = getattr(c, 'code', '')
+                                if code_str.endswith('R1') or code_str.endswith('R2') or '/' in code_str:
+                                    return False
                                 
-                            # 優先取得 delivery_date，若無則取 delivery_month，並清除斜線與破折號以利比對
-                            d_date = str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999')))
-                            d_date = d_date.replace('/', '').replace('-', '')
+                                # 優先取得 delivery_date，若無則取 delivery_month，並清除斜線與破折號以利比對
+                                d_date = str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999')))
+                                d_date = d_date.replace('/', '').replace('-', '')
                             
-                            # 若為 8 碼精確日期 (YYYYMMDD)
-                            if len(d_date) == 8:
-                                if d_date < today_str:
-                                    return False
-                                if d_date == today_str and now_time >= dt_time(13, 45):
-                                    return False
-                            # 若僅有 6 碼年月 (YYYYMM)
-                            elif len(d_date) == 6:
-                                today_ym = today_str[:6]
-                                if d_date < today_ym:
-                                    return False
-                                if d_date == today_ym:
-                                    # 判斷今天是否為結算日(第三個星期三)
-                                    cal = calendar.monthcalendar(tz_now.year, tz_now.month)
-                                    wednesdays = [week[calendar.WEDNESDAY] for week in cal if week[calendar.WEDNESDAY] != 0]
-                                    if len(wednesdays) >= 3:
-                                        settle_day = wednesdays[2]
-                                        if tz_now.day > settle_day:
-                                            return False
-                                        if tz_now.day == settle_day and now_time >= dt_time(13, 45):
-                                            return False
-                            return True
-
-                        if opt_main_tab == "台指期":
-                            try:
-                                if "大台" in opt_tx_type:
-                                    contracts = sj_api.Contracts.Futures.TXF
-                                elif "小台" in opt_tx_type:
-                                    contracts = sj_api.Contracts.Futures.MXF
-                                else:
-                                    contracts = sj_api.Contracts.Futures.TMF
-                                    
-                                valid_list = [c for c in contracts if is_valid_contract(c)]
-                                if valid_list:
-                                    contract = min(valid_list, key=lambda c: str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999'))).replace('/', '').replace('-', ''))
-                            except: pass
-                        elif opt_main_tab == "個股期貨":
-                            code = search_stock_futures.split(" ")[0] if search_stock_futures else ""
-                            if code:
+                                # 若為 8 碼精確日期 (YYYYMMDD)
+                                if len(d_date) == 8:
+                                    if d_date < today_str:
+                                        return False
+                                    if d_date == today_str and now_time >= dt_time(13, 45):
+                                        return False
+                                # 若僅有 6 碼年月 (YYYYMM)
+                                elif len(d_date) == 6:
+                                    today_ym = today_str[:6]
+                                    if d_date < today_ym:
+                                        return False
+                                    if d_date == today_ym:
+                                        # 判斷今天是否為結算日(第三個星期三)
+                                        cal = calendar.monthcalendar(tz_now.year, tz_now.month)
+                                        wednesdays = [week[calendar.WEDNESDAY] for week in cal if week[calendar.WEDNESDAY] != 0]
+                                        if len(wednesdays) >= 3:
+                                            settle_day = wednesdays[2]
+                                            if tz_now.day > settle_day:
+                                                return False
+                                            if tz_now.day == settle_day and now_time >= dt_time(13, 45):
+                                                return False
+                                return True
+
+                            if opt_main_tab == "台指期":
                                 try:
-                                    is_small = False
-                                    if 'opt_sub_type' in locals() and isinstance(opt_sub_type, str) and "小型" in opt_sub_type:
-                                        is_small = True
-                                    candidates = []
-                                    for category in sj_api.Contracts.Futures:
-                                        for c in category:
-                                            if str(getattr(c, 'underlying_code', '')) == str(code):
-                                                c_name = getattr(c, 'name', '')
-                                                if is_small and "小型" in c_name: candidates.append(c)
-                                                elif not is_small and "小型" not in c_name: candidates.append(c)
-                                    if not candidates:
+                                    if "大台" in opt_tx_type:
+                                        contracts = sj_api.Contracts.Futures.TXF
+                                    elif "小台" in opt_tx_type:
+                                        contracts = sj_api.Contracts.Futures.MXF
+                                    else:
+                                        contracts = sj_api.Contracts.Futures.TMF
+                                    
+                                    valid_list = [c for c in contracts if is_valid_contract(c)]
+                                    if valid_list:
+                                        contract = min(valid_list, key=lambda c: str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999'))).replace('/', '').replace('-', ''))
+                                except: pass
+                            elif opt_main_tab == "個股期貨":
+                                code = search_stock_futures.split(" ")[0] if search_stock_futures else ""
+                                if code:
+                                    try:
+                                        is_small = False
+                                        if 'opt_sub_type' in locals() and isinstance(opt_sub_type, str) and "小型" in opt_sub_type:
+                                            is_small = True
+                                        candidates = []
                                         for category in sj_api.Contracts.Futures:
                                             for c in category:
-                                                if str(getattr(c, 'underlying_code', '')) == str(code): candidates.append(c)
-                                    if candidates:
-                                        valid_contracts = [c for c in candidates if is_valid_contract(c)]
-                                        if valid_contracts:
-                                            contract = min(valid_contracts, key=lambda c: str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999'))).replace('/', '').replace('-', ''))
-                                except Exception: pass
+                                                if str(getattr(c, 'underlying_code', '')) == str(code):
+                                                    c_name = getattr(c, 'name', '')
+                                                    if is_small and "小型" in c_name: candidates.append(c)
+                                                    elif not is_small and "小型" not in c_name: candidates.append(c)
+                                        if not candidates:
+                                            for category in sj_api.Contracts.Futures:
+                                                for c in category:
+                                                    if str(getattr(c, 'underlying_code', '')) == str(code): candidates.append(c)
+                                        if candidates:
+                                            valid_contracts = [c for c in candidates if is_valid_contract(c)]
+                                            if valid_contracts:
+                                                contract = min(valid_contracts, key=lambda c: str(getattr(c, 'delivery_date', getattr(c, 'delivery_month', '999999'))).replace('/', '').replace('-', ''))
+                                    except Exception: pass
 
-                        if contract:
-                            try:
-                                snap = get_stream_quotes(sj_api, [contract])
-                                if snap and len(snap) > 0:
-                                    s = snap[0]
-                                    rt_p = s.close if s.close > 0 else s.open
+                            if contract:
+                                try:
+                                    snap = get_stream_quotes(sj_api, [contract])
+                                    if snap and len(snap) > 0:
+                                        s = snap[0]
+                                        rt_p = s.close if s.close > 0 else s.open
                                     
-                                    # 修正：精準讀取永豐快照的 change_price 反推基準價
-                                    change_val = getattr(s, 'change_price', getattr(s, 'change', None))
-                                    if change_val is not None and rt_p > 0:
-                                        ref_p = rt_p - float(change_val)
-                                    else:
-                                        # 堅固備援：直接向 API 請求 K 棒，抓取當日 13:45 最後一筆收盤價
-                                        tz_tw_loc = pytz.timezone('Asia/Taipei')
-                                        now_loc = datetime.now(tz_tw_loc)
-                                        start_str = (now_loc - timedelta(days=5)).strftime("%Y-%m-%d")
-                                        end_str = now_loc.strftime("%Y-%m-%d")
+                                        # 修正：精準讀取永豐快照的 change_price 反推基準價
+                                        change_val = getattr(s, 'change_price', getattr(s, 'change', None))
+                                        if change_val is not None and rt_p > 0:
+                                            ref_p = rt_p - float(change_val)
+                                        else:
+                                            # 堅固備援：直接向 API 請求 K 棒，抓取當日 13:45 最後一筆收盤價
+                                            tz_tw_loc = pytz.timezone('Asia/Taipei')
+                                            now_loc = datetime.now(tz_tw_loc)
+                                            start_str = (now_loc - timedelta(days=5)).strftime("%Y-%m-%d")
+                                            end_str = now_loc.strftime("%Y-%m-%d")
                                         
-                                        try:
-                                            kbars = sj_api.kbars(contract, start=start_str, end=end_str)
-                                            if kbars and hasattr(kbars, 'ts') and len(kbars.ts) > 0:
-                                                df_k = pd.DataFrame({**kbars})
-                                                df_k['ts'] = pd.to_datetime(df_k['ts'])
-                                                if df_k['ts'].dt.tz is not None:
-                                                    df_k['ts'] = df_k['ts'].dt.tz_convert('Asia/Taipei').dt.tz_localize(None)
+                                            try:
+                                                kbars = sj_api.kbars(contract, start=start_str, end=end_str)
+                                                if kbars and hasattr(kbars, 'ts') and len(kbars.ts) > 0:
+                                                    df_k = pd.DataFrame({**kbars})
+                                                    df_k['ts'] = pd.to_datetime(df_k['ts'])
+                                                    if df_k['ts'].dt.tz is not None:
+                                                        df_k['ts'] = df_k['ts'].dt.tz_convert('Asia/Taipei').dt.tz_localize(None)
                                                 
-                                                day_mask = (df_k['ts'].dt.time >= dt_time(8, 45)) & (df_k['ts'].dt.time <= dt_time(13, 45))
-                                                df_day = df_k[day_mask]
-                                                if not df_day.empty:
-                                                    daily_closes = df_day.groupby(df_day['ts'].dt.date)['Close'].last()
-                                                    curr_d = now_loc.date()
+                                                    day_mask = (df_k['ts'].dt.time >= dt_time(8, 45)) & (df_k['ts'].dt.time <= dt_time(13, 45))
+                                                    df_day = df_k[day_mask]
+                                                    if not df_day.empty:
+                                                        daily_closes = df_day.groupby(df_day['ts'].dt.date)['Close'].last()
+                                                        curr_d = now_loc.date()
                                                     
-                                                    # 14:00 前 (含凌晨夜盤與上午日盤)：基準價為「前一交易日」的 13:45
-                                                    if now_loc.time() < dt_time(14, 0):
-                                                        past_closes = daily_closes[daily_closes.index < curr_d]
-                                                        if not past_closes.empty: ref_p = float(past_closes.iloc[-1])
-                                                    # 14:00 後 (下午夜盤開始)：基準價為「今日」的 13:45
-                                                    else:
-                                                        valid_closes = daily_closes[daily_closes.index <= curr_d]
-                                                        if not valid_closes.empty: ref_p = float(valid_closes.iloc[-1])
-                                        except: pass
+                                                        # 14:00 前 (含凌晨夜盤與上午日盤)：基準價為「前一交易日」的 13:45
+                                                        if now_loc.time() < dt_time(14, 0):
+                                                            past_closes = daily_closes[daily_closes.index < curr_d]
+                                                            if not past_closes.empty: ref_p = float(past_closes.iloc[-1])
+                                                        # 14:00 後 (下午夜盤開始)：基準價為「今日」的 13:45
+                                                        else:
+                                                            valid_closes = daily_closes[daily_closes.index <= curr_d]
+                                                            if not valid_closes.empty: ref_p = float(valid_closes.iloc[-1])
+                                            except: pass
                                         
-                                        # 若真的都抓不到，最後才回退至快取的參考價
-                                        if ref_p is None or ref_p == 0:
-                                            ref_p = getattr(contract, 'reference', 0)
+                                            # 若真的都抓不到，最後才回退至快取的參考價
+                                            if ref_p is None or ref_p == 0:
+                                                ref_p = getattr(contract, 'reference', 0)
                                             
-                                    # 防呆：若夜盤尚未有成交量，讓成交價顯示與基準價相同
-                                    if rt_p == 0 and ref_p is not None and ref_p > 0:
-                                        rt_p = ref_p
-                            except Exception: pass
-                except Exception: pass
+                                        # 防呆：若夜盤尚未有成交量，讓成交價顯示與基準價相同
+                                        if rt_p == 0 and ref_p is not None and ref_p > 0:
+                                            rt_p = ref_p
+                                except Exception: pass
+                    except Exception: pass
                 
-                st.session_state.opt_rt_price = rt_p
-                st.session_state.opt_ref_price = ref_p
-            # ------------------------------------
+                    st.session_state.opt_rt_price = rt_p
+                    st.session_state.opt_ref_price = ref_p
+                # ------------------------------------
 
-            c_p1, c_p2 = st.columns(2)
-            with c_p1:
-                entry_p = st.number_input("進場價 (點)", value=None, format="%.12g", placeholder="輸入進場價", key="opt_entry_p")
+                c_p1, c_p2 = st.columns(2)
+                with c_p1:
+                    entry_p = keep_tab_widget("opt_entry_p", st.number_input("進場價 (點)", value=tab_widget_value("opt_entry_p"), format="%.12g", placeholder="輸入進場價", key="opt_entry_p"))
                 
-                # --- 顯示最新成交價及重新整理按鈕 ---
-                if opt_main_tab in ["台指期", "個股期貨"]:
-                    # 修正：注入 CSS 實現 align-items: center 讓按鈕與文字垂直置中平行，並移除 margin 造成的落差
-                    st.markdown("""
+                    # --- 顯示最新成交價及重新整理按鈕 ---
+                    if opt_main_tab in ["台指期", "個股期貨"]:
+                        # 修正：注入 CSS 實現 align-items: center 讓按鈕與文字垂直置中平行，並移除 margin 造成的落差
+                        st.markdown("""
                     <style>
                     div[data-testid="stHorizontalBlock"]:has(button[title="更新最新價格"]) {
                         align-items: center !important;
@@ -11648,223 +15412,224 @@ with tab2:
                     </style>
                     """, unsafe_allow_html=True)
 
-                    c_rt1, c_rt2 = st.columns([5, 1])
-                    with c_rt1:
-                        rt_p = st.session_state.get('opt_rt_price', None)
-                        ref_p = st.session_state.get('opt_ref_price', None)
-                        if rt_p is not None and ref_p is not None:
-                            color = "#ff4b4b" if rt_p > ref_p else ("#00e676" if rt_p < ref_p else "white")
-                            diff = rt_p - ref_p
-                            sign = "+" if diff > 0 else ""
-                            # 新增：計算漲跌幅百分比
-                            pct_chg = (diff / ref_p * 100) if ref_p else 0.0
-                            st.markdown(f"<div style='font-size:20px; margin:0px;'>最新成交價: <span style='color:{color}; font-weight:bold;'>{rt_p:g}</span> <span style='font-size:16px; color:{color};'>({_format_compact_number(diff, 2, signed=True)})({_format_compact_number(pct_chg, 2, signed=True)}%)</span></div>", unsafe_allow_html=True)
-                        else:
-                            st.markdown("<div style='font-size:20px; margin:0px; color:#aaa;'>最新成交價: 尚未更新</div>", unsafe_allow_html=True)
-                    with c_rt2:
-                        if st.button("🔄", key="btn_refresh_opt_rt", help="更新最新價格", use_container_width=True):
-                            st.session_state.opt_rt_trigger = True
-                            st.rerun()
-                # ------------------------------------
-
-            with c_p2:
-                exit_p = st.number_input("出場/目標價 (點)", value=None, format="%.12g", placeholder="輸入目標價", key="opt_exit_p")
-
-            st.markdown("###### ⇆ 停損及保證金設定")
-            sl_p = st.number_input("停損價 (點) - 用於風報比", value=None, format="%.12g", placeholder="輸入停損價", key="opt_sl_p")
+                        c_rt1, c_rt2 = st.columns([5, 1])
+                        with c_rt1:
+                            rt_p = st.session_state.get('opt_rt_price', None)
+                            ref_p = st.session_state.get('opt_ref_price', None)
+                            if rt_p is not None and ref_p is not None:
+                                color = "#ff4b4b" if rt_p > ref_p else ("#00e676" if rt_p < ref_p else "white")
+                                diff = rt_p - ref_p
+                                sign = "+" if diff > 0 else ""
+                                # 新增：計算漲跌幅百分比
+                                pct_chg = (diff / ref_p * 100) if ref_p else 0.0
+                                st.markdown(f"<div style='font-size:20px; margin:0px;'>最新成交價: <span style='color:{color}; font-weight:bold;'>{rt_p:g}</span> <span style='font-size:16px; color:{color};'>({_format_compact_number(diff, 2, signed=True)})({_format_compact_number(pct_chg, 2, signed=True)}%)</span></div>", unsafe_allow_html=True)
+                            else:
+                                st.markdown("<div style='font-size:20px; margin:0px; color:#aaa;'>最新成交價: 尚未更新</div>", unsafe_allow_html=True)
+                        with c_rt2:
+                            if st.button("🔄", key="btn_refresh_opt_rt", help="更新最新價格", use_container_width=True):
+                                st.session_state.opt_rt_trigger = True
+                                st.rerun()
+                    # ------------------------------------
+
+                with c_p2:
+                    exit_p = keep_tab_widget("opt_exit_p", st.number_input("出場/目標價 (點)", value=tab_widget_value("opt_exit_p"), format="%.12g", placeholder="輸入目標價", key="opt_exit_p"))
+
+                st.markdown("###### ⇆ 停損及保證金設定")
+                sl_p = keep_tab_widget("opt_sl_p", st.number_input("停損價 (點) - 用於風報比", value=tab_widget_value("opt_sl_p"), format="%.12g", placeholder="輸入停損價", key="opt_sl_p"))
             
-            # 手續費記憶
-            config = load_config()
-            if 'saved_opt_fee' not in st.session_state:
-                st.session_state.saved_opt_fee = config.get('saved_opt_fee', None)
+                # 手續費記憶
+                config = load_config()
+                if 'saved_opt_fee' not in st.session_state:
+                    st.session_state.saved_opt_fee = config.get('saved_opt_fee', None)
                 
-            opt_fee = st.number_input("單邊手續費 (元/口)", value=st.session_state.saved_opt_fee, step=1, placeholder="輸入手續費 (必填)")
-            if opt_fee is not None and opt_fee != st.session_state.saved_opt_fee:
-                st.session_state.saved_opt_fee = opt_fee
-                config['saved_opt_fee'] = opt_fee
-                try:
-                    with open(CONFIG_FILE, "w") as f: json.dump(config, f)
-                except: pass
+                opt_fee = st.number_input("單邊手續費 (元/口)", value=st.session_state.saved_opt_fee, step=1, placeholder="輸入手續費 (必填)")
+                if opt_fee is not None and opt_fee != st.session_state.saved_opt_fee:
+                    st.session_state.saved_opt_fee = opt_fee
+                    queue_config_update({'saved_opt_fee': opt_fee})
 
-            actual_margin_req = 0
-            margin_display_val = "尚未同步或無資料"
-            sync_text = "尚未同步"
+                actual_margin_req = 0
+                margin_display_val = "尚未同步或無資料"
+                sync_text = "尚未同步"
 
-            if opt_main_tab == "台指期":
-                sync_text = st.session_state.get('taifex_sync_date', '尚未同步')
-                opt_tx_type = st.session_state.get('opt_tx_type', '大台 (TX)')
+                if opt_main_tab == "台指期":
+                    sync_text = st.session_state.get('taifex_sync_date', '尚未同步')
+                    opt_tx_type = st.session_state.get('opt_tx_type', '大台 (TX)')
                 
-                # 修正此處的合約代號對應
-                sym = "TX" if "大台" in opt_tx_type else ("MTX" if "小台" in opt_tx_type else "MXF")
+                    # 修正此處的合約代號對應
+                    sym = "TX" if "大台" in opt_tx_type else ("MTX" if "小台" in opt_tx_type else "MXF")
                 
-                fetched_margin = st.session_state.taifex_margin_data.get(sym, 0)
+                    fetched_margin = st.session_state.taifex_margin_data.get(sym, 0)
                 
-                # 偵測合約切換，若切換則強制更新 session_state 裡的值
-                if st.session_state.get("last_opt_tx_type") != opt_tx_type:
-                    st.session_state["last_opt_tx_type"] = opt_tx_type
-                    if fetched_margin > 0:
-                        st.session_state["margin_display_tx"] = f"{fetched_margin:,.0f}"
-                    else:
-                        st.session_state["margin_display_tx"] = ""
-
-                st.markdown("<div style='font-size: 14px; margin-bottom: 5px;'>每口保證金 (原始)</div>", unsafe_allow_html=True)
-                c_m1, c_m2 = st.columns([3, 1])
-                with c_m1:
-                    user_margin = st.text_input("每口保證金", label_visibility="collapsed", key="margin_display_tx")
-                    try:
-                        actual_margin_req = float(user_margin.replace(',', '').replace(' ', '')) if user_margin else 0
-                    except ValueError:
-                        actual_margin_req = fetched_margin
-                with c_m2:
-                    st.button("↺ 重新整理", key="refresh_tx_margin", use_container_width=True, on_click=sync_taifex_margin)
-                if sync_text != "尚未同步":
-                    st.markdown(f"<div style='font-size:13px; margin-top: -10px; margin-bottom: 10px;'><span style='color:#00e676;'>✔️</span> <span style='color:#ff4b4b;'>已同步</span> <span style='color:#aaa;'>期交所資料：{sync_text}</span></div>", unsafe_allow_html=True)
+                    # 偵測合約切換，若切換則強制更新 session_state 裡的值
+                    if st.session_state.get("last_opt_tx_type") != opt_tx_type:
+                        st.session_state["last_opt_tx_type"] = opt_tx_type
+                        if fetched_margin > 0:
+                            st.session_state["margin_display_tx"] = f"{fetched_margin:,.0f}"
+                        else:
+                            st.session_state["margin_display_tx"] = ""
+
+                    st.markdown("<div style='font-size: 14px; margin-bottom: 5px;'>每口保證金 (原始)</div>", unsafe_allow_html=True)
+                    c_m1, c_m2 = st.columns([3, 1])
+                    with c_m1:
+                        # 這個欄位由程式直接寫入 key，不能再給 value 初值；分頁重新開啟時改為還原 key 本身。
+                        if "margin_display_tx" not in st.session_state:
+                            st.session_state["margin_display_tx"] = tab_widget_value("margin_display_tx", "")
+                        user_margin = keep_tab_widget("margin_display_tx", st.text_input("每口保證金", label_visibility="collapsed", key="margin_display_tx"))
+                        try:
+                            actual_margin_req = float(user_margin.replace(',', '').replace(' ', '')) if user_margin else 0
+                        except ValueError:
+                            actual_margin_req = fetched_margin
+                    with c_m2:
+                        st.button("↺ 重新整理", key="refresh_tx_margin", use_container_width=True, on_click=sync_taifex_margin, args=(True,))
+                    if sync_text != "尚未同步":
+                        st.markdown(f"<div style='font-size:13px; margin-top: -10px; margin-bottom: 10px;'><span style='color:#00e676;'>✔️</span> <span style='color:#ff4b4b;'>已同步</span> <span style='color:#aaa;'>期交所資料：{sync_text}</span></div>", unsafe_allow_html=True)
                     
-            elif opt_main_tab == "個股期貨":
-                sync_text = ssf_sync_date if ssf_sync_date else "尚未同步"
+                elif opt_main_tab == "個股期貨":
+                    sync_text = ssf_sync_date if ssf_sync_date else "尚未同步"
                 
-                sf_code = search_stock_futures.split(" ")[0] if search_stock_futures else ""
-                margin_pct = ssf_margin_map.get(sf_code, 0)
+                    sf_code = search_stock_futures.split(" ")[0] if search_stock_futures else ""
+                    margin_pct = ssf_margin_map.get(sf_code, 0)
                 
-                # 直接使用 API 的級距百分比計算標準合約保證金，避免套用到特殊調整合約的絕對金額
-                calc_margin = 0
-                if margin_pct > 0 and entry_p is not None:
-                    calc_margin = round(entry_p * mult * (margin_pct / 100.0))
+                    # 直接使用 API 的級距百分比計算標準合約保證金，避免套用到特殊調整合約的絕對金額
+                    calc_margin = 0
+                    if margin_pct > 0 and entry_p is not None:
+                        calc_margin = round(entry_p * mult * (margin_pct / 100.0))
                 
-                # 偵測合約切換或進場價變更，若切換則強制更新 session_state 裡的值
-                current_ssf_state = f"{sf_code}_{entry_p}_{mult}"
-                if st.session_state.get("last_ssf_state") != current_ssf_state:
-                    st.session_state["last_ssf_state"] = current_ssf_state
-                    if calc_margin > 0:
-                        st.session_state["margin_display_ssf"] = f"{calc_margin:,.0f}"
-                    else:
-                        st.session_state["margin_display_ssf"] = ""
-# ── 保證金級距資訊卡片 ──────────────────────────
-                group_level = ssf_group_level_map.get(sf_code, "")
-                maint_pct   = ssf_maint_map.get(sf_code, 0)
-                calc_maint  = round(entry_p * mult * (maint_pct / 100.0)) if maint_pct > 0 and entry_p is not None else 0
-
-                if sf_code and (group_level or margin_pct > 0):
-                    level_label = f"第 {group_level} 級" if group_level.isdigit() else (group_level if group_level else "—")
-                    init_line  = f"原始 <b style='color:#ff9800;'>{calc_margin:,}</b> 元" if calc_margin > 0 else f"原始比例 <b>{margin_pct}%</b>"
-                    maint_line = (f"　｜　維持 <b style='color:#4fc3f7;'>{calc_maint:,}</b> 元" if calc_maint > 0
-                                  else (f"　｜　維持比例 <b>{maint_pct}%</b>" if maint_pct > 0 else ""))
-                    st.markdown(f"""
+                    # 偵測合約切換或進場價變更，若切換則強制更新 session_state 裡的值
+                    current_ssf_state = f"{sf_code}_{entry_p}_{mult}"
+                    if st.session_state.get("last_ssf_state") != current_ssf_state:
+                        st.session_state["last_ssf_state"] = current_ssf_state
+                        if calc_margin > 0:
+                            st.session_state["margin_display_ssf"] = f"{calc_margin:,.0f}"
+                        else:
+                            st.session_state["margin_display_ssf"] = ""
+    # ── 保證金級距資訊卡片 ──────────────────────────
+                    group_level = ssf_group_level_map.get(sf_code, "")
+                    maint_pct   = ssf_maint_map.get(sf_code, 0)
+                    calc_maint  = round(entry_p * mult * (maint_pct / 100.0)) if maint_pct > 0 and entry_p is not None else 0
+
+                    if sf_code and (group_level or margin_pct > 0):
+                        level_label = f"第 {group_level} 級" if group_level.isdigit() else (group_level if group_level else "—")
+                        init_line  = f"原始 <b style='color:#ff9800;'>{calc_margin:,}</b> 元" if calc_margin > 0 else f"原始比例 <b>{margin_pct}%</b>"
+                        maint_line = (f"　｜　維持 <b style='color:#4fc3f7;'>{calc_maint:,}</b> 元" if calc_maint > 0
+                                      else (f"　｜　維持比例 <b>{maint_pct}%</b>" if maint_pct > 0 else ""))
+                        st.markdown(f"""
                     <div style='background:#0d1b2a;border:1px solid #1e3a5f;border-radius:8px;padding:9px 14px;margin-bottom:12px;font-size:13px;'>
                         <span style='color:#00e5ff;font-weight:700;'>📊 保證金級距：{level_label}</span>
                         <span style='color:#888;margin-left:10px;'>原始 {margin_pct}%</span>
                         {"<span style='color:#888;'> ／ 維持 " + str(maint_pct) + "%</span>" if maint_pct > 0 else ""}
                         <div style='margin-top:5px;color:#e0e0e0;'>{init_line}{maint_line}</div>
                     </div>""", unsafe_allow_html=True)
-                # ────────────────────────────────────────────────
-                st.markdown("<div style='font-size: 14px; margin-bottom: 5px;'>每口保證金 (原始)</div>", unsafe_allow_html=True)
-                c_m1, c_m2 = st.columns([3, 1])
-                with c_m1:
-                    user_margin = st.text_input("每口保證金", label_visibility="collapsed", placeholder=f"API 級距 {margin_pct}%" if margin_pct > 0 else "", key="margin_display_ssf")
-                    try:
-                        actual_margin_req = float(user_margin.replace(',', '').replace(' ', '')) if user_margin else 0
-                    except ValueError:
-                        actual_margin_req = calc_margin
-                with c_m2:
-                    if st.button("↺ 重新整理", key="refresh_ssf_margin", use_container_width=True):
-                        fetch_ssf_margin_info.clear()
-                        st.rerun()
-                if sync_text != "尚未同步":
-                    st.markdown(f"<div style='font-size:13px; margin-top: -10px; margin-bottom: 10px;'><span style='color:#00e676;'>✔️</span> <span style='color:#ff4b4b;'>已同步</span> <span style='color:#aaa;'>期交所資料：{sync_text}</span></div>", unsafe_allow_html=True)
+                    # ────────────────────────────────────────────────
+                    st.markdown("<div style='font-size: 14px; margin-bottom: 5px;'>每口保證金 (原始)</div>", unsafe_allow_html=True)
+                    c_m1, c_m2 = st.columns([3, 1])
+                    with c_m1:
+                        if "margin_display_ssf" not in st.session_state:
+                            st.session_state["margin_display_ssf"] = tab_widget_value("margin_display_ssf", "")
+                        user_margin = keep_tab_widget("margin_display_ssf", st.text_input("每口保證金", label_visibility="collapsed", placeholder=f"API 級距 {margin_pct}%" if margin_pct > 0 else "", key="margin_display_ssf"))
+                        try:
+                            actual_margin_req = float(user_margin.replace(',', '').replace(' ', '')) if user_margin else 0
+                        except ValueError:
+                            actual_margin_req = calc_margin
+                    with c_m2:
+                        if st.button("↺ 重新整理", key="refresh_ssf_margin", use_container_width=True):
+                            refresh_taifex_reference(['SingleStockFuturesMargining'], force=True)
+                            st.rerun()
+                    if sync_text != "尚未同步":
+                        st.markdown(f"<div style='font-size:13px; margin-top: -10px; margin-bottom: 10px;'><span style='color:#00e676;'>✔️</span> <span style='color:#ff4b4b;'>已同步</span> <span style='color:#aaa;'>期交所資料：{sync_text}</span></div>", unsafe_allow_html=True)
                     
-            else: # 選擇權
-                margin_req = st.number_input("每口保證金 (原始)", value=None, step=1000.0, format="%.0f", key="opt_manual_margin_opt", placeholder="買方為權利金，賣方請手動輸入")
-                if margin_req is not None:
-                    actual_margin_req = margin_req
-                elif entry_p is not None:
-                    actual_margin_req = entry_p * mult
-                else:
-                    actual_margin_req = 0
+                else: # 選擇權
+                    margin_req = keep_tab_widget("opt_manual_margin_opt", st.number_input("每口保證金 (原始)", value=tab_widget_value("opt_manual_margin_opt"), step=1000.0, format="%.0f", key="opt_manual_margin_opt", placeholder="買方為權利金，賣方請手動輸入"))
+                    if margin_req is not None:
+                        actual_margin_req = margin_req
+                    elif entry_p is not None:
+                        actual_margin_req = entry_p * mult
+                    else:
+                        actual_margin_req = 0
             
-            st.markdown("<div style='margin-top: 15px;'></div>", unsafe_allow_html=True)
-
-        with col_right:
-            st.markdown("###### 📈 損益結果")
+                st.markdown("<div style='margin-top: 15px;'></div>", unsafe_allow_html=True)
 
-            if entry_p is not None and exit_p is not None and opt_fee is not None:
-                pt_diff = (exit_p - entry_p) if "做多" in opt_dir else (entry_p - exit_p)
-                gross_pnl = pt_diff * mult * opt_lots
+            with col_right:
+                st.markdown("###### 📈 損益結果")
 
-                tax_buy = round(entry_p * mult * tax_rate) * opt_lots
-                tax_sell = round(exit_p * mult * tax_rate) * opt_lots
-                total_tax = tax_buy + tax_sell
-                total_fee = opt_fee * 2 * opt_lots
-
-                net_pnl = gross_pnl - total_tax - total_fee
+                if entry_p is not None and exit_p is not None and opt_fee is not None:
+                    opt_costs = calculate_derivative_trade_costs(
+                        entry_p, exit_p, mult, opt_lots, opt_fee, tax_rate, is_long="做多" in opt_dir
+                    )
+                    pt_diff = float(opt_costs['points'])
+                    gross_pnl = float(opt_costs['gross'])
+                    total_tax = float(opt_costs['tax'])
+                    total_fee = float(opt_costs['fee'])
+                    net_pnl = float(opt_costs['net'])
 
-                pnl_color = "#ff4b4b" if net_pnl > 0 else ("#00e676" if net_pnl < 0 else "white")
+                    pnl_color = "#ff4b4b" if net_pnl > 0 else ("#00e676" if net_pnl < 0 else "white")
 
-                st.markdown(f"""
+                    st.markdown(f"""
                 <div class="opt-card">
                     <div class="opt-label">預估淨損益 (含手續費與稅)</div>
                     <div class="opt-value" style="color: {pnl_color}; font-size: 24px;">{int(net_pnl):,} 元</div>
                 </div>
                 """, unsafe_allow_html=True)
 
-                cr1, cr2 = st.columns(2)
-                with cr1:
-                    st.markdown(f"""
+                    cr1, cr2 = st.columns(2)
+                    with cr1:
+                        st.markdown(f"""
                     <div class="opt-card">
                         <div class="opt-label">毛損益</div>
                         <div class="opt-value">{int(gross_pnl):,} 元</div>
                     </div>
                     """, unsafe_allow_html=True)
-                with cr2:
-                    st.markdown(f"""
+                    with cr2:
+                        st.markdown(f"""
                     <div class="opt-card">
                         <div class="opt-label">點差/口</div>
                         <div class="opt-value">{pt_diff:g} 點</div>
                     </div>
                     """, unsafe_allow_html=True)
 
-                cr3, cr4 = st.columns(2)
-                with cr3:
-                    st.markdown(f"""
+                    cr3, cr4 = st.columns(2)
+                    with cr3:
+                        st.markdown(f"""
                     <div class="opt-card">
                         <div class="opt-label">手續費 (雙邊)</div>
                         <div class="opt-value">{int(total_fee):,} 元</div>
                     </div>
                     """, unsafe_allow_html=True)
-                with cr4:
-                    st.markdown(f"""
+                    with cr4:
+                        st.markdown(f"""
                     <div class="opt-card">
                         <div class="opt-label">期交稅 (雙邊)</div>
                         <div class="opt-value">{int(total_tax):,} 元</div>
                     </div>
                     """, unsafe_allow_html=True)
 
-                # 刪除原本冗長重複的區塊，只留下這一段：
-                if actual_margin_req > 0:
-                    roi = net_pnl / (actual_margin_req * opt_lots) * 100
-                    st.markdown(f"""
+                    # 刪除原本冗長重複的區塊，只留下這一段：
+                    if actual_margin_req > 0:
+                        roi = net_pnl / (actual_margin_req * opt_lots) * 100
+                        st.markdown(f"""
                     <div class="opt-card">
                         <div class="opt-label">預估保證金總額</div>
                         <div class="opt-value">{int(actual_margin_req * opt_lots):,} 元 <span style="font-size: 14px; font-weight: normal; color: #aaa;">(報酬率: {_format_compact_number(roi, 2)}%)</span></div>
                     </div>
                     """, unsafe_allow_html=True)
 
-                st.markdown("<br><div style='font-size:16px; font-weight:bold; color:#ddd; margin-bottom:5px;'>風報比 (R:R)</div>", unsafe_allow_html=True)
-                if sl_p is not None:
-                    risk_pt = (entry_p - sl_p) if "做多" in opt_dir else (sl_p - entry_p)
-                    if risk_pt > 0:
-                        reward_pt = pt_diff if pt_diff > 0 else 0
-                        rrr = reward_pt / risk_pt if risk_pt != 0 else 0
+                    st.markdown("<br><div style='font-size:16px; font-weight:bold; color:#ddd; margin-bottom:5px;'>風報比 (R:R)</div>", unsafe_allow_html=True)
+                    if sl_p is not None:
+                        risk_pt = (entry_p - sl_p) if "做多" in opt_dir else (sl_p - entry_p)
+                        if risk_pt > 0:
+                            reward_pt = pt_diff if pt_diff > 0 else 0
+                            rrr = reward_pt / risk_pt if risk_pt != 0 else 0
 
-                        st.markdown(f"<div style='text-align: right; font-size: 20px; font-weight: bold; margin-bottom: 5px;'>1 : {_format_compact_number(rrr, 2)}</div>", unsafe_allow_html=True)
+                            st.markdown(f"<div style='text-align: right; font-size: 20px; font-weight: bold; margin-bottom: 5px;'>1 : {_format_compact_number(rrr, 2)}</div>", unsafe_allow_html=True)
 
-                        total_rr = risk_pt + reward_pt
-                        if total_rr > 0:
-                            risk_pct = (risk_pt / total_rr) * 100
-                            reward_pct = (reward_pt / total_rr) * 100
-                        else:
-                            risk_pct = 100; reward_pct = 0
+                            total_rr = risk_pt + reward_pt
+                            if total_rr > 0:
+                                risk_pct = (risk_pt / total_rr) * 100
+                                reward_pct = (reward_pt / total_rr) * 100
+                            else:
+                                risk_pct = 100; reward_pct = 0
 
-                        st.markdown(f"""
+                            st.markdown(f"""
                         <div style="width: 100%; height: 8px; display: flex; border-radius: 4px; overflow: hidden; margin-bottom: 5px;">
                             <div style="width: {risk_pct}%; background-color: #00e676;"></div>
                             <div style="width: {reward_pct}%; background-color: #ff4b4b;"></div>
@@ -11874,14 +15639,14 @@ with tab2:
                             <span>▲ 報酬 {reward_pt:g} 點</span>
                         </div>
                         """, unsafe_allow_html=True)
+                        else:
+                            st.error("停損價設定錯誤 (做多時停損應低於進場價，做空時應高於進場價)")
                     else:
-                        st.error("停損價設定錯誤 (做多時停損應低於進場價，做空時應高於進場價)")
-                else:
-                    st.caption("輸入停損價後即可顯示風報比評估")
+                        st.caption("輸入停損價後即可顯示風報比評估")
                     
-                st.markdown("<br><div style='text-align: center; font-size: 12px; color: #888;'>💡 提示：手續費依各券商折扣不同 (大台≈100、小台≈50、微台≈25)<br>保證金請以期交所最新公告為準</div>", unsafe_allow_html=True)
-            else:
-                st.info("👈 請在左側填寫完整的 **進場價**、**出場/目標價** 與 **單邊手續費** 即可自動開始計算損益與風險。")
+                    st.markdown("<br><div style='text-align: center; font-size: 12px; color: #888;'>💡 提示：手續費依各券商折扣不同 (大台≈100、小台≈50、微台≈25)<br>保證金請以期交所最新公告為準</div>", unsafe_allow_html=True)
+                else:
+                    st.info("👈 請在左側填寫完整的 **進場價**、**出場/目標價** 與 **單邊手續費** 即可自動開始計算損益與風險。")
                 
 with tab_fibo:
     
@@ -11914,8 +15679,8 @@ with tab_fibo:
                 st.session_state[key] = f"{best_match[0]}({best_match[1]})"
         save_fibo_config()
     
-    tab_trade_plan, tab_option_plan, tab_fibo_thermometer, tab_fibo_chart, tab_fibo_manual = st.tabs(
-        ["🧭 指數操作計畫", "📅 選擇權操作計畫", "🌡️ 市場溫度計", "📊 費波圖表", "🧮 手動費波"],
+    tab_trade_plan, tab_option_plan, tab_fibo_thermometer, tab_fibo_chart, tab_fibo_scan, tab_fibo_manual = st.tabs(
+        ["🧭 指數操作計畫", "📅 選擇權操作計畫", "🌡️ 市場溫度計", "📊 費波圖表", "🔎 費波掃描", "🧮 手動費波"],
         default="🧭 指數操作計畫", key="index_workspace_active_tab", on_change="rerun",
     )
 
@@ -11925,341 +15690,342 @@ with tab_fibo:
     ]
     thermometer_data = []
     # Streamlit tabs 仍會執行隱藏分頁程式；只在實際開啟需要的分頁時下載兩組溫度資料。
-    if tab_trade_plan.open or tab_option_plan.open or tab_fibo_thermometer.open:
-        for label, code in thermometer_specs:
-            temp_df, source = get_cached_market_temperature_data(code)
-            result = calculate_market_temperature(temp_df)
+    if tab_fibo.open and (tab_trade_plan.open or tab_option_plan.open or tab_fibo_thermometer.open):
+        loaded = [(label, code, *get_cached_market_temperature_data(code)) for label, code in thermometer_specs]
+        # 兩組溫度同時送入計算池，再依序取回。
+        for _label, _code, temp_df, _source in loaded:
+            submit_analysis_job(frame_job_key('temperature', temp_df), calculate_market_temperature, temp_df)
+        for label, code, temp_df, source in loaded:
+            result = run_analysis_job(frame_job_key('temperature', temp_df), calculate_market_temperature, temp_df)
+            record_market_temperature_history(f"{code}@1d", result)
             thermometer_data.append((label, code, temp_df, source, result))
 
     with tab_trade_plan:
-        st.subheader("指數操作計畫")
-        st.caption("日線費波決定主方向，5 分 K 提供短波當沖點位；即時報價僅供觀察，不會自動下單或構成投資建議。")
-        option_mode_choices = [
-            "自動評選（單買／價差）",
-            "價差單（限定風險，偏結算）",
-            "單買 BC／BP（快進快出）",
-        ]
-        saved_option_mode = st.session_state.get('trade_plan_option_mode_saved', '')
-        if saved_option_mode not in option_mode_choices:
-            if str(saved_option_mode).startswith('價差單'):
-                saved_option_mode = option_mode_choices[1]
-            elif str(saved_option_mode).startswith('單買'):
-                saved_option_mode = option_mode_choices[2]
-            else:
-                saved_option_mode = option_mode_choices[0]
-            st.session_state['trade_plan_option_mode_saved'] = saved_option_mode
-        index_item = next((item for item in thermometer_data if item[1] == '^TWII'), None)
-        futures_item = next((item for item in thermometer_data if item[1] == 'TWF=F'), None)
-        plan = calculate_index_trade_plan(
-            index_item[2] if index_item else pd.DataFrame(), index_item[4] if index_item else None,
-            futures_item[2] if futures_item else pd.DataFrame(), futures_item[4] if futures_item else None,
-        )
-        if plan is None:
-            st.warning("目前缺少足夠的加權或期貨日 K，暫時無法建立操作計畫。")
-        else:
-            display_direction, direction_color = {
-                '偏多': ('偏多', '#ff4b4b'),
-                '偏空': ('偏空', '#00c853'),
-            }.get(plan['direction'], ('區間盤整', '#ffc107'))
-            profile_col, refresh_col = st.columns([6, 1])
-            with profile_col:
-                entry_profile = st.radio(
-                    "進場靈敏度",
-                    ["積極（提早確認）", "穩健（完整確認）"],
-                    horizontal=True,
-                    key="trade_plan_entry_profile",
-                    help="積極模式會擴大費波觀察區，並允許即時價站穩／跌破 VWAP 後提早小部位進場；過熱與反向急漲跌保護仍保留。",
-                )
-            with refresh_col:
-                st.button("↻ 即時更新", key="refresh_trade_plan_live", width='stretch')
-            live_snapshot = get_live_futures_snapshot(st.session_state.get('sj_api'), 'TMF')
-            live_price = live_snapshot['price'] if live_snapshot else plan['latest']
-            live_change = live_snapshot['change'] if live_snapshot else float((futures_item[4] or {}).get('change', 0))
-            intraday_state = get_cached_futures_intraday_state(
-                st.session_state.get('sj_api'), plan['direction'],
-            )
-            previous_temperature = None
-            if futures_item is not None and len(futures_item[2]) > 20:
-                previous_temperature = calculate_market_temperature(futures_item[2].iloc[:-1].copy())
-            temperature_delta = (
-                float(futures_item[4]['score']) - float(previous_temperature['score'])
-                if futures_item and futures_item[4] and previous_temperature else 0.0
-            )
-            trade_state = evaluate_trade_entry_state(
-                plan, live_price, live_change, intraday_state, temperature_delta, entry_profile,
+        # 選擇權操作計畫沿用這裡算出的方向、短波與即時價，兩個分頁任一開啟時都要執行。
+        if tab_fibo.open and (tab_trade_plan.open or tab_option_plan.open):
+            st.subheader("指數操作計畫")
+            st.caption("日線費波決定主方向，5 分 K 提供短波當沖點位；即時報價僅供觀察，不會自動下單或構成投資建議。")
+            option_mode_choices = [
+                "自動評選（單買／價差）",
+                "價差單（限定風險，偏結算）",
+                "單買 BC／BP（快進快出）",
+            ]
+            saved_option_mode = st.session_state.get('trade_plan_option_mode_saved', '')
+            if saved_option_mode not in option_mode_choices:
+                if str(saved_option_mode).startswith('價差單'):
+                    saved_option_mode = option_mode_choices[1]
+                elif str(saved_option_mode).startswith('單買'):
+                    saved_option_mode = option_mode_choices[2]
+                else:
+                    saved_option_mode = option_mode_choices[0]
+                st.session_state['trade_plan_option_mode_saved'] = saved_option_mode
+            index_item = next((item for item in thermometer_data if item[1] == '^TWII'), None)
+            futures_item = next((item for item in thermometer_data if item[1] == 'TWF=F'), None)
+            plan = calculate_index_trade_plan(
+                index_item[2] if index_item else pd.DataFrame(), index_item[4] if index_item else None,
+                futures_item[2] if futures_item else pd.DataFrame(), futures_item[4] if futures_item else None,
             )
-            confirmation_text = intraday_state['confirmation_text']
-            if trade_state['can_enter'] and trade_state['execution_direction'] == '偏多':
-                position_recommendation = '建議做多｜可快進快出'
-                position_color = '#ff4b4b'
-            elif trade_state['can_enter'] and trade_state['execution_direction'] == '偏空':
-                position_recommendation = '建議做空｜可快進快出'
-                position_color = '#00c853'
+            if plan is None:
+                st.warning("目前缺少足夠的加權或期貨日 K，暫時無法建立操作計畫。")
             else:
-                position_recommendation = f"保守不進場｜{trade_state['permission']}"
-                position_color = '#ffc107'
-            st.markdown(
-                f"""<div style='border-left:5px solid {plan['action_color']};background:#151a22;padding:14px 18px;border-radius:7px;margin-bottom:12px'>
+                display_direction, direction_color = {
+                    '偏多': ('偏多', '#ff4b4b'),
+                    '偏空': ('偏空', '#00c853'),
+                }.get(plan['direction'], ('區間盤整', '#ffc107'))
+                profile_col, refresh_col = st.columns([6, 1])
+                with profile_col:
+                    entry_profile = st.radio(
+                        "進場靈敏度",
+                        ["積極（提早確認）", "穩健（完整確認）"],
+                        horizontal=True,
+                        key="trade_plan_entry_profile",
+                        help="積極模式會擴大費波觀察區，並允許即時價站穩／跌破 VWAP 後提早小部位進場；過熱與反向急漲跌保護仍保留。",
+                    )
+                with refresh_col:
+                    st.button("↻ 即時更新", key="refresh_trade_plan_live", width='stretch')
+                live_snapshot = get_live_futures_snapshot(st.session_state.get('sj_api'), 'TMF')
+                live_price = live_snapshot['price'] if live_snapshot else plan['latest']
+                live_change = live_snapshot['change'] if live_snapshot else float((futures_item[4] or {}).get('change', 0))
+                intraday_state = get_cached_futures_intraday_state(
+                    st.session_state.get('sj_api'), plan['direction'],
+                )
+                # 前一日分數已在同一次溫度計算的逐 K 分數中，不必截掉最後一根重算。
+                temperature_delta = futures_item[4]['score_delta'] if futures_item and futures_item[4] else 0.0
+                trade_state = evaluate_trade_entry_state(
+                    plan, live_price, live_change, intraday_state, temperature_delta, entry_profile,
+                )
+                confirmation_text = intraday_state['confirmation_text']
+                if trade_state['can_enter'] and trade_state['execution_direction'] == '偏多':
+                    position_recommendation = '建議做多｜可快進快出'
+                    position_color = '#ff4b4b'
+                elif trade_state['can_enter'] and trade_state['execution_direction'] == '偏空':
+                    position_recommendation = '建議做空｜可快進快出'
+                    position_color = '#00c853'
+                else:
+                    position_recommendation = f"保守不進場｜{trade_state['permission']}"
+                    position_color = '#ffc107'
+                st.markdown(
+                    f"""<div style='border-left:5px solid {plan['action_color']};background:#151a22;padding:14px 18px;border-radius:7px;margin-bottom:12px'>
                 <div style='font-size:14px;color:#b7c0cc'>{plan['market_label']}</div>
                 <div style='font-size:15px;font-weight:700;color:{direction_color};margin-top:3px'>趨勢背景：{display_direction}</div>
                 <div style='font-size:21px;font-weight:800;color:{trade_state['color']};margin-top:3px'>{trade_state['stage']}｜{trade_state['permission']}</div>
                 <div style='font-size:14px;color:#dfe6e9;margin-top:4px'>{plan['alignment_note']}</div>
                 </div>""", unsafe_allow_html=True
-            )
-            st.info(f"**即時判斷：** {trade_state['reason']}")
-            p1, p2, p3, p4 = st.columns(4)
-            if live_snapshot:
-                p1.markdown(
-                    f"""<div style='line-height:1.25'>
+                )
+                st.info(f"**即時判斷：** {trade_state['reason']}")
+                p1, p2, p3, p4 = st.columns(4)
+                if live_snapshot:
+                    p1.markdown(
+                        f"""<div style='line-height:1.25'>
                     <div style='font-size:14px;font-weight:600;color:#dfe6e9'>最新微台（{live_snapshot['contract_code']}）</div>
                     <div style='font-size:25px;font-weight:700;color:{live_snapshot['color']}'>{live_snapshot['price']:,.0f}</div>
                     <div style='font-size:14px;font-weight:700;color:{live_snapshot['color']}'>{live_snapshot['arrow']} {abs(live_snapshot['change']):,.0f} ({_format_compact_number(live_snapshot['change_pct'], 2, signed=True)}%)</div>
                     </div>""",
-                    unsafe_allow_html=True,
-                )
-            else:
-                p1.metric("最新期貨（日 K）", f"{plan['latest']:,.0f}")
-            render_index_level_metric(p2, "費波支撐", _format_compact_number(plan['support'], 0))
-            render_index_level_metric(p3, "費波壓力", _format_compact_number(plan['resistance'], 0))
-            render_index_level_metric(
-                p4, "費波區寬", f"± {_format_compact_number(plan['zone_points'], 0)} 點"
-            )
-            if live_snapshot:
-                st.caption(
-                    f"微台快照於 {datetime.now(pytz.timezone('Asia/Taipei')).strftime('%H:%M:%S')} 擷取；"
-                    "按「即時更新」會更新最新快照，日線歷史快取 3 分鐘、15 分／5 分 K 快取 8 秒，以減少重複下載。"
-                )
-
-            index_result = index_item[4] if index_item else None
-            if index_result is not None:
-                index_price = float(index_result['close'])
-                basis = live_price - index_price
-                if basis > 0:
-                    basis_label, basis_color = "正價差", "#ff4b4b"
-                    basis_advice = (
-                        "期貨高於加權，反映期貨相對現貨偏強。僅在市場判讀同為偏多、"
-                        "且價格回測費波支撐後獲確認時，才考慮順勢做多；不可只因正價差追價。"
-                    )
-                elif basis < 0:
-                    basis_label, basis_color = "逆價差", "#00c853"
-                    basis_advice = (
-                        "期貨低於加權，反映期貨相對現貨偏弱。僅在市場判讀同為偏空、"
-                        "且價格反彈至費波壓力後受壓時，才考慮順勢做空；不可只因逆價差追空。"
+                        unsafe_allow_html=True,
                     )
                 else:
-                    basis_label, basis_color = "平價", "#dfe6e9"
-                    basis_advice = "期現價格貼近，價差不提供方向優勢；以費波位置與 15 分 K 確認作為主要進出依據。"
-
-                now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
-                updated_at = pd.Timestamp(index_result['updated_at']).date()
-                is_cash_snapshot = (
-                    updated_at == now_tw.date()
-                    and dt_time(9, 0) <= now_tw.time() < dt_time(13, 35)
-                    and index_item[3] and '即時串流' in index_item[3]
+                    p1.metric("最新期貨（日 K）", f"{plan['latest']:,.0f}")
+                render_index_level_metric(p2, "費波支撐", _format_compact_number(plan['support'], 0))
+                render_index_level_metric(p3, "費波壓力", _format_compact_number(plan['resistance'], 0))
+                render_index_level_metric(
+                    p4, "費波區寬", f"± {_format_compact_number(plan['zone_points'], 0)} 點"
                 )
-                basis_reference = "加權盤中快照" if is_cash_snapshot else "最近加權日收盤"
-                index_change = float(index_result.get('change', 0) or 0)
-                index_change_pct = float(index_result.get('change_pct', 0) or 0)
-                index_color = '#ff4b4b' if index_change > 0 else ('#00c853' if index_change < 0 else '#dfe6e9')
-                index_arrow = '▲' if index_change > 0 else ('▼' if index_change < 0 else '◆')
-                futures_result = (futures_item[4] or {}) if futures_item else {}
-                futures_change = float(live_snapshot['change']) if live_snapshot else float(futures_result.get('change', 0) or 0)
-                futures_change_pct = float(live_snapshot['change_pct']) if live_snapshot else float(futures_result.get('change_pct', 0) or 0)
-                futures_color = '#ff4b4b' if futures_change > 0 else ('#00c853' if futures_change < 0 else '#dfe6e9')
-                futures_arrow = '▲' if futures_change > 0 else ('▼' if futures_change < 0 else '◆')
-                st.markdown("##### ⚖️ 期現價差判讀")
-                b1, b2, b3 = st.columns(3)
-                b1.markdown(
-                    f"""<div style='line-height:1.25'>
+                if live_snapshot:
+                    st.caption(
+                        f"微台快照於 {datetime.now(pytz.timezone('Asia/Taipei')).strftime('%H:%M:%S')} 擷取；"
+                        "按「即時更新」會更新最新快照，日線歷史快取 3 分鐘、15 分／5 分 K 快取 8 秒，以減少重複下載。"
+                    )
+
+                index_result = index_item[4] if index_item else None
+                if index_result is not None:
+                    index_price = float(index_result['close'])
+                    basis = live_price - index_price
+                    if basis > 0:
+                        basis_label, basis_color = "正價差", "#ff4b4b"
+                        basis_advice = (
+                            "期貨高於加權，反映期貨相對現貨偏強。僅在市場判讀同為偏多、"
+                            "且價格回測費波支撐後獲確認時，才考慮順勢做多；不可只因正價差追價。"
+                        )
+                    elif basis < 0:
+                        basis_label, basis_color = "逆價差", "#00c853"
+                        basis_advice = (
+                            "期貨低於加權，反映期貨相對現貨偏弱。僅在市場判讀同為偏空、"
+                            "且價格反彈至費波壓力後受壓時，才考慮順勢做空；不可只因逆價差追空。"
+                        )
+                    else:
+                        basis_label, basis_color = "平價", "#dfe6e9"
+                        basis_advice = "期現價格貼近，價差不提供方向優勢；以費波位置與 15 分 K 確認作為主要進出依據。"
+
+                    now_tw = datetime.now(pytz.timezone('Asia/Taipei'))
+                    updated_at = pd.Timestamp(index_result['updated_at']).date()
+                    is_cash_snapshot = (
+                        updated_at == now_tw.date()
+                        and dt_time(9, 0) <= now_tw.time() < dt_time(13, 35)
+                        and index_item[3] and '即時串流' in index_item[3]
+                    )
+                    basis_reference = "加權盤中快照" if is_cash_snapshot else "最近加權日收盤"
+                    index_change = float(index_result.get('change', 0) or 0)
+                    index_change_pct = float(index_result.get('change_pct', 0) or 0)
+                    index_color = '#ff4b4b' if index_change > 0 else ('#00c853' if index_change < 0 else '#dfe6e9')
+                    index_arrow = '▲' if index_change > 0 else ('▼' if index_change < 0 else '◆')
+                    futures_result = (futures_item[4] or {}) if futures_item else {}
+                    futures_change = float(live_snapshot['change']) if live_snapshot else float(futures_result.get('change', 0) or 0)
+                    futures_change_pct = float(live_snapshot['change_pct']) if live_snapshot else float(futures_result.get('change_pct', 0) or 0)
+                    futures_color = '#ff4b4b' if futures_change > 0 else ('#00c853' if futures_change < 0 else '#dfe6e9')
+                    futures_arrow = '▲' if futures_change > 0 else ('▼' if futures_change < 0 else '◆')
+                    st.markdown("##### ⚖️ 期現價差判讀")
+                    b1, b2, b3 = st.columns(3)
+                    b1.markdown(
+                        f"""<div style='line-height:1.25'>
                     <div style='font-size:14px;font-weight:600;color:#dfe6e9'>{basis_reference}</div>
                     <div style='font-size:24px;font-weight:700;color:{index_color}'>{index_price:,.0f}</div>
                     <div style='font-size:14px;font-weight:700;color:{index_color}'>{index_arrow} {abs(index_change):,.0f} ({_format_compact_number(index_change_pct, 2, signed=True)}%)</div>
                     </div>""",
-                    unsafe_allow_html=True,
-                )
-                b2.markdown(
-                    f"""<div style='line-height:1.25'>
+                        unsafe_allow_html=True,
+                    )
+                    b2.markdown(
+                        f"""<div style='line-height:1.25'>
                     <div style='font-size:14px;font-weight:600;color:#dfe6e9'>期貨指數</div>
                     <div style='font-size:24px;font-weight:700;color:{futures_color}'>{live_price:,.0f}</div>
                     <div style='font-size:14px;font-weight:700;color:{futures_color}'>{futures_arrow} {abs(futures_change):,.0f} ({_format_compact_number(futures_change_pct, 2, signed=True)}%)</div>
                     </div>""",
-                    unsafe_allow_html=True,
-                )
-                b3.markdown(
-                    f"""<div style='line-height:1.25'>
+                        unsafe_allow_html=True,
+                    )
+                    b3.markdown(
+                        f"""<div style='line-height:1.25'>
                     <div style='font-size:14px;font-weight:600;color:#dfe6e9'>期貨－加權價差</div>
                     <div style='font-size:24px;font-weight:700;color:{basis_color}'>{basis:+,.0f} 點</div>
                     <div style='font-size:14px;font-weight:700;color:{basis_color}'>{basis_label}</div>
                     </div>""",
+                        unsafe_allow_html=True,
+                    )
+                    st.caption(
+                        f"計算：期貨 {live_price:,.0f} − {basis_reference} {index_price:,.0f} = {basis:+,.0f} 點。"
+                        "夜盤因現貨已收盤，價差主要反映夜盤預期與海外市場，不宜單獨作為交易訊號。"
+                    )
+                    st.info(f"**操作建議：** {basis_advice}")
+
+                st.divider()
+                st.markdown(
+                    f"#### 🎯 進出依據 <span style='font-size:15px;color:{position_color};font-weight:700'>　{position_recommendation}</span>",
                     unsafe_allow_html=True,
                 )
-                st.caption(
-                    f"計算：期貨 {live_price:,.0f} − {basis_reference} {index_price:,.0f} = {basis:+,.0f} 點。"
-                    "夜盤因現貨已收盤，價差主要反映夜盤預期與海外市場，不宜單獨作為交易訊號。"
+                st.caption("以日線費波支撐／壓力與 15 分 K 確認，作為順勢進場、停損與目標依據。")
+                st.info(f"**進場確認：** {plan['trigger']}")
+                position_count = st.selectbox(
+                    "預計進場口數",
+                    options=[1, 2, 3, 4, 5],
+                    format_func=lambda count: f"{count} 口微型臺指",
+                    key="trade_plan_position_count",
+                    help="此設定會連動更新進出依據與短波當沖的停損金額及預估收益。",
                 )
-                st.info(f"**操作建議：** {basis_advice}")
-
-            st.divider()
-            st.markdown(
-                f"#### 🎯 進出依據 <span style='font-size:15px;color:{position_color};font-weight:700'>　{position_recommendation}</span>",
-                unsafe_allow_html=True,
-            )
-            st.caption("以日線費波支撐／壓力與 15 分 K 確認，作為順勢進場、停損與目標依據。")
-            st.info(f"**進場確認：** {plan['trigger']}")
-            position_count = st.selectbox(
-                "預計進場口數",
-                options=[1, 2, 3, 4, 5],
-                format_func=lambda count: f"{count} 口微型臺指",
-                key="trade_plan_position_count",
-                help="此設定會連動更新進出依據與短波當沖的停損金額及預估收益。",
-            )
-            render_index_plan_metric_cards([
-                ("觀察進場區", _format_compact_number(trade_state['entry_level'], 0)),
-                ("失效／停損", _format_compact_number(trade_state['invalidation'], 0)),
-                ("第一目標", _format_compact_number(trade_state['target'], 0)),
-                (
-                    "預估風報比",
-                    f"1 : {_format_compact_number(trade_state['rr_ratio'], 2)}"
-                    if trade_state['rr_ratio'] is not None else "—",
-                ),
-            ])
-            entry_risk_level, entry_risk_color, entry_risk_ratio = get_trade_risk_level(
-                trade_state['risk_points'], plan['atr'],
-            )
-            entry_risk_amount = trade_state['risk_points'] * 10 * position_count
-            entry_reward_amount = trade_state['reward_points'] * 10 * position_count
-            er1, er2, er3, er4 = st.columns(4)
-            er1.markdown(
-                f"""<div style='line-height:1.2'>
+                render_index_plan_metric_cards([
+                    ("觀察進場區", _format_compact_number(trade_state['entry_level'], 0)),
+                    ("失效／停損", _format_compact_number(trade_state['invalidation'], 0)),
+                    ("第一目標", _format_compact_number(trade_state['target'], 0)),
+                    (
+                        "預估風報比",
+                        f"1 : {_format_compact_number(trade_state['rr_ratio'], 2)}"
+                        if trade_state['rr_ratio'] is not None else "—",
+                    ),
+                ])
+                entry_risk_level, entry_risk_color, entry_risk_ratio = get_trade_risk_level(
+                    trade_state['risk_points'], plan['atr'],
+                )
+                entry_risk_amount = trade_state['risk_points'] * 10 * position_count
+                entry_reward_amount = trade_state['reward_points'] * 10 * position_count
+                er1, er2, er3, er4 = st.columns(4)
+                er1.markdown(
+                    f"""<div style='line-height:1.2'>
                 <div style='font-size:12px;color:#b7c0cc'>計畫風險點數</div>
                 <div style='font-size:19px;font-weight:700;color:{entry_risk_color}'>{trade_state['risk_points']:,.0f} 點</div>
                 <div style='font-size:12px;font-weight:700;color:{entry_risk_color}'>風險等級：{entry_risk_level}</div>
                 </div>""", unsafe_allow_html=True,
-            )
-            er2.markdown(
-                f"""<div style='line-height:1.2'>
+                )
+                er2.markdown(
+                    f"""<div style='line-height:1.2'>
                 <div style='font-size:12px;color:#b7c0cc'>預估盈利點數</div>
                 <div style='font-size:19px;font-weight:700;color:#ff4b4b'>{trade_state['reward_points']:,.0f} 點</div>
                 </div>""", unsafe_allow_html=True,
-            )
-            er3.markdown(
-                f"""<div style='line-height:1.2'>
+                )
+                er3.markdown(
+                    f"""<div style='line-height:1.2'>
                 <div style='font-size:12px;color:#b7c0cc'>{position_count} 口最大風險</div>
                 <div style='font-size:19px;font-weight:700;color:{entry_risk_color}'>${entry_risk_amount:,.0f}</div>
                 </div>""", unsafe_allow_html=True,
-            )
-            er4.markdown(
-                f"""<div style='line-height:1.2'>
+                )
+                er4.markdown(
+                    f"""<div style='line-height:1.2'>
                 <div style='font-size:12px;color:#b7c0cc'>{position_count} 口預估收益</div>
                 <div style='font-size:19px;font-weight:700;color:#ff4b4b'>${entry_reward_amount:,.0f}</div>
                 </div>""", unsafe_allow_html=True,
-            )
-            st.caption(
-                f"風險等級以停損距離相對日 ATR 判定：{_format_compact_number(entry_risk_ratio, 2)} ATR；"
-                "微台每點 10 元。"
-            )
-            if trade_state['can_enter']:
-                st.info(f"15 分 K：{confirmation_text} 目前符合「{trade_state['permission']}」條件，仍須依設定停損控制部位。")
-            elif plan['direction'] in ('偏多', '偏空'):
-                st.warning(f"15 分 K：{confirmation_text} 目前狀態為「{trade_state['permission']}」，不觸發進場。")
-            else:
-                st.info(f"區間策略：{trade_state['reason']}")
+                )
+                st.caption(
+                    f"風險等級以停損距離相對日 ATR 判定：{_format_compact_number(entry_risk_ratio, 2)} ATR；"
+                    "微台每點 10 元。"
+                )
+                if trade_state['can_enter']:
+                    st.info(f"15 分 K：{confirmation_text} 目前符合「{trade_state['permission']}」條件，仍須依設定停損控制部位。")
+                elif plan['direction'] in ('偏多', '偏空'):
+                    st.warning(f"15 分 K：{confirmation_text} 目前狀態為「{trade_state['permission']}」，不觸發進場。")
+                else:
+                    st.info(f"區間策略：{trade_state['reason']}")
 
-            signal_details = []
-            if intraday_state['available']:
-                signal_details.append(f"15 分 K VWAP {intraday_state['vwap']:,.0f}")
+                signal_details = []
+                if intraday_state['available']:
+                    signal_details.append(f"15 分 K VWAP {intraday_state['vwap']:,.0f}")
+                    signal_details.append(
+                        f"本段開盤區間 {intraday_state['opening_low']:,.0f}–{intraday_state['opening_high']:,.0f}"
+                    )
                 signal_details.append(
-                    f"本段開盤區間 {intraday_state['opening_low']:,.0f}–{intraday_state['opening_high']:,.0f}"
+                    f"即時漲跌為日 ATR 的 {_format_compact_number(trade_state['shock_ratio'], 2, signed=True)} 倍"
                 )
-            signal_details.append(
-                f"即時漲跌為日 ATR 的 {_format_compact_number(trade_state['shock_ratio'], 2, signed=True)} 倍"
-            )
-            signal_details.append(
-                f"溫度變化 {_format_compact_number(trade_state['temperature_delta'], 0, signed=True)} 度"
-            )
-            st.caption("｜".join(signal_details))
+                signal_details.append(
+                    f"溫度變化 {_format_compact_number(trade_state['temperature_delta'], 0, signed=True)} 度"
+                )
+                st.caption("｜".join(signal_details))
 
-            st.divider()
-            short_wave_direction, short_direction_note = resolve_short_wave_direction(
-                plan, trade_state, intraday_state,
-            )
-            if short_wave_direction == '偏多':
-                short_recommendation, short_color = '短多｜可提早小部位進場', '#ff4b4b'
-            elif short_wave_direction == '偏空':
-                short_recommendation, short_color = '短空｜可提早小部位進場', '#00c853'
-            else:
-                short_recommendation, short_color = '等待盤中動能', '#ffc107'
-            st.markdown(
-                f"#### ⚡ 短波當沖（5 分 K） <span style='font-size:15px;color:{short_color};font-weight:700'>　{short_recommendation}</span>",
-                unsafe_allow_html=True,
-            )
-            st.caption(f"{short_direction_note}。短波採 EMA5 或前根高低點即時觸發，不等待完整 5 分 K 收盤。")
-            short_wave = get_cached_short_wave_plan(st.session_state.get('sj_api'), short_wave_direction)
-            if short_wave:
-                render_index_plan_metric_cards([
-                    (
-                        "短波進場區",
-                        f"{_format_compact_number(short_wave['entry'], 0)} ± {_format_compact_number(short_wave['zone'], 0)}",
-                    ),
-                    ("短波停損", _format_compact_number(short_wave['stop'], 0)),
-                    ("短波目標", _format_compact_number(short_wave['target'], 0)),
-                    (
-                        "短波風報比",
-                        f"1 : {_format_compact_number(short_wave['rr'], 2)}"
-                        if short_wave['rr'] is not None else "—",
-                    ),
-                ])
-                st.info(f"**快速進場條件：** {short_wave['trigger']}")
-                momentum_label = "已達快速觸發" if short_wave['momentum_ready'] else "接近觸發，等待穿越前根高低點"
-                momentum_color = '#ff4b4b' if short_wave_direction == '偏多' else '#00c853'
+                st.divider()
+                short_wave_direction, short_direction_note = resolve_short_wave_direction(
+                    plan, trade_state, intraday_state,
+                )
+                if short_wave_direction == '偏多':
+                    short_recommendation, short_color = '短多｜可提早小部位進場', '#ff4b4b'
+                elif short_wave_direction == '偏空':
+                    short_recommendation, short_color = '短空｜可提早小部位進場', '#00c853'
+                else:
+                    short_recommendation, short_color = '等待盤中動能', '#ffc107'
                 st.markdown(
-                    f"<div style='font-size:14px;font-weight:700;color:{momentum_color}'>即時狀態：{momentum_label}｜"
-                    f"EMA5 {short_wave['ema_fast']:,.0f}｜量比 {_format_compact_number(short_wave['volume_ratio'], 2)}</div>",
+                    f"#### ⚡ 短波當沖（5 分 K） <span style='font-size:15px;color:{short_color};font-weight:700'>　{short_recommendation}</span>",
                     unsafe_allow_html=True,
                 )
-                short_risk_level, short_risk_color, short_risk_ratio = get_trade_risk_level(
-                    short_wave['risk'], plan['atr'],
-                )
-                short_risk_amount = short_wave['risk'] * 10 * position_count
-                short_reward_amount = short_wave['reward'] * 10 * position_count
-                sr1, sr2, sr3, sr4 = st.columns(4)
-                sr1.markdown(
-                    f"""<div style='line-height:1.2'>
+                st.caption(f"{short_direction_note}。短波採 EMA5 或前根高低點即時觸發，不等待完整 5 分 K 收盤。")
+                short_wave = get_cached_short_wave_plan(st.session_state.get('sj_api'), short_wave_direction)
+                if short_wave:
+                    render_index_plan_metric_cards([
+                        (
+                            "短波進場區",
+                            f"{_format_compact_number(short_wave['entry'], 0)} ± {_format_compact_number(short_wave['zone'], 0)}",
+                        ),
+                        ("短波停損", _format_compact_number(short_wave['stop'], 0)),
+                        ("短波目標", _format_compact_number(short_wave['target'], 0)),
+                        (
+                            "短波風報比",
+                            f"1 : {_format_compact_number(short_wave['rr'], 2)}"
+                            if short_wave['rr'] is not None else "—",
+                        ),
+                    ])
+                    st.info(f"**快速進場條件：** {short_wave['trigger']}")
+                    momentum_label = "已達快速觸發" if short_wave['momentum_ready'] else "接近觸發，等待穿越前根高低點"
+                    momentum_color = '#ff4b4b' if short_wave_direction == '偏多' else '#00c853'
+                    st.markdown(
+                        f"<div style='font-size:14px;font-weight:700;color:{momentum_color}'>即時狀態：{momentum_label}｜"
+                        f"EMA5 {short_wave['ema_fast']:,.0f}｜量比 {_format_compact_number(short_wave['volume_ratio'], 2)}</div>",
+                        unsafe_allow_html=True,
+                    )
+                    short_risk_level, short_risk_color, short_risk_ratio = get_trade_risk_level(
+                        short_wave['risk'], plan['atr'],
+                    )
+                    short_risk_amount = short_wave['risk'] * 10 * position_count
+                    short_reward_amount = short_wave['reward'] * 10 * position_count
+                    sr1, sr2, sr3, sr4 = st.columns(4)
+                    sr1.markdown(
+                        f"""<div style='line-height:1.2'>
                     <div style='font-size:12px;color:#b7c0cc'>短波風險點數</div>
                     <div style='font-size:18px;font-weight:700;color:{short_risk_color}'>{short_wave['risk']:,.0f} 點</div>
                     <div style='font-size:12px;font-weight:700;color:{short_risk_color}'>風險等級：{short_risk_level}</div>
                     </div>""", unsafe_allow_html=True,
-                )
-                sr2.markdown(
-                    f"""<div style='line-height:1.2'>
+                    )
+                    sr2.markdown(
+                        f"""<div style='line-height:1.2'>
                     <div style='font-size:12px;color:#b7c0cc'>短波盈利點數</div>
                     <div style='font-size:18px;font-weight:700;color:#ff4b4b'>{short_wave['reward']:,.0f} 點</div>
                     </div>""", unsafe_allow_html=True,
-                )
-                sr3.markdown(
-                    f"""<div style='line-height:1.2'>
+                    )
+                    sr3.markdown(
+                        f"""<div style='line-height:1.2'>
                     <div style='font-size:12px;color:#b7c0cc'>{position_count} 口最大風險</div>
                     <div style='font-size:18px;font-weight:700;color:{short_risk_color}'>${short_risk_amount:,.0f}</div>
                     </div>""", unsafe_allow_html=True,
-                )
-                sr4.markdown(
-                    f"""<div style='line-height:1.2'>
+                    )
+                    sr4.markdown(
+                        f"""<div style='line-height:1.2'>
                     <div style='font-size:12px;color:#b7c0cc'>{position_count} 口預估收益</div>
                     <div style='font-size:18px;font-weight:700;color:#ff4b4b'>${short_reward_amount:,.0f}</div>
                     </div>""", unsafe_allow_html=True,
-                )
-                st.caption(
-                    "以最新 6 根 5 分 K、EMA5 與前根高低點計算；短波停損為日 ATR 的 "
-                    f"{_format_compact_number(short_risk_ratio, 2)} 倍。"
-                    "短波可先於日線進場許可觸發，但只適合小部位快進快出。"
-                )
-            elif short_wave_direction:
-                st.info("即時條件已通過，但尚未取得足夠的 5 分 K，暫不提供短波點位。")
-            else:
-                st.info("尚未形成可辨識的盤中方向；短波暫不啟用，避免在區間中段雙向追價。")
+                    )
+                    st.caption(
+                        "以最新 6 根 5 分 K、EMA5 與前根高低點計算；短波停損為日 ATR 的 "
+                        f"{_format_compact_number(short_risk_ratio, 2)} 倍。"
+                        "短波可先於日線進場許可觸發，但只適合小部位快進快出。"
+                    )
+                elif short_wave_direction:
+                    st.info("即時條件已通過，但尚未取得足夠的 5 分 K，暫不提供短波點位。")
+                else:
+                    st.info("尚未形成可辨識的盤中方向；短波暫不啟用，避免在區間中段雙向追價。")
 
     with tab_option_plan:
-        if tab_option_plan.open:
+        if tab_fibo.open and tab_option_plan.open:
             st.subheader("選擇權操作計畫")
             st.caption("獨立載入最近到期週三選、週五選或月選；比較價外／平價／價內單買與限定風險價差。")
             option_now = datetime.now(pytz.timezone('Asia/Taipei'))
@@ -12506,7 +16272,12 @@ with tab_fibo:
                     if diagnostic:
                         st.caption(f"契約讀取診斷：{diagnostic}")
                 else:
-                    payoff_chart = build_txo_payoff_chart(option_quote, quote_plan, display_spread)
+                    payoff_profile = txo_payoff_profile(option_quote, quote_plan, display_spread)
+                    payoff_chart = None if payoff_profile is None else live_chart_figure(
+                        'txo_payoff', payoff_profile['static_key'], build_txo_payoff_chart,
+                        (option_quote, quote_plan, display_spread, payoff_profile),
+                        patch_txo_payoff_spot, (payoff_profile['spot'],),
+                    )
                     if payoff_chart is not None:
                         st.plotly_chart(
                             payoff_chart, width='stretch',
@@ -12520,63 +16291,190 @@ with tab_fibo:
                         st.info("即時權利金或淨收權利金不足，暫時無法繪製可驗證的損益曲線。")
 
     with tab_fibo_thermometer:
-        title_col, refresh_col = st.columns([6, 1])
-        with title_col:
-            st.subheader("臺灣加權／期貨溫度計")
-            st.caption("以 60 日位置、RSI、均線趨勢與 5 日動能合成 0–100 分；期貨納入夜盤至次日日盤的未完成交易日 K。")
-        with refresh_col:
-            st.button("🔄 更新", key="refresh_market_temperature", width='stretch')
-
-        gauge_cols = st.columns(2)
-        summary_rows = []
-        for column, (label, code, temp_df, source, result) in zip(gauge_cols, thermometer_data):
-            with column:
-                if result is None:
-                    if code == "TWF=F":
-                        st.warning("臺股期貨溫度計需要登入永豐 Shioaji，才能取得含夜盤的完整資料。")
-                    else:
-                        st.warning("目前無法取得足夠的加權指數資料。")
-                    continue
+        if tab_fibo.open and tab_fibo_thermometer.open:
+            title_col, refresh_col = st.columns([6, 1])
+            with title_col:
+                st.subheader("臺灣加權／期貨溫度計")
+                st.caption("以 60 日位置、RSI、均線趨勢與 5 日動能合成 0–100 分；期貨納入夜盤至次日日盤的未完成交易日 K。")
+            with refresh_col:
+                st.button("🔄 更新", key="refresh_market_temperature", width='stretch')
+
+            gauge_cols = st.columns(2)
+            summary_rows = []
+            for column, (label, code, temp_df, source, result) in zip(gauge_cols, thermometer_data):
+                with column:
+                    if result is None:
+                        if code == "TWF=F":
+                            st.warning("臺股期貨溫度計需要登入永豐 Shioaji，才能取得含夜盤的完整資料。")
+                        else:
+                            st.warning("目前無法取得足夠的加權指數資料。")
+                        continue
 
-                st.plotly_chart(build_market_temperature_gauge(label, result), width='stretch', config={'displayModeBar': False})
-                m1, m2, m3 = st.columns(3)
-                m1.markdown(
-                    f"""<div style='line-height:1.25'>
+                    st.plotly_chart(build_market_temperature_gauge(label, result), width='stretch', config={'displayModeBar': False})
+                    m1, m2, m3 = st.columns(3)
+                    m1.markdown(
+                        f"""<div style='line-height:1.25'>
                     <div style='font-size:14px;font-weight:600;color:#dfe6e9'>最新</div>
                     <div style='font-size:31px;font-weight:700;color:{result['price_color']}'>{result['close']:,.0f}</div>
                     <div style='font-size:15px;font-weight:700;color:{result['price_color']}'>{result['price_arrow']} {abs(result['change']):,.0f} ({_format_compact_number(result['change_pct'], 2, signed=True)}%)</div>
                     </div>""",
-                    unsafe_allow_html=True
+                        unsafe_allow_html=True
+                    )
+                    m2.metric("RSI(14)", _format_compact_number(result['rsi'], 1))
+                    m3.metric("5日動能", f"{_format_compact_number(result['momentum'], 2, signed=True)}%")
+                    st.markdown(f"**狀態：** <span style='color:{result['color']}; font-size:18px; font-weight:700'>{result['status']}</span>", unsafe_allow_html=True)
+                    st.info(f"入場觀察：{result['entry']}")
+                    st.warning(f"出場／風控：{result['exit_rule']}")
+                    if source:
+                        st.caption(f"資料來源：{source}｜最新交易日：{pd.Timestamp(result['updated_at']).strftime('%Y/%m/%d')}")
+
+                    summary_rows.append({
+                        "市場": label,
+                        "溫度": result['score'],
+                        "日變化": _format_compact_number(result['score_delta'], 0, signed=True) if result['previous_score'] is not None else '—',
+                        "狀態": result['status'],
+                        "60日位置": _format_compact_number(result['range_score'], 1),
+                        "MA20": f"{result['ma20']:,.0f}",
+                        "MA60": f"{result['ma60']:,.0f}",
+                    })
+
+            if summary_rows:
+                st.markdown("#### 判讀摘要")
+                temperature_frame = pd.DataFrame(summary_rows)
+                st.dataframe(
+                    temperature_frame,
+                    column_config=compact_table_column_config(temperature_frame),
+                    width='stretch', hide_index=True,
                 )
-                m2.metric("RSI(14)", _format_compact_number(result['rsi'], 1))
-                m3.metric("5日動能", f"{_format_compact_number(result['momentum'], 2, signed=True)}%")
-                st.markdown(f"**狀態：** <span style='color:{result['color']}; font-size:18px; font-weight:700'>{result['status']}</span>", unsafe_allow_html=True)
-                st.info(f"入場觀察：{result['entry']}")
-                st.warning(f"出場／風控：{result['exit_rule']}")
-                if source:
-                    st.caption(f"資料來源：{source}｜最新交易日：{pd.Timestamp(result['updated_at']).strftime('%Y/%m/%d')}")
-
-                summary_rows.append({
-                    "市場": label,
-                    "溫度": result['score'],
-                    "狀態": result['status'],
-                    "60日位置": _format_compact_number(result['range_score'], 1),
-                    "MA20": f"{result['ma20']:,.0f}",
-                    "MA60": f"{result['ma60']:,.0f}",
-                })
 
-        if summary_rows:
-            st.markdown("#### 判讀摘要")
-            temperature_frame = pd.DataFrame(summary_rows)
-            st.dataframe(
-                temperature_frame,
-                column_config=compact_table_column_config(temperature_frame),
-                width='stretch', hide_index=True,
+            st.markdown("#### 🕰️ 溫度歷史與狀態轉換")
+            history_key = st.radio(
+                "序列", list(MARKET_TEMPERATURE_HISTORY_SERIES), horizontal=True,
+                format_func=MARKET_TEMPERATURE_HISTORY_SERIES.get, key="market_temperature_history_series",
+                label_visibility="collapsed",
             )
+            live_result = None
+            if history_key.endswith('@1d'):
+                live_result = next((item[4] for item in thermometer_data if f"{item[1]}@1d" == history_key), None)
+            elif st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api') is not None:
+                intraday_df = fetch_shioaji_data(st.session_state.get('sj_api'), 'TWF=F', interval='15m', lookback_days=5)
+                live_result = run_analysis_job(frame_job_key('temperature', intraday_df), calculate_market_temperature, intraday_df)
+                record_market_temperature_history(history_key, live_result)
+            stored_history = load_market_temperature_history(history_key)
+            # 圖表接上進行中的最後一根（僅顯示，不寫入序列）。
+            display_history = stored_history
+            if live_result is not None:
+                live_row = live_result['history'].iloc[[-1]][MARKET_TEMPERATURE_HISTORY_COLUMNS]
+                if stored_history.empty or live_row.index[-1] > stored_history.index[-1]:
+                    display_history = pd.concat([stored_history, live_row]) if not stored_history.empty else live_row
+            if display_history.empty:
+                st.info("此序列尚無已保存的溫度紀錄；15 分 K 序列需登入永豐 Shioaji。")
+            else:
+                st.plotly_chart(
+                    cached_chart_figure(
+                        (
+                            'temperature_history_chart', history_key, len(display_history),
+                            str(display_history.index[0]), str(display_history.index[-1]),
+                            float(display_history['close'].iloc[-1]), float(display_history['score'].iloc[-1]),
+                        ),
+                        build_market_temperature_history_chart, display_history, MARKET_TEMPERATURE_HISTORY_SERIES[history_key],
+                    ),
+                    width='stretch', config={'displayModeBar': False},
+                )
+                st.caption(
+                    f"已保存 {len(stored_history):,} 根（{pd.Timestamp(stored_history.index[0]).strftime('%Y/%m/%d') if not stored_history.empty else '—'} 起）；"
+                    "每次更新只附加新收完的 K 棒，重啟後接續累積。"
+                )
+                events_col, stats_col = st.columns([2, 3])
+                with events_col:
+                    st.markdown("**近期狀態轉換**")
+                    events = get_market_temperature_events(history_key)
+                    if events.empty:
+                        st.caption("尚未出現狀態轉換。")
+                    else:
+                        recent_events = events.tail(10).iloc[::-1]
+                        recent_events = pd.DataFrame({
+                            "時間": pd.DatetimeIndex(recent_events.index).strftime('%Y/%m/%d %H:%M' if history_key.endswith('@15m') else '%Y/%m/%d'),
+                            "轉換": recent_events['from'] + " → " + recent_events['to'],
+                            "溫度": recent_events['score'].astype(int),
+                            "收盤": recent_events['close'].map(lambda value: f"{value:,.0f}"),
+                        })
+                        st.dataframe(recent_events, width='stretch', hide_index=True)
+                with stats_col:
+                    st.markdown("**溫度條件後的報酬回顧**")
+                    forward_stats = market_temperature_forward_stats(stored_history)
+                    if forward_stats.empty:
+                        st.caption("樣本不足。")
+                    else:
+                        st.dataframe(
+                            forward_stats,
+                            column_config=compact_table_column_config(forward_stats),
+                            width='stretch', hide_index=True,
+                        )
+
+            st.markdown("#### 📶 全市場廣度")
+            breadth_info_col, breadth_button_col = st.columns([6, 1])
+            with breadth_info_col:
+                st.caption(
+                    f"以 stock_names.csv 內上市櫃普通股的官方日收盤行情計算，保留最近 {MARKET_BREADTH_MAX_DAYS} 個交易日；"
+                    "首次使用需回補約 6 分鐘，之後每天只補抓缺少的交易日。"
+                )
+            with breadth_button_col:
+                refresh_breadth = st.button("📥 更新廣度", key="refresh_market_breadth", width='stretch')
+            if refresh_breadth:
+                breadth_progress = st.progress(0.0, text="正在抓取全市場日收盤行情...")
+                added_days, failed_days = update_market_breadth(
+                    lambda done, total: breadth_progress.progress(done / max(total, 1), text=f"全市場日收盤行情 {done}/{total}")
+                )
+                breadth_progress.empty()
+                if failed_days:
+                    st.warning(f"新增 {added_days} 個交易日，{failed_days} 日抓取失敗，可稍後再按一次補齊。")
+                else:
+                    st.toast(f"全市場廣度已更新 {added_days} 個交易日", icon="📶")
+            breadth = compute_market_breadth()
+            breadth_result = summarize_market_breadth(breadth)
+            if breadth_result is None:
+                st.info("尚未建立全市場廣度資料，請按「📥 更新廣度」。")
+            else:
+                latest_breadth = breadth_result['latest']
+                gauge_col, breadth_chart_col = st.columns([2, 3])
+                with gauge_col:
+                    st.plotly_chart(
+                        build_market_temperature_gauge("全市場廣度", breadth_result),
+                        width='stretch', config={'displayModeBar': False}
+                    )
+                    b1, b2, b3 = st.columns(3)
+                    b1.metric("上漲／下跌", f"{int(latest_breadth['上漲家數'])}／{int(latest_breadth['下跌家數'])}")
+                    b2.metric("漲停／跌停", f"{int(latest_breadth['漲停家數'])}／{int(latest_breadth['跌停家數'])}")
+                    b3.metric("新高／新低", f"{int(latest_breadth['創20日新高'])}／{int(latest_breadth['創20日新低'])}")
+                    st.caption(
+                        f"站上 MA20：{_format_compact_number(latest_breadth['站上MA20(%)'], 1)}%｜"
+                        f"站上 MA60：{_format_compact_number(latest_breadth['站上MA60(%)'], 1)}%｜"
+                        f"最新交易日：{pd.Timestamp(breadth_result['updated_at']).strftime('%Y/%m/%d')}"
+                    )
+                with breadth_chart_col:
+                    breadth_chart = make_subplots(specs=[[{"secondary_y": True}]])
+                    breadth_chart.add_trace(go.Bar(
+                        x=breadth.index, y=breadth['上漲家數'] - breadth['下跌家數'], name='漲跌家數差',
+                        marker_color=np.where(breadth['上漲家數'] >= breadth['下跌家數'], '#ff4b4b', '#00c853'),
+                        opacity=0.45,
+                    ), secondary_y=True)
+                    for column, color in (('廣度溫度', '#ffc107'), ('站上MA20(%)', '#4fc3f7'), ('站上MA60(%)', '#ba68c8')):
+                        breadth_chart.add_trace(go.Scatter(
+                            x=breadth.index, y=breadth[column], name=column, mode='lines', line=dict(color=color, width=2)
+                        ), secondary_y=False)
+                    breadth_chart.update_yaxes(range=[0, 100], secondary_y=False)
+                    breadth_chart.update_layout(
+                        height=360, margin=dict(l=10, r=10, t=30, b=10), hovermode='x unified',
+                        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='#dfe6e9'),
+                        legend=dict(orientation='h', y=1.12),
+                    )
+                    st.plotly_chart(breadth_chart, width='stretch', config={'displayModeBar': False})
 
-        with st.expander("溫度計判讀規則"):
-            st.markdown("""
+            with st.expander("溫度計判讀規則"):
+                st.markdown("""
             - 0–39：空方動能較強；40–59：區間盤整；60–100：多方動能較強。
+            - 全市場廣度溫度＝35% 站上 MA20 比例＋25% 站上 MA60 比例＋25% 上漲家數占比＋15% 20 日新高占新高低比例；漲跌停以昨收 ±10% 並依升降單位推算。
             - 溫度屬於日線「趨勢背景」，不是立即進場訊號；操作計畫會另外確認費波位置、15 分 K、VWAP、開盤區間及 ATR 反轉幅度。
             - 反向漲跌達約 1.5 日 ATR，或溫度快速反轉並突破盤中結構時，會先暫停原趨勢方向，避免在超跌反彈追空或過熱回落追多。
             - 期貨在 15:00 後會建立下一交易日的夜盤未完成日 K，隔日日盤會累加到同一根，因此可直接用於夜盤支撐壓力判讀。
@@ -12584,1028 +16482,1008 @@ with tab_fibo:
             """)
 
     with tab_fibo_chart:
-        code_map_fibo, name_map_fibo = load_local_stock_names()
-        fibo_stock_options = []
-        for c, n in sorted(code_map_fibo.items()):
-            if not st.session_state.get('allow_warrant_search', False) and is_warrant(c):
-                continue
-            fibo_stock_options.append(f"{n}({c})")
-        # 下方 search_list 修改對應變數
-        search_list = ["加權股價指數(TAIEX)", "臺股期貨(TX)", "微型臺指期貨(TMF)"] + fibo_stock_options
-
-        def set_fibo_search(val):
-            st.session_state.fibo_search_input = val
-            st.session_state.fibo_trigger_search = True
-            st.session_state.fibo_interval = "1d"
-
-        with st.expander("⚙️ 設定快速標籤"):
-            st.info("💡 將圖表字體大小設定獨立：")
-            st.session_state.fibo_font_size = st.slider("圖表標籤字體大小", min_value=8, max_value=24, value=st.session_state.fibo_font_size)
-            st.write("---")
-            c1, c2, c3, c4, c5 = st.columns(5)
-            c1.text_input("快速標籤 1", key="custom_tag_1", on_change=format_fibo_tag, args=("custom_tag_1",))
-            c2.text_input("快速標籤 2", key="custom_tag_2", on_change=format_fibo_tag, args=("custom_tag_2",))
-            c3.text_input("快速標籤 3", key="custom_tag_3", on_change=format_fibo_tag, args=("custom_tag_3",))
-            c4.text_input("快速標籤 4", key="custom_tag_4", on_change=format_fibo_tag, args=("custom_tag_4",))
-            c5.text_input("快速標籤 5", key="custom_tag_5", on_change=format_fibo_tag, args=("custom_tag_5",))
-            if st.button("💾 儲存快速標籤", key="save_fibo_quick_tags", use_container_width=True):
-                save_fibo_config()
-                st.toast("快速標籤已同步儲存", icon="✅")
-
-        st.write("📌 **快速查詢標籤** (點擊按鈕直接帶入)")
-        btn_labels = [
-            ("加權股價指數(TAIEX)", "加權股價指數(TAIEX)"),
-            ("臺股期貨(TX)", "臺股期貨(TX)"),
-            ("微型臺指期貨(TMF)", "微型臺指期貨(TMF)")
-        ]
-        for tag in [st.session_state.custom_tag_1, st.session_state.custom_tag_2, st.session_state.custom_tag_3, st.session_state.custom_tag_4, st.session_state.custom_tag_5]:
-            if tag.strip(): btn_labels.append((tag.strip(), tag.strip()))
-        
-        if btn_labels:
-            tag_cols = st.columns(len(btn_labels))
-            for i, (label, val) in enumerate(btn_labels):
-                if i < len(tag_cols):
-                    tag_cols[i].button(label, on_click=set_fibo_search, args=(val,), width='stretch', key=f"btn_fibo_{i}")
-
-        # 移除重複且未過濾的賦值，直接取得當前搜尋框的預設索引值
-        current_val = st.session_state.fibo_search_input
-        default_index = None
-        
-        if current_val:
-            for i, opt in enumerate(search_list):
-                if current_val in opt:
-                    default_index = i
-                    break
+        if tab_fibo.open and tab_fibo_chart.open:
+            code_map_fibo, name_map_fibo = load_local_stock_names()
+            fibo_stock_options = []
+            for c, n in sorted(code_map_fibo.items()):
+                if not st.session_state.get('allow_warrant_search', False) and is_warrant(c):
+                    continue
+                fibo_stock_options.append(f"{n}({c})")
+            # 下方 search_list 修改對應變數
+            search_list = ["加權股價指數(TAIEX)", "臺股期貨(TX)", "微型臺指期貨(TMF)"] + fibo_stock_options
 
-        def selectbox_changed():
-            val = st.session_state.fibo_selectbox
-            if val:
+            def set_fibo_search(val):
                 st.session_state.fibo_search_input = val
+                st.session_state.fibo_trigger_search = True
                 st.session_state.fibo_interval = "1d"
-            else:
-                st.session_state.fibo_search_input = ""
-
-        selected_raw = st.selectbox(
-            "🔍 搜尋股票 (可直接輸入股號或股名查找，或點擊上方快捷按鈕)",
-            options=search_list,
-            index=default_index,
-            placeholder="請選擇或輸入...",
-            key="fibo_selectbox",
-            on_change=selectbox_changed
-        )
+
+            with st.expander("⚙️ 設定快速標籤"):
+                st.info("💡 將圖表字體大小設定獨立：")
+                st.session_state.fibo_font_size = st.slider("圖表標籤字體大小", min_value=8, max_value=24, value=st.session_state.fibo_font_size)
+                st.write("---")
+                c1, c2, c3, c4, c5 = st.columns(5)
+                c1.text_input("快速標籤 1", key="custom_tag_1", on_change=format_fibo_tag, args=("custom_tag_1",))
+                c2.text_input("快速標籤 2", key="custom_tag_2", on_change=format_fibo_tag, args=("custom_tag_2",))
+                c3.text_input("快速標籤 3", key="custom_tag_3", on_change=format_fibo_tag, args=("custom_tag_3",))
+                c4.text_input("快速標籤 4", key="custom_tag_4", on_change=format_fibo_tag, args=("custom_tag_4",))
+                c5.text_input("快速標籤 5", key="custom_tag_5", on_change=format_fibo_tag, args=("custom_tag_5",))
+                if st.button("💾 儲存快速標籤", key="save_fibo_quick_tags", use_container_width=True):
+                    save_fibo_config()
+                    st.toast("快速標籤已同步儲存", icon="✅")
+
+            st.write("📌 **快速查詢標籤** (點擊按鈕直接帶入)")
+            btn_labels = [
+                ("加權股價指數(TAIEX)", "加權股價指數(TAIEX)"),
+                ("臺股期貨(TX)", "臺股期貨(TX)"),
+                ("微型臺指期貨(TMF)", "微型臺指期貨(TMF)")
+            ]
+            for tag in [st.session_state.custom_tag_1, st.session_state.custom_tag_2, st.session_state.custom_tag_3, st.session_state.custom_tag_4, st.session_state.custom_tag_5]:
+                if tag.strip(): btn_labels.append((tag.strip(), tag.strip()))
         
-        final_target = st.session_state.fibo_search_input
+            if btn_labels:
+                tag_cols = st.columns(len(btn_labels))
+                for i, (label, val) in enumerate(btn_labels):
+                    if i < len(tag_cols):
+                        tag_cols[i].button(label, on_click=set_fibo_search, args=(val,), width='stretch', key=f"btn_fibo_{i}")
+
+            # 移除重複且未過濾的賦值，直接取得當前搜尋框的預設索引值
+            current_val = st.session_state.fibo_search_input
+            default_index = None
         
-        st.write("---")
-        st.write("⚙️ **圖表顯示設定**")
-        col_m1, col_m2, col_m3, col_m4, col_v, col_w = st.columns([1, 1, 1, 1, 1.5, 2.5])
-        s_ma5 = col_m1.checkbox("5MA (橘)", value=True)
-        s_ma10 = col_m2.checkbox("10MA (淺藍)", value=True)
-        s_ma20 = col_m3.checkbox("20MA (綠)", value=True)
-        s_ma60 = col_m4.checkbox("60MA (黃)", value=True)
-        s_vol = col_v.checkbox("📊 顯示成交量", value=True)
-        ma_w = col_w.slider(
-            "均線粗細", min_value=1.0, max_value=5.0, step=0.5,
-            key="ma_w", on_change=save_fibo_config, label_visibility="collapsed"
-        )
+            if current_val:
+                for i, opt in enumerate(search_list):
+                    if current_val in opt:
+                        default_index = i
+                        break
+
+            def selectbox_changed():
+                val = st.session_state.fibo_selectbox
+                if val:
+                    st.session_state.fibo_search_input = val
+                    st.session_state.fibo_interval = "1d"
+                else:
+                    st.session_state.fibo_search_input = ""
+
+            selected_raw = st.selectbox(
+                "🔍 搜尋股票 (可直接輸入股號或股名查找，或點擊上方快捷按鈕)",
+                options=search_list,
+                index=default_index,
+                placeholder="請選擇或輸入...",
+                key="fibo_selectbox",
+                on_change=selectbox_changed
+            )
         
-        ma_flags = {'5': s_ma5, '10': s_ma10, '20': s_ma20, '60': s_ma60}
-
-        st.write("---")
-        interval_options = {"5m": "5分", "15m": "15分", "60m": "60分", "1d": "日", "1wk": "週", "1mo": "月"}
-        try: default_radio_idx = list(interval_options.keys()).index(st.session_state.fibo_interval)
-        except: default_radio_idx = 0 
-
-        interval_col, advice_col = st.columns([1, 3], vertical_alignment="top")
-        selected_interval_label = interval_col.radio(
-            "⏱️ 選擇時間標籤",
-            options=list(interval_options.values()),
-            index=default_radio_idx,
-            horizontal=True
-        )
-        advice_placeholder = advice_col.container()
+            final_target = st.session_state.fibo_search_input
+        
+            st.write("---")
+            st.write("⚙️ **圖表顯示設定**")
+            col_m1, col_m2, col_m3, col_m4, col_v, col_w = st.columns([1, 1, 1, 1, 1.5, 2.5])
+            s_ma5 = col_m1.checkbox("5MA (橘)", value=True)
+            s_ma10 = col_m2.checkbox("10MA (淺藍)", value=True)
+            s_ma20 = col_m3.checkbox("20MA (綠)", value=True)
+            s_ma60 = col_m4.checkbox("60MA (黃)", value=True)
+            s_vol = col_v.checkbox("📊 顯示成交量", value=True)
+            ma_w = col_w.slider(
+                "均線粗細", min_value=1.0, max_value=5.0, step=0.5,
+                key="ma_w", on_change=save_fibo_config, label_visibility="collapsed"
+            )
+        
+            ma_flags = {'5': s_ma5, '10': s_ma10, '20': s_ma20, '60': s_ma60}
+
+            st.write("---")
+            interval_options = {"5m": "5分", "15m": "15分", "60m": "60分", "1d": "日", "1wk": "週", "1mo": "月"}
+            try: default_radio_idx = list(interval_options.keys()).index(st.session_state.fibo_interval)
+            except: default_radio_idx = 0 
+
+            interval_col, advice_col = st.columns([1, 3], vertical_alignment="top")
+            selected_interval_label = interval_col.radio(
+                "⏱️ 選擇時間標籤",
+                options=list(interval_options.values()),
+                index=default_radio_idx,
+                horizontal=True
+            )
+            advice_placeholder = advice_col.container()
         
-        selected_interval = list(interval_options.keys())[list(interval_options.values()).index(selected_interval_label)]
-        st.session_state.fibo_interval = selected_interval 
+            selected_interval = list(interval_options.keys())[list(interval_options.values()).index(selected_interval_label)]
+            st.session_state.fibo_interval = selected_interval 
         
-        if tab_fibo_chart.open and final_target.strip():
-            plot_fibonacci_chart(
-                final_target, selected_interval,
-                font_size=st.session_state.fibo_font_size,
-                ma_flags=ma_flags, ma_width=st.session_state.ma_w,
-                show_vol=s_vol, advice_container=advice_placeholder,
+            if final_target.strip():
+                plot_fibonacci_chart(
+                    final_target, selected_interval,
+                    font_size=st.session_state.fibo_font_size,
+                    ma_flags=ma_flags, ma_width=st.session_state.ma_w,
+                    show_vol=s_vol, advice_container=advice_placeholder,
+                )
+            else:
+                st.info("請在上方選擇或輸入股票/期貨以顯示圖表。")
+
+    with tab_fibo_scan:
+        if tab_fibo.open and tab_fibo_scan.open:
+            st.subheader("多週期費波掃描")
+            quick_tags = [st.session_state.get(f"custom_tag_{i}", "") for i in range(1, 6)]
+            scan_symbols = fibo_scan_universe(st.session_state.get('stock_data'), quick_tags)
+            sj_ready = st.session_state.get('sj_logged_in', False) and st.session_state.get('sj_api') is not None
+            st.caption(
+                f"掃描股票表格與快速標籤共 {len(scan_symbols)} 檔；日 K 讀取本地全市場廣度資料（請先於市場溫度計更新廣度），"
+                "分 K 需登入永豐。每個週期取 60／45／30 根區間中最接近的費波回撤價位，距離以 ATR 計。"
+            )
+            scan_col1, scan_col2, scan_col3 = st.columns([3, 2, 1], vertical_alignment="bottom")
+            scan_intervals = scan_col1.multiselect(
+                "週期", list(FIBO_SCAN_INTERVALS), default=['1d'], format_func=FIBO_SCAN_INTERVALS.get,
+                key="fibo_scan_intervals",
             )
-        elif tab_fibo_chart.open:
-            st.info("請在上方選擇或輸入股票/期貨以顯示圖表。")
+            scan_max_atr = scan_col2.slider("距離上限（ATR）", 0.1, 2.0, 0.5, 0.1, key="fibo_scan_max_atr")
+            run_scan = scan_col3.button("🔎 開始掃描", key="fibo_scan_run", width='stretch', disabled=not scan_symbols or not scan_intervals)
+            if run_scan:
+                if not sj_ready and any(interval != '1d' for interval in scan_intervals):
+                    st.info("尚未登入永豐，本次只掃描日 K。")
+                progress = st.progress(0.0, text="讀取 K 棒中…")
+                scan_table, scanned_count = scan_fibonacci_watchlist(
+                    scan_symbols, scan_intervals, scan_max_atr,
+                    api=st.session_state.get('sj_api') if sj_ready else None,
+                    progress_callback=lambda done, total: progress.progress(done / total, text=f"讀取分 K {done}/{total}"),
+                )
+                progress.empty()
+                st.session_state['fibo_scan_result'] = {
+                    'table': scan_table, 'scanned': scanned_count, 'total': len(scan_symbols),
+                    'intervals': list(scan_intervals), 'at': datetime.now(pytz.timezone('Asia/Taipei')).strftime('%H:%M:%S'),
+                }
+            scan_result = st.session_state.get('fibo_scan_result')
+            if scan_result:
+                st.caption(
+                    f"{scan_result['at']} 掃描 {scan_result['scanned']}/{scan_result['total']} 檔"
+                    f"（{'、'.join(FIBO_SCAN_INTERVALS.get(interval, interval) for interval in scan_result['intervals'])}）；"
+                    "缺少本地日 K 或分 K 的標的不列入。"
+                )
+                if scan_result['table'].empty:
+                    st.info("目前沒有收盤價接近費波價位的標的。")
+                else:
+                    scan_display = scan_result['table'].copy()
+                    scan_display['結構確認'] = scan_display['結構確認'].map({True: '✅', False: ''})
+                    st.dataframe(
+                        scan_display,
+                        column_config=compact_table_column_config(scan_display),
+                        width='stretch', hide_index=True,
+                    )
 
     with tab_fibo_manual:
-        st.write("📌 **手動輸入高低點，計算費波納契回撤與延伸點位**")
-        col_table, col_empty = st.columns([1, 2])
+        if tab_fibo.open and tab_fibo_manual.open:
+            st.write("📌 **手動輸入高低點，計算費波納契回撤與延伸點位**")
+            col_table, col_empty = st.columns([1, 2])
         
-        with col_table:
-            col_h, col_l = st.columns(2)
-            with col_h:
-                fibo_high = st.number_input("輸入波段高點：", value=None, step=1.0, format="%.12g")
-            with col_l:
-                fibo_low = st.number_input("輸入波段低點：", value=None, step=1.0, format="%.12g")
+            with col_table:
+                col_h, col_l = st.columns(2)
+                with col_h:
+                    fibo_high = st.number_input("輸入波段高點：", value=None, step=1.0, format="%.12g")
+                with col_l:
+                    fibo_low = st.number_input("輸入波段低點：", value=None, step=1.0, format="%.12g")
                 
-            if fibo_high is not None and fibo_low is not None:
-                if fibo_high > 0 and fibo_low > 0 and fibo_high >= fibo_low:
-                    diff = fibo_high - fibo_low
-                    ratios_manual = [-2.618, -2.0, -1.618, -1.0, 0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0, 1.618, 2.0, 2.618]
+                if fibo_high is not None and fibo_low is not None:
+                    if fibo_high > 0 and fibo_low > 0 and fibo_high >= fibo_low:
+                        diff = fibo_high - fibo_low
+                        ratios_manual = [-2.618, -2.0, -1.618, -1.0, 0.0, 0.236, 0.382, 0.5, 0.618, 0.786, 1.0, 1.618, 2.0, 2.618]
                     
-                    fibo_data = []
-                    for r in ratios_manual:
-                        price = fibo_low + (r * diff)
-                        calc_price = round(price, 2)
-                        r_label = "1" if r == 1.0 else ("0" if r == 0.0 else f"{r:g}")
-                        fibo_data.append({
-                            "比例": r_label,
-                            "計算點位": _format_compact_number(calc_price, 2),
-                            "_raw_r": r 
-                        })
+                        fibo_data = []
+                        for r in ratios_manual:
+                            price = fibo_low + (r * diff)
+                            calc_price = round(price, 2)
+                            r_label = "1" if r == 1.0 else ("0" if r == 0.0 else f"{r:g}")
+                            fibo_data.append({
+                                "比例": r_label,
+                                "計算點位": _format_compact_number(calc_price, 2),
+                                "_raw_r": r 
+                            })
                     
-                    df_fibo = pd.DataFrame(fibo_data)
+                        df_fibo = pd.DataFrame(fibo_data)
                     
-                    def style_fibo_manual(row):
-                        important_ratios = [0.0, 0.382, 0.5, 0.618, 1.0]
-                        if row["_raw_r"] in important_ratios:
-                            return ['background-color: #ffffcc; color: black; font-weight: bold;'] * len(row)
-                        return [''] * len(row)
+                        def style_fibo_manual(row):
+                            important_ratios = [0.0, 0.382, 0.5, 0.618, 1.0]
+                            if row["_raw_r"] in important_ratios:
+                                return ['background-color: #ffffcc; color: black; font-weight: bold;'] * len(row)
+                            return [''] * len(row)
                         
-                    table_height = (len(df_fibo) + 1) * 36
-                    styled_fibo = df_fibo.style.apply(style_fibo_manual, axis=1)
+                        table_height = (len(df_fibo) + 1) * 36
+                        styled_fibo = df_fibo.style.apply(style_fibo_manual, axis=1)
                     
-                    st.dataframe(
-                        styled_fibo, 
-                        width='stretch', 
-                        height=table_height, 
-                        hide_index=True,
-                        column_config={"_raw_r": None}
-                    )
+                        st.dataframe(
+                            styled_fibo, 
+                            width='stretch', 
+                            height=table_height, 
+                            hide_index=True,
+                            column_config={"_raw_r": None}
+                        )
+                    else:
+                        st.warning("波段高點必須大於波段低點且大於0")
                 else:
-                    st.warning("波段高點必須大於波段低點且大於0")
-            else:
-                st.info("請在上方輸入高低點數值開始計算。")
+                    st.info("請在上方輸入高低點數值開始計算。")
 
 
 with tab_db:
-    sub_tab1, sub_tab2, sub_tab3 = st.tabs(["三大法人買賣超", "台指期籌碼快訊", "處置股"])
+    sub_tab1, sub_tab2, sub_tab3 = st.tabs(
+        ["三大法人買賣超", "台指期籌碼快訊", "處置股"],
+        default="三大法人買賣超", key="strategy_database_active_tab", on_change="rerun",
+    )
     
     with sub_tab1:
-        st.markdown("#### 📊 台股三大法人每日買賣超統計")
+        if tab_db.open and sub_tab1.open:
+            st.markdown("#### 📊 台股三大法人每日買賣超統計")
         
-        # 調整預設日期邏輯：若是週六或週日，預設切回上週五
-        today_check = datetime.today()
-        if today_check.weekday() == 5:
-            default_date = today_check - timedelta(days=1)
-        elif today_check.weekday() == 6:
-            default_date = today_check - timedelta(days=2)
-        else:
-            default_date = today_check
-
-        selected_date = st.date_input("選擇日期", default_date)
-        date_str = selected_date.strftime("%Y%m%d")
+            # 調整預設日期邏輯：若是週六或週日，預設切回上週五
+            default_date = default_institutional_date()
+            selected_date = st.date_input("選擇日期", default_date)
+            date_str = selected_date.strftime("%Y%m%d")
         
-        # 加入安全攔截，若發生錯誤則預設為 None
-        try:
-            df_inst = get_major_institutional_data(date_str)
-        except Exception:
-            df_inst = None
+            # 加入安全攔截，若發生錯誤則預設為 None
+            try:
+                df_inst = get_major_institutional_data(date_str)
+            except Exception:
+                df_inst = None
             
-        if df_inst is not None:
-            st.subheader(f"📅 {selected_date.strftime('%Y-%m-%d')} 統計結果")
+            if df_inst is not None:
+                st.subheader(f"📅 {selected_date.strftime('%Y-%m-%d')} 統計結果")
             
-            # 建立一個自訂的格式化函數，將原始數字轉為：千分位(+-XXX.XX億)
-            def fmt_with_yi(val):
-                try:
-                    v = float(val)
-                    yi_val = v / 100000000
-                    return f"{int(v):,}  ({_format_compact_number(yi_val, 2, signed=True)}億)"
-                except:
-                    return str(val)
+                # 建立一個自訂的格式化函數，將原始數字轉為：千分位(+-XXX.XX億)
+                def fmt_with_yi(val):
+                    try:
+                        v = float(val)
+                        yi_val = v / 100000000
+                        return f"{int(v):,}  ({_format_compact_number(yi_val, 2, signed=True)}億)"
+                    except:
+                        return str(val)
             
-            # 將自訂格式套用到買進、賣出、買賣差額三個欄位
-            fmt_dict = {col: fmt_with_yi for col in ['買進金額', '賣出金額', '買賣差額']}
+                # 將自訂格式套用到買進、賣出、買賣差額三個欄位
+                fmt_dict = {col: fmt_with_yi for col in ['買進金額', '賣出金額', '買賣差額']}
             
-            try:
-                styled_df = df_inst.style.map(color_negative_positive, subset=['買賣差額']).format(fmt_dict)
-            except AttributeError:
-                styled_df = df_inst.style.applymap(color_negative_positive, subset=['買賣差額']).format(fmt_dict)
+                try:
+                    styled_df = df_inst.style.map(color_negative_positive, subset=['買賣差額']).format(fmt_dict)
+                except AttributeError:
+                    styled_df = df_inst.style.applymap(color_negative_positive, subset=['買賣差額']).format(fmt_dict)
             
-            # 使用 columns 進行縮排，不讓表格佔滿全螢幕
-            col_tbl, _ = st.columns([1.5, 1])
-            with col_tbl:
-                st.dataframe(styled_df, width='stretch', hide_index=True)
-            st.caption("數據來源：[台灣證券交易所 (TWSE)](https://www.twse.com.tw/zh/trading/foreign/bfi82u.html)")
-        else:
-            st.warning("該日期目前無資料（可能尚未開市或為休假日或證交所 API 觸發防護防阻）。")
+                # 使用 columns 進行縮排，不讓表格佔滿全螢幕
+                col_tbl, _ = st.columns([1.5, 1])
+                with col_tbl:
+                    st.dataframe(styled_df, width='stretch', hide_index=True)
+                st.caption("數據來源：[台灣證券交易所 (TWSE)](https://www.twse.com.tw/zh/trading/foreign/bfi82u.html)")
+            else:
+                st.warning("該日期目前無資料（可能尚未開市或為休假日或證交所 API 觸發防護防阻）。")
                 
-        st.markdown("---")
-        st.markdown("#### 📈 法人當日買賣超個股")
-        inst_tabs = st.tabs(["外資當日買賣超", "投信當日買賣超", "自營商當日買賣超"])
-        with inst_tabs[0]:
-            components.html(fetch_fubon_html("https://fubon-ebrokerdj.fbs.com.tw/Z/ZG/ZGK_D.djhtm"), height=1185, width=800, scrolling=True)
-        with inst_tabs[1]:
-            components.html(fetch_fubon_html("https://fubon-ebrokerdj.fbs.com.tw/Z/ZG/ZGK_DD.djhtm"), height=1185, width=800, scrolling=True)
-        with inst_tabs[2]:
-            components.html(fetch_fubon_html("https://fubon-ebrokerdj.fbs.com.tw/Z/ZG/ZGK_DB.djhtm"), height=1185, width=800, scrolling=True)
-        
+            st.markdown("---")
+            st.markdown("#### 📈 法人當日買賣超個股")
+            inst_tabs = st.tabs(
+                ["外資當日買賣超", "投信當日買賣超", "自營商當日買賣超"],
+                default="外資當日買賣超", key="institutional_rank_active_tab", on_change="rerun",
+            )
+            inst_pages = ["ZGK_D", "ZGK_DD", "ZGK_DB"]
+            for inst_tab, inst_page in zip(inst_tabs, inst_pages):
+                with inst_tab:
+                    if inst_tab.open:
+                        components.html(fetch_fubon_html(f"https://fubon-ebrokerdj.fbs.com.tw/Z/ZG/{inst_page}.djhtm"), height=1185, width=800, scrolling=True)
+
+            st.markdown("---")
+            st.markdown("#### 🗄️ 法人籌碼資料庫（多週累計／排行／連買賣）")
+            st.caption("資料來自證交所上市個股三大法人日報，已入庫的日期不會重抓；每日 15:00 後開啟本頁會自動補入最近交易日；上櫃股票不在此資料源內。")
+            ensure_institutional_flow_latest()
+            flow_range = st.date_input(
+                "統計區間", (default_date - timedelta(days=28), default_date), key="inst_flow_range"
+            )
+            flow_start, flow_end = (flow_range if isinstance(flow_range, (list, tuple)) and len(flow_range) == 2 else (default_date, default_date))
+            flow_col_investor, flow_col_code, flow_col_fill = st.columns([1, 1, 1])
+            with flow_col_investor:
+                flow_investor = st.selectbox("法人別", INSTITUTIONAL_FLOW_COLUMNS, index=3, key="inst_flow_investor")
+            with flow_col_code:
+                flow_code_filter = st.text_input("個股代號（空白為全部）", key="inst_flow_code").strip()
+            with flow_col_fill:
+                if st.button("📥 補齊區間資料", key="btn_inst_flow_backfill", width='stretch'):
+                    flow_progress = st.progress(0.0, text="正在補齊法人資料...")
+                    flow_added, flow_failed = backfill_institutional_flow(
+                        flow_start, flow_end,
+                        progress_callback=lambda done, total: flow_progress.progress(done / max(total, 1), text=f"正在補齊法人資料 {done}/{total}"),
+                    )
+                    flow_progress.empty()
+                    if flow_failed:
+                        st.warning(f"新增 {flow_added} 個交易日，{flow_failed} 日抓取失敗，可稍後再補。")
+                    else:
+                        st.success(f"新增 {flow_added} 個交易日。")
+
+            flow_frame = query_institutional_flow(flow_start, flow_end, codes=[flow_code_filter] if flow_code_filter else None)
+            if flow_frame.empty:
+                st.info("此區間尚未入庫，請先按「補齊區間資料」。")
+            elif flow_code_filter:
+                stock_flow = flow_frame.sort_values('日期').set_index('日期')[INSTITUTIONAL_FLOW_COLUMNS] / 1000
+                stock_flow['累計(張)'] = stock_flow[flow_investor].cumsum()
+                st.dataframe(stock_flow.round(0), width='stretch')
+            else:
+                flow_summary = summarize_institutional_flow(flow_frame, flow_investor)
+                stored_days = flow_frame['日期'].nunique()
+                st.caption(f"區間內已入庫 {stored_days} 個交易日，{len(flow_summary)} 檔個股。")
+                rank_buy_col, rank_sell_col, rank_streak_col = st.columns(3)
+                with rank_buy_col:
+                    st.markdown("**累計買超前 20**")
+                    st.dataframe(flow_summary.nlargest(20, '累計(張)')[['代號', '名稱', '累計(張)', '買超天數']], width='stretch', hide_index=True)
+                with rank_sell_col:
+                    st.markdown("**累計賣超前 20**")
+                    st.dataframe(flow_summary.nsmallest(20, '累計(張)')[['代號', '名稱', '累計(張)', '賣超天數']], width='stretch', hide_index=True)
+                with rank_streak_col:
+                    st.markdown("**連續買超天數前 20**")
+                    st.dataframe(flow_summary.sort_values(['連買天數', '累計(張)'], ascending=False).head(20)[['代號', '名稱', '連買天數', '累計(張)']], width='stretch', hide_index=True)
+
     with sub_tab2:
-        st.markdown("#### 📑 永豐期貨盤後籌碼自動化工具")
+        if tab_db.open and sub_tab2.open:
+            st.markdown("#### 📑 永豐期貨盤後籌碼自動化工具")
         
-        if st.button("🔄 刷新最新報告清單"):
-            get_report_list.clear()        # 只清報告清單
-            fetch_and_parse_pdf.clear()   # 只清 PDF 快取
-            st.rerun()
+            if st.button("🔄 刷新最新報告清單"):
+                get_report_list.clear()        # 只清報告清單
+                fetch_and_parse_pdf.clear()   # 只清 PDF 快取
+                st.rerun()
 
-        reports = get_report_list()
+            reports = get_report_list()
 
-        if not reports:
-            st.warning("目前找不到相關報告，請檢查官網是否變動或稍後再試。")
-        else:
-            latest_report = reports[0]
-            st.markdown(f"### 🔥 最新快訊: {latest_report['日期']} | {latest_report['title']}")
+            if not reports:
+                st.warning("目前找不到相關報告，請檢查官網是否變動或稍後再試。")
+            else:
+                latest_report = reports[0]
+                st.markdown(f"### 🔥 最新快訊: {latest_report['日期']} | {latest_report['title']}")
             
-            with st.spinner("正在下載並自動預覽最新報告..."):
-                data = fetch_and_parse_pdf(latest_report['url'])
+                with st.spinner("正在下載並自動預覽最新報告..."):
+                    data = fetch_and_parse_pdf(latest_report['url'], latest_report['日期'], latest_report['title'])
                 
-                if data['ratio'] != "N/A" and data['ratio'] != "解析錯誤":
-                    val = float(data['ratio'])
-                    st.metric("散戶小台多空比", f"{val}%", delta=f"{val}%", delta_color="inverse")
+                    if data['ratio'] != "N/A" and data['ratio'] != "解析錯誤":
+                        val = float(data['ratio'])
+                        st.metric("散戶小台多空比", f"{val}%", delta=f"{val}%", delta_color="inverse")
                 
-                if data.get('images'):
-                    col_img, _ = st.columns([1, 2])
-                    with col_img:
-                        for img in data['images']:
-                            st.image(img, width='stretch')
-                else:
-                    st.warning("⚠️ 無法自動轉譯為圖片，請使用下方連結開啟。")
+                    if data.get('images'):
+                        col_img, _ = st.columns([1, 2])
+                        with col_img:
+                            for img in data['images']:
+                                st.image(img, width='stretch')
+                    else:
+                        st.warning("⚠️ 無法自動轉譯為圖片，請使用下方連結開啟。")
                     
-            st.link_button("📥 點此進入原始報告下載頁面", latest_report['url'])
-            
-            st.divider()
-            st.markdown("#### 📅 歷史報告清單")
+                st.link_button("📥 點此進入原始報告下載頁面", latest_report['url'])
+
+                st.divider()
+                st.markdown("#### 📉 散戶小台多空比歷史")
+                if st.button("📥 回補歷史報告多空比", key="btn_backfill_report_ratio"):
+                    with st.spinner("正在回補尚未解析的歷史報告..."):
+                        added_count, missing_count, failed_count = backfill_report_history(reports, max_workers=ANALYSIS_MAX_WORKERS)
+                    missing_text = f"，{missing_count} 份報告內沒有多空比" if missing_count else ""
+                    if failed_count:
+                        st.warning(f"已回補 {added_count} 份{missing_text}，{failed_count} 份下載或解析失敗，下次回補會再重試。")
+                    else:
+                        st.success(f"已回補 {added_count} 份報告{missing_text}。")
+                ratio_history = build_report_ratio_history()
+                if len(ratio_history) >= 2:
+                    ratio_fig = go.Figure(go.Scatter(
+                        x=ratio_history['日期'], y=ratio_history['散戶小台多空比(%)'],
+                        mode='lines+markers', line=dict(color='#ff9800', width=2),
+                    ))
+                    ratio_fig.add_hline(y=0, line_dash='dot', line_color='#888888')
+                    ratio_fig.update_layout(
+                        height=320, margin=dict(l=10, r=10, t=20, b=10),
+                        yaxis_title='多空比(%)', template='plotly_dark',
+                    )
+                    st.plotly_chart(ratio_fig, width='stretch')
+                else:
+                    st.caption("已解析的報告少於兩份；按上方按鈕回補清單內的歷史報告後即可繪製走勢。")
+
+                st.divider()
+                st.markdown("#### 📅 歷史報告清單")
             
-            # 設定7天前的日期界線 (以台灣時間計算，精準到天)
-            tz_tw = pytz.timezone('Asia/Taipei')
-            limit_date = pd.Timestamp(datetime.now(tz_tw).date() - timedelta(days=7))
+                # 設定7天前的日期界線 (以台灣時間計算，精準到天)
+                tz_tw = pytz.timezone('Asia/Taipei')
+                limit_date = pd.Timestamp(datetime.now(tz_tw).date() - timedelta(days=7))
             
-            for idx, report in enumerate(reports[1:], 1):
-                show_report = False # 預設改為不顯示
+                for idx, report in enumerate(reports[1:], 1):
+                    show_report = False # 預設改為不顯示
                 
-                try:
-                    # 改用 pandas 處理日期，可自動適應 - 或 / 等不同格式
-                    rep_date = pd.to_datetime(report['日期'])
-                    if rep_date.tzinfo is not None: 
-                        rep_date = rep_date.tz_localize(None)
+                    try:
+                        # 改用 pandas 處理日期，可自動適應 - 或 / 等不同格式
+                        rep_date = pd.to_datetime(report['日期'])
+                        if rep_date.tzinfo is not None: 
+                            rep_date = rep_date.tz_localize(None)
                         
-                    if rep_date >= limit_date:
-                        show_report = True
-                except:
-                    # 只有在明確寫 "近期發布" 時才例外顯示
-                    if report['日期'] == "近期發布":
-                        show_report = True
+                        if rep_date >= limit_date:
+                            show_report = True
+                    except:
+                        # 只有在明確寫 "近期發布" 時才例外顯示
+                        if report['日期'] == "近期發布":
+                            show_report = True
                         
-                if show_report:
-                    with st.expander(f"📅 {report['日期']} | {report['title']}"):
-                        st.write(f"連結: [點此查看原始 PDF]({report['url']})")
+                    if show_report:
+                        with st.expander(f"📅 {report['日期']} | {report['title']}"):
+                            st.write(f"連結: [點此查看原始 PDF]({report['url']})")
 
     with sub_tab3:
-        st.markdown("#### 🚨 處置股預測與公告")
+        if tab_db.open and sub_tab3.open:
+            st.markdown("#### 🚨 處置股預測與公告")
         
-        # 初始化處置股獨立重整計數器
-        if 'disposal_refresh_idx' not in st.session_state:
-            st.session_state.disposal_refresh_idx = 0
+            # 初始化處置股獨立重整計數器
+            if 'disposal_refresh_idx' not in st.session_state:
+                st.session_state.disposal_refresh_idx = 0
             
-        # 新增重新整理按鈕
-        if st.button("🔄 重新整理處置股", key="btn_refresh_disposal"):
-            st.session_state.disposal_refresh_idx += 1
-            st.rerun()
+            # 新增重新整理按鈕
+            if st.button("🔄 重新整理處置股", key="btn_refresh_disposal"):
+                st.session_state.disposal_refresh_idx += 1
+                st.rerun()
             
-        # 將計數器加入網址參數，藉由改變網址強制 iframe 重新載入
-        refresh_url = f"https://cmfaren.github.io/dispositionforecast/?t={st.session_state.disposal_refresh_idx}"
+            # 將計數器加入網址參數，藉由改變網址強制 iframe 重新載入
+            refresh_url = f"https://cmfaren.github.io/dispositionforecast/?t={st.session_state.disposal_refresh_idx}"
         
-        components.iframe(
-            refresh_url, 
-            height=800, 
-            scrolling=True
-        )
+            components.iframe(
+                refresh_url, 
+                height=800, 
+                scrolling=True
+            )
 
 with tab3:
-    # ==========================================
-    # 新增：自訂行事曆存取與 UI 介面
-    # ==========================================
-    CAL_OVERRIDE_FILE = "cal_override.json"
-    CAL_PREFERENCES_FILE = "cal_preferences.json"
-    CALENDAR_EVENT_OPTIONS = [
-        "台股開休市",
-        "台股突發休市公告",
-        "FOMC 利率決議",
-        "美國 CPI",
-        "美國大非農",
-        "美國小非農 ADP",
-        "美國初領失業金",
-        "指定股票財報",
-        "台股月營收",
-        "美股季度／年度營收",
-    ]
-    US_HIGH_IMPACT_EVENTS = [
-        "FOMC 利率決議", "美國 CPI", "美國大非農", "美國小非農 ADP", "美國初領失業金"
-    ]
-    US_HIGH_IMPACT_DESCRIPTIONS = {
-        "FOMC 利率決議": "聯準會利率決策與政策聲明",
-        "美國 CPI": "消費者物價指數，觀察通膨",
-        "美國大非農": "非農就業人數與失業率",
-        "美國小非農 ADP": "ADP 民間就業預估",
-        "美國初領失業金": "每週首次申請失業救濟人數",
-    }
-    TAIWAN_COMPANY_GROUP = "台股公司營收與財報"
-    US_COMPANY_GROUP = "美股公司營收與財報"
-    CALENDAR_GROUP_OPTIONS = [
-        "台股市場與休市", "美國高影響總經", TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP
-    ]
-    CALENDAR_GROUP_EVENTS = {
-        "台股市場與休市": ["台股開休市", "台股突發休市公告"],
-        "美國高影響總經": US_HIGH_IMPACT_EVENTS,
-        TAIWAN_COMPANY_GROUP: ["台股公司財報", "台股月營收"],
-        US_COMPANY_GROUP: ["美股公司財報", "美股季度／年度營收"],
-    }
-
-    def normalize_calendar_preferences(saved=None):
-        """將檔案或既有 Streamlit session 的舊版事件設定升級為目前格式。"""
-        default_preferences = {
-            "groups": CALENDAR_GROUP_OPTIONS.copy(),
-            "macro_events": US_HIGH_IMPACT_EVENTS.copy(),
-            "tickers": "2330.TW",
-        }
-        if not isinstance(saved, dict):
-            return default_preferences
-
-        raw_groups = saved.get("groups", [])
-        if isinstance(raw_groups, str):
-            raw_groups = [raw_groups]
-        migrated_groups = []
-        for item in raw_groups if isinstance(raw_groups, (list, tuple, set)) else []:
-            if item in {"個股財報與營收", "公司財報／營收摘要"}:
-                migrated_groups.extend([TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP])
-            else:
-                migrated_groups.append(item)
-        raw_groups = migrated_groups
-        groups = [
-            item for item in raw_groups
-            if isinstance(item, str) and item in CALENDAR_GROUP_OPTIONS
-        ] if isinstance(raw_groups, (list, tuple, set)) else []
-        if not groups:
-            legacy_events = saved.get("events", [])
-            if isinstance(legacy_events, str):
-                legacy_events = [legacy_events]
-            legacy_events = {
-                item for item in legacy_events if isinstance(item, str)
-            } if isinstance(legacy_events, (list, tuple, set)) else set()
-            groups = [
-                group for group, events in CALENDAR_GROUP_EVENTS.items()
-                if legacy_events.intersection(events)
-            ] or CALENDAR_GROUP_OPTIONS.copy()
-
-        raw_macro_events = saved.get("macro_events", saved.get("events", []))
-        if isinstance(raw_macro_events, str):
-            raw_macro_events = [raw_macro_events]
-        macro_events = [
-            item for item in US_HIGH_IMPACT_EVENTS if item in set(raw_macro_events or [])
-        ]
-        if not macro_events:
-            macro_events = US_HIGH_IMPACT_EVENTS.copy()
-        tickers = saved.get("tickers", default_preferences["tickers"])
-        if tickers is None:
-            tickers = default_preferences["tickers"]
-        return {"groups": groups, "macro_events": macro_events, "tickers": str(tickers)}
-
-    def load_calendar_preferences():
-        if not os.path.exists(CAL_PREFERENCES_FILE):
-            return normalize_calendar_preferences()
-        try:
-            with open(CAL_PREFERENCES_FILE, "r", encoding="utf-8") as file:
-                saved = json.load(file)
-            return normalize_calendar_preferences(saved)
-        except (OSError, ValueError, TypeError):
-            return normalize_calendar_preferences()
-
-    def save_calendar_preferences(groups, macro_events, tickers, events):
-        try:
-            with open(CAL_PREFERENCES_FILE, "w", encoding="utf-8") as file:
-                json.dump({
-                    "groups": groups,
-                    "macro_events": macro_events,
-                    "events": events,
-                    "tickers": tickers,
-                    "calendar_events_version": 4,
-                }, file, ensure_ascii=False, indent=2)
-        except OSError:
-            pass
-    
-    def load_cal_overrides():
-        if os.path.exists(CAL_OVERRIDE_FILE):
-            try:
-                with open(CAL_OVERRIDE_FILE, "r", encoding="utf-8") as f:
-                    df = pd.DataFrame(json.load(f))
-                    if not df.empty and "日期" in df.columns:
-                        df["日期"] = pd.to_datetime(df["日期"], errors='coerce').dt.date
-                        return df
-            except: pass
-        
-        # 預設給予一列空白資料，並確保日期欄位擁有正確的空值型別 (NaT)
-        df = pd.DataFrame([{"日期": pd.NaT, "事件名稱": "", "文字顏色": "白色"}])
-        df["日期"] = pd.to_datetime(df["日期"], errors='coerce').dt.date
-        return df
-        
-    def save_cal_overrides(df):
-        try:
-            # 確保日期格式為字串以利 JSON 儲存
-            df_save = df.copy()
-            df_save['日期'] = df_save['日期'].astype(str)
-            df_save.to_json(CAL_OVERRIDE_FILE, orient="records", force_ascii=False)
-        except: pass
-
-    if 'cal_overrides' not in st.session_state:
-        st.session_state.cal_overrides = load_cal_overrides()
-    if 'calendar_preferences' not in st.session_state:
-        st.session_state.calendar_preferences = load_calendar_preferences()
-    else:
-        # Streamlit Cloud 部署新版程式時會沿用既有 session，需在讀取欄位前即時遷移。
-        st.session_state.calendar_preferences = normalize_calendar_preferences(
-            st.session_state.calendar_preferences
-        )
-    if "company_event_snapshot" not in st.session_state:
-        st.session_state.company_event_snapshot = load_company_event_snapshot()
-
-    with st.expander("🛠️ 自訂與校正行事曆事件"):
-        st.info("若發現系統預設日期或時間有誤，可在此手動新增或覆寫事件（例如：提前休市、自訂總經數據時間）。")
-        edited_cal_df = st.data_editor(
-            st.session_state.cal_overrides,
-            num_rows="dynamic",
-            column_config={
-                "日期": st.column_config.DateColumn("日期 (YYYY-MM-DD)", required=True),
-                "事件名稱": st.column_config.TextColumn("事件名稱", required=True),
-                "文字顏色": st.column_config.SelectboxColumn(
-                    "文字顏色",
-                    options=["白色", "紅色", "綠色", "黃色", "藍色", "橘色", "紫紅色"],
-                    default="白色"
-                )
-            },
-            key="cal_override_editor",
-            use_container_width=True
-        )
+    if tab3.open:
+        with st.expander("🛠️ 自訂與校正行事曆事件"):
+            st.info("若發現系統預設日期或時間有誤，可在此手動新增或覆寫事件（例如：提前休市、自訂總經數據時間）。")
+            edited_cal_df = st.data_editor(
+                st.session_state.cal_overrides,
+                num_rows="dynamic",
+                column_config={
+                    "日期": st.column_config.DateColumn("日期 (YYYY-MM-DD)", required=True),
+                    "事件名稱": st.column_config.TextColumn("事件名稱", required=True),
+                    "文字顏色": st.column_config.SelectboxColumn(
+                        "文字顏色",
+                        options=["白色", "紅色", "綠色", "黃色", "藍色", "橘色", "紫紅色"],
+                        default="白色"
+                    )
+                },
+                key="cal_override_editor",
+                use_container_width=True
+            )
         
-        if st.button("💾 儲存行事曆設定", key="btn_save_cal_override"):
-            st.session_state.cal_overrides = edited_cal_df
-            save_cal_overrides(edited_cal_df)
-            st.toast("自訂行事曆已儲存！", icon="✅")
-            st.rerun()
-    st.markdown("---")
-
-    with st.expander("🌐 網路同步與追蹤事件", expanded=False):
-        st.caption("選擇要顯示的事件；公司資料只讀取獨立分頁的最近快照，不會在切換月份時重新查詢。")
-        selected_event_groups = st.multiselect(
-            "追蹤類別",
-            options=CALENDAR_GROUP_OPTIONS,
-            default=st.session_state.calendar_preferences["groups"],
-            key="calendar_event_groups",
-        )
+            if st.button("💾 儲存行事曆設定", key="btn_save_cal_override"):
+                st.session_state.cal_overrides = edited_cal_df
+                save_cal_overrides(edited_cal_df)
+                st.toast("自訂行事曆已儲存！", icon="✅")
+                st.rerun()
+        st.markdown("---")
 
-        if "美國高影響總經" in selected_event_groups:
-            selected_macro_events = st.multiselect(
-                "美國高影響總經（勾選要呈現的事件）",
-                options=US_HIGH_IMPACT_EVENTS,
-                default=st.session_state.calendar_preferences.get(
-                    "macro_events", US_HIGH_IMPACT_EVENTS
-                ),
-                key="calendar_macro_events",
+        with st.expander("🌐 網路同步與追蹤事件", expanded=False):
+            st.caption("選擇要顯示的事件；公司資料只讀取獨立分頁的最近快照，不會在切換月份時重新查詢。")
+            selected_event_groups = st.multiselect(
+                "追蹤類別",
+                options=CALENDAR_GROUP_OPTIONS,
+                default=st.session_state.calendar_preferences["groups"],
+                key="calendar_event_groups",
             )
-            with st.expander("高影響總經包含什麼？", expanded=False):
-                st.markdown("\n".join(
-                    f"- **{event_name}**：{US_HIGH_IMPACT_DESCRIPTIONS[event_name]}"
-                    for event_name in US_HIGH_IMPACT_EVENTS
-                ))
-        else:
-            selected_macro_events = []
 
-        selected_event_types = []
-        for group in selected_event_groups:
-            if group != "美國高影響總經":
-                selected_event_types.extend(CALENDAR_GROUP_EVENTS[group])
-        selected_event_types.extend(selected_macro_events)
-        st.caption(
-            "呈現模式：完整（只顯示已勾選事件）｜目前顯示：" + (
-                "｜".join(selected_event_groups) if selected_event_groups else "未選擇自動事件"
-            ) + (
-                "｜總經：" + "、".join(selected_macro_events)
-                if selected_macro_events else ""
-            )
-        )
-        snapshot = st.session_state.company_event_snapshot
-        if {TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP}.intersection(selected_event_groups):
-            if snapshot.get("updated_at"):
-                st.caption(f"公司事件快照：{snapshot['updated_at']}｜追蹤：{snapshot.get('tickers', '—')}")
+            if "美國高影響總經" in selected_event_groups:
+                selected_macro_events = st.multiselect(
+                    "美國高影響總經（勾選要呈現的事件）",
+                    options=US_HIGH_IMPACT_EVENTS,
+                    default=st.session_state.calendar_preferences.get(
+                        "macro_events", US_HIGH_IMPACT_EVENTS
+                    ),
+                    key="calendar_macro_events",
+                )
+                with st.expander("高影響總經包含什麼？", expanded=False):
+                    st.markdown("\n".join(
+                        f"- **{event_name}**：{US_HIGH_IMPACT_DESCRIPTIONS[event_name]}"
+                        for event_name in US_HIGH_IMPACT_EVENTS
+                    ))
             else:
-                st.info("尚無公司事件快照；請到「公司財報與營收」分頁同步一次。")
-        update_col, save_col = st.columns(2)
-        with update_col:
-            if st.button("🔄 更新市場行事曆", key="refresh_calendar_network"):
-                fetch_twse_holiday_events.clear()
-                fetch_twse_temporary_closure_events.clear()
-                fetch_fomc_events.clear()
-                fetch_bls_cpi_events.clear()
-                fetch_bls_employment_events.clear()
-                fetch_tradingview_us_calendar.clear()
-                fetch_adp_employment_events.clear()
-                build_us_initial_claims_events.clear()
-                st.toast("已更新市場與總經行事曆；公司資料請在獨立分頁同步。", icon="🔄")
-                st.rerun()
-        with save_col:
-            if st.button("💾 儲存追蹤設定", key="save_calendar_preferences"):
-                st.session_state.calendar_preferences = {
-                    "groups": selected_event_groups,
-                    "macro_events": selected_macro_events,
-                    "tickers": st.session_state.calendar_preferences.get("tickers", "2330.TW"),
-                }
-                save_calendar_preferences(
-                    selected_event_groups,
-                    selected_macro_events,
-                    st.session_state.calendar_preferences["tickers"],
-                    selected_event_types,
+                selected_macro_events = []
+
+            selected_event_types = calendar_event_types(selected_event_groups, selected_macro_events)
+            st.caption(
+                "呈現模式：完整（只顯示已勾選事件）｜目前顯示：" + (
+                    "｜".join(selected_event_groups) if selected_event_groups else "未選擇自動事件"
+                ) + (
+                    "｜總經：" + "、".join(selected_macro_events)
+                    if selected_macro_events else ""
                 )
-                st.toast("追蹤設定已儲存。", icon="✅")
-
-    st.caption("行事曆資料來源：TWSE、Federal Reserve、TradingView 免費經濟日曆（CPI／大非農備援）、U.S. BLS、U.S. Department of Labor、ADP；公司財報與營收顯示獨立分頁的最近快照。")
-
-    def change_month(delta):
-        st.session_state.cal_month += delta
-        if st.session_state.cal_month > 12:
-            st.session_state.cal_month = 1
-            st.session_state.cal_year += 1
-        elif st.session_state.cal_month < 1:
-            st.session_state.cal_month = 12
-            st.session_state.cal_year -= 1
+            )
+            snapshot = st.session_state.company_event_snapshot
+            if {TAIWAN_COMPANY_GROUP, US_COMPANY_GROUP}.intersection(selected_event_groups):
+                if snapshot.get("updated_at"):
+                    st.caption(f"公司事件快照：{snapshot['updated_at']}｜追蹤：{snapshot.get('tickers', '—')}")
+                else:
+                    st.info("尚無公司事件快照；請到「公司財報與營收」分頁同步一次。")
+            update_col, save_col = st.columns(2)
+            with update_col:
+                if st.button("🔄 更新市場行事曆", key="refresh_calendar_network"):
+                    fetch_twse_holiday_events.clear()
+                    fetch_twse_temporary_closure_events.clear()
+                    fetch_fomc_events.clear()
+                    fetch_bls_cpi_events.clear()
+                    fetch_bls_employment_events.clear()
+                    fetch_tradingview_us_calendar.clear()
+                    fetch_adp_employment_events.clear()
+                    build_us_initial_claims_events.clear()
+                    st.toast("已更新市場與總經行事曆；公司資料請在獨立分頁同步。", icon="🔄")
+                    st.rerun()
+            with save_col:
+                if st.button("💾 儲存追蹤設定", key="save_calendar_preferences"):
+                    st.session_state.calendar_preferences = {
+                        "groups": selected_event_groups,
+                        "macro_events": selected_macro_events,
+                        "tickers": st.session_state.calendar_preferences.get("tickers", "2330.TW"),
+                    }
+                    save_calendar_preferences(
+                        selected_event_groups,
+                        selected_macro_events,
+                        st.session_state.calendar_preferences["tickers"],
+                        selected_event_types,
+                    )
+                    st.toast("追蹤設定已儲存。", icon="✅")
+
+        st.caption("行事曆資料來源：TWSE、Federal Reserve、TradingView 免費經濟日曆（CPI／大非農備援）、U.S. BLS、U.S. Department of Labor、ADP；公司財報與營收顯示獨立分頁的最近快照。")
+
+        def change_month(delta):
+            st.session_state.cal_month += delta
+            if st.session_state.cal_month > 12:
+                st.session_state.cal_month = 1
+                st.session_state.cal_year += 1
+            elif st.session_state.cal_month < 1:
+                st.session_state.cal_month = 12
+                st.session_state.cal_year -= 1
         
-        if 'sel_year_box' in st.session_state: del st.session_state['sel_year_box']
-        if 'sel_month_box' in st.session_state: del st.session_state['sel_month_box']
-
-    col_sel_y, col_sel_m = st.columns(2)
-    with col_sel_y:
-        current_year_idx = range(2024, 2031).index(st.session_state.cal_year)
-        new_year = st.selectbox("年份", range(2024, 2031), index=current_year_idx, key='sel_year_box')
-        if new_year != st.session_state.cal_year:
-            st.session_state.cal_year = new_year
-            st.rerun()
+            if 'sel_year_box' in st.session_state: del st.session_state['sel_year_box']
+            if 'sel_month_box' in st.session_state: del st.session_state['sel_month_box']
+
+        col_sel_y, col_sel_m = st.columns(2)
+        with col_sel_y:
+            current_year_idx = range(2024, 2031).index(st.session_state.cal_year)
+            new_year = st.selectbox("年份", range(2024, 2031), index=current_year_idx, key='sel_year_box')
+            if new_year != st.session_state.cal_year:
+                st.session_state.cal_year = new_year
+                st.rerun()
 
-    with col_sel_m:
-        current_month_idx = st.session_state.cal_month - 1
-        new_month = st.selectbox("月份", range(1, 13), index=current_month_idx, key='sel_month_box')
-        if new_month != st.session_state.cal_month:
-            st.session_state.cal_month = new_month
-            st.rerun()
+        with col_sel_m:
+            current_month_idx = st.session_state.cal_month - 1
+            new_month = st.selectbox("月份", range(1, 13), index=current_month_idx, key='sel_month_box')
+            if new_month != st.session_state.cal_month:
+                st.session_state.cal_month = new_month
+                st.rerun()
 
-    sel_year = st.session_state.cal_year
-    sel_month = st.session_state.cal_month
+        sel_year = st.session_state.cal_year
+        sel_month = st.session_state.cal_month
 
-    col_prev, col_header, col_next = st.columns([1, 8, 1])
-    with col_prev: st.button("◀️", on_click=change_month, args=(-1,), width='stretch')
-    with col_next: st.button("▶️", on_click=change_month, args=(1,), width='stretch')
-    with col_header: st.markdown(f"<div class='calendar-header'>{sel_year}/{sel_month:02}</div>", unsafe_allow_html=True)
+        col_prev, col_header, col_next = st.columns([1, 8, 1])
+        with col_prev: st.button("◀️", on_click=change_month, args=(-1,), width='stretch')
+        with col_next: st.button("▶️", on_click=change_month, args=(1,), width='stretch')
+        with col_header: st.markdown(f"<div class='calendar-header'>{sel_year}/{sel_month:02}</div>", unsafe_allow_html=True)
 
-    # 每次切換月份都以 TWSE 年度資料重新建立交易日判定；網路暫不可用才退回既有固定表。
-    twse_holiday_events = fetch_twse_holiday_events(sel_year)
-    twse_temporary_events = fetch_twse_temporary_closure_events()
-    current_holidays = {
-        (pd.Timestamp(event["date"]).month, pd.Timestamp(event["date"]).day): event["title"]
-        for event in twse_holiday_events if event["closed"]
-    }
-    if not current_holidays:
-        current_holidays = get_holidays(sel_year)
-    temporary_closures = {
-        pd.Timestamp(event["date"]).date(): event for event in twse_temporary_events
-    }
+        # 每次切換月份都以 TWSE 年度資料重新建立交易日判定；網路暫不可用才退回既有固定表。
+        twse_holiday_events = fetch_twse_holiday_events(sel_year)
+        twse_temporary_events = fetch_twse_temporary_closure_events()
+        current_holidays = {
+            (pd.Timestamp(event["date"]).month, pd.Timestamp(event["date"]).day): event["title"]
+            for event in twse_holiday_events if event["closed"]
+        }
+        if not current_holidays:
+            current_holidays = get_holidays(sel_year)
+        temporary_closures = {
+            pd.Timestamp(event["date"]).date(): event for event in twse_temporary_events
+        }
 
-    # 將使用者選擇的資料來源合併成統一事件格式；台股突發休市永遠覆蓋交易日狀態。
-    network_events = list(twse_temporary_events)
-    calendar_source_counts = {}
-
-    def add_network_source(label, events):
-        event_list = list(events or [])
-        calendar_source_counts[label] = len(event_list)
-        network_events.extend(event_list)
-
-    if "台股開休市" in selected_event_types:
-        add_network_source('台股開休市', twse_holiday_events)
-    if "FOMC 利率決議" in selected_event_types:
-        add_network_source('FOMC', fetch_fomc_events(sel_year))
-    if "美國 CPI" in selected_event_types:
-        add_network_source('CPI', fetch_bls_cpi_events(sel_year))
-    if "美國大非農" in selected_event_types:
-        add_network_source('大非農', fetch_bls_employment_events(sel_year))
-    if "美國小非農 ADP" in selected_event_types:
-        add_network_source('小非農 ADP', fetch_adp_employment_events(sel_year))
-    if "美國初領失業金" in selected_event_types:
-        add_network_source('初領失業金', build_us_initial_claims_events(sel_year))
-
-    company_snapshot = st.session_state.company_event_snapshot
-    earnings_events = list(company_snapshot.get("earnings", {}).get("events", []))
-    legacy_market_by_name = {}
-    for resolved_text in company_snapshot.get("earnings", {}).get("resolved", []):
-        match = re.search(r"→\s*(.*?)（([^（）]+)）", str(resolved_text))
-        if match:
-            legacy_market_by_name[match.group(1).strip()] = (
-                "台股" if re.fullmatch(r"\d{4,6}\.(?:TW|TWO)", match.group(2).strip(), re.I)
-                else "美股"
-            )
+        # 將使用者選擇的資料來源合併成統一事件格式；台股突發休市永遠覆蓋交易日狀態。
+        network_events = list(twse_temporary_events)
+        calendar_source_counts = {}
+
+        def add_network_source(label, events):
+            event_list = list(events or [])
+            calendar_source_counts[label] = len(event_list)
+            network_events.extend(event_list)
+
+        if "台股開休市" in selected_event_types:
+            add_network_source('台股開休市', twse_holiday_events)
+        if "FOMC 利率決議" in selected_event_types:
+            add_network_source('FOMC', fetch_fomc_events(sel_year))
+        if "美國 CPI" in selected_event_types:
+            add_network_source('CPI', fetch_bls_cpi_events(sel_year))
+        if "美國大非農" in selected_event_types:
+            add_network_source('大非農', fetch_bls_employment_events(sel_year))
+        if "美國小非農 ADP" in selected_event_types:
+            add_network_source('小非農 ADP', fetch_adp_employment_events(sel_year))
+        if "美國初領失業金" in selected_event_types:
+            add_network_source('初領失業金', build_us_initial_claims_events(sel_year))
+
+        company_snapshot = st.session_state.company_event_snapshot
+        earnings_events = list(company_snapshot.get("earnings", {}).get("events", []))
+        legacy_market_by_name = {}
+        for resolved_text in company_snapshot.get("earnings", {}).get("resolved", []):
+            match = re.search(r"→\s*(.*?)（([^（）]+)）", str(resolved_text))
+            if match:
+                legacy_market_by_name[match.group(1).strip()] = (
+                    "台股" if re.fullmatch(r"\d{4,6}\.(?:TW|TWO)", match.group(2).strip(), re.I)
+                    else "美股"
+                )
 
-    def company_earnings_for_market(market_name):
-        matched = []
-        for event in earnings_events:
-            event_market = event.get("market")
-            if not event_market:
-                ticker = str(event.get("ticker", ""))
-                if ticker:
-                    event_market = (
-                        "台股" if re.fullmatch(r"\d{4,6}\.(?:TW|TWO)", ticker, re.I) else "美股"
-                    )
-                else:
-                    company_name = str(event.get("title", "")).replace(" 財報預估日", "").strip()
-                    event_market = legacy_market_by_name.get(company_name)
-            if event_market == market_name:
-                matched.append(event)
-        return matched
-
-    if TAIWAN_COMPANY_GROUP in selected_event_groups:
-        network_events.extend(company_earnings_for_market("台股"))
-        network_events.extend(company_snapshot.get("taiwan_revenue", {}).get("events", []))
-    if US_COMPANY_GROUP in selected_event_groups:
-        network_events.extend(company_earnings_for_market("美股"))
-        network_events.extend(company_snapshot.get("us_revenue", {}).get("events", []))
-    if "美國高影響總經" in selected_event_groups:
-        us_count_text = '｜'.join(
-            f"{label} {calendar_source_counts.get(label, 0)} 筆"
-            for label in ('FOMC', 'CPI', '大非農', '小非農 ADP')
-        )
-        st.caption(f"{sel_year} 高影響事件來源檢查：{us_count_text}。事件已換算為台灣日期與時間。")
-        missing_core_sources = [
-            label for label in ('FOMC', 'CPI', '大非農', '小非農 ADP')
-            if calendar_source_counts.get(label, 0) == 0
-        ]
-        if missing_core_sources:
-            st.warning("以下資料來源本次未讀到資料：" + '、'.join(missing_core_sources) + "；可按『更新市場行事曆』重試。")
-
-    def get_us_events(y, m):
-        events = {}
-        def add_evt(d, txt, color):
-            if d not in events: events[d] = []
-            events[d].append(f"<div style='color:{color}; font-size:0.8em; margin-top:2px; font-weight:bold;'>{txt}</div>")
+        def company_earnings_for_market(market_name):
+            matched = []
+            for event in earnings_events:
+                event_market = event.get("market")
+                if not event_market:
+                    ticker = str(event.get("ticker", ""))
+                    if ticker:
+                        event_market = (
+                            "台股" if re.fullmatch(r"\d{4,6}\.(?:TW|TWO)", ticker, re.I) else "美股"
+                        )
+                    else:
+                        company_name = str(event.get("title", "")).replace(" 財報預估日", "").strip()
+                        event_market = legacy_market_by_name.get(company_name)
+                if event_market == market_name:
+                    matched.append(event)
+            return matched
+
+        if TAIWAN_COMPANY_GROUP in selected_event_groups:
+            network_events.extend(company_earnings_for_market("台股"))
+            network_events.extend(company_snapshot.get("taiwan_revenue", {}).get("events", []))
+        if US_COMPANY_GROUP in selected_event_groups:
+            network_events.extend(company_earnings_for_market("美股"))
+            network_events.extend(company_snapshot.get("us_revenue", {}).get("events", []))
+        if "美國高影響總經" in selected_event_groups:
+            us_count_text = '｜'.join(
+                f"{label} {calendar_source_counts.get(label, 0)} 筆"
+                for label in ('FOMC', 'CPI', '大非農', '小非農 ADP')
+            )
+            st.caption(f"{sel_year} 高影響事件來源檢查：{us_count_text}。事件已換算為台灣日期與時間。")
+            missing_core_sources = [
+                label for label in ('FOMC', 'CPI', '大非農', '小非農 ADP')
+                if calendar_source_counts.get(label, 0) == 0
+            ]
+            if missing_core_sources:
+                st.warning("以下資料來源本次未讀到資料：" + '、'.join(missing_core_sources) + "；可按『更新市場行事曆』重試。")
+
+        def get_us_events(y, m):
+            events = {}
+            def add_evt(d, txt, color):
+                if d not in events: events[d] = []
+                events[d].append(f"<div style='color:{color}; font-size:0.8em; margin-top:2px; font-weight:bold;'>{txt}</div>")
         
-        cal_temp = calendar.Calendar(firstweekday=6)
-        month_days_list = list(cal_temp.itermonthdays2(y, m))
+            cal_temp = calendar.Calendar(firstweekday=6)
+            month_days_list = list(cal_temp.itermonthdays2(y, m))
         
-        # (1) 美股固定休市日期與節日對照表
-        us_holiday_names = {
-            2024: {
-                (1,1): "元旦", (1,15): "馬丁路德金紀念日", (2,19): "總統日", (3,29): "耶穌受難日", 
-                (5,27): "陣亡將士紀念日", (6,19): "六月節", (7,4): "獨立紀念日", (9,2): "勞動節", 
-                (11,28): "感恩節", (12,25): "聖誕節"
-            },
-            2025: {
-                (1,1): "元旦", (1,20): "馬丁路德金紀念日", (2,17): "總統日", (4,18): "耶穌受難日", 
-                (5,26): "陣亡將士紀念日", (6,19): "六月節", (7,4): "獨立紀念日", (9,1): "勞動節", 
-                (11,27): "感恩節", (12,25): "聖誕節"
-            },
-            2026: {
-                (1,1): "元旦", (1,19): "馬丁路德金紀念日", (2,16): "總統日", (4,3): "耶穌受難日", 
-                (5,25): "陣亡將士紀念日", (6,19): "六月節", (7,3): "獨立紀念日", (9,7): "勞動節", 
-                (11,26): "感恩節", (12,25): "聖誕節"
+            # (1) 美股固定休市日期與節日對照表
+            us_holiday_names = {
+                2024: {
+                    (1,1): "元旦", (1,15): "馬丁路德金紀念日", (2,19): "總統日", (3,29): "耶穌受難日", 
+                    (5,27): "陣亡將士紀念日", (6,19): "六月節", (7,4): "獨立紀念日", (9,2): "勞動節", 
+                    (11,28): "感恩節", (12,25): "聖誕節"
+                },
+                2025: {
+                    (1,1): "元旦", (1,20): "馬丁路德金紀念日", (2,17): "總統日", (4,18): "耶穌受難日", 
+                    (5,26): "陣亡將士紀念日", (6,19): "六月節", (7,4): "獨立紀念日", (9,1): "勞動節", 
+                    (11,27): "感恩節", (12,25): "聖誕節"
+                },
+                2026: {
+                    (1,1): "元旦", (1,19): "馬丁路德金紀念日", (2,16): "總統日", (4,3): "耶穌受難日", 
+                    (5,25): "陣亡將士紀念日", (6,19): "六月節", (7,3): "獨立紀念日", (9,7): "勞動節", 
+                    (11,26): "感恩節", (12,25): "聖誕節"
+                }
             }
-        }
-        if y in us_holiday_names:
-            for (hm, hd), name in us_holiday_names[y].items():
-                if hm == m: 
-                    add_evt(hd, f"美股{name}休市", "#B0BEC5")
+            if y in us_holiday_names:
+                for (hm, hd), name in us_holiday_names[y].items():
+                    if hm == m: 
+                        add_evt(hd, f"美股{name}休市", "#B0BEC5")
         
-        # (2) 美國非農人數公布 (自動判斷美股休市提前與夏令時間)
-        for d, wd in month_days_list:
-            if d != 0 and wd == 4:
-                year_holidays = us_holiday_names.get(y, {})
-                # 檢查該週五是否恰逢美股休市（例如 2026/7/3 獨立紀念日）
-                if (m, d) in year_holidays:
-                    # 提前至週四公布，且因必為夏令時間，固定顯示 20:30
-                    add_evt(d - 1, "美國非農 (20:30)", "#00E5FF")
-                else:
-                    # 正常週五公布，依月份區分夏令(3~11月: 20:30) 與 冬令(12~2月: 21:30)
-                    time_str = "20:30" if 3 <= m <= 11 else "21:30"
-                    add_evt(d, f"美國非農 ({time_str})", "#00E5FF")
-                break
+            # (2) 美國非農人數公布 (自動判斷美股休市提前與夏令時間)
+            for d, wd in month_days_list:
+                if d != 0 and wd == 4:
+                    year_holidays = us_holiday_names.get(y, {})
+                    # 檢查該週五是否恰逢美股休市（例如 2026/7/3 獨立紀念日）
+                    if (m, d) in year_holidays:
+                        # 提前至週四公布，且因必為夏令時間，固定顯示 20:30
+                        add_evt(d - 1, "美國非農 (20:30)", "#00E5FF")
+                    else:
+                        # 正常週五公布，依月份區分夏令(3~11月: 20:30) 與 冬令(12~2月: 21:30)
+                        time_str = "20:30" if 3 <= m <= 11 else "21:30"
+                        add_evt(d, f"美國非農 ({time_str})", "#00E5FF")
+                    break
                 
-        # (3) 四巫日 (3,6,9,12月 第三個週五)
-        if m in [3, 6, 9, 12]:
-            fridays = [d for d, wd in month_days_list if d != 0 and wd == 4]
-            if len(fridays) >= 3:
-                add_evt(fridays[2], "四巫日", "#FF00FF") # 洋紅色
+            # (3) 四巫日 (3,6,9,12月 第三個週五)
+            if m in [3, 6, 9, 12]:
+                fridays = [d for d, wd in month_days_list if d != 0 and wd == 4]
+                if len(fridays) >= 3:
+                    add_evt(fridays[2], "四巫日", "#FF00FF") # 洋紅色
                 
-        # (4) 13F報告 (通常在2,5,8,11月的14日或15日，以估算值為主)
-        if m == 2: add_evt(14, "13F報告", "#FFD700") # 金黃色
-        elif m == 5: add_evt(15, "13F報告", "#FFD700")
-        elif m == 8: add_evt(14, "13F報告", "#FFD700")
-        elif m == 11: add_evt(14, "13F報告", "#FFD700")
+            # (4) 13F報告 (通常在2,5,8,11月的14日或15日，以估算值為主)
+            if m == 2: add_evt(14, "13F報告", "#FFD700") # 金黃色
+            elif m == 5: add_evt(15, "13F報告", "#FFD700")
+            elif m == 8: add_evt(14, "13F報告", "#FFD700")
+            elif m == 11: add_evt(14, "13F報告", "#FFD700")
         
-        # (5) MSCI季調 (2,5,8,11月最後一個交易日生效)
-        if m in [2, 5, 8, 11]:
-            weekdays = [d for d, wd in month_days_list if d != 0 and wd < 5]
-            if weekdays:
-                add_evt(weekdays[-1], "MSCI季調生效", "#FF9800") # 橘色
-
-        # (6) FOMC (台灣時間，大多為週四凌晨 02:00 或 03:00，整理2024-2026日期)
-        fomc_dates = {
-            2024: [(2,1), (3,21), (5,2), (6,13), (8,1), (9,19), (11,8), (12,19)],
-            2025: [(1,30), (3,20), (5,8), (6,19), (7,31), (9,18), (10,30), (12,11)],
-            2026: [(1,29), (3,19), (5,7), (6,18), (7,30), (9,17), (10,29), (12,10)]
-        }
-        if y in fomc_dates:
-            for fm, fd in fomc_dates[y]:
-                if fm == m: 
-                    time_str = "02:00" if 3 <= m <= 11 else "03:00"
-                    add_evt(fd, f"FOMC ({time_str})", "#FF4500")
+            # (5) MSCI季調 (2,5,8,11月最後一個交易日生效)
+            if m in [2, 5, 8, 11]:
+                weekdays = [d for d, wd in month_days_list if d != 0 and wd < 5]
+                if weekdays:
+                    add_evt(weekdays[-1], "MSCI季調生效", "#FF9800") # 橘色
+
+            # (6) FOMC (台灣時間，大多為週四凌晨 02:00 或 03:00，整理2024-2026日期)
+            fomc_dates = {
+                2024: [(2,1), (3,21), (5,2), (6,13), (8,1), (9,19), (11,8), (12,19)],
+                2025: [(1,30), (3,20), (5,8), (6,19), (7,31), (9,18), (10,30), (12,11)],
+                2026: [(1,29), (3,19), (5,7), (6,18), (7,30), (9,17), (10,29), (12,10)]
+            }
+            if y in fomc_dates:
+                for fm, fd in fomc_dates[y]:
+                    if fm == m: 
+                        time_str = "02:00" if 3 <= m <= 11 else "03:00"
+                        add_evt(fd, f"FOMC ({time_str})", "#FF4500")
                 
-        # (7) 美國CPI公布 (台灣時間 20:30 或 21:30，整理2024-2026日期)
-        cpi_dates = {
-            2024: [(1,11), (2,13), (3,12), (4,10), (5,15), (6,12), (7,11), (8,14), (9,11), (10,10), (11,13), (12,11)],
-            2025: [(1,15), (2,12), (3,12), (4,9), (5,14), (6,11), (7,16), (8,13), (9,10), (10,15), (11,12), (12,10)],
-            2026: [(1,14), (2,11), (3,11), (4,15), (5,13), (6,10), (7,15), (8,12), (9,16), (10,15), (11,12), (12,16)]
-        }
-        if y in cpi_dates:
-            for cm, cd in cpi_dates[y]:
-                if cm == m: 
-                    time_str = "20:30" if 3 <= m <= 11 else "21:30"
-                    add_evt(cd, f"美國CPI ({time_str})", "#00FA9A")
+            # (7) 美國CPI公布 (台灣時間 20:30 或 21:30，整理2024-2026日期)
+            cpi_dates = {
+                2024: [(1,11), (2,13), (3,12), (4,10), (5,15), (6,12), (7,11), (8,14), (9,11), (10,10), (11,13), (12,11)],
+                2025: [(1,15), (2,12), (3,12), (4,9), (5,14), (6,11), (7,16), (8,13), (9,10), (10,15), (11,12), (12,10)],
+                2026: [(1,14), (2,11), (3,11), (4,15), (5,13), (6,10), (7,15), (8,12), (9,16), (10,15), (11,12), (12,16)]
+            }
+            if y in cpi_dates:
+                for cm, cd in cpi_dates[y]:
+                    if cm == m: 
+                        time_str = "20:30" if 3 <= m <= 11 else "21:30"
+                        add_evt(cd, f"美國CPI ({time_str})", "#00FA9A")
         
-        return events
+            return events
 
-    # 不再以程式內的固定日期作為主要來源；保留函數僅相容既有程式結構。
-    us_events = {}
-    network_event_dict = {}
-    for event in network_events:
-        try:
-            event_date = pd.Timestamp(event["date"]).date()
-            if event_date.year == sel_year and event_date.month == sel_month:
-                network_event_dict.setdefault(event_date, []).append(event)
-        except (KeyError, TypeError, ValueError):
-            continue
+        # 不再以程式內的固定日期作為主要來源；保留函數僅相容既有程式結構。
+        us_events = {}
+        network_event_dict = {}
+        for event in network_events:
+            try:
+                event_date = pd.Timestamp(event["date"]).date()
+                if event_date.year == sel_year and event_date.month == sel_month:
+                    network_event_dict.setdefault(event_date, []).append(event)
+            except (KeyError, TypeError, ValueError):
+                continue
 
-    def is_market_closed_func(d_date):
-        if d_date.weekday() >= 5: return True
-        if d_date in temporary_closures: return True
-        name = current_holidays.get((d_date.month, d_date.day), "")
-        if name and name != "封關日": return True
-        return False
+        def is_market_closed_func(d_date):
+            if d_date.weekday() >= 5: return True
+            if d_date in temporary_closures: return True
+            name = current_holidays.get((d_date.month, d_date.day), "")
+            if name and name != "封關日": return True
+            return False
 
-    real_settlements = {} 
-    def calculate_month_settlements(y, m):
-        cal_obj = calendar.Calendar(firstweekday=6)
-        days_in_month = cal_obj.itermonthdays(y, m)
-        d_list = [d for d in days_in_month if d != 0]
+        real_settlements = {} 
+        def calculate_month_settlements(y, m):
+            cal_obj = calendar.Calendar(firstweekday=6)
+            days_in_month = cal_obj.itermonthdays(y, m)
+            d_list = [d for d in days_in_month if d != 0]
         
-        w_count, f_count = 0, 0
-        month_raw_wed, month_raw_fri = [], []
+            w_count, f_count = 0, 0
+            month_raw_wed, month_raw_fri = [], []
         
-        for d in d_list:
-            curr = date(y, m, d)
-            if curr.weekday() == 2: w_count += 1; month_raw_wed.append((curr, w_count))
-            if curr.weekday() == 4: f_count += 1; month_raw_fri.append((curr, f_count))
+            for d in d_list:
+                curr = date(y, m, d)
+                if curr.weekday() == 2: w_count += 1; month_raw_wed.append((curr, w_count))
+                if curr.weekday() == 4: f_count += 1; month_raw_fri.append((curr, f_count))
                 
-        monthly_raw = month_raw_wed[2][0] if len(month_raw_wed) >= 3 else None
-        real_monthly_date = None
-        if monthly_raw:
-            check = monthly_raw
-            while is_market_closed_func(check): check += timedelta(days=1)
-            real_monthly_date = check
+            monthly_raw = month_raw_wed[2][0] if len(month_raw_wed) >= 3 else None
+            real_monthly_date = None
+            if monthly_raw:
+                check = monthly_raw
+                while is_market_closed_func(check): check += timedelta(days=1)
+                real_monthly_date = check
         
-        local_results = []
-        if monthly_raw: local_results.append((monthly_raw, 'M', f"{m:02}月", real_monthly_date))
-
-        for dt, idx in month_raw_wed:
-            if dt != monthly_raw: local_results.append((dt, 'W', f"{str(y)[2:]}{m:02}W{idx}", real_monthly_date))
-        for dt, idx in month_raw_fri: local_results.append((dt, 'F', f"{str(y)[2:]}{m:02}F{idx}", real_monthly_date))
-        return local_results
-
-    current_month_data = calculate_month_settlements(sel_year, sel_month)
-    if sel_month == 1: prev_y, prev_m = sel_year - 1, 12
-    else: prev_y, prev_m = sel_year, sel_month - 1
-    prev_month_data = calculate_month_settlements(prev_y, prev_m)
+            local_results = []
+            if monthly_raw: local_results.append((monthly_raw, 'M', f"{m:02}月", real_monthly_date))
+
+            for dt, idx in month_raw_wed:
+                if dt != monthly_raw: local_results.append((dt, 'W', f"{str(y)[2:]}{m:02}W{idx}", real_monthly_date))
+            for dt, idx in month_raw_fri: local_results.append((dt, 'F', f"{str(y)[2:]}{m:02}F{idx}", real_monthly_date))
+            return local_results
+
+        current_month_data = calculate_month_settlements(sel_year, sel_month)
+        if sel_month == 1: prev_y, prev_m = sel_year - 1, 12
+        else: prev_y, prev_m = sel_year, sel_month - 1
+        prev_month_data = calculate_month_settlements(prev_y, prev_m)
     
-    all_raw_data = prev_month_data + current_month_data
+        all_raw_data = prev_month_data + current_month_data
     
-    for raw_date, s_type, s_code, m_date in all_raw_data:
-        check_date = raw_date
-        while is_market_closed_func(check_date):
-            check_date += timedelta(days=1)
-            if (check_date - raw_date).days > 30: break
+        for raw_date, s_type, s_code, m_date in all_raw_data:
+            check_date = raw_date
+            while is_market_closed_func(check_date):
+                check_date += timedelta(days=1)
+                if (check_date - raw_date).days > 30: break
         
-        if check_date.year == sel_year and check_date.month == sel_month:
-            if s_type == 'F' and check_date == m_date: continue
-            if check_date not in real_settlements: real_settlements[check_date] = []
-            real_settlements[check_date].append((s_type, s_code))
-
-    cal_obj = calendar.Calendar(firstweekday=6)
-    month_days = cal_obj.monthdayscalendar(sel_year, sel_month)
-
-    # --- 新增：將自訂事件整理為字典以利快速渲染 ---
-    override_dict = {}
-    if not st.session_state.cal_overrides.empty:
-        for _, r in st.session_state.cal_overrides.iterrows():
-            try:
-                if pd.notna(r["日期"]) and str(r["日期"]).strip():
-                    d_obj = pd.to_datetime(r["日期"]).date()
-                    if d_obj.year == sel_year and d_obj.month == sel_month:
-                        if d_obj not in override_dict:
-                            override_dict[d_obj] = []
-                        color_map = {"白色": "#FFFFFF", "紅色": "#FF4B4B", "綠色": "#00E676", "黃色": "#FFD700", "藍色": "#00E5FF", "橘色": "#FF9800", "紫紅色": "#FF00FF"}
-                        raw_col = str(r["文字顏色"]).strip() if pd.notna(r["文字顏色"]) else "白色"
-                        col = color_map.get(raw_col, "#FFFFFF")
-                        override_dict[d_obj].append(f"<div style='color:{col}; font-size:0.8em; margin-top:2px; font-weight:bold;'>{r['事件名稱']}</div>")
-            except:
-                pass
-    def calendar_day_content(curr_date):
-        """建立單日事件內容，桌機月曆與手機清單共用，避免兩種版面日期不一致。"""
-        holiday_name = current_holidays.get((curr_date.month, curr_date.day), "")
-        content_html = []
-        if holiday_name:
-            if holiday_name and holiday_name != "封關日": content_html.append(f"<div class='holiday-tag'>{html.escape(holiday_name)}</div>")
-            if holiday_name == "封關日": content_html.append(f"<div style='color:#ff9800; font-size:0.8em;'>{html.escape(holiday_name)}</div>")
-
-        for event in network_event_dict.get(curr_date, []):
-            if event.get("closed") and not event.get("temporary"):
-                continue
-            if event.get("temporary"):
-                detail = html.escape(str(event.get("detail", "")))
-                content_html.append(
-                    "<div style='background:#B71C1C;color:#fff;padding:3px;margin-top:3px;"
-                    "font-size:.78em;font-weight:900;border-radius:3px'>"
-                    f"{html.escape(str(event.get('title', '台股突發休市')))}</div>"
-                )
-                if detail:
-                    content_html.append(f"<div style='color:#FFCDD2;font-size:.72em;margin-top:2px'>{detail}</div>")
-            else:
-                color = "#FF7043" if event.get("source") == "Federal Reserve" else "#00E5FF"
-                if "大非農" in event.get("title", ""):
-                    color = "#FF5252"
-                elif "小非農" in event.get("title", ""):
-                    color = "#FFB74D"
-                elif event.get("impact") == "routine":
-                    color = "#B0BEC5"
-                elif "CPI" in event.get("title", ""):
-                    color = "#00FA9A"
-                if "財報" in event.get("title", ""):
-                    color = "#FFD700"
-                if "MOPS" in event.get("source", ""):
-                    revenue = event.get("revenue", {})
-                    mom, yoy = str(revenue.get("mom", "--")), str(revenue.get("yoy", "--"))
-                    content_html.append(
-                        "<div style='font-size:.8em;margin-top:2px;font-weight:bold'>"
-                        f"<span style='color:#00E676'>{html.escape(str(revenue.get('company', '月營收事件')))} 月營收</span> "
-                        f"<span style='color:{_percent_color(mom)}'>MoM{html.escape(mom)}</span>／"
-                        f"<span style='color:{_percent_color(yoy)}'>YoY{html.escape(yoy)}</span></div>"
-                    )
-                elif event.get("source") == "Yahoo Finance（季度／年度營收）":
-                    revenue = event.get("revenue", {})
-                    qoq, yoy = str(revenue.get("qoq", "--")), str(revenue.get("yoy", "--"))
+            if check_date.year == sel_year and check_date.month == sel_month:
+                if s_type == 'F' and check_date == m_date: continue
+                if check_date not in real_settlements: real_settlements[check_date] = []
+                real_settlements[check_date].append((s_type, s_code))
+
+        cal_obj = calendar.Calendar(firstweekday=6)
+        month_days = cal_obj.monthdayscalendar(sel_year, sel_month)
+
+        # --- 新增：將自訂事件整理為字典以利快速渲染 ---
+        override_dict = {}
+        if not st.session_state.cal_overrides.empty:
+            for _, r in st.session_state.cal_overrides.iterrows():
+                try:
+                    if pd.notna(r["日期"]) and str(r["日期"]).strip():
+                        d_obj = pd.to_datetime(r["日期"]).date()
+                        if d_obj.year == sel_year and d_obj.month == sel_month:
+                            if d_obj not in override_dict:
+                                override_dict[d_obj] = []
+                            color_map = {"白色": "#FFFFFF", "紅色": "#FF4B4B", "綠色": "#00E676", "黃色": "#FFD700", "藍色": "#00E5FF", "橘色": "#FF9800", "紫紅色": "#FF00FF"}
+                            raw_col = str(r["文字顏色"]).strip() if pd.notna(r["文字顏色"]) else "白色"
+                            col = color_map.get(raw_col, "#FFFFFF")
+                            override_dict[d_obj].append(f"<div style='color:{col}; font-size:0.8em; margin-top:2px; font-weight:bold;'>{r['事件名稱']}</div>")
+                except:
+                    pass
+        def calendar_day_content(curr_date):
+            """建立單日事件內容，桌機月曆與手機清單共用，避免兩種版面日期不一致。"""
+            holiday_name = current_holidays.get((curr_date.month, curr_date.day), "")
+            content_html = []
+            if holiday_name:
+                if holiday_name and holiday_name != "封關日": content_html.append(f"<div class='holiday-tag'>{html.escape(holiday_name)}</div>")
+                if holiday_name == "封關日": content_html.append(f"<div style='color:#ff9800; font-size:0.8em;'>{html.escape(holiday_name)}</div>")
+
+            for event in network_event_dict.get(curr_date, []):
+                if event.get("closed") and not event.get("temporary"):
+                    continue
+                if event.get("temporary"):
+                    detail = html.escape(str(event.get("detail", "")))
                     content_html.append(
-                        "<div style='font-size:.8em;margin-top:2px;font-weight:bold'>"
-                        f"<span style='color:#FFD700'>{html.escape(str(revenue.get('company', '美股營收事件')))} 季營收</span> "
-                        f"<span style='color:{_percent_color(qoq)}'>QoQ{html.escape(qoq)}</span>／"
-                        f"<span style='color:{_percent_color(yoy)}'>YoY{html.escape(yoy)}</span></div>"
+                        "<div style='background:#B71C1C;color:#fff;padding:3px;margin-top:3px;"
+                        "font-size:.78em;font-weight:900;border-radius:3px'>"
+                        f"{html.escape(str(event.get('title', '台股突發休市')))}</div>"
                     )
+                    if detail:
+                        content_html.append(f"<div style='color:#FFCDD2;font-size:.72em;margin-top:2px'>{detail}</div>")
                 else:
-                    content_html.append(
-                        f"<div style='color:{color};font-size:.8em;margin-top:2px;font-weight:bold'>"
-                        f"{html.escape(str(event.get('title', '未命名事件')))}</div>"
-                    )
-                if event.get("source") == "Yahoo Finance":
-                    time_note = str(event.get("detail", "")).split("；", 1)[0].replace("Yahoo Finance｜", "")
-                    content_html.append(
-                        f"<div style='color:#B0BEC5;font-size:.72em;margin-top:1px'>{html.escape(time_note)}</div>"
-                    )
+                    color = "#FF7043" if event.get("source") == "Federal Reserve" else "#00E5FF"
+                    if "大非農" in event.get("title", ""):
+                        color = "#FF5252"
+                    elif "小非農" in event.get("title", ""):
+                        color = "#FFB74D"
+                    elif event.get("impact") == "routine":
+                        color = "#B0BEC5"
+                    elif "CPI" in event.get("title", ""):
+                        color = "#00FA9A"
+                    if "財報" in event.get("title", ""):
+                        color = "#FFD700"
+                    if "MOPS" in event.get("source", ""):
+                        revenue = event.get("revenue", {})
+                        mom, yoy = str(revenue.get("mom", "--")), str(revenue.get("yoy", "--"))
+                        content_html.append(
+                            "<div style='font-size:.8em;margin-top:2px;font-weight:bold'>"
+                            f"<span style='color:#00E676'>{html.escape(str(revenue.get('company', '月營收事件')))} 月營收</span> "
+                            f"<span style='color:{_percent_color(mom)}'>MoM{html.escape(mom)}</span>／"
+                            f"<span style='color:{_percent_color(yoy)}'>YoY{html.escape(yoy)}</span></div>"
+                        )
+                    elif event.get("source") == "Yahoo Finance（季度／年度營收）":
+                        revenue = event.get("revenue", {})
+                        qoq, yoy = str(revenue.get("qoq", "--")), str(revenue.get("yoy", "--"))
+                        content_html.append(
+                            "<div style='font-size:.8em;margin-top:2px;font-weight:bold'>"
+                            f"<span style='color:#FFD700'>{html.escape(str(revenue.get('company', '美股營收事件')))} 季營收</span> "
+                            f"<span style='color:{_percent_color(qoq)}'>QoQ{html.escape(qoq)}</span>／"
+                            f"<span style='color:{_percent_color(yoy)}'>YoY{html.escape(yoy)}</span></div>"
+                        )
+                    else:
+                        content_html.append(
+                            f"<div style='color:{color};font-size:.8em;margin-top:2px;font-weight:bold'>"
+                            f"{html.escape(str(event.get('title', '未命名事件')))}</div>"
+                        )
+                    if event.get("source") == "Yahoo Finance":
+                        time_note = str(event.get("detail", "")).split("；", 1)[0].replace("Yahoo Finance｜", "")
+                        content_html.append(
+                            f"<div style='color:#B0BEC5;font-size:.72em;margin-top:1px'>{html.escape(time_note)}</div>"
+                        )
 
-        content_html.extend(override_dict.get(curr_date, []))
-        infos = sorted(real_settlements.get(curr_date, []), key=lambda item: 0 if item[0] == 'M' else 1)
-        for settlement_type, settlement_code in infos:
-            if settlement_type == 'M':
-                content_html.append(f"<div class='settle-m'>台指期{settlement_code}結算<br>月選結算</div>")
-            elif settlement_type == 'W':
-                content_html.append(f"<div class='settle-w'>週選(三) {settlement_code}</div>")
-            elif settlement_type == 'F':
-                content_html.append(f"<div class='settle-f'>週選(五) {settlement_code}</div>")
-        return ''.join(content_html)
-
-    desktop_cells = ["<div class='calendar-week-head'>ISO<br>週</div>"]
-    desktop_cells.extend(
-        f"<div class='calendar-day-head'>{weekday}</div>" for weekday in ["日", "一", "二", "三", "四", "五", "六"]
-    )
-    mobile_cells = []
-    weekday_names = ["週一", "週二", "週三", "週四", "週五", "週六", "週日"]
-    for week in month_days:
-        first_valid_day = next((day for day in week if day), None)
-        # 月曆從週日開始，但 ISO 週從週一開始；優先取該列週一作為週次基準。
-        iso_anchor_day = week[1] if len(week) > 1 and week[1] else first_valid_day
-        iso_week = date(sel_year, sel_month, iso_anchor_day).isocalendar().week
-        desktop_cells.append(f"<div class='cal-box cal-week'>W{iso_week}</div>")
-        for day in week:
-            if not day:
-                desktop_cells.append("<div class='cal-box cal-empty'></div>")
-                continue
-            curr_date = date(sel_year, sel_month, day)
-            day_content = calendar_day_content(curr_date)
-            bg_class = "cal-closed" if is_market_closed_func(curr_date) else "cal-open"
-            today_class = "today-border" if curr_date == now_tw.date() else ""
-            desktop_cells.append(
-                f"<div class='cal-box {bg_class} {today_class}'><div class='cal-date'>{day}</div>{day_content}</div>"
-            )
-            mobile_cells.append(
-                f"<div class='calendar-mobile-day {bg_class} {today_class}'>"
-                f"<div class='calendar-mobile-date'><span>{sel_month}/{day} {weekday_names[curr_date.weekday()]}</span>"
-                f"<span class='calendar-mobile-week'>ISO W{curr_date.isocalendar().week}</span></div>"
-                f"{day_content}</div>"
-            )
+            content_html.extend(override_dict.get(curr_date, []))
+            infos = sorted(real_settlements.get(curr_date, []), key=lambda item: 0 if item[0] == 'M' else 1)
+            for settlement_type, settlement_code in infos:
+                if settlement_type == 'M':
+                    content_html.append(f"<div class='settle-m'>台指期{settlement_code}結算<br>月選結算</div>")
+                elif settlement_type == 'W':
+                    content_html.append(f"<div class='settle-w'>週選(三) {settlement_code}</div>")
+                elif settlement_type == 'F':
+                    content_html.append(f"<div class='settle-f'>週選(五) {settlement_code}</div>")
+            return ''.join(content_html)
+
+        desktop_cells = ["<div class='calendar-week-head'>ISO<br>週</div>"]
+        desktop_cells.extend(
+            f"<div class='calendar-day-head'>{weekday}</div>" for weekday in ["日", "一", "二", "三", "四", "五", "六"]
+        )
+        mobile_cells = []
+        weekday_names = ["週一", "週二", "週三", "週四", "週五", "週六", "週日"]
+        for week in month_days:
+            first_valid_day = next((day for day in week if day), None)
+            # 月曆從週日開始，但 ISO 週從週一開始；優先取該列週一作為週次基準。
+            iso_anchor_day = week[1] if len(week) > 1 and week[1] else first_valid_day
+            iso_week = date(sel_year, sel_month, iso_anchor_day).isocalendar().week
+            desktop_cells.append(f"<div class='cal-box cal-week'>W{iso_week}</div>")
+            for day in week:
+                if not day:
+                    desktop_cells.append("<div class='cal-box cal-empty'></div>")
+                    continue
+                curr_date = date(sel_year, sel_month, day)
+                day_content = calendar_day_content(curr_date)
+                bg_class = "cal-closed" if is_market_closed_func(curr_date) else "cal-open"
+                today_class = "today-border" if curr_date == now_tw.date() else ""
+                desktop_cells.append(
+                    f"<div class='cal-box {bg_class} {today_class}'><div class='cal-date'>{day}</div>{day_content}</div>"
+                )
+                mobile_cells.append(
+                    f"<div class='calendar-mobile-day {bg_class} {today_class}'>"
+                    f"<div class='calendar-mobile-date'><span>{sel_month}/{day} {weekday_names[curr_date.weekday()]}</span>"
+                    f"<span class='calendar-mobile-week'>ISO W{curr_date.isocalendar().week}</span></div>"
+                    f"{day_content}</div>"
+                )
 
-    st.markdown(
-        f"<div class='calendar-desktop-grid'>{''.join(desktop_cells)}</div>"
-        f"<div class='calendar-mobile-list'>{''.join(mobile_cells)}</div>",
-        unsafe_allow_html=True,
-    )
+        st.markdown(
+            f"<div class='calendar-desktop-grid'>{''.join(desktop_cells)}</div>"
+            f"<div class='calendar-mobile-list'>{''.join(mobile_cells)}</div>",
+            unsafe_allow_html=True,
+        )
 
 
 
 with tab_company:
-    st.header("🏢 公司財報與營收")
-    st.caption("這個分頁採手動同步；只有按下按鈕時才查詢 MOPS／TWSE／Yahoo。行事曆只讀取完成後的摘要快照。")
-
-    company_ticker_input = st.text_input(
-        "追蹤公司或代碼（用逗號分隔，例如 2408, 台積電, META, Google, Tesla）",
-        value=st.session_state.calendar_preferences.get("tickers", "2330.TW"),
-        key="company_data_tickers",
-    )
-    preview_inputs = [item.strip() for item in company_ticker_input.split(",") if item.strip()]
-    if preview_inputs:
-        resolved_preview = [resolve_earnings_ticker(item) for item in preview_inputs]
-        st.caption("辨識結果：" + "； ".join(
-            f"{item['input']} → {item['display_name']}（{item['candidates'][0]}）" for item in resolved_preview
-        ))
-
-    sync_col, status_col = st.columns([1, 2.2])
-    with sync_col:
-        sync_company_data = st.button("🔄 同步公司資料", key="sync_company_financial_data", width="stretch")
-    with status_col:
-        current_snapshot = st.session_state.company_event_snapshot
-        if current_snapshot.get("updated_at"):
-            st.caption(f"最近同步：{current_snapshot['updated_at']}｜{current_snapshot.get('tickers', '')}")
-        else:
-            st.caption("尚未建立快照；行事曆目前不會顯示公司事件。")
+    if tab_company.open:
+        st.header("🏢 公司財報與營收")
+        st.caption("這個分頁採手動同步；只有按下按鈕時才查詢 MOPS／TWSE／Yahoo。行事曆只讀取完成後的摘要快照。")
+
+        company_ticker_input = st.text_input(
+            "追蹤公司或代碼（用逗號分隔，例如 2408, 台積電, META, Google, Tesla）",
+            value=st.session_state.calendar_preferences.get("tickers", "2330.TW"),
+            key="company_data_tickers",
+        )
+        preview_inputs = [item.strip() for item in company_ticker_input.split(",") if item.strip()]
+        if preview_inputs:
+            resolved_preview = [resolve_earnings_ticker(item) for item in preview_inputs]
+            st.caption("辨識結果：" + "； ".join(
+                f"{item['input']} → {item['display_name']}（{item['candidates'][0]}）" for item in resolved_preview
+            ))
+
+        sync_col, status_col = st.columns([1, 2.2])
+        with sync_col:
+            sync_company_data = st.button("🔄 同步公司資料", key="sync_company_financial_data", width="stretch")
+        with status_col:
+            current_snapshot = st.session_state.company_event_snapshot
+            if current_snapshot.get("updated_at"):
+                st.caption(f"最近同步：{current_snapshot['updated_at']}｜{current_snapshot.get('tickers', '')}")
+            else:
+                st.caption("尚未建立快照；行事曆目前不會顯示公司事件。")
 
-    if sync_company_data:
-        ticker_symbols = tuple(item.upper() for item in preview_inputs)
-        if not ticker_symbols:
-            st.warning("請至少輸入一家公司或代碼。")
-        else:
-            fetch_earnings_events.clear()
-            fetch_twse_monthly_revenue_rows.clear()
-            fetch_mops_company_monthly_revenue.clear()
-            fetch_taiwan_monthly_revenue_events.clear()
-            fetch_us_revenue_events.clear()
-            with st.spinner("正在同步財報日期與營收資料；完成後行事曆會直接讀取快照……"):
-                earnings_result = fetch_earnings_events(ticker_symbols)
-                taiwan_revenue_result = fetch_taiwan_monthly_revenue_events(ticker_symbols)
-                us_revenue_result = fetch_us_revenue_events(ticker_symbols)
-            combined_events = (
-                earnings_result.get("events", [])
-                + taiwan_revenue_result.get("events", [])
-                + us_revenue_result.get("events", [])
-            )
-            new_snapshot = {
-                "updated_at": datetime.now(pytz.timezone("Asia/Taipei")).strftime("%Y/%m/%d %H:%M"),
-                "tickers": company_ticker_input,
-                "events": combined_events,
-                "earnings": earnings_result,
-                "taiwan_revenue": taiwan_revenue_result,
-                "us_revenue": us_revenue_result,
-            }
-            st.session_state.company_event_snapshot = new_snapshot
-            save_company_event_snapshot(new_snapshot)
-            st.session_state.calendar_preferences["tickers"] = company_ticker_input
-            save_calendar_preferences(
-                st.session_state.calendar_preferences.get("groups", CALENDAR_GROUP_OPTIONS),
-                st.session_state.calendar_preferences.get("macro_events", US_HIGH_IMPACT_EVENTS),
-                company_ticker_input,
-                selected_event_types,
-            )
-            st.toast("公司資料已同步，行事曆摘要快照已更新。", icon="✅")
-            st.rerun()
+        if sync_company_data:
+            ticker_symbols = tuple(item.upper() for item in preview_inputs)
+            if not ticker_symbols:
+                st.warning("請至少輸入一家公司或代碼。")
+            else:
+                fetch_earnings_events.clear()
+                fetch_twse_monthly_revenue_rows.clear()
+                fetch_mops_company_monthly_revenue.clear()
+                fetch_taiwan_monthly_revenue_events.clear()
+                fetch_us_revenue_events.clear()
+                with st.spinner("正在同步財報日期與營收資料；完成後行事曆會直接讀取快照……"):
+                    earnings_result = fetch_earnings_events(ticker_symbols)
+                    taiwan_revenue_result = fetch_taiwan_monthly_revenue_events(ticker_symbols)
+                    us_revenue_result = fetch_us_revenue_events(ticker_symbols)
+                combined_events = (
+                    earnings_result.get("events", [])
+                    + taiwan_revenue_result.get("events", [])
+                    + us_revenue_result.get("events", [])
+                )
+                new_snapshot = {
+                    "updated_at": datetime.now(pytz.timezone("Asia/Taipei")).strftime("%Y/%m/%d %H:%M"),
+                    "tickers": company_ticker_input,
+                    "events": combined_events,
+                    "earnings": earnings_result,
+                    "taiwan_revenue": taiwan_revenue_result,
+                    "us_revenue": us_revenue_result,
+                }
+                st.session_state.company_event_snapshot = new_snapshot
+                save_company_event_snapshot(new_snapshot)
+                st.session_state.calendar_preferences["tickers"] = company_ticker_input
+                save_calendar_preferences(
+                    st.session_state.calendar_preferences.get("groups", CALENDAR_GROUP_OPTIONS),
+                    st.session_state.calendar_preferences.get("macro_events", US_HIGH_IMPACT_EVENTS),
+                    company_ticker_input,
+                    calendar_event_types(
+                        st.session_state.calendar_preferences.get("groups", CALENDAR_GROUP_OPTIONS),
+                        st.session_state.calendar_preferences.get("macro_events", US_HIGH_IMPACT_EVENTS),
+                    ),
+                )
+                st.toast("公司資料已同步，行事曆摘要快照已更新。", icon="✅")
+                st.rerun()
 
-    st.markdown("""
+        st.markdown("""
     <style>
     .revenue-metric-card { padding: 0.15rem 0 0.55rem; min-height: 6rem; }
     .revenue-metric-label { font-size: 0.78rem; font-weight: 700; color: #F5F5F5; }
@@ -13613,9 +17491,9 @@ with tab_company:
     .revenue-metric-delta { display: inline-block; margin-top: 0.18rem; font-size: 0.72rem; font-weight: 750; background: rgba(128,128,128,.16); border-radius: .6rem; padding: .08rem .34rem; }
     </style>
     """, unsafe_allow_html=True)
-    snapshot = st.session_state.company_event_snapshot
-    summary_cols = st.columns(3)
-    summary_cols[0].metric("財報事件", len(snapshot.get("earnings", {}).get("events", [])))
-    summary_cols[1].metric("台股月營收", len(snapshot.get("taiwan_revenue", {}).get("events", [])))
-    summary_cols[2].metric("美股營收", len(snapshot.get("us_revenue", {}).get("events", [])))
-    render_company_event_snapshot(snapshot)
+        snapshot = st.session_state.company_event_snapshot
+        summary_cols = st.columns(3)
+        summary_cols[0].metric("財報事件", len(snapshot.get("earnings", {}).get("events", [])))
+        summary_cols[1].metric("台股月營收", len(snapshot.get("taiwan_revenue", {}).get("events", [])))
+        summary_cols[2].metric("美股營收", len(snapshot.get("us_revenue", {}).get("events", [])))
+        render_company_event_snapshot(snapshot)